@@ -51,6 +51,7 @@ class DoctorAdmin(admin.ModelAdmin):
     search_fields = ['user__username', 'user__email', 'department']
     list_filter = ['department']
     ordering = ['user__username']
+    list_select_related = ['user']
 
     def email(self, obj):
         return obj.user.email
@@ -64,6 +65,11 @@ class PatientAdmin(admin.ModelAdmin):
     list_display = ['user', 'email', 'phone']
     search_fields = ['user__username', 'user__email']
     ordering = ['user__username']
+    list_select_related = ['user']
+
+    def get_queryset(self, request):
+        # __str__ is the username, also in the autocomplete results of assessments
+        return super().get_queryset(request).select_related('user')
 
     def email(self, obj):
         return obj.user.email
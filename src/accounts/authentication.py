@@ -0,0 +1,172 @@
+"""
+Token authentication with cached credentials.
+
+DRF's `TokenAuthentication` joins `Token` and `User` on every request.
+`CachedTokenAuthentication` keeps what request handling needs of a token
+(user id, role, flags and the ids of the patient profile and conversation)
+in a process-local TTL LRU, optionally backed by a shared Django cache, and
+builds the user from it without touching the database.
+
+Entries are invalidated explicitly on logout, password reset, role or
+status changes (see `accounts.signals`). Invalidating a token gives it a
+new revision in the shared cache (`AUTH_TOKEN_CACHE['SHARED_CACHE']`), and
+every request checks the revision of its token there, so the local copies
+other workers and replicas hold are dropped on their next use. Without a
+shared cache invalidation only reaches the current process.
+"""
+
+import uuid
+from typing import Any, Dict, Optional
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from beaconmind.caching import TTLLRUCache
+
+
+User = get_user_model()
+
+USER_FIELDS = ('id', 'username', 'role', 'is_active', 'is_staff', 'is_superuser')
+
+_config = getattr(settings, 'AUTH_TOKEN_CACHE', {})
+_local = TTLLRUCache(maxsize=_config.get('MAXSIZE', 10_000), ttl=_config.get('TTL', 60))
+
+
+def _shared_cache():
+    alias = _config.get('SHARED_CACHE')
+    return caches[alias] if alias else None
+
+
+def _shared_key(key: str) -> str:
+    return f"auth:token:{key}"
+
+
+def _revision_key(key: str) -> str:
+    return f"auth:token-revision:{key}"
+
+
+def _load(key: str) -> Optional[Dict[str, Any]]:
+    token = (
+        Token.objects
+        .select_related('user', 'user__patient', 'user__conversation')
+        .filter(key=key)
+        .first()
+    )
+    if token is None:
+        return None
+    user = token.user
+    patient = getattr(user, 'patient', None)
+    conversation = getattr(user, 'conversation', None)
+    return {
+        'user': {name: getattr(user, name) for name in USER_FIELDS},
+        'patient_id': patient.id if patient else None,
+        'conversation_id': conversation.id if conversation else None,
+    }
+
+
+def _build_user(entry: Dict[str, Any]):
+    """
+    User instance with only `USER_FIELDS` loaded (others are deferred and
+    fetched on first access), and its patient profile and conversation
+    pre-cached as id-only instances.
+    """
+    from chat.models import Conversation
+    from .models import Patient
+
+    # from_db() expects values in model field order
+    names = [f.attname for f in User._meta.concrete_fields if f.attname in USER_FIELDS]
+    user = User.from_db(DEFAULT_DB_ALIAS, names, [entry['user'][name] for name in names])
+    if entry['patient_id']:
+        patient = Patient.from_db(DEFAULT_DB_ALIAS, ['id', 'user_id'], [entry['patient_id'], user.pk])
+        User.patient.related.set_cached_value(user, patient)
+        Patient.user.field.set_cached_value(patient, user)
+    if entry['conversation_id']:
+        conversation = Conversation.from_db(DEFAULT_DB_ALIAS, ['id', 'user_id'], [entry['conversation_id'], user.pk])
+        User.conversation.related.set_cached_value(user, conversation)
+        Conversation.user.field.set_cached_value(conversation, user)
+    return user
+
+
+def get_token_entry(key: str) -> Optional[Dict[str, Any]]:
+    entry = _local.get(key)
+    shared = _shared_cache()
+    if shared is None:
+        if entry is not None:
+            return entry
+        revision = None
+    else:
+        # one round trip: the token's current revision and, for a local miss, the shared entry
+        values = shared.get_many([_revision_key(key), _shared_key(key)])
+        revision = values.get(_revision_key(key))
+        if entry is not None and entry.get('revision') == revision:
+            return entry
+        entry = values.get(_shared_key(key))
+        if entry is not None and entry.get('revision') != revision:
+            entry = None
+    if entry is None:
+        entry = _load(key)
+        if entry is None:
+            return None
+        entry['revision'] = revision
+        if shared is not None:
+            shared.set(_shared_key(key), entry, _config.get('SHARED_TTL', 300))
+    _local.set(key, entry)
+    return entry
+
+
+def _revoke(key: str) -> None:
+    _local.delete(key)
+    shared = _shared_cache()
+    if shared is not None:
+        # outlives the local copies tagged with the previous revision, and hides the shared entry
+        timeout = max(_config.get('SHARED_TTL', 300), _config.get('TTL', 60))
+        shared.set(_revision_key(key), uuid.uuid4().hex, timeout)
+
+
+def invalidate_token(key: str, revoke: bool = True) -> None:
+    """
+    Drops the cached credentials of a token. With `revoke`, the copies other
+    processes hold are rejected too; without, they are only dropped from the
+    current process and the shared cache (ex. for a profile created since,
+    which the copies elsewhere lack but are still correct without).
+    """
+    if not revoke:
+        _local.delete(key)
+        shared = _shared_cache()
+        if shared is not None:
+            shared.delete(_shared_key(key))
+        return
+    _revoke(key)
+    # again once the change is committed: requests in between may have cached the old rows
+    transaction.on_commit(lambda: _revoke(key))
+
+
+def invalidate_user(user_id, revoke: bool = True) -> None:
+    """
+    Drops the cached credentials of all tokens of a user.
+    """
+    for key in Token.objects.filter(user_id=user_id).values_list('key', flat=True):
+        invalidate_token(key, revoke)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    Drop-in replacement for `TokenAuthentication` that serves credentials
+    from the token cache. `request.auth` is an unsaved `Token` carrying only
+    the key and user.
+    """
+
+    def authenticate_credentials(self, key):
+        entry = get_token_entry(key)
+        if entry is None:
+            raise exceptions.AuthenticationFailed(_('Invalid token.'))
+        if not entry['user']['is_active']:
+            raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+        user = _build_user(entry)
+        return user, Token(key=key, user=user)
@@ -0,0 +1,73 @@
+# accounts/management/commands/benchlogin.py
+
+import time
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from rest_framework.authtoken.views import ObtainAuthToken
+from rest_framework.test import APIRequestFactory
+
+from accounts.views import LoginView
+
+
+User = get_user_model()
+
+
+class LegacyLoginView(ObtainAuthToken):
+    """
+    The previous LoginView: validates credentials in `super().post()` and
+    again to get hold of the user, then saves `last_login`.
+    """
+
+    def post(self, request, *args, **kwargs):
+        response = super().post(request, *args, **kwargs)
+        user = self.serializer_class(data=request.data)
+        user.is_valid(raise_exception=True)
+        user = user.validated_data['user']
+        user.last_login = timezone.now()
+        user.save(update_fields=['last_login'])
+        return response
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmarks the token login endpoint against the previous double-validating '
+        'implementation with a burst of logins. Test users are created and rolled back.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=50, help="number of distinct users logging in")
+        parser.add_argument('--rounds', type=int, default=2, help="logins per user")
+
+    def handle(self, *args, **options):
+        n_users, rounds = options['users'], options['rounds']
+        password = 'bench-login-password'
+        factory = APIRequestFactory()
+
+        with transaction.atomic():
+            encoded = make_password(password)
+            users = User.objects.bulk_create([
+                User(username=f'benchlogin_{i}', email=f'benchlogin_{i}@example.com', password=encoded, role='staff')
+                for i in range(n_users)
+            ])
+            results = {}
+            for name, view in (('legacy', LegacyLoginView.as_view()), ('current', LoginView.as_view())):
+                cpu, wall = time.process_time(), time.perf_counter()
+                for _ in range(rounds):
+                    for user in users:
+                        request = factory.post('/accounts/api/get-auth/', {'username': user.username, 'password': password}, format='json')
+                        response = view(request)
+                        if response.status_code != 200:
+                            raise RuntimeError(f"{name} login failed: {response.data}")
+                results[name] = (time.process_time() - cpu, time.perf_counter() - wall)
+            transaction.set_rollback(True)
+
+        n = n_users * rounds
+        for name, (cpu, wall) in results.items():
+            self.stdout.write(f"{name:>8}: {n} logins, cpu {cpu * 1000 / n:.1f} ms/login, wall {wall * 1000 / n:.1f} ms/login")
+        self.stdout.write(self.style.SUCCESS(
+            f"CPU time per login: {results['current'][0] / results['legacy'][0]:.0%} of legacy"
+        ))
@@ -1,9 +1,11 @@
 from django.db import models
+from django.contrib.auth.hashers import check_password
 from django.contrib.auth.models import AbstractUser
 from shortuuid.django_fields import ShortUUIDField
 from assessments.definitions import PhaseMap
 from django.core.validators import EmailValidator
 from phonenumber_field.modelfields import PhoneNumberField
+from .passwords import rehash_in_background
 
 
 class User(AbstractUser):
@@ -18,6 +20,40 @@ class User(AbstractUser):
     )
     role = models.CharField(max_length=10, choices=ROLE_CHOICES, default='staff')
 
+    def check_password(self, raw_password):
+        """
+        Same as `AbstractBaseUser.check_password`, but an outdated hash is
+        upgraded in the background rather than re-hashed and saved inline.
+        """
+        if self.pk is None:
+            return super().check_password(raw_password)
+
+        def setter(raw_password):
+            rehash_in_background(self, raw_password)
+            self._password = None
+
+        return check_password(raw_password, self.password, setter)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # role as stored in the database, used by the pre_save signal to detect role changes
+        instance._loaded_role = instance.__dict__.get('role')
+        return instance
+
+    def refresh_from_db(self, using=None, fields=None, **kwargs):
+        super().refresh_from_db(using, fields, **kwargs)
+        if fields is None or 'role' in fields:
+            self._loaded_role = self.__dict__.get('role')
+
+    @property
+    def loaded_role(self):
+        """
+        Role of the user as last loaded from or saved to the database, or None
+        for unsaved users and instances loaded with `role` deferred.
+        """
+        return getattr(self, '_loaded_role', None)
+
 class Doctor(models.Model):
     id = ShortUUIDField(primary_key=True, prefix='doc_')
     user = models.OneToOneField(User, on_delete=models.CASCADE)
@@ -0,0 +1,39 @@
+"""
+Background password rehashing.
+
+`check_password` upgrades hashes made with outdated hasher parameters (ex.
+after a Django upgrade raises the PBKDF2 iteration count). Django does this
+inline, hashing the password a second time inside the login request; here
+the new hash is computed on a single background worker instead so logins
+pay for one hash only.
+"""
+
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.hashers import make_password
+from django.db import close_old_connections, connection
+
+
+logger = logging.getLogger(__name__)
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='password-rehash')
+
+
+def _rehash(model, pk, encoded: str, raw_password: str) -> None:
+    close_old_connections()
+    try:
+        # only replace the hash that was verified, never a password changed meanwhile
+        model._default_manager.filter(pk=pk, password=encoded).update(password=make_password(raw_password))
+    except Exception:
+        logger.exception(f"Failed to rehash password of user {pk}")
+    finally:
+        connection.close()
+
+
+def rehash_in_background(user, raw_password: str) -> None:
+    """
+    Schedules an upgrade of `user`'s password hash to the current hasher
+    parameters. Meant to be passed as the `setter` of `check_password`.
+    """
+    _executor.submit(_rehash, type(user), user.pk, user.password, raw_password)
@@ -1,11 +1,17 @@
-from django.db.models.signals import post_save, pre_save
+from django.db.models.signals import post_delete, post_save, pre_save
 from django.dispatch import receiver
 from django.contrib.auth import get_user_model
+from rest_framework.authtoken.models import Token
+from chat.models import Conversation
+from .authentication import invalidate_token, invalidate_user
 from .models import Doctor, Patient
 
 
 User = get_user_model()
 
+# user fields that cached token credentials depend on
+AUTH_FIELDS = {'username', 'password', 'role', 'is_active', 'is_staff', 'is_superuser'}
+
 @receiver(post_save, sender=User)
 def create_user_profile(sender, instance, created, **kwargs):
     if created:
@@ -13,25 +19,54 @@ def create_user_profile(sender, instance, created, **kwargs):
             Doctor.objects.create(user=instance)
         elif instance.role == 'patient':
             Patient.objects.create(user=instance)
-        elif instance.role == 'staff':
-            instance.is_staff = True
-            # add staff permissions here
-        instance.save()
+    # the saved role is now the one stored in the database
+    if kwargs.get('update_fields') is None or 'role' in kwargs['update_fields']:
+        instance._loaded_role = instance.role
 
 @receiver(pre_save, sender=User)
 def update_user_profile(sender, instance, **kwargs):
-    if instance.pk:
-        try:
-            old_instance = User.objects.get(pk=instance.pk)
-        except User.DoesNotExist:
+    if instance._state.adding:
+        if instance.role == 'staff':
+            instance.is_staff = True
+            # add staff permissions here
+        return
+
+    update_fields = kwargs.get('update_fields')
+    if update_fields is not None and 'role' not in update_fields:
+        return # role is not being written, ex. last_login updates
+
+    old_role = instance.loaded_role
+    if old_role is None: # instance was not loaded with its role
+        old_role = User.objects.filter(pk=instance.pk).values_list('role', flat=True).first()
+        if old_role is None:
             return
-        if instance.role != old_instance.role: # role is updated
-            if instance.role == 'doctor':
-                Doctor.objects.create(user=instance)
-                Patient.objects.filter(user=instance).delete()
-            elif instance.role == 'patient':
-                Patient.objects.create(user=instance)
-                Doctor.objects.filter(user=instance).delete()
-            else:
-                Doctor.objects.filter(user=instance).delete()
-                Patient.objects.filter(user=instance).delete()
+    if instance.role != old_role: # role is updated
+        if instance.role == 'doctor':
+            Doctor.objects.create(user=instance)
+            Patient.objects.filter(user=instance).delete()
+        elif instance.role == 'patient':
+            Patient.objects.create(user=instance)
+            Doctor.objects.filter(user=instance).delete()
+        else:
+            Doctor.objects.filter(user=instance).delete()
+            Patient.objects.filter(user=instance).delete()
+
+@receiver(post_save, sender=User)
+def invalidate_user_credentials(sender, instance, created, update_fields=None, **kwargs):
+    if not created and (update_fields is None or AUTH_FIELDS & set(update_fields)):
+        invalidate_user(instance.pk)
+
+@receiver(post_delete, sender=Token)
+def invalidate_deleted_token(sender, instance, **kwargs):
+    invalidate_token(instance.key)
+
+@receiver(post_save, sender=Patient)
+@receiver(post_save, sender=Conversation)
+def invalidate_on_profile_created(sender, instance, created, **kwargs):
+    if created:
+        invalidate_user(instance.user_id, revoke=False)
+
+@receiver(post_delete, sender=Patient)
+@receiver(post_delete, sender=Conversation)
+def invalidate_on_profile_deleted(sender, instance, **kwargs):
+    invalidate_user(instance.user_id)
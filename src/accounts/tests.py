@@ -0,0 +1,171 @@
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import check_password, make_password
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.test import APIClient
+
+from . import authentication, passwords
+from .models import Doctor, Patient
+
+
+User = get_user_model()
+
+
+class RoleChangeTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user("alice", "alice@example.com", "secret", role="patient")
+
+    def test_loaded_role(self):
+        self.assertEqual(self.user.loaded_role, "patient")
+        self.assertEqual(User.objects.get(pk=self.user.pk).loaded_role, "patient")
+        self.assertIsNone(User.objects.only("username").get(pk=self.user.pk).loaded_role)
+        self.assertIsNone(User(role="doctor").loaded_role)
+
+    def test_role_change_after_from_db(self):
+        user = User.objects.get(pk=self.user.pk)
+        user.role = "doctor"
+        user.save()
+        self.assertTrue(Doctor.objects.filter(user=user).exists())
+        self.assertFalse(Patient.objects.filter(user=user).exists())
+        self.assertEqual(user.loaded_role, "doctor")
+        # saved again unchanged: no second profile
+        user.save()
+        self.assertEqual(Doctor.objects.filter(user=user).count(), 1)
+
+    def test_role_change_with_deferred_role(self):
+        user = User.objects.only("username").get(pk=self.user.pk)
+        user.role = "staff"
+        user.save()
+        self.assertFalse(Patient.objects.filter(user=user).exists())
+
+    def test_role_change_after_refresh_from_db(self):
+        user = User.objects.get(pk=self.user.pk)
+        # changed by another process
+        other = User.objects.get(pk=user.pk)
+        other.role = "doctor"
+        other.save()
+        user.refresh_from_db()
+        self.assertEqual(user.loaded_role, "doctor")
+        user.role = "patient"
+        user.save()
+        self.assertFalse(Doctor.objects.filter(user=user).exists())
+        self.assertEqual(Patient.objects.filter(user=user).count(), 1)
+
+    def test_other_updates_do_not_read_the_role(self):
+        user = User.objects.get(pk=self.user.pk)
+        with self.assertNumQueries(1):
+            user.save(update_fields=["last_login"])
+
+
+@override_settings(PASSWORD_HASHERS=["django.contrib.auth.hashers.PBKDF2PasswordHasher",
+                                     "django.contrib.auth.hashers.MD5PasswordHasher"])
+class LoginTests(TransactionTestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user("alice", "alice@example.com", "secret", role="patient")
+        self.url = reverse("accounts:api-get-auth")
+
+    def login(self, password):
+        response = self.client.post(self.url, {"username": "alice", "password": password})
+        # waits for the background rehash, if any
+        passwords._executor.submit(lambda: None).result()
+        return response
+
+    def test_login_updates_last_login(self):
+        response = self.login("secret")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["token"], Token.objects.get(user=self.user).key)
+        self.assertIsNotNone(User.objects.get(pk=self.user.pk).last_login)
+        # the same token on the next login
+        self.assertEqual(self.login("secret").json()["token"], response.json()["token"])
+
+    def test_bad_credentials(self):
+        for username, password in [("alice", "wrong"), ("bob", "secret")]:
+            response = self.client.post(self.url, {"username": username, "password": password})
+            self.assertEqual(response.status_code, 400)
+            self.assertIn("detail", response.json())
+        self.assertIsNone(User.objects.get(pk=self.user.pk).last_login)
+        self.assertFalse(Token.objects.exists())
+
+    def test_outdated_hash_is_upgraded(self):
+        User.objects.filter(pk=self.user.pk).update(password=make_password("secret", hasher="md5"))
+        with mock.patch.object(passwords, "make_password", wraps=make_password) as rehash:
+            self.assertEqual(self.login("secret").status_code, 200)
+        self.assertEqual(rehash.call_count, 1)
+        password = User.objects.get(pk=self.user.pk).password
+        self.assertTrue(password.startswith("pbkdf2_sha256$"))
+        self.assertTrue(check_password("secret", password))
+
+    def test_rehash_keeps_a_password_changed_meanwhile(self):
+        outdated = make_password("secret", hasher="md5")
+        User.objects.filter(pk=self.user.pk).update(password=outdated)
+        User.objects.filter(pk=self.user.pk).update(password=make_password("changed"))
+        passwords._rehash(User, self.user.pk, outdated, "secret")
+        self.assertTrue(check_password("changed", User.objects.get(pk=self.user.pk).password))
+
+
+class TokenRevocationTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user("alice", "alice@example.com", "old secret", role="patient")
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {self.token.key}")
+        authentication._local.clear()
+        self.addCleanup(authentication._local.clear)
+
+    def authenticate(self, key=None):
+        return authentication.CachedTokenAuthentication().authenticate_credentials(key or self.token.key)[0]
+
+    def stale_copy(self):
+        """
+        Caches the token's credentials, and returns them as another worker would still hold them.
+        """
+        self.authenticate()
+        return dict(authentication._local.get(self.token.key))
+
+    def test_cached_credentials(self):
+        self.authenticate()
+        # only the token's revision is read from the shared cache
+        with self.assertNumQueries(1):
+            user = self.authenticate()
+        self.assertEqual((user.pk, user.role, user.patient.pk), (self.user.pk, "patient", self.user.patient.pk))
+
+    def test_rejected_after_logout(self):
+        stale = self.stale_copy()
+        self.assertEqual(self.client.post(reverse("accounts:api-logout")).status_code, 200)
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate()
+        authentication._local.set(self.token.key, stale)
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate()
+
+    def test_rejected_after_password_reset(self):
+        stale = self.stale_copy()
+        response = self.client.post(reverse("accounts:api-password-reset"),
+                                    {"old_password": "old secret", "new_password": "a new secret"})
+        self.assertEqual(response.status_code, 200)
+        authentication._local.set(self.token.key, stale)
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate()
+        self.assertEqual(self.authenticate(response.json()["token"]).pk, self.user.pk)
+
+    def test_role_change_reaches_other_workers(self):
+        stale = self.stale_copy()
+        user = User.objects.get(pk=self.user.pk)
+        user.role = "doctor"
+        user.save()
+        authentication._local.set(self.token.key, stale)
+        self.assertEqual(self.authenticate().role, "doctor")
+
+    def test_deactivated_user(self):
+        self.stale_copy()
+        self.user.is_active = False
+        self.user.save(update_fields=["is_active"])
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate()
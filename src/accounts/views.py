@@ -4,13 +4,14 @@ from rest_framework import status
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework.permissions import IsAuthenticated
-from rest_framework.authentication import TokenAuthentication
 from rest_framework.decorators import api_view
 from django.shortcuts import render, redirect
 from django.contrib.auth import login, authenticate
+from .authentication import CachedTokenAuthentication
 from .forms import UserRegisterForm, UserLoginForm, PatientRegisterForm
 from .serializers import PasswordResetSerializer, UserRegisterSerializer
 from django.http import HttpResponseNotAllowed
+from rest_framework.authtoken.models import Token
 from rest_framework.authtoken.views import ObtainAuthToken
 from django.utils import timezone
 
@@ -23,35 +24,35 @@ class RegisterView(generics.CreateAPIView):
 
 
 class LogoutView(APIView):
-    authentication_classes = [TokenAuthentication]
+    authentication_classes = [CachedTokenAuthentication]
     permission_classes = [IsAuthenticated]
 
     def post(self, request):
-        try:
-            request._user.auth_token.delete()
-            return Response({"detail": "Successfully logged out."}, status=status.HTTP_200_OK)
-        except AttributeError:
+        if request.auth is None:
             return Response({"detail": "Invalid request. No token found."}, status=status.HTTP_400_BAD_REQUEST)
+        Token.objects.filter(key=request.auth.key).delete() # invalidates the cached token too
+        return Response({"detail": "Successfully logged out."}, status=status.HTTP_200_OK)
 
 
 class LoginView(ObtainAuthToken):
     """
-    Extends ObtainAuthToken class to update last_login field on successful token based login
+    Extends ObtainAuthToken class to update last_login field on successful token based login.
+    Credentials are verified once; the password hash is the most expensive part of a login.
     """
 
     def post(self, request, *args, **kwargs):
-        try:
-            response = super().post(request, *args, **kwargs)
-            user = self.serializer_class(data=request.data)
-            user.is_valid(raise_exception=True)
-            user = user.validated_data['user']
-            
-            user.last_login = timezone.now()
-            user.save(update_fields=['last_login'])
+        serializer = self.get_serializer(data=request.data)
+        if not serializer.is_valid():
+            errors = serializer.errors
+            error = (errors.get('non_field_errors') or next(iter(errors.values())))[0]
+            return Response({'detail': f'{error}'}, status=status.HTTP_400_BAD_REQUEST)
+        user = serializer.validated_data['user']
+        token, _ = Token.objects.get_or_create(user=user)
 
-            return response
-        except Exception as e:
-            return Response({'detail': f'{e.detail['non_field_errors'][0]}'}, status=status.HTTP_400_BAD_REQUEST)
+        user.last_login = timezone.now()
+        User.objects.filter(pk=user.pk).update(last_login=user.last_login)
+
+        return Response({'token': token.key})
 
 
 @api_view(['GET', 'POST'])
@@ -109,7 +110,7 @@ def user_logout(request):
 
 class PasswordResetView(APIView):
     permission_classes = [IsAuthenticated]
-    authentication_classes = [TokenAuthentication]
+    authentication_classes = [CachedTokenAuthentication]
 
     def post(self, request):
         serializer = PasswordResetSerializer(
@@ -117,6 +118,9 @@ class PasswordResetView(APIView):
         if serializer.is_valid():
             request.user.set_password(
                 serializer._validated_data['new_password'])
-            request.user.save()
-            return Response({'detail': 'Password changed successfully.'}, status=status.HTTP_200_OK)
+            request.user.save(update_fields=['password'])
+            # tokens issued with the old password stop working; the caller gets a new one
+            Token.objects.filter(user_id=request.user.pk).delete()
+            token = Token.objects.create(user_id=request.user.pk)
+            return Response({'detail': 'Password changed successfully.', 'token': token.key}, status=status.HTTP_200_OK)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
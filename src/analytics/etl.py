@@ -0,0 +1,235 @@
+"""
+Incremental extraction of OLTP rows into the analytics store.
+
+Each source keeps a (timestamp, id) high-water mark in the store's
+`etl_state` table and only rows past that mark are copied on the next run.
+Rows younger than `lag` are left for the next run so that turns still
+running inside `SessionPipeline.trigger_pipeline`'s transaction (which
+commits after the timestamps are taken) are never skipped.
+
+Rows keep changing after they were exported (ex. a message's `meta_data`
+or an assessment's records), so every run also re-exports the `window`
+before the high-water mark; the store's upserts replace the old copies.
+"""
+
+import json
+import sqlite3
+from datetime import datetime, timedelta, timezone as dt_timezone
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from django.db.models import F, Q, QuerySet
+from django.db.models.functions import Length
+from django.utils import timezone
+
+from assessments.models import Assessment, AssessmentRecord
+from chat.models import ChatMessage
+
+from .store import AnalyticsStore
+
+
+def _iso(value: Optional[datetime]) -> Optional[str]:
+    return value.astimezone(dt_timezone.utc).isoformat() if value else None
+
+
+def _usage(meta: Dict[str, Any], stage: str) -> Dict[str, Any]:
+    """
+    Pulls model name and token usage of a stage out of `ChatMessage.meta_data`.
+    """
+    stage_meta = (meta or {}).get(stage) or {}
+    llm_meta = stage_meta.get("meta") or {}
+    usage = llm_meta.get("token_usage") or {}
+    return {
+        "type": stage_meta.get("type"),
+        "model": llm_meta.get("model_name"),
+        "prompt_tokens": usage.get("prompt_tokens"),
+        "completion_tokens": usage.get("completion_tokens"),
+    }
+
+
+def _after(qs: QuerySet, ts_field: str, hwm_ts: Optional[str], hwm_id: Optional[str]) -> QuerySet:
+    """
+    Keyset filter: rows strictly after the (timestamp, id) high-water mark.
+    """
+    if hwm_ts is None:
+        return qs
+    hwm = datetime.fromisoformat(hwm_ts)
+    return qs.filter(Q(**{f"{ts_field}__gt": hwm}) | Q(**{ts_field: hwm, "id__gt": hwm_id}))
+
+
+def assessment_rows(hwm_ts, hwm_id, cutoff, batch_size) -> Iterator[List[Dict[str, Any]]]:
+    """
+    Completed assessments, with their result, ordered by completion time.
+    """
+    qs = _after(
+        Assessment.objects.filter(status="completed", completed_at__lte=cutoff),
+        "completed_at", hwm_ts, hwm_id,
+    ).order_by("completed_at", "id").values(
+        "id", "patient_id", "session_id", "type", "status", "timestamp",
+        "completed_at", "result__score", "result__severity",
+    )
+    batch = []
+    for row in qs.iterator(chunk_size=batch_size):
+        batch.append({
+            "id": row["id"],
+            "patient_id": row["patient_id"],
+            "session_id": row["session_id"],
+            "type": row["type"],
+            "status": row["status"],
+            "started_at": _iso(row["timestamp"]),
+            "completed_at": _iso(row["completed_at"]),
+            "score": row["result__score"],
+            "severity": row["result__severity"],
+        })
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def record_rows(assessment_ids: List[str]) -> List[Dict[str, Any]]:
+    """
+    Per-question records of the given assessments.
+    """
+    qs = AssessmentRecord.objects.filter(assessment_id__in=assessment_ids).values(
+        "id", "assessment_id", "question_id", "score", "keywords", "timestamp",
+        patient_id=F("assessment__patient_id"), type=F("assessment__type"),
+    )
+    return [
+        {
+            "id": row["id"],
+            "assessment_id": row["assessment_id"],
+            "patient_id": row["patient_id"],
+            "type": row["type"],
+            "question_id": row["question_id"],
+            "score": row["score"],
+            "keywords": json.dumps(row["keywords"] or []),
+            "timestamp": _iso(row["timestamp"]),
+        }
+        for row in qs
+    ]
+
+
+def turn_rows(hwm_ts, hwm_id, cutoff, batch_size) -> Iterator[List[Dict[str, Any]]]:
+    """
+    Normalized turn metadata of chat messages, ordered by creation time.
+    """
+    qs = _after(
+        ChatMessage.objects.filter(timestamp__lte=cutoff),
+        "timestamp", hwm_ts, hwm_id,
+    ).order_by("timestamp", "id").values(
+        "id", "conversation_id", "chat_session_id", "timestamp",
+        "user_response_timestamp", "ai_response_timestamp",
+        "user_marker", "ai_marker", "meta_data",
+        patient_id=F("conversation__user__patient__id"),
+        user_chars=Length("user_response"), ai_chars=Length("ai_response"),
+    )
+    batch = []
+    for row in qs.iterator(chunk_size=batch_size):
+        user_marker = row["user_marker"] or {}
+        ai_marker = row["ai_marker"] or {}
+        eval_usage = _usage(row["meta_data"], "eval")
+        dec_usage = _usage(row["meta_data"], "dec")
+        u_ts, a_ts = row["user_response_timestamp"], row["ai_response_timestamp"]
+        batch.append({
+            "id": row["id"],
+            "conversation_id": row["conversation_id"],
+            "session_id": row["chat_session_id"],
+            "patient_id": row["patient_id"],
+            "timestamp": _iso(row["timestamp"]),
+            "user_response_timestamp": _iso(u_ts),
+            "ai_response_timestamp": _iso(a_ts),
+            "response_ms": int((a_ts - u_ts).total_seconds() * 1000) if u_ts and a_ts else None,
+            "phase": user_marker.get("phase") or ai_marker.get("phase"),
+            "node_id": user_marker.get("node_id") or ai_marker.get("node_id"),
+            "tr": user_marker.get("tr"),
+            "chat_status": ai_marker.get("chat_status"),
+            "eval_model": eval_usage["model"],
+            "eval_prompt_tokens": eval_usage["prompt_tokens"],
+            "eval_completion_tokens": eval_usage["completion_tokens"],
+            "dec_type": dec_usage["type"],
+            "dec_model": dec_usage["model"],
+            "dec_prompt_tokens": dec_usage["prompt_tokens"],
+            "dec_completion_tokens": dec_usage["completion_tokens"],
+            "user_chars": row["user_chars"] or 0,
+            "ai_chars": row["ai_chars"] or 0,
+        })
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class AnalyticsETL:
+    """
+    Copies new OLTP rows into the analytics store, one source at a time.
+    Every batch is committed together with its high-water mark so an
+    interrupted run resumes where it stopped.
+    """
+
+    def __init__(self, store: AnalyticsStore = None, lag: timedelta = timedelta(minutes=10),
+                 batch_size: int = 2000, log: Callable[[str], None] = None,
+                 window: timedelta = timedelta(days=2)):
+        self.store = store or AnalyticsStore()
+        self.lag = lag
+        self.window = window
+        self.batch_size = batch_size
+        self.log = log or (lambda _: None)
+
+    def run(self, full: bool = False) -> Dict[str, int]:
+        now = timezone.now()
+        cutoff = now - self.lag
+        counts = {}
+        with self.store.connect(read_only=False) as conn:
+            if full:
+                with conn:
+                    self.store.reset(conn)
+            counts["assessments"] = self._run_assessments(conn, cutoff, now)
+            counts["turns"] = self._run_turns(conn, cutoff, now)
+        return counts
+
+    def _trailing(self, hwm_ts: str):
+        """
+        Lower bound and cutoff of the already exported rows to export again: the window before the mark.
+        """
+        hwm = datetime.fromisoformat(hwm_ts)
+        return _iso(hwm - self.window), "", hwm
+
+    def _run_assessments(self, conn: sqlite3.Connection, cutoff: datetime, now: datetime) -> int:
+        hwm_ts, hwm_id = self.store.get_hwm(conn, "assessments")
+        if hwm_ts is not None:
+            for batch in assessment_rows(*self._trailing(hwm_ts), self.batch_size):
+                records = record_rows([row["id"] for row in batch])
+                with conn:
+                    self.store.upsert(conn, "assessments", batch)
+                    self.store.upsert(conn, "assessment_records", records)
+                self.log(f"assessments: ~{len(batch)} re-exported ({len(records)} records)")
+        total = 0
+        for batch in assessment_rows(hwm_ts, hwm_id, cutoff, self.batch_size):
+            records = record_rows([row["id"] for row in batch])
+            with conn:
+                self.store.upsert(conn, "assessments", batch)
+                self.store.upsert(conn, "assessment_records", records)
+                self.store.set_hwm(conn, "assessments", batch[-1]["completed_at"],
+                                   batch[-1]["id"], len(batch), _iso(now))
+            total += len(batch)
+            self.log(f"assessments: +{len(batch)} ({len(records)} records)")
+        return total
+
+    def _run_turns(self, conn: sqlite3.Connection, cutoff: datetime, now: datetime) -> int:
+        hwm_ts, hwm_id = self.store.get_hwm(conn, "turns")
+        if hwm_ts is not None:
+            for batch in turn_rows(*self._trailing(hwm_ts), self.batch_size):
+                with conn:
+                    self.store.upsert(conn, "turns", batch)
+                self.log(f"turns: ~{len(batch)} re-exported")
+        total = 0
+        for batch in turn_rows(hwm_ts, hwm_id, cutoff, self.batch_size):
+            with conn:
+                self.store.upsert(conn, "turns", batch)
+                self.store.set_hwm(conn, "turns", batch[-1]["timestamp"],
+                                   batch[-1]["id"], len(batch), _iso(now))
+            total += len(batch)
+            self.log(f"turns: +{len(batch)}")
+        return total
@@ -0,0 +1,37 @@
+# analytics/management/commands/analytics_etl.py
+
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from analytics.etl import AnalyticsETL
+from analytics.store import AnalyticsStore
+
+
+class Command(BaseCommand):
+    help = (
+        'Incrementally copies completed assessments, their records and turn metadata '
+        'into the offline analytics store. Meant to be run nightly (e.g. from cron).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help="drop the store contents and re-export everything")
+        parser.add_argument('--lag', type=int, default=10, help="skip rows younger than LAG minutes (default: 10)")
+        parser.add_argument('--window', type=int, default=48,
+                            help="re-export rows up to WINDOW hours before the last export, which may have changed (default: 48)")
+        parser.add_argument('--batch-size', type=int, default=2000, help="rows per committed batch (default: 2000)")
+        parser.add_argument('--path', type=str, default=None, help="analytics store file (default: settings.ANALYTICS_STORE_PATH)")
+
+    def handle(self, *args, **options):
+        store = AnalyticsStore(options['path'])
+        etl = AnalyticsETL(
+            store=store,
+            lag=timedelta(minutes=options['lag']),
+            batch_size=options['batch_size'],
+            window=timedelta(hours=options['window']),
+            log=lambda line: self.stdout.write(line) if options['verbosity'] > 1 else None,
+        )
+        counts = etl.run(full=options['full'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Exported {counts['assessments']} assessments and {counts['turns']} turns to {store.path}"
+        ))
@@ -0,0 +1,177 @@
+"""
+Offline analytics store.
+
+A local SQLite file, kept outside the production database, that holds
+denormalized copies of completed assessments, their per-question records
+and turn level metadata of chat messages. It is filled incrementally by the
+`analytics_etl` management command and is meant to be queried by analytics
+pages and notebooks so that heavy scans never hit the OLTP database.
+
+Message text is deliberately not copied; only the metadata of each turn.
+"""
+
+import sqlite3
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from django.conf import settings
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS etl_state (
+    source TEXT PRIMARY KEY,
+    hwm_ts TEXT,
+    hwm_id TEXT,
+    rows INTEGER NOT NULL DEFAULT 0,
+    updated_at TEXT
+);
+
+CREATE TABLE IF NOT EXISTS assessments (
+    id TEXT PRIMARY KEY,
+    patient_id TEXT NOT NULL,
+    session_id TEXT,
+    type TEXT NOT NULL,
+    status TEXT NOT NULL,
+    started_at TEXT,
+    completed_at TEXT,
+    score INTEGER,
+    severity TEXT
+);
+CREATE INDEX IF NOT EXISTS assessments_patient_idx ON assessments (patient_id, completed_at);
+CREATE INDEX IF NOT EXISTS assessments_type_idx ON assessments (type, completed_at);
+
+CREATE TABLE IF NOT EXISTS assessment_records (
+    id TEXT PRIMARY KEY,
+    assessment_id TEXT NOT NULL,
+    patient_id TEXT NOT NULL,
+    type TEXT NOT NULL,
+    question_id TEXT,
+    score INTEGER NOT NULL,
+    keywords TEXT,
+    timestamp TEXT
+);
+CREATE INDEX IF NOT EXISTS records_assessment_idx ON assessment_records (assessment_id);
+CREATE INDEX IF NOT EXISTS records_type_question_idx ON assessment_records (type, question_id);
+
+CREATE TABLE IF NOT EXISTS turns (
+    id TEXT PRIMARY KEY,
+    conversation_id TEXT NOT NULL,
+    session_id TEXT,
+    patient_id TEXT,
+    timestamp TEXT NOT NULL,
+    user_response_timestamp TEXT,
+    ai_response_timestamp TEXT,
+    response_ms INTEGER,
+    phase TEXT,
+    node_id TEXT,
+    tr TEXT,
+    chat_status TEXT,
+    eval_model TEXT,
+    eval_prompt_tokens INTEGER,
+    eval_completion_tokens INTEGER,
+    dec_type TEXT,
+    dec_model TEXT,
+    dec_prompt_tokens INTEGER,
+    dec_completion_tokens INTEGER,
+    user_chars INTEGER,
+    ai_chars INTEGER
+);
+CREATE INDEX IF NOT EXISTS turns_session_idx ON turns (session_id, timestamp);
+CREATE INDEX IF NOT EXISTS turns_phase_idx ON turns (phase, node_id);
+"""
+
+
+class AnalyticsStore:
+    """
+    Thin wrapper around the analytics SQLite file.
+
+    Example usage:
+    ```
+    store = AnalyticsStore()
+    rows = store.query(
+        "SELECT type, avg(score) AS avg_score FROM assessments GROUP BY type"
+    )
+    ```
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = Path(path or settings.ANALYTICS_STORE_PATH)
+
+    @contextmanager
+    def connect(self, read_only: bool = True) -> Iterator[sqlite3.Connection]:
+        """
+        Opens a connection to the store. Read only connections never create
+        the file and can not modify it; the writer (ETL) opens it read-write.
+        """
+        if read_only:
+            if not self.path.exists():
+                raise FileNotFoundError(
+                    f"Analytics store {self.path} does not exist. Run `manage.py analytics_etl` first.")
+            conn = sqlite3.connect(f"{self.path.as_uri()}?mode=ro", uri=True)
+        else:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.path)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def query(self, sql: str, params: Sequence[Any] = ()) -> List[Dict[str, Any]]:
+        """
+        Runs a read-only query and returns the rows as dictionaries.
+        """
+        with self.connect() as conn:
+            return [dict(row) for row in conn.execute(sql, params)]
+
+    @staticmethod
+    def get_hwm(conn: sqlite3.Connection, source: str) -> Tuple[Optional[str], Optional[str]]:
+        """
+        Returns the (timestamp, id) high-water mark of a source.
+        """
+        row = conn.execute(
+            "SELECT hwm_ts, hwm_id FROM etl_state WHERE source = ?", (source,)
+        ).fetchone()
+        return (row["hwm_ts"], row["hwm_id"]) if row else (None, None)
+
+    @staticmethod
+    def set_hwm(conn: sqlite3.Connection, source: str, hwm_ts: str, hwm_id: str, rows: int, now: str) -> None:
+        conn.execute(
+            """
+            INSERT INTO etl_state (source, hwm_ts, hwm_id, rows, updated_at)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(source) DO UPDATE SET
+                hwm_ts = excluded.hwm_ts,
+                hwm_id = excluded.hwm_id,
+                rows = etl_state.rows + excluded.rows,
+                updated_at = excluded.updated_at
+            """,
+            (source, hwm_ts, hwm_id, rows, now),
+        )
+
+    @staticmethod
+    def upsert(conn: sqlite3.Connection, table: str, rows: Iterable[Dict[str, Any]]) -> int:
+        """
+        Inserts or replaces rows (dictionaries keyed by column name) into `table`.
+        """
+        rows = list(rows)
+        if not rows:
+            return 0
+        columns = list(rows[0].keys())
+        sql = (
+            f"INSERT OR REPLACE INTO {table} ({', '.join(columns)}) "
+            f"VALUES ({', '.join('?' for _ in columns)})"
+        )
+        conn.executemany(sql, [tuple(row[c] for c in columns) for row in rows])
+        return len(rows)
+
+    @staticmethod
+    def reset(conn: sqlite3.Connection) -> None:
+        """
+        Drops all exported data and high-water marks.
+        """
+        for table in ("assessments", "assessment_records", "turns", "etl_state"):
+            conn.execute(f"DELETE FROM {table}")
@@ -0,0 +1,123 @@
+import os
+import tempfile
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+
+from assessments.models import Assessment, AssessmentRecord, AssessmentResult
+from chat.models import ChatMessage, ChatSession, Conversation
+
+from .etl import AnalyticsETL
+from .store import AnalyticsStore
+
+
+def temp_store(test):
+    directory = tempfile.TemporaryDirectory()
+    test.addCleanup(directory.cleanup)
+    return AnalyticsStore(os.path.join(directory.name, "analytics.sqlite3"))
+
+
+class AnalyticsStoreTests(SimpleTestCase):
+
+    def setUp(self):
+        self.store = temp_store(self)
+
+    def test_read_only_needs_the_file(self):
+        with self.assertRaises(FileNotFoundError):
+            self.store.query("SELECT 1")
+        self.assertFalse(self.store.path.exists())
+
+    def test_upsert_replaces_rows(self):
+        row = {"id": "asm_1", "patient_id": "pat_1", "type": "PHQ9", "status": "completed", "score": 4}
+        with self.store.connect(read_only=False) as conn, conn:
+            self.assertEqual(self.store.upsert(conn, "assessments", [row]), 1)
+            self.store.upsert(conn, "assessments", [{**row, "score": 9}, {**row, "id": "asm_2"}])
+            self.assertEqual(self.store.upsert(conn, "assessments", []), 0)
+        rows = self.store.query("SELECT id, score FROM assessments ORDER BY id")
+        self.assertEqual(rows, [{"id": "asm_1", "score": 9}, {"id": "asm_2", "score": 4}])
+
+    def test_hwm(self):
+        with self.store.connect(read_only=False) as conn, conn:
+            self.assertEqual(self.store.get_hwm(conn, "turns"), (None, None))
+            self.store.set_hwm(conn, "turns", "2024-05-17T10:00:00+00:00", "msg_1", 10, "2024-05-17T11:00:00+00:00")
+            self.store.set_hwm(conn, "turns", "2024-05-17T10:30:00+00:00", "msg_2", 5, "2024-05-17T11:00:00+00:00")
+            self.assertEqual(self.store.get_hwm(conn, "turns"), ("2024-05-17T10:30:00+00:00", "msg_2"))
+        self.assertEqual(self.store.query("SELECT rows FROM etl_state WHERE source = 'turns'"), [{"rows": 15}])
+
+
+class AnalyticsETLTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user("patient", "patient@example.com", "secret", role="patient")
+        cls.conversation = Conversation.objects.create(user=cls.user)
+        cls.session = ChatSession.objects.create(conversation=cls.conversation)
+
+    def setUp(self):
+        self.store = temp_store(self)
+        self.etl = AnalyticsETL(store=self.store, lag=timedelta(minutes=10), window=timedelta(hours=1), batch_size=2)
+
+    def assessment(self, minutes_ago: int, score: int = 5) -> Assessment:
+        assessment = Assessment.objects.create(
+            patient=self.user.patient, session=self.session, status="completed",
+            completed_at=timezone.now() - timedelta(minutes=minutes_ago))
+        AssessmentResult.objects.create(assessment=assessment, score=score, severity="mild")
+        AssessmentRecord.objects.create(assessment=assessment, question_id="1", score=1, keywords=["fatigue"])
+        return assessment
+
+    def message(self, minutes_ago: int) -> ChatMessage:
+        message = ChatMessage.objects.create(
+            conversation=self.conversation, chat_session=self.session, user_response="yes", ai_response="Thanks!",
+            user_marker={"phase": "PHQ9", "node_id": "1", "tr": "NORMAL_y"},
+            meta_data={"dec": {"type": "llm", "meta": {"model_name": "gpt-test",
+                                                       "token_usage": {"prompt_tokens": 120, "completion_tokens": 8}}}})
+        ChatMessage.objects.filter(pk=message.pk).update(timestamp=timezone.now() - timedelta(minutes=minutes_ago))
+        return message
+
+    def test_incremental_runs(self):
+        for minutes_ago in (50, 40, 30):
+            self.assessment(minutes_ago)
+        self.message(30)
+        self.assertEqual(self.etl.run(), {"assessments": 3, "turns": 1})
+        self.assertEqual(self.etl.run(), {"assessments": 0, "turns": 0})
+
+        self.assessment(20)
+        self.message(20)
+        self.assertEqual(self.etl.run(), {"assessments": 1, "turns": 1})
+        self.assertEqual(len(self.store.query("SELECT id FROM assessments")), 4)
+        self.assertEqual(len(self.store.query("SELECT id FROM assessment_records")), 4)
+        turn = self.store.query("SELECT * FROM turns")[0]
+        self.assertEqual((turn["phase"], turn["node_id"], turn["tr"]), ("PHQ9", "1", "NORMAL_y"))
+        self.assertEqual((turn["dec_model"], turn["dec_prompt_tokens"], turn["user_chars"]), ("gpt-test", 120, 3))
+        self.assertEqual(self.store.query("SELECT rows FROM etl_state WHERE source = 'assessments'"), [{"rows": 4}])
+
+    def test_rows_younger_than_lag_are_skipped(self):
+        assessment = self.assessment(5)
+        self.message(5)
+        self.assertEqual(self.etl.run(), {"assessments": 0, "turns": 0})
+
+        Assessment.objects.filter(pk=assessment.pk).update(completed_at=timezone.now() - timedelta(minutes=15))
+        ChatMessage.objects.update(timestamp=timezone.now() - timedelta(minutes=15))
+        self.assertEqual(self.etl.run(), {"assessments": 1, "turns": 1})
+
+    def test_changes_inside_the_window_are_re_exported(self):
+        old, recent = self.assessment(120), self.assessment(30)
+        self.etl.run()
+        AssessmentResult.objects.update(score=20)
+        AssessmentRecord.objects.update(keywords=["sleeping problem"])
+
+        self.assertEqual(self.etl.run()["assessments"], 0)
+        scores = {row["id"]: row["score"] for row in self.store.query("SELECT id, score FROM assessments")}
+        # only the hour before the high-water mark is exported again
+        self.assertEqual(scores, {old.id: 5, recent.id: 20})
+        keywords = self.store.query("SELECT keywords FROM assessment_records WHERE assessment_id = ?", [recent.id])
+        self.assertEqual(keywords, [{"keywords": '["sleeping problem"]'}])
+
+    def test_full_run_starts_over(self):
+        self.assessment(30)
+        self.etl.run()
+        Assessment.objects.all().delete()
+        self.assertEqual(self.etl.run(full=True), {"assessments": 0, "turns": 0})
+        self.assertEqual(self.store.query("SELECT id FROM assessments"), [])
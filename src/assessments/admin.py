@@ -1,24 +1,51 @@
 from django.contrib import admin
 
-from .models import Assessment, AssessmentRecord, AssessmentResult
+from beaconmind.admin_utils import InputFilter, KeysetPaginationMixin
+from beaconmind.search import ASSESSMENT_RECORDS, FullTextSearchMixin
+from .models import Assessment, AssessmentRecord, AssessmentResult, KeywordStat, KeywordSynonym
+
+
+class PatientUsernameFilter(InputFilter):
+    title = 'patient username'
+    parameter_name = 'patient'
+    lookup = 'patient__user__username'
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(**{self.lookup: self.value().strip()})
+        return queryset
+
+
+class AssessmentPatientUsernameFilter(PatientUsernameFilter):
+    lookup = 'assessment__patient__user__username'
 
 
 @admin.register(Assessment)
 class AssessmentAdmin(admin.ModelAdmin):
     list_display = ['patient', 'type', 'status', 'timestamp', 'completed_at']
     search_fields = ['patient__user__username', 'patient__user__email']
-    list_filter = ['type', 'status', 'patient']
+    list_filter = ['type', 'status', PatientUsernameFilter]
     ordering = ['-timestamp']
+    list_select_related = ['patient__user']
+    autocomplete_fields = ['patient', 'session']
+
+    def get_queryset(self, request):
+        # __str__ goes through patient.user, also in the autocomplete results of records and results
+        return super().get_queryset(request).select_related('patient__user')
 
 
 @admin.register(AssessmentRecord)
-class AssessmentRecordAdmin(admin.ModelAdmin):
+class AssessmentRecordAdmin(FullTextSearchMixin, KeysetPaginationMixin, admin.ModelAdmin):
     list_display = ['assessment', 'question_id',
                     'question_text', 'score', 'timestamp']
     search_fields = ['assessment__patient__user__username',
                      'assessment__patient__user__email', 'question_text']
-    list_filter = ['assessment__type', 'assessment__status', 'assessment__patient']
-    ordering = ['-timestamp', 'assessment']
+    search_document = ASSESSMENT_RECORDS
+    list_filter = ['assessment__type', 'assessment__status', AssessmentPatientUsernameFilter]
+    ordering = ['-timestamp']
+    list_select_related = ['assessment__patient__user']
+    autocomplete_fields = ['assessment']
+    show_full_result_count = False
 
 
 @admin.register(AssessmentResult)
@@ -26,6 +53,28 @@ class AssessmentResultAdmin(admin.ModelAdmin):
     list_display = ['assessment', 'score', 'timestamp']
     search_fields = ['assessment__patient__user__username',
                      'assessment__patient__user__email']
-    list_filter = ['assessment__type', 'assessment__status', 'assessment__patient']
+    list_filter = ['assessment__type', 'assessment__status', AssessmentPatientUsernameFilter]
     ordering = ['assessment', '-timestamp']
+    list_select_related = ['assessment__patient__user']
+    autocomplete_fields = ['assessment']
+
+
+@admin.register(KeywordSynonym)
+class KeywordSynonymAdmin(admin.ModelAdmin):
+    list_display = ['term', 'canonical']
+    search_fields = ['term', 'canonical']
+    ordering = ['canonical', 'term']
+
+
+@admin.register(KeywordStat)
+class KeywordStatAdmin(admin.ModelAdmin):
+    list_display = ['keyword', 'type', 'month', 'records', 'high_records', 'score_sum']
+    search_fields = ['keyword']
+    list_filter = ['type', 'month']
+    ordering = ['-month', '-high_records']
+
+    def has_add_permission(self, request):
+        return False
 
+    def has_change_permission(self, request, obj=None):
+        return False
@@ -0,0 +1,202 @@
+"""
+Keyword normalization and incremental keyword statistics.
+
+Keywords extracted by the score chain are free-form ("Sleeping problems",
+"sleep issue", "insomnia"). They are normalized at write time so that
+`AssessmentRecord.keywords` can be matched exactly (GIN indexed on
+PostgreSQL) and aggregated into `KeywordStat` rows as each assessment is
+scored.
+"""
+
+import re
+import time
+from collections import defaultdict
+from datetime import date
+from typing import Dict, Iterable, List, Tuple
+
+from django.db import connection, transaction
+
+from .definitions import BaseAssessmentPhase
+
+
+_PUNCT = re.compile(r"[^\w\s'-]+")
+_SPACES = re.compile(r"\s+")
+
+# irregular forms the suffix rules below would get wrong
+_IRREGULAR = {
+    "children": "child",
+    "feet": "foot",
+    "men": "man",
+    "women": "woman",
+    "people": "person",
+    "thoughts": "thought",
+    "felt": "feel",
+    "slept": "sleep",
+    "ate": "eat",
+    "lost": "lose",
+}
+
+# endings that look plural but are not
+_KEEP = ("ss", "us", "is", "ous", "ics")
+
+# words ending in "s" that are not plurals, or whose singular means something else
+_INVARIANT = {
+    "news", "diabetes", "herpes", "rabies", "scabies", "measles", "mumps", "shingles", "hives",
+    "series", "species", "means", "lens", "clothes", "glasses", "thanks", "always", "sometimes",
+    "perhaps", "yes",
+}
+
+_SYNONYM_TTL = 300  # seconds
+
+
+def lemmatize(word: str) -> str:
+    """
+    Conservative rule-based lemmatizer for single English words: reduces
+    plurals and a few irregular forms, leaves everything else untouched.
+    """
+    if word in _IRREGULAR:
+        return _IRREGULAR[word]
+    if len(word) <= 3 or word in _INVARIANT or word.endswith(_KEEP):
+        return word
+    if word.endswith("ies") and len(word) > 4:
+        return word[:-3] + "y"
+    if word.endswith(("ches", "shes", "sses", "xes", "zzes")) and not word.endswith("aches"):
+        return word[:-2]
+    if word.endswith("s"):
+        return word[:-1]
+    return word
+
+
+def _normalize_phrase(keyword: str) -> str:
+    phrase = _PUNCT.sub(" ", str(keyword).lower())
+    phrase = _SPACES.sub(" ", phrase).strip(" '-")
+    return " ".join(lemmatize(word) for word in phrase.split(" ") if word)[:100]
+
+
+class SynonymTable:
+    """
+    Process-local copy of `KeywordSynonym`, refreshed every few minutes and
+    on every change to the table (see `assessments.signals`).
+    """
+
+    _map: Dict[str, str] = {}
+    _loaded_at: float = 0.0
+
+    @classmethod
+    def get(cls) -> Dict[str, str]:
+        if time.monotonic() - cls._loaded_at > _SYNONYM_TTL:
+            from .models import KeywordSynonym
+            cls._map = {
+                _normalize_phrase(term): _normalize_phrase(canonical)
+                for term, canonical in KeywordSynonym.objects.values_list("term", "canonical")
+            }
+            cls._loaded_at = time.monotonic()
+        return cls._map
+
+    @classmethod
+    def invalidate(cls) -> None:
+        cls._loaded_at = 0.0
+
+
+def normalize_keywords(keywords: Iterable[str]) -> List[str]:
+    """
+    Lowercases, strips punctuation, lemmatizes and maps synonyms to their
+    canonical keyword. Order is kept and duplicates are dropped.
+
+    ex. ["Sleeping Problems", "insomnia!", "sleeping problem"] -> ["sleeping problem"]
+    (given a synonym "insomnia" -> "sleeping problem"; verb forms are kept)
+    """
+    synonyms = SynonymTable.get()
+    normalized = []
+    for keyword in keywords or []:
+        phrase = _normalize_phrase(keyword)
+        phrase = synonyms.get(phrase, phrase)
+        if phrase and phrase not in normalized:
+            normalized.append(phrase)
+    return normalized
+
+
+def is_high_score(phase: BaseAssessmentPhase, score: int) -> bool:
+    """
+    Whether a question score falls in the upper third of the phase's range
+    (ex. 2 or 3 on PHQ-9/GAD-7, 1 on ASQ).
+    """
+    return phase.high > 0 and score >= max(1, round(phase.high * 2 / 3))
+
+
+def record_keyword_stats(phase: BaseAssessmentPhase, records: Iterable, day: date) -> None:
+    """
+    Adds the keywords of freshly scored records to the monthly `KeywordStat`
+    counters of `phase`, in a single upsert that increments existing rows in
+    place so concurrent scoring writes never lose updates.
+    """
+    from .models import KeywordStat
+
+    month = day.replace(day=1)
+    deltas: Dict[str, List[int]] = defaultdict(lambda: [0, 0, 0])  # records, score_sum, high
+    for record in records:
+        for keyword in record.keywords or []:
+            delta = deltas[keyword]
+            delta[0] += 1
+            delta[1] += record.score
+            delta[2] += int(is_high_score(phase, record.score))
+    if not deltas:
+        return
+
+    # bulk_create(update_conflicts=True) can only overwrite the counters, not add to them
+    table = connection.ops.quote_name(KeywordStat._meta.db_table)
+    counters = ("records", "score_sum", "high_records")
+    rows = ", ".join(["(%s, %s, %s, %s, %s, %s)"] * len(deltas))
+    params = []
+    for keyword, (count, score_sum, high) in deltas.items():
+        params += [keyword, phase.name, connection.ops.adapt_datefield_value(month), count, score_sum, high]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {table} (keyword, type, month, {', '.join(counters)}) VALUES {rows} "
+            f"ON CONFLICT (keyword, type, month) DO UPDATE SET "
+            + ", ".join(f"{name} = {table}.{name} + EXCLUDED.{name}" for name in counters),
+            params,
+        )
+
+
+def rebuild_keyword_stats(phases: Iterable[BaseAssessmentPhase]) -> Tuple[int, int]:
+    """
+    Re-normalizes the keywords of every completed record and recomputes all
+    `KeywordStat` rows from scratch. Returns (records updated, stat rows).
+    """
+    from django.utils import timezone
+    from .models import AssessmentRecord, KeywordStat
+
+    phases = {phase.name: phase for phase in phases}
+    totals: Dict[Tuple[str, str, date], List[int]] = defaultdict(lambda: [0, 0, 0])
+    changed = []
+    qs = (
+        AssessmentRecord.objects
+        .filter(assessment__status="completed")
+        .select_related("assessment")
+    )
+    for record in qs.iterator(chunk_size=2000):
+        keywords = normalize_keywords(record.keywords)
+        if keywords != record.keywords:
+            record.keywords = keywords
+            changed.append(record)
+        phase = phases.get(record.assessment.type)
+        if phase is None:
+            continue
+        completed_at = record.assessment.completed_at or record.timestamp
+        month = timezone.localdate(completed_at).replace(day=1)
+        for keyword in keywords:
+            total = totals[(keyword, phase.name, month)]
+            total[0] += 1
+            total[1] += record.score
+            total[2] += int(is_high_score(phase, record.score))
+
+    with transaction.atomic():
+        AssessmentRecord.objects.bulk_update(changed, ["keywords"], batch_size=1000)
+        KeywordStat.objects.all().delete()
+        KeywordStat.objects.bulk_create([
+            KeywordStat(keyword=keyword, type=type_, month=month,
+                        records=count, score_sum=score_sum, high_records=high)
+            for (keyword, type_, month), (count, score_sum, high) in totals.items()
+        ], batch_size=1000)
+    return len(changed), len(totals)
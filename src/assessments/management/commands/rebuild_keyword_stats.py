@@ -0,0 +1,20 @@
+# assessments/management/commands/rebuild_keyword_stats.py
+
+from django.core.management.base import BaseCommand
+
+from assessments.definitions import PhaseMap
+from assessments.keywords import SynonymTable, rebuild_keyword_stats
+
+
+class Command(BaseCommand):
+    help = (
+        'Re-normalizes the keywords of all completed assessment records and rebuilds the '
+        'KeywordStat counters. Run after changing keyword synonyms or normalization rules.'
+    )
+
+    def handle(self, *args, **options):
+        SynonymTable.invalidate()
+        updated, stats = rebuild_keyword_stats(PhaseMap.all())
+        self.stdout.write(self.style.SUCCESS(
+            f"Re-normalized {updated} records, rebuilt {stats} keyword stat rows"
+        ))
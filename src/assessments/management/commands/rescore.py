@@ -0,0 +1,56 @@
+# assessments/management/commands/rescore.py
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from assessments.definitions import PhaseMap
+from assessments.models import Assessment
+from chat.breaker import is_outage
+from chat.services.session import SessionPipeline
+
+
+class Command(BaseCommand):
+    help = (
+        'Scores the assessments completed while the chat ran in degraded mode (LLM unavailable) with '
+        'the score chain. Meant to run periodically: it stops at the first provider outage.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=100, help="assessments to score, oldest first")
+
+    def handle(self, *args, **options):
+        ids = list(
+            Assessment.objects.filter(needs_scoring=True, session__isnull=False)
+            .order_by('timestamp').values_list('id', flat=True)[:options['limit']]
+        )
+        scored = failed = 0
+        for assessment_id in ids:
+            pipeline = None
+            try:
+                with transaction.atomic():
+                    assessment = (
+                        Assessment.objects.select_for_update(skip_locked=True, of=('self',))
+                        .select_related('session__conversation__user__patient')
+                        .filter(id=assessment_id, needs_scoring=True).first()
+                    )
+                    if assessment is None:
+                        # scored meanwhile
+                        continue
+                    phase = PhaseMap.get(assessment.type)
+                    pipeline = SessionPipeline(assessment.session.conversation, assessment.session)
+                    # usage is accounted to the scored phase, not the session's current one
+                    pipeline.curr_phase = phase
+                    pipeline.run_score_routine(phase, assessment)
+                scored += 1
+            except Exception as e:
+                if is_outage(e):
+                    self.stderr.write(f"LLM unavailable, stopping: {e!r}")
+                    break
+                failed += 1
+                self.stderr.write(f"Could not score {assessment_id}: {e!r}")
+            finally:
+                if pipeline is not None:
+                    pipeline.usage.flush()
+        self.stdout.write(self.style.SUCCESS(
+            f"Scored {scored} of {len(ids)} assessments ({failed} failed)"
+        ))
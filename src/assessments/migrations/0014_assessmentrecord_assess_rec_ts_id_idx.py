@@ -0,0 +1,17 @@
+# Generated by Django 5.0.7 on 2026-10-19 07:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('assessments', '0013_alter_assessmentrecord_question_id'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='assessmentrecord',
+            index=models.Index(fields=['timestamp', 'id'], name='assess_rec_ts_id_idx'),
+        ),
+    ]
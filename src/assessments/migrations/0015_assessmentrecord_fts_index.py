@@ -0,0 +1,42 @@
+# Full-text search index over assessment records (PostgreSQL only).
+# The indexed expression must match `beaconmind.search.ASSESSMENT_RECORDS.vector()`.
+
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector
+from django.db import migrations
+from django.db.models import TextField
+from django.db.models.functions import Cast
+
+
+def fts_index():
+    return GinIndex(
+        SearchVector('question_text', 'remark', 'snippet', Cast('keywords', TextField()), config='english'),
+        name='assess_rec_fts_idx',
+    )
+
+
+def add_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    model = apps.get_model('assessments', 'AssessmentRecord')
+    schema_editor.add_index(model, fts_index(), concurrently=True)
+
+
+def remove_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    model = apps.get_model('assessments', 'AssessmentRecord')
+    schema_editor.remove_index(model, fts_index(), concurrently=True)
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('assessments', '0014_assessmentrecord_assess_rec_ts_id_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_index, remove_index),
+    ]
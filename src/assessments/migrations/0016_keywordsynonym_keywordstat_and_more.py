@@ -0,0 +1,47 @@
+# Generated by Django 5.0.7 on 2026-10-19 07:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('assessments', '0015_assessmentrecord_fts_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='KeywordSynonym',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=100, unique=True)),
+                ('canonical', models.CharField(max_length=100)),
+            ],
+            options={
+                'verbose_name': 'Keyword Synonym',
+                'verbose_name_plural': 'Keyword Synonyms',
+                'ordering': ['canonical', 'term'],
+            },
+        ),
+        migrations.CreateModel(
+            name='KeywordStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('keyword', models.CharField(max_length=100)),
+                ('type', models.CharField(choices=[('assessment.phq9', 'PHQ9'), ('assessment.gad7', 'GAD7'), ('monitoring', 'Monitoring'), ('assessment.asq', 'ASQ')], max_length=30)),
+                ('month', models.DateField()),
+                ('records', models.PositiveIntegerField(default=0)),
+                ('score_sum', models.PositiveIntegerField(default=0)),
+                ('high_records', models.PositiveIntegerField(default=0, verbose_name='High-score records')),
+            ],
+            options={
+                'verbose_name': 'Keyword Stat',
+                'verbose_name_plural': 'Keyword Stats',
+                'indexes': [models.Index(fields=['type', 'month'], name='keyword_stat_type_month_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='keywordstat',
+            constraint=models.UniqueConstraint(fields=('keyword', 'type', 'month'), name='unique_keyword_stat'),
+        ),
+    ]
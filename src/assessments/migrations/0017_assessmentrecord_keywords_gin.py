@@ -0,0 +1,36 @@
+# GIN index over AssessmentRecord.keywords for `keywords__contains` (jsonb @>)
+# lookups (PostgreSQL only).
+
+from django.contrib.postgres.indexes import GinIndex
+from django.db import migrations
+
+
+def keywords_index():
+    return GinIndex(fields=['keywords'], name='assess_rec_keywords_gin', opclasses=['jsonb_path_ops'])
+
+
+def add_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    model = apps.get_model('assessments', 'AssessmentRecord')
+    schema_editor.add_index(model, keywords_index(), concurrently=True)
+
+
+def remove_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    model = apps.get_model('assessments', 'AssessmentRecord')
+    schema_editor.remove_index(model, keywords_index(), concurrently=True)
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('assessments', '0016_keywordsynonym_keywordstat_and_more'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_index, remove_index),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.7 on 2026-10-19 08:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('assessments', '0017_assessmentrecord_keywords_gin'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='assessment',
+            name='needs_scoring',
+            field=models.BooleanField(db_index=True, default=False),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.7 on 2026-10-19 10:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('assessments', '0018_assessment_needs_scoring'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='assessmentresult',
+            name='severity',
+            field=models.CharField(blank=True, max_length=40, null=True),
+        ),
+    ]
@@ -25,6 +25,8 @@ class Assessment(models.Model):
     status = models.CharField(max_length=10, choices=_status, default='pending')
     timestamp = models.DateTimeField(verbose_name="Started at", auto_now_add=True)
     completed_at = models.DateTimeField(blank=True, null=True)
+    # completed in degraded mode (LLM unavailable): scored later by `manage.py rescore`
+    needs_scoring = models.BooleanField(default=False, db_index=True)
 
     def __str__(self):
         return f"{self.patient.user.username}'s {self.get_type_display()} assessment"
@@ -44,6 +46,9 @@ class AssessmentRecord(models.Model):
     class Meta:
         verbose_name = 'Assessment Record'
         verbose_name_plural = 'Assessment Records'
+        indexes = [
+            models.Index(fields=['timestamp', 'id'], name='assess_rec_ts_id_idx'),
+        ]
 
     def __str__(self):
         return f"[Q{self.question_id} : {self.score}] in {self.assessment}"
@@ -52,7 +57,7 @@ class AssessmentResult(models.Model):
     id = ShortUUIDField(primary_key=True, prefix='res_')
     assessment = models.OneToOneField(Assessment, related_name='result', on_delete=models.CASCADE)
     score = models.IntegerField()
-    severity = models.CharField(max_length=20, null=True, blank=True)
+    severity = models.CharField(max_length=40, null=True, blank=True)
     timestamp = models.DateTimeField(auto_now_add=True)
 
     class Meta:
@@ -61,3 +66,42 @@ class AssessmentResult(models.Model):
 
     def __str__(self):
         return f"{self.assessment.patient.user.username}'s {self.assessment.get_type_display()} assessment result"
+
+
+class KeywordSynonym(models.Model):
+    """Maps a (normalized) keyword to the canonical keyword it is counted as."""
+    term = models.CharField(max_length=100, unique=True)
+    canonical = models.CharField(max_length=100)
+
+    class Meta:
+        verbose_name = 'Keyword Synonym'
+        verbose_name_plural = 'Keyword Synonyms'
+        ordering = ['canonical', 'term']
+
+    def __str__(self):
+        return f"{self.term} -> {self.canonical}"
+
+class KeywordStat(models.Model):
+    """
+    Pre-aggregated monthly counts of a keyword across records of one
+    assessment type; maintained incrementally as assessments are scored.
+    """
+    keyword = models.CharField(max_length=100)
+    type = models.CharField(max_length=30, choices=Assessment._types)
+    month = models.DateField()
+    records = models.PositiveIntegerField(default=0)
+    score_sum = models.PositiveIntegerField(default=0)
+    high_records = models.PositiveIntegerField("High-score records", default=0)
+
+    class Meta:
+        verbose_name = 'Keyword Stat'
+        verbose_name_plural = 'Keyword Stats'
+        constraints = [
+            models.UniqueConstraint(fields=['keyword', 'type', 'month'], name='unique_keyword_stat'),
+        ]
+        indexes = [
+            models.Index(fields=['type', 'month'], name='keyword_stat_type_month_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.keyword} ({self.get_type_display()}, {self.month:%b %Y}): {self.records}"
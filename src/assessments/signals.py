@@ -0,0 +1,10 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .keywords import SynonymTable
+from .models import KeywordSynonym
+
+
+@receiver([post_save, post_delete], sender=KeywordSynonym)
+def invalidate_synonyms(sender, **kwargs):
+    SynonymTable.invalidate()
@@ -1,3 +1,94 @@
+from datetime import date
+from types import SimpleNamespace
+from unittest import mock
+
+from django.contrib.auth import get_user_model
 from django.test import TestCase
 
-# Create your tests here.
+from beaconmind.admin_utils import KeysetPaginator
+
+from .definitions import PHQ9Phase
+from .keywords import SynonymTable, lemmatize, normalize_keywords, record_keyword_stats
+from .models import Assessment, AssessmentRecord, KeywordStat, KeywordSynonym
+
+
+class LemmatizeTests(TestCase):
+
+    def test_plurals(self):
+        for word, lemma in [("problems", "problem"), ("worries", "worry"), ("headaches", "headache"),
+                            ("rashes", "rash"), ("sizes", "size"), ("children", "child")]:
+            self.assertEqual(lemmatize(word), lemma)
+
+    def test_invariant_words(self):
+        for word in ["news", "diabetes", "shingles", "stress", "anxious", "psychosis", "sometimes"]:
+            self.assertEqual(lemmatize(word), word)
+
+    def test_normalize_keywords(self):
+        KeywordSynonym.objects.create(term="insomnia", canonical="sleeping problem")
+        SynonymTable.invalidate()
+        self.addCleanup(SynonymTable.invalidate)
+        self.assertEqual(
+            normalize_keywords(["Sleeping Problems", "insomnia!", "sleeping problem", "Bad News"]),
+            ["sleeping problem", "bad news"],
+        )
+
+
+class KeywordStatTests(TestCase):
+
+    def test_record_keyword_stats_upserts_in_one_query(self):
+        phase = PHQ9Phase()
+        records = [
+            SimpleNamespace(keywords=["fatigue", "sleeping problem"], score=3),
+            SimpleNamespace(keywords=["fatigue"], score=1),
+        ]
+        day = date(2024, 5, 17)
+        with self.assertNumQueries(1):
+            record_keyword_stats(phase, records, day)
+        record_keyword_stats(phase, records[:1], day)
+
+        stats = {stat.keyword: stat for stat in KeywordStat.objects.all()}
+        self.assertEqual(set(stats), {"fatigue", "sleeping problem"})
+        fatigue = stats["fatigue"]
+        self.assertEqual(fatigue.month, date(2024, 5, 1))
+        self.assertEqual((fatigue.records, fatigue.score_sum, fatigue.high_records), (3, 7, 2))
+        self.assertEqual(stats["sleeping problem"].records, 2)
+
+    def test_record_keyword_stats_without_keywords(self):
+        with self.assertNumQueries(0):
+            record_keyword_stats(PHQ9Phase(), [SimpleNamespace(keywords=[], score=2)], date(2024, 5, 17))
+
+
+class KeysetPaginatorTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        user = get_user_model().objects.create_user("patient", "patient@example.com", "secret", role="patient")
+        assessment = Assessment.objects.create(patient=user.patient)
+        AssessmentRecord.objects.bulk_create(
+            AssessmentRecord(assessment=assessment, question_id=str(i), score=i % 4) for i in range(25))
+
+    def paginate(self, session, number):
+        paginator = KeysetPaginator(AssessmentRecord.objects.order_by("-timestamp", "-pk"), 10, cursors=session)
+        with mock.patch.object(KeysetPaginator, "_seek", autospec=True, side_effect=KeysetPaginator._seek) as seek:
+            page = paginator.page(number)
+        return [record.pk for record in page.object_list], seek.called
+
+    def test_seeks_from_the_previous_page_of_the_same_session(self):
+        expected = list(AssessmentRecord.objects.order_by("-timestamp", "-pk").values_list("pk", flat=True))
+        session = {}
+        self.assertEqual(self.paginate(session, 1), (expected[:10], False))
+        self.assertEqual(self.paginate(session, 2), (expected[10:20], True))
+        self.assertEqual(self.paginate(session, 3), (expected[20:], True))
+        # only the cursor of the last page served is kept
+        self.assertEqual(self.paginate(session, 2), (expected[10:20], False))
+
+    def test_cursors_are_not_shared_between_sessions(self):
+        session, other = {}, {}
+        self.paginate(session, 1)
+        pks, seeked = self.paginate(other, 2)
+        self.assertFalse(seeked)
+        self.assertEqual(pks, self.paginate(session, 2)[0])
+
+    def test_without_cursors(self):
+        paginator = KeysetPaginator(AssessmentRecord.objects.order_by("-timestamp", "-pk"), 10)
+        self.assertEqual(len(paginator.page(3).object_list), 5)
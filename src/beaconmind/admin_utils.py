@@ -0,0 +1,196 @@
+"""
+Admin helpers for changelists over large tables.
+"""
+
+import hashlib
+import json
+from typing import Any, List, Optional
+
+from django.contrib import admin
+from django.core.exceptions import FieldDoesNotExist
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import IntegerField, OuterRef, Q, QuerySet, Subquery
+from django.utils.functional import cached_property
+
+
+class SubqueryCount(Subquery):
+    """
+    Correlated `COUNT(*)` subquery, for annotating reverse relation counts
+    without joining (and multiplying) several relations in one GROUP BY.
+
+    Example usage:
+    ```
+    qs.annotate(n_messages=SubqueryCount(
+        ChatMessage.objects.filter(conversation=OuterRef('pk'))
+    ))
+    ```
+    """
+
+    template = '(SELECT COUNT(*) FROM (%(subquery)s) _count)'
+    output_field = IntegerField()
+
+    def __init__(self, queryset: QuerySet, **kwargs):
+        super().__init__(queryset.order_by().values('pk'), **kwargs)
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that takes the planner's row estimate instead of running
+    `COUNT(*)` on PostgreSQL, falling back to an exact count for small
+    result sets and for other database backends.
+    """
+
+    exact_threshold = 10_000
+
+    @cached_property
+    def count(self) -> int:
+        qs = self.object_list
+        if not isinstance(qs, QuerySet) or connections[qs.db].vendor != 'postgresql':
+            return super().count
+        estimate = self.estimate(qs)
+        if estimate is None or estimate < self.exact_threshold:
+            return super().count
+        return estimate
+
+    @staticmethod
+    def estimate(qs: QuerySet) -> Optional[int]:
+        try:
+            plan = json.loads(qs.order_by().explain(format='json'))
+            return int(plan[0]['Plan']['Plan Rows'])
+        except Exception:
+            return None
+
+
+class KeysetPaginator(EstimatedCountPaginator):
+    """
+    Estimated-count paginator that seeks to the next page with a keyset
+    (`WHERE (ordering keys) < (last row keys)`) condition instead of an
+    `OFFSET` when the previous page was just served.
+
+    The last row keys of the page served are kept in `cursors`, the admin
+    user's session (see `KeysetPaginationMixin`), keyed by the queryset SQL,
+    so sequential paging through the changelist stays an index range scan
+    however deep it goes. A cursor is only ever taken from the same user's
+    previous page; jumping to any other page, or paginating without
+    `cursors`, falls back to `OFFSET`.
+    """
+
+    session_key = 'admin:keyset'
+    # querysets whose cursor is kept per session
+    max_cursors = 20
+
+    def __init__(self, object_list, per_page, orphans=0, allow_empty_first_page=True, cursors=None):
+        super().__init__(object_list, per_page, orphans, allow_empty_first_page)
+        self.cursors = cursors
+
+    def page(self, number):
+        number = self.validate_number(number)
+        fields = self._keyset_fields() if self.cursors is not None else []
+        cursor = self._get_cursor(number - 1) if fields and number > 1 else None
+        if cursor is not None:
+            object_list = list(self._seek(fields, cursor)[:self.per_page])
+        else:
+            bottom = (number - 1) * self.per_page
+            object_list = list(self.object_list[bottom:bottom + self.per_page])
+        if fields and object_list:
+            last = object_list[-1]
+            # as strings, the session is serialized to JSON
+            self._set_cursor(number, [field.value_to_string(last) for field, _ in fields])
+        return self._get_page(object_list, number, self)
+
+    def _keyset_fields(self) -> List[tuple]:
+        """
+        Returns [(field, descending), ...] for the queryset ordering, or an
+        empty list when the ordering can not be used as a keyset.
+        """
+        qs = self.object_list
+        if not isinstance(qs, QuerySet) or not qs.query.order_by:
+            return []
+        fields = []
+        for item in qs.query.order_by:
+            if not isinstance(item, str):
+                return []
+            name = item.lstrip('-')
+            if name == 'pk':
+                name = qs.model._meta.pk.attname
+            try:
+                field = qs.model._meta.get_field(name)
+            except FieldDoesNotExist:
+                return []
+            if field.is_relation or field.null:
+                return []
+            if field not in (field for field, _ in fields):
+                fields.append((field, item.startswith('-')))
+        return fields
+
+    def _seek(self, fields: List[tuple], cursor: List[Any]) -> QuerySet:
+        condition = Q()
+        for i, (field, descending) in enumerate(fields):
+            term = Q(**{f"{field.attname}__{'lt' if descending else 'gt'}": cursor[i]})
+            for j in range(i):
+                term &= Q(**{fields[j][0].attname: cursor[j]})
+            condition |= term
+        return self.object_list.filter(condition)
+
+    @cached_property
+    def _cursor_key(self) -> str:
+        return hashlib.md5(f"{self.object_list.query}|{self.per_page}".encode()).hexdigest()
+
+    def _get_cursor(self, number: int) -> Optional[List[str]]:
+        entry = self.cursors.get(self.session_key, {}).get(self._cursor_key)
+        return entry[1] if entry and entry[0] == number else None
+
+    def _set_cursor(self, number: int, cursor: List[str]) -> None:
+        cursors = dict(self.cursors.get(self.session_key, {}))
+        cursors.pop(self._cursor_key, None)
+        cursors[self._cursor_key] = [number, cursor]
+        while len(cursors) > self.max_cursors:
+            del cursors[next(iter(cursors))]
+        self.cursors[self.session_key] = cursors
+
+
+class KeysetPaginationMixin:
+    """
+    ModelAdmin mixin that paginates the changelist with `KeysetPaginator`,
+    keeping the cursors in the admin user's session.
+    """
+
+    paginator = KeysetPaginator
+
+    def get_paginator(self, request, queryset, per_page, orphans=0, allow_empty_first_page=True):
+        return self.paginator(queryset, per_page, orphans, allow_empty_first_page, cursors=request.session)
+
+
+class InputFilter(admin.SimpleListFilter):
+    """
+    List filter rendered as a free-text input instead of a list of every
+    value in the table. Subclasses implement `queryset()` using `self.value()`.
+    """
+
+    template = 'admin/input_filter.html'
+
+    def lookups(self, request, model_admin):
+        return ()
+
+    def has_output(self):
+        return True
+
+    def choices(self, changelist):
+        yield {
+            'selected': self.value() is None,
+            'query_string': changelist.get_query_string(remove=[self.parameter_name]),
+            'query_parts': [
+                (key, value)
+                for key, values in changelist.get_filters_params().items()
+                if key != self.parameter_name
+                for value in (values if isinstance(values, list) else [values])
+            ],
+        }
+
+
+def outer_count(model, field: str) -> SubqueryCount:
+    """
+    Shorthand for `SubqueryCount(model.objects.filter(<field>=OuterRef('pk')))`.
+    """
+    return SubqueryCount(model.objects.filter(**{field: OuterRef('pk')}))
@@ -0,0 +1,170 @@
+"""
+Full-text search over chat transcripts and assessment records.
+
+On PostgreSQL the documents below are matched with `to_tsvector(...) @@
+websearch_to_tsquery(...)` against expression GIN indexes created by the
+`chat` and `assessments` migrations, ranked with `ts_rank` and highlighted
+with `ts_headline`. The vector expressions here must stay identical to the
+indexed ones, otherwise the planner falls back to sequential scans.
+
+Other database backends (SQLite in development) fall back to `icontains`.
+"""
+
+from dataclasses import dataclass, field
+from functools import reduce
+from operator import or_
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from django.contrib.postgres.search import SearchHeadline, SearchQuery, SearchRank, SearchVector
+from django.db import connections
+from django.db.models import Q, QuerySet, TextField
+from django.db.models.functions import Cast
+
+
+SEARCH_CONFIG = 'english'
+HEADLINE_OPTIONS = {
+    'start_sel': '<mark>',
+    'stop_sel': '</mark>',
+    'max_words': 35,
+    'min_words': 15,
+    'max_fragments': 2,
+}
+
+
+@dataclass
+class SearchDocument:
+    """
+    A searchable document over one model.
+
+    `fields` are the indexed text expressions, `highlight` the fields that
+    get a highlighted fragment in results and `extra` an optional callable
+    returning a Q object OR-ed with the text match (e.g. exact username), or
+    None. `extra` conditions should be plain `IN (<values>)` lookups on
+    indexed columns; a correlated subquery there makes PostgreSQL drop the
+    GIN index for a filtered sequential scan.
+    """
+
+    fields: Tuple[Any, ...]
+    highlight: Tuple[str, ...]
+    extra: Optional[Callable[[str], Q]] = None
+    fallback: Tuple[str, ...] = field(default_factory=tuple)
+
+    def vector(self) -> SearchVector:
+        return SearchVector(*self.fields, config=SEARCH_CONFIG)
+
+    @staticmethod
+    def query(term: str) -> SearchQuery:
+        return SearchQuery(term, search_type='websearch', config=SEARCH_CONFIG)
+
+    @staticmethod
+    def is_supported(qs: QuerySet) -> bool:
+        return connections[qs.db].vendor == 'postgresql'
+
+    def filter(self, qs: QuerySet, term: str) -> QuerySet:
+        """
+        Restricts `qs` to rows matching `term`.
+        """
+        if self.is_supported(qs):
+            condition = Q(_search=self.query(term))
+            qs = qs.alias(_search=self.vector())
+        else:
+            condition = reduce(or_, (Q(**{f"{name}__icontains": term}) for name in self.fallback))
+        extra = self.extra(term) if self.extra else None
+        if extra is not None:
+            condition |= extra
+        return qs.filter(condition)
+
+    def search(self, qs: QuerySet, term: str, limit: int = 20, offset: int = 0) -> List[Dict[str, Any]]:
+        """
+        Returns ranked hits with highlighted fragments, best first.
+
+        Ranking and filtering run in one query; headlines are computed in a
+        second query over the page of hits only, as `ts_headline` re-parses
+        the whole text of every row it is applied to.
+        """
+        if not term.strip():
+            return []
+        supported = self.is_supported(qs)
+        hits = self.filter(qs, term)
+        if supported:
+            hits = hits.annotate(rank=SearchRank(self.vector(), self.query(term))).order_by('-rank', 'pk')
+        else:
+            hits = hits.order_by('-pk')
+        page = list(hits[offset:offset + limit])
+        if not page:
+            return []
+
+        if supported:
+            headlines = qs.model.objects.filter(pk__in=[obj.pk for obj in page]).order_by().annotate(**{
+                f"hl_{name}": SearchHeadline(name, self.query(term), config=SEARCH_CONFIG, **HEADLINE_OPTIONS)
+                for name in self.highlight
+            }).values('pk', *[f"hl_{name}" for name in self.highlight])
+            headlines = {row['pk']: row for row in headlines}
+        else:
+            headlines = {}
+
+        results = []
+        for obj in page:
+            row = headlines.get(obj.pk, {})
+            results.append({
+                'object': obj,
+                'rank': getattr(obj, 'rank', None),
+                'highlights': {
+                    name: row.get(f"hl_{name}", excerpt(getattr(obj, name), term))
+                    for name in self.highlight
+                },
+            })
+        return results
+
+
+def excerpt(text: Optional[str], term: str, width: int = 120) -> str:
+    """
+    Plain excerpt around the first occurrence of `term`, used when
+    `ts_headline` is not available.
+    """
+    if not text:
+        return ''
+    idx = text.lower().find(term.lower())
+    start = max(idx - width // 2, 0) if idx >= 0 else 0
+    return ('...' if start else '') + text[start:start + width] + ('...' if start + width < len(text) else '')
+
+
+def _username_in_conversation(term: str) -> Optional[Q]:
+    from chat.models import Conversation
+    ids = list(Conversation.objects.filter(user__username__iexact=term.strip()).values_list('id', flat=True))
+    return Q(conversation_id__in=ids) if ids else None
+
+
+def _username_in_assessment(term: str) -> Optional[Q]:
+    from assessments.models import Assessment
+    ids = list(Assessment.objects.filter(patient__user__username__iexact=term.strip()).values_list('id', flat=True))
+    return Q(assessment_id__in=ids) if ids else None
+
+
+TRANSCRIPTS = SearchDocument(
+    fields=('user_response', 'ai_response'),
+    highlight=('user_response', 'ai_response'),
+    extra=_username_in_conversation,
+    fallback=('user_response', 'ai_response'),
+)
+
+ASSESSMENT_RECORDS = SearchDocument(
+    fields=('question_text', 'remark', 'snippet', Cast('keywords', TextField())),
+    highlight=('remark', 'snippet'),
+    extra=_username_in_assessment,
+    fallback=('question_text', 'remark', 'snippet'),
+)
+
+
+class FullTextSearchMixin:
+    """
+    ModelAdmin mixin that answers the changelist search box from a
+    `SearchDocument` instead of `ILIKE '%..%'` over `search_fields`.
+    """
+
+    search_document: SearchDocument = None
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term or self.search_document is None:
+            return super().get_search_results(request, queryset, search_term)
+        return self.search_document.filter(queryset, search_term), False
@@ -6,6 +6,9 @@ import os
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent.parent
 
+# Generated diagnostics (profiles, traces, benchmark results, ...) go here, outside the source tree
+RUNTIME_DIR = os.getenv('RUNTIME_DIR', os.path.join(Path.home(), '.cache', 'beaconmind'))
+
 # Secret key
 SECRET_KEY = os.getenv('SECRET_KEY', 'django-insecure-l9zh=bozp&nhe)_p7e_8=(upicts0d)86tn_-fv9_-dy6b1sqz')
 
@@ -28,11 +31,16 @@ INSTALLED_APPS = [
     'assessments',
     'chat',
     'dashboard',
+    'analytics',
+    'telemetry',
     'pwa',
 ]
 
 MIDDLEWARE = [
     'middleware.access.AccessLogMiddleware',
+    'middleware.tracing.TracingMiddleware',
+    'middleware.profiling.ProfilingMiddleware',
+    'middleware.querybudget.QueryBudgetMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -87,6 +95,28 @@ DATABASES = {
 }
 
 
+# Caches
+# "shared" is seen by every worker and replica; the database table it needs is created with
+# `manage.py createcachetable`. SHARED_CACHE_BACKEND / SHARED_CACHE_LOCATION point it at
+# another backend (ex. django.core.cache.backends.redis.RedisCache and a redis:// URL).
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'shared': {
+        'BACKEND': os.getenv('SHARED_CACHE_BACKEND', 'django.core.cache.backends.db.DatabaseCache'),
+        'LOCATION': os.getenv('SHARED_CACHE_LOCATION', 'beaconmind_cache'),
+        'OPTIONS': {'MAX_ENTRIES': int(os.getenv('SHARED_CACHE_MAX_ENTRIES', 100000))},
+    },
+}
+
+
+# Offline analytics store (SQLite file fed by `manage.py analytics_etl`)
+
+ANALYTICS_STORE_PATH = os.getenv('ANALYTICS_STORE_PATH', os.path.join(RUNTIME_DIR, 'analytics.sqlite3'))
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
 
@@ -102,6 +132,16 @@ AUTH_PASSWORD_VALIDATORS = [
 AUTH_USER_MODEL = 'accounts.User'
 LOGIN_URL = 'accounts:login'
 
+# Token authentication cache (accounts.authentication.CachedTokenAuthentication)
+# SHARED_CACHE is the alias in CACHES through which revocations reach all workers; an empty
+# value is only safe with a single worker process
+AUTH_TOKEN_CACHE = {
+    'TTL': int(os.getenv('AUTH_TOKEN_CACHE_TTL', 60)),
+    'MAXSIZE': int(os.getenv('AUTH_TOKEN_CACHE_MAXSIZE', 10000)),
+    'SHARED_CACHE': os.getenv('AUTH_TOKEN_SHARED_CACHE', 'shared') or None,
+    'SHARED_TTL': int(os.getenv('AUTH_TOKEN_SHARED_CACHE_TTL', 300)),
+}
+
 
 # reCAPTCHA settings
 RECAPTCHA_PUBLIC_KEY = os.getenv('RECAPTCHA_PUBLIC_KEY', '')
@@ -130,9 +170,267 @@ STATICFILES_DIRS = [
 STATIC_ROOT = BASE_DIR / 'staticfiles'
 
 
+# Local LLM stand-ins (chat.standins), for tests, benchmarks and load runs
+# MODEL "fake" answers every chain locally; "replay" plays back (or, with REPLAY_MODE "record",
+# captures) real responses from FIXTURES_DIR. Empty uses the real models.
+LLM_STANDIN = {
+    "MODEL": os.getenv("LLM_STANDIN", ""),
+    "SEED": int(os.getenv("LLM_STANDIN_SEED", 0)),
+    # log-normal latency: median seconds, shape, cap
+    "LATENCY": {
+        "MEDIAN": float(os.getenv("LLM_STANDIN_LATENCY", 0)),
+        "SIGMA": float(os.getenv("LLM_STANDIN_LATENCY_SIGMA", 0.5)),
+        "MAX": 30.0,
+    },
+    # probability of each injected error per call
+    "ERRORS": {
+        "timeout": float(os.getenv("LLM_STANDIN_TIMEOUT_RATE", 0)),
+        "rate_limit": float(os.getenv("LLM_STANDIN_RATE_LIMIT_RATE", 0)),
+        "server": float(os.getenv("LLM_STANDIN_SERVER_ERROR_RATE", 0)),
+    },
+    "COMPLETION_TOKENS": None,
+    # probability of a malformed (fenced, wrapped, truncated, ...) output when no output schema is set
+    "MALFORMED_RATE": float(os.getenv("LLM_STANDIN_MALFORMED_RATE", 0)),
+    # recorded prompts hold patient data: keep them out of the source tree
+    "FIXTURES_DIR": os.getenv("LLM_STANDIN_FIXTURES", os.path.join(RUNTIME_DIR, "llm_fixtures")),
+    "REPLAY_MODE": os.getenv("LLM_STANDIN_REPLAY_MODE", "replay"),
+    "REPLAY_LATENCY": os.getenv("LLM_STANDIN_REPLAY_LATENCY", "false").lower() == "true",
+    # "error" (raise ReplayMiss) or "fake" (answer with the fake model)
+    "ON_MISS": os.getenv("LLM_STANDIN_ON_MISS", "error"),
+}
+
+
+# Local fast path for the eval chain (chat.services.fastpath)
+# MODE "off", "shadow" (predict and compare, the eval chain decides) or "enforce" (confident
+# predictions for STATES skip the eval chain). MODEL_PATH is written by `manage.py fastpath train`.
+CHAT_FASTPATH = {
+    "MODE": os.getenv("CHAT_FASTPATH_MODE", "shadow"),
+    "THRESHOLD": float(os.getenv("CHAT_FASTPATH_THRESHOLD", 0.9)),
+    "STATES": ("NORMAL_y", "NORMAL_n", "AMBIGUOUS", "CLARIFY"),
+    "MODEL_PATH": os.getenv("CHAT_FASTPATH_MODEL", os.path.join(RUNTIME_DIR, "fastpath.json")),
+}
+
+
+# Eval classification cache (chat.services.evalcache)
+# Short, context-free replies (at most MAX_CHARS / MAX_WORDS once normalized) are cached by
+# phase, node and reply; KEY_LAST_MSG also keys on the last AI turn. SHARED_CACHE is an optional
+# alias in CACHES whose entries all workers and replicas share, ex. "shared". Best with a
+# Redis/Memcached "shared" backend: with the default DatabaseCache a miss costs the turn ~6 queries.
+EVAL_CACHE = {
+    "ENABLED": os.getenv("EVAL_CACHE_ENABLED", "true").lower() == "true",
+    "TTL": int(os.getenv("EVAL_CACHE_TTL", 86400)),
+    "MAXSIZE": int(os.getenv("EVAL_CACHE_MAXSIZE", 10000)),
+    "SHARED_CACHE": os.getenv("EVAL_SHARED_CACHE") or None,
+    "SHARED_TTL": int(os.getenv("EVAL_SHARED_CACHE_TTL", 7 * 86400)),
+    "MAX_CHARS": 40,
+    "MAX_WORDS": 6,
+    "KEY_LAST_MSG": os.getenv("EVAL_CACHE_KEY_LAST_MSG", "false").lower() == "true",
+}
+
+
+# Semantic cache of dec responses (chat.services.semcache)
+# Messages in STATES (at most MAX_CHARS once normalized) whose nearest cached message on the same
+# node is at least THRESHOLD cosine-similar are answered from the cache. A miss costs a second dec call:
+# the patient is answered with the conversation history, the response cached is generated without it.
+# DRIFT messages are personal and must never be cached. PERSONALIZE_MODEL, when set (ex. "gpt-4o-mini"),
+# adapts the cached response with a short prompt; empty picks a variant locally.
+DEC_SEMANTIC_CACHE = {
+    "ENABLED": os.getenv("DEC_SEMANTIC_CACHE_ENABLED", "false").lower() == "true",
+    "STATES": ("CLARIFY",),
+    "THRESHOLD": float(os.getenv("DEC_SEMANTIC_CACHE_THRESHOLD", 0.8)),
+    "CAPACITY": 50,
+    "MAX_NODES": 1000,
+    "TTL": int(os.getenv("DEC_SEMANTIC_CACHE_TTL", 7 * 86400)),
+    "MAX_VARIANTS": 3,
+    "MAX_CHARS": 120,
+    "PERSONALIZE_MODEL": os.getenv("DEC_SEMANTIC_CACHE_PERSONALIZE_MODEL", ""),
+}
+
+# Models of the pipeline chains (chat.chains.ChainStore)
+# MODEL, PROVIDER ("openai" or "ollama"; by model name when empty), TEMPERATURE and MAX_TOKENS of a
+# chain come from DEFAULT, its stage ("dec" for the dec.* chains) and the chain itself, overridden by
+# LLM_CHAIN_<CHAIN>_<KEY> variables (ex. LLM_CHAIN_DEC_CONCLUDE_MODEL=gpt-4o-mini) and then by the
+# JSON file LLM_CHAINS_FILE (same layout), which is re-read when it changes: chains are rebuilt
+# without a restart. STRUCTURED constrains the eval output to the states (structured outputs).
+LLM_CHAINS = {
+    "DEFAULT": {
+        "MODEL": os.getenv("LLM_MODEL", "gpt-4o"),
+        "PROVIDER": None,
+        "TEMPERATURE": None,
+        "MAX_TOKENS": None,
+    },
+    "eval": {
+        "MAX_TOKENS": 16,
+        "STRUCTURED": os.getenv("LLM_EVAL_STRUCTURED", "true").lower() == "true",
+    },
+}
+for _chain in ("eval", "score", "dec", "dec.init", "dec.normal", "dec.ambiguous", "dec.drift", "dec.clarify",
+               "dec.skipped", "dec.conclude"):
+    for _key in ("MODEL", "PROVIDER", "TEMPERATURE", "MAX_TOKENS"):
+        _value = os.getenv(f"LLM_CHAIN_{_chain.upper().replace('.', '_')}_{_key}")
+        if _value:
+            LLM_CHAINS.setdefault(_chain, {})[_key] = _value
+LLM_CHAINS_FILE = os.getenv("LLM_CHAINS_FILE", "")
+
+# Chain outputs (chat.outputs)
+# outputs that cannot be repaired locally are retried RETRIES times
+LLM_OUTPUT = {
+    "RETRIES": int(os.getenv("LLM_OUTPUT_RETRIES", 1)),
+}
+
+# LLM call policy (chat.policy)
+# per stage: DEADLINE seconds for the whole call; HEDGE fires a duplicate request after the observed
+# p95 latency (HEDGE_AFTER until MIN_SAMPLES calls, within HEDGE_MIN..HEDGE_MAX); 429/5xx/timeouts are
+# retried with backoff up to MAX_ATTEMPTS per model; FALLBACKS (ex. "gpt-4o-mini,llama3") are raced in
+# once less than FALLBACK_AT of the deadline is left, or used when a model is out of attempts
+LLM_FALLBACK_MODELS = [name for name in os.getenv("LLM_FALLBACK_MODELS", "gpt-4o-mini").split(",") if name]
+LLM_CALL_POLICY = {
+    "ENABLED": os.getenv("LLM_CALL_POLICY_ENABLED", "true").lower() == "true",
+    "WORKERS": int(os.getenv("LLM_CALL_POLICY_WORKERS", 32)),
+    # per request timeout of the OpenAI clients, ending abandoned requests
+    "REQUEST_TIMEOUT": 60,
+    "BACKOFF_BASE": 0.5,
+    "BACKOFF_MAX": 8.0,
+    "MIN_SAMPLES": 20,
+    # all the LLM calls of a chat turn, retries included, end within this many seconds: stage deadlines are cut to
+    # what is left of it (keep it under gunicorn's worker timeout, see gunicorn.conf.py)
+    "TURN_BUDGET": float(os.getenv("LLM_TURN_BUDGET", 45)),
+    "STAGES": {
+        "eval": {
+            "DEADLINE": float(os.getenv("LLM_EVAL_DEADLINE", 10)),
+            "HEDGE": True,
+            "HEDGE_AFTER": 2.0,
+            "HEDGE_MIN": 0.5,
+            "HEDGE_MAX": 5.0,
+            "MAX_ATTEMPTS": 3,
+            "FALLBACK_AT": 0.3,
+            "FALLBACKS": LLM_FALLBACK_MODELS,
+        },
+        "dec": {
+            "DEADLINE": float(os.getenv("LLM_DEC_DEADLINE", 20)),
+            "HEDGE": True,
+            "HEDGE_AFTER": 5.0,
+            "HEDGE_MIN": 1.0,
+            "HEDGE_MAX": 10.0,
+            "MAX_ATTEMPTS": 3,
+            "FALLBACK_AT": 0.3,
+            "FALLBACKS": LLM_FALLBACK_MODELS,
+        },
+        # long and expensive: no hedging, and no weaker model for the clinical scores
+        "score": {
+            "DEADLINE": float(os.getenv("LLM_SCORE_DEADLINE", 60)),
+            "HEDGE": False,
+            "MAX_ATTEMPTS": 3,
+            "FALLBACKS": [],
+        },
+    },
+}
+
+# LLM rate limits (chat.quota)
+# requests to the MODELS listed are paced cluster-wide under their requests/tokens per minute quotas,
+# through token buckets in the database ("db", PostgreSQL only, or "local" to each process) refilled at HEADROOM of the
+# quotas and holding BURST_SECONDS of them; waiting requests are served by stage PRIORITIES (lowest first)
+LLM_QUOTAS = {
+    "ENABLED": os.getenv("LLM_QUOTAS_ENABLED", "true").lower() == "true",
+    "BACKEND": os.getenv("LLM_QUOTAS_BACKEND", "db"),
+    "MODELS": {
+        "gpt-4o": {
+            "RPM": int(os.getenv("LLM_QUOTA_GPT_4O_RPM", 5000)),
+            "TPM": int(os.getenv("LLM_QUOTA_GPT_4O_TPM", 800000)),
+        },
+        "gpt-4o-mini": {
+            "RPM": int(os.getenv("LLM_QUOTA_GPT_4O_MINI_RPM", 5000)),
+            "TPM": int(os.getenv("LLM_QUOTA_GPT_4O_MINI_TPM", 4000000)),
+        },
+    },
+    "HEADROOM": float(os.getenv("LLM_QUOTAS_HEADROOM", 0.9)),
+    "BURST_SECONDS": 5.0,
+    "PRIORITIES": {"eval": 0, "dec": 1, "score": 2},
+    # prompt estimate until chars per token are observed, completion estimate without max_tokens
+    "CHARS_PER_TOKEN": 4.0,
+    "COMPLETION_TOKENS": 256,
+    # wait for quota of calls without a deadline, and between checks of the buckets
+    "MAX_WAIT": 30.0,
+    "MAX_POLL": 1.0,
+    # pause of every replica after a 429 without Retry-After
+    "THROTTLE_SECONDS": 1.0,
+    # while the database is unavailable (retried after BACKEND_RETRY seconds), each process
+    # uses local buckets with LOCAL_SHARE of the quotas
+    "LOCAL_SHARE": float(os.getenv("LLM_QUOTAS_LOCAL_SHARE", 0.25)),
+    "BACKEND_RETRY": 30,
+}
+
+# LLM circuit breaker (chat.breaker)
+# opens once FAILURE_RATE of at least MIN_CALLS calls in the last WINDOW seconds failed for an outage;
+# while open, chat turns run in deterministic degraded mode (chat.services.degraded) and, after
+# OPEN_SECONDS (doubled on each failed probe up to MAX_OPEN_SECONDS), a background probe checks the provider
+LLM_CIRCUIT_BREAKER = {
+    "ENABLED": os.getenv("LLM_CIRCUIT_BREAKER_ENABLED", "true").lower() == "true",
+    "WINDOW": 60.0,
+    "MIN_CALLS": int(os.getenv("LLM_CIRCUIT_BREAKER_MIN_CALLS", 5)),
+    "FAILURE_RATE": float(os.getenv("LLM_CIRCUIT_BREAKER_FAILURE_RATE", 0.5)),
+    "OPEN_SECONDS": float(os.getenv("LLM_CIRCUIT_BREAKER_OPEN_SECONDS", 30)),
+    "MAX_OPEN_SECONDS": 300.0,
+    "PROBE_PROMPT": "Reply with OK.",
+}
+
+# LLM prices in USD per million tokens, for the usage ledger (chat.services.usage)
+# models are matched by the longest name prefix; cached prompt tokens use "cached"
+LLM_PRICES = {
+    "gpt-4o": {"prompt": 2.50, "cached": 1.25, "completion": 10.00},
+    "gpt-4o-mini": {"prompt": 0.15, "cached": 0.075, "completion": 0.60},
+}
+
+
 # Logging Configuration
 # https://docs.djangoproject.com/en/5.0/topics/logging/
 
+# bearer token required by the /metrics endpoint (when empty, /metrics is only served with DEBUG on)
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
+# Request tracing (telemetry.tracing)
+# traces are kept when head sampled (SAMPLE_RATE), slower than SLOW_THRESHOLD seconds or failed
+TRACING = {
+    "ENABLED": os.getenv("TRACING_ENABLED", "true").lower() == "true",
+    "SAMPLE_RATE": float(os.getenv("TRACING_SAMPLE_RATE", 0.05)),
+    "SLOW_THRESHOLD": float(os.getenv("TRACING_SLOW_THRESHOLD", 10)),
+    # networks of the callers (ex. internal services) whose traceparent sampled flag is honoured;
+    # other callers keep their trace id but get the local sampling decision
+    "TRUSTED_PARENTS": [network for network in os.getenv("TRACING_TRUSTED_PARENTS", "").split(",") if network],
+    "MAX_SPANS": 1000,
+    "SERVICE_NAME": "beaconmind",
+}
+# where kept traces go: "file" (RUNTIME_DIR/traces.jsonl) and/or "otlp" (OTLP/HTTP collector at TRACING_OTLP_ENDPOINT)
+TRACE_EXPORTERS = [name for name in os.getenv("TRACE_EXPORTERS", "file").split(",") if name]
+
+# Slow request profiler (telemetry.profiling)
+# requests under PATHS are stack-sampled every INTERVAL seconds; profiles of those slower
+# than SLOW_THRESHOLD seconds are written to DIR (aggregate with `manage.py flamegraph`)
+PROFILING = {
+    "ENABLED": os.getenv("PROFILING_ENABLED", "false").lower() == "true",
+    "PATHS": ["/chat/", "/dashboard/"],
+    "INTERVAL": float(os.getenv("PROFILING_INTERVAL", 0.01)),
+    "SLOW_THRESHOLD": float(os.getenv("PROFILING_SLOW_THRESHOLD", 8)),
+    "DIR": os.getenv("PROFILING_DIR", os.path.join(RUNTIME_DIR, "profiles")),
+    "MAX_FILES": 500,
+}
+
+# Query budgets and N+1 detection (telemetry.querybudget)
+# views declare budgets with @query_budget; the defaults apply to views without one.
+# RAISE makes over-budget requests fail (tests) instead of being logged.
+QUERY_BUDGET = {
+    "ENABLED": os.getenv("QUERY_BUDGET_ENABLED", "true").lower() == "true",
+    "RAISE": os.getenv("QUERY_BUDGET_RAISE", "false").lower() == "true",
+    "DEFAULT_MAX_QUERIES": None,
+    "DEFAULT_MAX_DUPLICATES": 10,
+}
+
+# Micro-benchmark results and baseline (`manage.py benchmark`, telemetry.benchmarks)
+BENCHMARKS_DIR = os.getenv("BENCHMARKS_DIR", os.path.join(RUNTIME_DIR, "benchmarks"))
+
+# access log line format: "access" (plain text) or "json" (JSON lines)
+ACCESS_LOG_FORMAT = os.getenv("ACCESS_LOG_FORMAT", "access")
+
 LOGGING = {
     "version": 1,
     "disable_existing_loggers": False,
@@ -149,6 +447,12 @@ LOGGING = {
             "format": "{asctime} {levelname} {message}",
             "style": "{",
         },
+        "json": {
+            "()": "telemetry.logging.JsonFormatter",
+        },
+        "otlp": {
+            "()": "telemetry.tracing.OTLPJsonFormatter",
+        },
     },
     "filters": {
         "require_debug_true": {
@@ -193,11 +497,45 @@ LOGGING = {
         },
         "access_file": {
             "level": "INFO",
-            "class": "logging.handlers.RotatingFileHandler",
+            "class": "telemetry.logging.BatchRotatingFileHandler",
             "filename": os.path.join(BASE_DIR, "logs", "access.log"),
             "maxBytes": 1 * 1024 * 1024,
             "backupCount": 5,
-            "formatter": "access",
+            "formatter": ACCESS_LOG_FORMAT,
+        },
+        # access records are queued on the request thread and written in batches by a listener thread
+        "access_queue": {
+            "class": "telemetry.logging.AsyncQueueHandler",
+            "handlers": ["access_file"],
+            "listener": "telemetry.logging.BatchQueueListener",
+            "queue": {"()": "queue.Queue", "maxsize": 10000},
+        },
+        "querybudget_file": {
+            "level": "WARNING",
+            "class": "logging.handlers.RotatingFileHandler",
+            "filename": os.path.join(BASE_DIR, "logs", "querybudget.log"),
+            "maxBytes": 10 * 1024 * 1024,
+            "backupCount": 5,
+            "formatter": "verbose",
+        },
+        "traces_file": {
+            "level": "INFO",
+            "class": "telemetry.logging.BatchRotatingFileHandler",
+            "filename": os.path.join(RUNTIME_DIR, "traces.jsonl"),
+            "maxBytes": 10 * 1024 * 1024,
+            "backupCount": 5,
+            "formatter": "otlp",
+        },
+        "traces_otlp": {
+            "level": "INFO",
+            "class": "telemetry.tracing.OTLPHttpHandler",
+            "endpoint": os.getenv("TRACING_OTLP_ENDPOINT", "http://localhost:4318/v1/traces"),
+        },
+        "traces_queue": {
+            "class": "telemetry.logging.AsyncQueueHandler",
+            "handlers": [f"traces_{name}" for name in TRACE_EXPORTERS],
+            "listener": "telemetry.logging.BatchQueueListener",
+            "queue": {"()": "queue.Queue", "maxsize": 1000},
         },
     },
     "loggers": {
@@ -207,12 +545,22 @@ LOGGING = {
             "propagate": True,
         },
         "access": {
-            "handlers": ["access_file"],
+            "handlers": ["access_queue"],
+            "level": "INFO",
+            "propagate": False,
+        },
+        "traces": {
+            "handlers": ["traces_queue"] if TRACE_EXPORTERS else [],
             "level": "INFO",
             "propagate": False,
         },
+        "querybudget": {
+            "handlers": ["querybudget_file", "console"],
+            "level": "WARNING",
+            "propagate": False,
+        },
         "django.request": {
-            "handlers": ["access_file"],
+            "handlers": ["access_queue"],
             "level": "INFO",
             "propagate": False,
         },
@@ -16,6 +16,7 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path, include
+from telemetry.views import metrics
 from .views import home, hello
 
 
@@ -27,4 +28,5 @@ urlpatterns = [
     path('accounts/', include('accounts.urls')),
     path('chat/', include('chat.urls')),
     path('dashboard/', include('dashboard.urls')),
+    path('metrics', metrics, name='metrics'),
 ]
@@ -1,6 +1,39 @@
 from django.contrib import admin
+from django.db.models import Count, Max, Min
 
-from .models import ChatMessage, ChatSession, Conversation
+from beaconmind.admin_utils import InputFilter, KeysetPaginationMixin, outer_count
+from beaconmind.search import TRANSCRIPTS, FullTextSearchMixin
+from .models import ChatMessage, ChatSession, Conversation, LLMUsage, LLMUsageDaily
+
+
+class PatientUsernameFilter(InputFilter):
+    title = 'patient username'
+    parameter_name = 'patient'
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(conversation__user__username=self.value().strip())
+        return queryset
+
+
+class ChatSessionIdFilter(InputFilter):
+    title = 'chat session id'
+    parameter_name = 'session'
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(chat_session_id=self.value().strip())
+        return queryset
+
+
+class TraceIdFilter(InputFilter):
+    title = 'trace id'
+    parameter_name = 'trace'
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(trace_id=self.value().strip().lower())
+        return queryset
 
 
 @admin.register(Conversation)
@@ -10,34 +43,47 @@ class ConversationAdmin(admin.ModelAdmin):
     readonly_fields = ('id', 'user')
     list_filter = ('user__is_active',)
     ordering = ('-user__date_joined',)
+    list_select_related = ('user',)
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(
+            n_sessions=outer_count(ChatSession, 'conversation'),
+            n_messages=outer_count(ChatMessage, 'conversation'),
+        )
 
     def total_sessions(self, obj):
-        return obj.chatsession_set.count()
+        return obj.n_sessions
     total_sessions.short_description = 'Total Sessions'
+    total_sessions.admin_order_field = 'n_sessions'
 
     def total_messages(self, obj):
-        return obj.chatmessage_set.count()
+        return obj.n_messages
     total_messages.short_description = 'Total Messages'
+    total_messages.admin_order_field = 'n_messages'
 
 
 @admin.register(ChatMessage)
-class ChatMessageAdmin(admin.ModelAdmin):
+class ChatMessageAdmin(FullTextSearchMixin, KeysetPaginationMixin, admin.ModelAdmin):
     list_display = ('conversation', 'chat_session', 'phase', 'user_response_excerpt',
                     'ai_response_excerpt', 'timestamp')
     search_fields = ('user_response', 'ai_response',
                      'conversation__user__username')
+    search_document = TRANSCRIPTS
     readonly_fields = ('id', 'conversation', 'chat_session', 'timestamp', 'user_response', 'ai_response',
-                       'user_marker', 'ai_marker', 'user_response_timestamp', 'ai_response_timestamp', 'meta_data')
-    list_filter = ('conversation__user__patient',
-                   'timestamp', 'chat_session')
+                       'user_marker', 'ai_marker', 'user_response_timestamp', 'ai_response_timestamp', 'meta_data', 'trace_id')
+    list_filter = (PatientUsernameFilter,
+                   'timestamp', ChatSessionIdFilter, TraceIdFilter)
     ordering = ('-timestamp',)
+    list_select_related = ('conversation__user', 'chat_session__conversation__user')
+    show_full_result_count = False
 
     fieldsets = (
         (None, {'fields': ('id',)}),
         ('User Response', {'fields': ('user_response', 'user_marker')}),
         ('AI Response', {'fields': ('ai_response', 'ai_marker')}),
         ('Meta Data', {
-            'fields': ('meta_data', 'conversation', 'chat_session', 'user_response_timestamp', 'ai_response_timestamp'),
+            'fields': ('meta_data', 'conversation', 'chat_session', 'user_response_timestamp', 'ai_response_timestamp',
+                       'trace_id'),
             'classes': ('collapse',),
         }),
     )
@@ -75,19 +121,26 @@ class ChatSessionAdmin(admin.ModelAdmin):
     readonly_fields = ('id', 'conversation', 'timestamp')
     list_filter = ('timestamp',)
     ordering = ('-timestamp',)
+    list_select_related = ('conversation__user',)
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(
+            n_messages=Count('chatmessage'),
+            first_response_at=Min('chatmessage__user_response_timestamp'),
+            last_response_at=Max('chatmessage__ai_response_timestamp'),
+        )
 
     def total_messages(self, obj):
-        return obj.chatmessage_set.count()
+        return obj.n_messages
     total_messages.short_description = 'Total Messages'
+    total_messages.admin_order_field = 'n_messages'
 
     def session_duration(self, obj):
-        # get the first and last message of the session; in minutes
-        chat_messages = obj.chatmessage_set.order_by('timestamp')
-        if chat_messages:
-            first_message = chat_messages.first()
-            last_message = chat_messages.last()
-            duration = last_message.ai_response_timestamp - \
-                first_message.user_response_timestamp
+        # time between the first user message and the last AI response of the session
+        if obj.n_messages:
+            if not (obj.first_response_at and obj.last_response_at):
+                return '-'
+            duration = obj.last_response_at - obj.first_response_at
             hrs = duration.seconds // 3600
             mins = (duration.seconds // 60) % 60
             secs = duration.seconds % 60
@@ -96,3 +149,29 @@ class ChatSessionAdmin(admin.ModelAdmin):
             return f"{mins}:{secs:02d}s"
         return 'No Messages'
     session_duration.short_description = 'Session duration'
+
+
+class ReadOnlyAdmin(admin.ModelAdmin):
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(LLMUsage)
+class LLMUsageAdmin(KeysetPaginationMixin, ReadOnlyAdmin):
+    list_display = ('timestamp', 'stage', 'chain', 'model', 'phase', 'outcome', 'prompt_tokens',
+                    'cached_tokens', 'completion_tokens', 'latency_ms', 'cost')
+    list_filter = ('stage', 'model', 'outcome', 'timestamp')
+    search_fields = ('=session_id', '=patient_id')
+    ordering = ('-timestamp',)
+    show_full_result_count = False
+
+
+@admin.register(LLMUsageDaily)
+class LLMUsageDailyAdmin(ReadOnlyAdmin):
+    list_display = ('date', 'stage', 'chain', 'model', 'phase', 'calls', 'errors', 'sessions',
+                    'prompt_tokens', 'cached_tokens', 'completion_tokens', 'cost')
+    list_filter = ('stage', 'model', 'date')
+    ordering = ('-date', 'stage', 'chain')
@@ -0,0 +1,137 @@
+"""
+Circuit breaker around the LLM provider.
+
+The chat pipeline reports the outcome of its LLM calls (`success()`,
+`failure()`); only outages count as failures: deadlines, missing quota,
+connection errors, 429s and 5xx (`is_outage`), not invalid outputs.
+
+- closed: calls go through; once at least `MIN_CALLS` calls were made in
+  the last `WINDOW` seconds and `FAILURE_RATE` of them failed, the breaker
+  opens;
+- open: `allow()` is False and the pipeline runs its degraded mode (see
+  `services.degraded`) for `OPEN_SECONDS`, doubled on each failed probe
+  up to `MAX_OPEN_SECONDS`;
+- half open: a background probe (a tiny request to the eval chain's
+  model) checks the provider; its success closes the breaker, its failure
+  opens it again. Patients are not kept waiting on the probe.
+
+The state is kept per process: each one finds out about an outage from
+its own calls, within `MIN_CALLS` of them.
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+from typing import Optional
+
+import httpx
+from django.conf import settings
+
+from telemetry.metrics import LLM_CIRCUIT_STATE
+
+from . import policy
+
+
+logger = logging.getLogger(__name__)
+
+_config = getattr(settings, 'LLM_CIRCUIT_BREAKER', {})
+
+CLOSED = "closed"
+HALF_OPEN = "half_open"
+OPEN = "open"
+
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+def is_outage(error: Exception) -> bool:
+    """
+    Whether an error of an LLM call means the provider is unavailable.
+    """
+    if isinstance(error, (TimeoutError, ConnectionError, httpx.TransportError)):
+        return True
+    return policy.is_retryable(error)
+
+
+class CircuitBreaker:
+
+    def __init__(self):
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.open_seconds = _config.get('OPEN_SECONDS', 30.0)
+        self._calls = deque()  # (time, failed)
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def _set(self, state: str) -> None:
+        if state != self.state:
+            logger.warning("LLM circuit breaker %s -> %s", self.state, state)
+        self.state = state
+        LLM_CIRCUIT_STATE.set(_STATE_VALUES[state])
+
+    def _open(self) -> None:
+        self.opened_at = time.monotonic()
+        self._calls.clear()
+        self._set(OPEN)
+
+    def allow(self) -> bool:
+        """
+        Whether LLM calls should be made; starts the probe once the breaker has been open long enough.
+        """
+        if not _config.get('ENABLED', False):
+            return True
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.open_seconds:
+                self._set(HALF_OPEN)
+            if self.state == HALF_OPEN and not self._probing:
+                self._probing = True
+                threading.Thread(target=self._probe, name="llm-breaker-probe", daemon=True).start()
+            return False
+
+    def success(self) -> None:
+        with self._lock:
+            if self.state == CLOSED:
+                self._record(False)
+
+    def failure(self, error: Optional[Exception] = None) -> None:
+        if error is not None and not is_outage(error):
+            return
+        with self._lock:
+            if self.state == CLOSED:
+                self._record(True)
+
+    def _record(self, failed: bool) -> None:
+        now = time.monotonic()
+        self._calls.append((now, failed))
+        while self._calls and self._calls[0][0] < now - _config.get('WINDOW', 60.0):
+            self._calls.popleft()
+        failures = sum(1 for _, f in self._calls if f)
+        if (len(self._calls) >= _config.get('MIN_CALLS', 5)
+                and failures / len(self._calls) >= _config.get('FAILURE_RATE', 0.5)):
+            self.open_seconds = _config.get('OPEN_SECONDS', 30.0)
+            self._open()
+
+    def _probe(self) -> None:
+        from .chains import ChainStore
+
+        try:
+            model = ChainStore.eval_chain.last
+            model = getattr(model, "bound", model)
+            model.invoke(_config.get('PROBE_PROMPT', "Reply with OK."))
+        except Exception as e:
+            logger.warning("LLM circuit breaker probe failed: %s", e)
+            with self._lock:
+                self._probing = False
+                self.open_seconds = min(self.open_seconds * 2, _config.get('MAX_OPEN_SECONDS', 300.0))
+                self._open()
+            return
+        with self._lock:
+            self._probing = False
+            self.open_seconds = _config.get('OPEN_SECONDS', 30.0)
+            self._calls.clear()
+            self._set(CLOSED)
+
+
+breaker = CircuitBreaker()
@@ -1,34 +1,102 @@
-from typing import Union
+import json
+import logging
+import os
+import re
+import threading
+from typing import Any, Dict, Optional, Tuple, Union
+from django.conf import settings
 from langchain_community.chat_models.ollama import ChatOllama
 from langchain_core.language_models.chat_models import BaseChatModel
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder, PromptTemplate
+from langchain_core.runnables import RunnableBinding, RunnableSequence
 from langchain_openai.chat_models import ChatOpenAI
 
 from . import prompts
+from .outputs import EVAL_SCHEMA
+from .standins import FakeChatModel, ReplayChatModel
+
+
+logger = logging.getLogger(__name__)
 
 
 class Models:
 
+    STANDINS = ("fake", "replay")
+    OLLAMA = ("orca-mini", "llama3")
+    OPENAI = ("gpt-3.5-turbo", "gpt-4o-mini", "gpt-4-turbo", "gpt-4o-2024-08-06", "gpt-4o")
+
     @staticmethod
-    def get(model_name, **kwargs) -> BaseChatModel:
-        model_map = {
-            # local models
-            "orca-mini": lambda: ChatOllama(model="orca-mini", **kwargs),
-            "llama3": lambda: ChatOllama(model="llama3", **kwargs),
-
-            # openai models
-            "gpt-3.5-turbo": lambda: ChatOpenAI(model="gpt-3.5-turbo", **kwargs),
-            "gpt-4o-mini": lambda: ChatOpenAI(model="gpt-4o-mini", **kwargs),
-            "gpt-4-turbo": lambda: ChatOpenAI(model="gpt-4-turbo", **kwargs),
-            "gpt-4o-2024-08-06": lambda: ChatOpenAI(model="gpt-4o-2024-08-06", **kwargs),
-            "gpt-4o": lambda: ChatOpenAI(model="gpt-4o", **kwargs),
-
-            # Add more models as needed
-        }
-        if model_name not in model_map:
-            raise ValueError(f"Model '{model_name}' is not recognized. Available models: {list(model_map.keys())}")
+    def get(model_name, provider=None, **kwargs) -> BaseChatModel:
+        standin = settings.LLM_STANDIN.get("MODEL")
+        if standin and model_name not in Models.STANDINS:
+            # every chain talks to the configured local stand-in instead (see chat.standins)
+            return Models.build(standin, target=model_name, provider=provider, **kwargs)
+        return Models.build(model_name, provider=provider, **kwargs)
+
+    @staticmethod
+    def provider(model_name, provider=None):
+        """
+        Provider of a model: the given one (for models not listed here), else by name
+        """
+        if provider:
+            return provider
+        if model_name in Models.OLLAMA:
+            return "ollama"
+        if model_name in Models.OPENAI:
+            return "openai"
+        return None
+
+    @staticmethod
+    def build(model_name, target=None, provider=None, **kwargs) -> BaseChatModel:
+        # local stand-ins for tests and load runs
+        if model_name == "fake":
+            return FakeChatModel.from_settings(target, **kwargs)
+        if model_name == "replay":
+            return ReplayChatModel.from_settings(
+                target or "gpt-4o", upstream=lambda: Models.build(target or "gpt-4o", provider=provider, **kwargs))
+
+        kwargs = {key: value for key, value in kwargs.items() if value is not None}
+        provider = Models.provider(model_name, provider)
+        if provider == "openai":
+            if settings.LLM_CALL_POLICY["ENABLED"]:
+                # retries and deadlines are handled by the call policy (chat.policy)
+                kwargs = {"max_retries": 0, "timeout": settings.LLM_CALL_POLICY["REQUEST_TIMEOUT"], **kwargs}
+            return ChatOpenAI(model=model_name, **kwargs)
+        if provider == "ollama":
+            if "max_tokens" in kwargs:
+                kwargs["num_predict"] = kwargs.pop("max_tokens")
+            return ChatOllama(model=model_name, **kwargs)
+        raise ValueError(
+            f"Model '{model_name}' is not recognized. Available models: {list(Models.OPENAI + Models.OLLAMA)}; "
+            "set the provider (\"openai\" or \"ollama\") for others."
+        )
+
+
+def _supports_response_format(model) -> bool:
+    return isinstance(model, (ChatOpenAI, FakeChatModel, ReplayChatModel))
 
-        return model_map[model_name]()
+
+def model_label(model) -> str:
+    return getattr(model, "model_name", None) or getattr(model, "model", None) or type(model).__name__
+
+
+def replace_model(chain, model_name):
+    """
+    The chain with its chat model replaced by `model_name`, keeping the output constraints
+    (response_format, max_tokens) the new model supports
+    """
+    steps = list(chain.steps) if isinstance(chain, RunnableSequence) else [chain]
+    for index, step in enumerate(steps):
+        model = step.bound if isinstance(step, RunnableBinding) else step
+        if not isinstance(model, BaseChatModel):
+            continue
+        max_tokens = getattr(model, "max_tokens", None) or getattr(model, "num_predict", None)
+        new = Models.get(model_name, max_tokens=max_tokens)
+        if isinstance(step, RunnableBinding) and _supports_response_format(new):
+            new = new.bind(**step.kwargs)
+        steps[index] = new
+        return RunnableSequence(*steps) if len(steps) > 1 else steps[0]
+    raise ValueError("Chain has no chat model")
 
 
 class BasePrompt:
@@ -100,6 +168,9 @@ class Prompts:
             "dec.conclude": lambda: BasePrompt(
                 template=prompts.dec.conclude
             ),
+            "dec.personalize": lambda: BasePrompt(
+                template=prompts.dec.personalize
+            ),
             "eval": lambda: BasePrompt(
                 template=prompts.eval
             ),
@@ -110,6 +181,27 @@ class Prompts:
         return prompts_map.get(prompt_type, lambda: None)().create_prompt(**kwargs)
 
 
+class PromptLayoutError(ValueError):
+    pass
+
+
+_SENTINEL = re.compile(r"\x00\w+\x00")
+
+
+def prompt_prefix(prompt) -> Tuple[str, float]:
+    """
+    Static prefix of a prompt (the rendered text before the first input
+    value) and its share of all the static text of the prompt.
+    """
+    rendered = prompt.invoke({
+        name: f"\x00{name}\x00" for name in prompt.input_variables
+    }).to_string()
+    first = _SENTINEL.search(rendered)
+    prefix = rendered[:first.start()] if first else rendered
+    static = len(_SENTINEL.sub("", rendered))
+    return prefix, (len(prefix) / static if static else 1.0)
+
+
 class ChainBuilder:
     """
     Builder class to create a chain of models, prompts, and output parsers
@@ -127,17 +219,32 @@ class ChainBuilder:
     ```
     """
 
+    # share of a prompt's static text that must precede its first input value, so that
+    # provider-side prompt prefix caching applies across turns
+    MIN_PREFIX_SHARE = 0.9
+
     def __init__(self):
         self.model = None
         self.prompt = None
         self.extra_steps = []
+        self.check_prefix = True
+        self.output_schema = None
 
     def with_model(self, model_name, **kwargs):
         self.model = Models.get(model_name, **kwargs)
         return self
 
-    def with_prompt(self, prompt_type, **kwargs):
+    def with_prompt(self, prompt_type, check_prefix=True, **kwargs):
         self.prompt = Prompts.get(prompt_type, **kwargs)
+        self.check_prefix = check_prefix
+        return self
+
+    def with_output_schema(self, name, schema):
+        """
+        Constrains the model's output to a JSON schema (provider structured outputs), for the
+        models supporting it; others are left unconstrained
+        """
+        self.output_schema = (name, schema) if schema else None
         return self
 
     def add_step(self, step):
@@ -147,68 +254,144 @@ class ChainBuilder:
     def build(self):
         if not self.model or not self.prompt:
             raise ValueError("Model and prompt are required to build a chain.")
-        chain = self.prompt | self.model
+        if self.check_prefix:
+            _, share = prompt_prefix(self.prompt)
+            if share < self.MIN_PREFIX_SHARE:
+                raise PromptLayoutError(
+                    f"Only {share:.0%} of the prompt's static text precedes its first input value; "
+                    "move the per-turn values after the instructions so that prompt prefix caching applies."
+                )
+        model = self.model
+        if self.output_schema and _supports_response_format(model):
+            name, schema = self.output_schema
+            model = model.bind(response_format={
+                "type": "json_schema",
+                "json_schema": {"name": name, "schema": schema, "strict": True},
+            })
+        chain = self.prompt | model
         for step in self.extra_steps:
             chain = chain | step
         return chain
 
 
-class ChainStore:
+CHAINS = (
+    "dec.init", "dec.normal", "dec.ambiguous", "dec.drift", "dec.clarify", "dec.skipped", "dec.conclude",
+    "eval", "score",
+)
+
+_CONFIG_KEYS = ("MODEL", "PROVIDER", "TEMPERATURE", "MAX_TOKENS", "STRUCTURED")
+
+
+class _ChainsFile:
     """
-    Predefined chains for convenience
+    Chain configuration overrides from `LLM_CHAINS_FILE`, re-read when the file changes.
     """
+    data: Dict[str, Any] = {}
+    path: Optional[str] = None
+    mtime: float = 0.0
 
-    dec_init_chain = (
-        ChainBuilder()
-        .with_model("gpt-4o")
-        .with_prompt("dec.init")
-        .build()
-    )
-    dec_normal_chain = (
-        ChainBuilder()
-        .with_model("gpt-4o")
-        .with_prompt("dec.normal")
-        .build()
-    )
-    dec_ambiguous_chain = (
-        ChainBuilder()
-        .with_model("gpt-4o")
-        .with_prompt("dec.ambiguous")
-        .build()
-    )
-    dec_drift_chain = (
-        ChainBuilder()
-        .with_model("gpt-4o")
-        .with_prompt("dec.drift")
-        .build()
-    )
-    dec_clarify_chain = (
-        ChainBuilder()
-        .with_model("gpt-4o")
-        .with_prompt("dec.clarify")
-        .build()
-    )
-    dec_skipped_chain = (
-        ChainBuilder()
-        .with_model("gpt-4o")
-        .with_prompt("dec.skipped")
-        .build()
-    )
-    dec_conclude_chain = (
-        ChainBuilder()
-        .with_model("gpt-4o")
-        .with_prompt("dec.conclude")
-        .build()
-    )
-    eval_chain = (
-        ChainBuilder()
-        .with_model("gpt-4o")
-        .with_prompt("eval")
-        .build()
-    )
-    score_chain = (
+    @classmethod
+    def get(cls) -> Dict[str, Any]:
+        path = getattr(settings, "LLM_CHAINS_FILE", None)
+        try:
+            mtime = os.stat(path).st_mtime
+        except (OSError, TypeError):
+            return {}
+        if path != cls.path or mtime != cls.mtime:
+            try:
+                with open(path) as f:
+                    cls.data = json.load(f)
+            except ValueError:
+                logger.exception("Invalid chain configuration file %s; keeping the previous one", path)
+            cls.path, cls.mtime = path, mtime
+        return cls.data
+
+
+def chain_config(name: str, overrides: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Effective configuration of a chain: DEFAULT, then its stage ("dec" for the dec.* chains), then
+    the chain itself, from `LLM_CHAINS` and then from `LLM_CHAINS_FILE`, then `overrides`
+    """
+    stage = name.split(".")[0]
+    config = {}
+    for source in (settings.LLM_CHAINS, _ChainsFile.get()):
+        for key in ("DEFAULT", stage, name) if stage != name else ("DEFAULT", name):
+            config.update(source.get(key) or {})
+    config.update(overrides or {})
+    config = {key: config.get(key) for key in _CONFIG_KEYS}
+    if config["TEMPERATURE"] not in (None, ""):
+        config["TEMPERATURE"] = float(config["TEMPERATURE"])
+    if config["MAX_TOKENS"] not in (None, ""):
+        config["MAX_TOKENS"] = int(config["MAX_TOKENS"])
+    if isinstance(config["STRUCTURED"], str):
+        config["STRUCTURED"] = config["STRUCTURED"].lower() == "true"
+    return config
+
+
+def build_chain(name: str, config: Dict[str, Any]):
+    builder = (
         ChainBuilder()
-        .with_model("gpt-4o")
-        .with_prompt("score")
-        .build()
+        .with_model(
+            config["MODEL"], provider=config["PROVIDER"] or None,
+            temperature=config["TEMPERATURE"], max_tokens=config["MAX_TOKENS"] or None,
+        )
+        .with_prompt(name)
     )
+    if name == "eval" and config["STRUCTURED"]:
+        builder.with_output_schema("eval_state", EVAL_SCHEMA)
+    return builder.build()
+
+
+class ChainRegistry:
+    """
+    The pipeline's chains, built from their configuration (see `chain_config`) and rebuilt when
+    it changes, so that models are swapped without a restart
+
+    Example usage:
+    ```
+    ChainStore.eval_chain.invoke(data)
+    getattr(ChainStore, f"dec_{state.lower()}_chain")
+    ```
+    """
+
+    def __init__(self):
+        self._chains: Dict[str, Tuple[str, Any]] = {}
+        self._failed: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def get(self, name: str):
+        config = chain_config(name)
+        key = json.dumps(config, sort_keys=True)
+        current = self._chains.get(name)
+        if current is not None and current[0] == key:
+            return current[1]
+        if current is not None and self._failed.get(name) == key:
+            return current[1]
+        with self._lock:
+            current = self._chains.get(name)
+            if current is None or current[0] != key:
+                try:
+                    chain = build_chain(name, config)
+                except Exception:
+                    if current is None:
+                        raise
+                    logger.exception("Could not build the %s chain with %s; keeping the previous one", name, config)
+                    self._failed[name] = key
+                    return current[1]
+                if current is not None:
+                    logger.warning("%s chain rebuilt with %s", name, config)
+                current = self._chains[name] = (key, chain)
+        return current[1]
+
+    def __getattr__(self, attr):
+        if attr.endswith("_chain"):
+            name = attr[:-len("_chain")].replace("_", ".", 1)
+            if name in CHAINS:
+                return self.get(name)
+        raise AttributeError(attr)
+
+
+ChainStore = ChainRegistry()
+# build at import: configuration and prompt layout errors surface at startup
+for _name in CHAINS:
+    ChainStore.get(_name)
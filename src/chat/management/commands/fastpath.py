@@ -0,0 +1,95 @@
+# chat/management/commands/fastpath.py
+
+import random
+from collections import Counter
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from chat.services import fastpath
+
+
+THRESHOLDS = (0.5, 0.7, 0.8, 0.9, 0.95, 0.97)
+
+
+class Command(BaseCommand):
+    help = (
+        'Trains the local fast path classifier of the eval routine on the labelled chat history '
+        '("train", with a held-out evaluation), or reports how its shadow-mode predictions agree with '
+        'the eval chain and how many replies it would answer at each threshold ("report").'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=['train', 'report'])
+        parser.add_argument('--limit', type=int, default=None, help="newest replies to use")
+        parser.add_argument('--holdout', type=float, default=0.2, help="share of replies held out for evaluation")
+        parser.add_argument('--epochs', type=int, default=15)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', type=str, default=None,
+                            help="model file (default CHAT_FASTPATH['MODEL_PATH'])")
+
+    def handle(self, *args, **options):
+        if options['action'] == 'train':
+            self.train(options)
+        else:
+            self.report(options)
+
+    def train(self, options):
+        samples = fastpath.labelled_history(options['limit'])
+        if len(samples) < 20:
+            raise CommandError(f"Only {len(samples)} labelled replies; not enough to train on")
+        self.stdout.write(f"{len(samples)} labelled replies: {dict(Counter(state for _, state in samples))}")
+
+        rng = random.Random(options['seed'])
+        rng.shuffle(samples)
+        n_test = int(len(samples) * options['holdout'])
+        test, train = samples[:n_test], samples[n_test:]
+
+        model = fastpath.LinearModel.train(train, epochs=options['epochs'], seed=options['seed'])
+        if test:
+            self.stdout.write(f"held out: {len(test)} replies")
+            self.print_coverage([(fastpath.predict_with(model, text), state) for text, state in test])
+
+        # the saved model is trained on everything
+        model = fastpath.LinearModel.train(samples, epochs=options['epochs'], seed=options['seed'])
+        model.info = {'samples': len(samples), 'epochs': options['epochs']}
+        path = Path(options['output'] or settings.CHAT_FASTPATH['MODEL_PATH'])
+        model.save(path)
+        self.stdout.write(self.style.SUCCESS(f"model written to {path}"))
+
+    def report(self, options):
+        pairs = []
+        for _, user_marker, _, meta in fastpath.evaluated_history(options['limit']):
+            shadow = ((meta or {}).get('eval') or {}).get('fastpath')
+            if not shadow or shadow.get('used'):
+                continue
+            prediction = fastpath.Prediction(shadow['state'], shadow['confidence'], shadow['source'])
+            pairs.append((prediction, user_marker['tr']))
+        if not pairs:
+            raise CommandError("No shadow predictions recorded; run with CHAT_FASTPATH['MODE'] = 'shadow'")
+        self.stdout.write(f"{len(pairs)} replies with shadow predictions")
+        self.print_coverage(pairs)
+
+    def print_coverage(self, pairs):
+        """
+        Agreement (on the transition taken) and share of replies answered at
+        each threshold, for (prediction, actual state or tr) pairs.
+        """
+        states = settings.CHAT_FASTPATH['STATES']
+        actual_tr = [actual if len(actual) == 1 else fastpath.to_tr(actual) for _, actual in pairs]
+
+        self.stdout.write(f"{'threshold':>10}{'answered':>10}{'coverage':>10}{'agreement':>11}")
+        for threshold in THRESHOLDS:
+            answered = [
+                (prediction, tr) for (prediction, _), tr in zip(pairs, actual_tr)
+                if prediction is not None and prediction.state in states and prediction.confidence >= threshold
+            ]
+            agree = sum(fastpath.to_tr(prediction.state) == tr for prediction, tr in answered)
+            self.stdout.write(
+                f"{threshold:>10.2f}{len(answered):>10}{len(answered) / len(pairs):>10.1%}"
+                f"{(agree / len(answered) if answered else 0):>11.1%}"
+            )
+
+        by_source = Counter(prediction.source for prediction, _ in pairs if prediction is not None)
+        self.stdout.write(f"predictions by source: {dict(by_source)}")
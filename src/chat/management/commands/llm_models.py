@@ -0,0 +1,97 @@
+# chat/management/commands/llm_models.py
+
+from django.core.management.base import BaseCommand, CommandError
+
+from chat.chains import CHAINS, chain_config
+from chat.services import candidates
+
+
+class Command(BaseCommand):
+    help = (
+        'Prints the effective model configuration of each chain ("show") or replays recorded turns '
+        'through candidate models for a chain and reports their agreement with the production labels, '
+        'output validity, latency and cost against the current configuration ("eval").'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=['show', 'eval'])
+        parser.add_argument('--chain', type=str, default='eval',
+                            help="eval, score, dec (all dec chains) or one dec chain, ex. dec.conclude")
+        parser.add_argument('--candidates', type=str, default='',
+                            help="comma separated candidate models, ex. gpt-4o-mini,llama3")
+        parser.add_argument('--provider', type=str, default=None, help="provider of the candidates (openai, ollama)")
+        parser.add_argument('--temperature', type=float, default=None, help="temperature of the candidates")
+        parser.add_argument('--max-tokens', type=int, default=None, help="max output tokens of the candidates")
+        parser.add_argument('--limit', type=int, default=200, help="recorded turns to replay, most recent first")
+        parser.add_argument('--workers', type=int, default=4, help="concurrent calls per candidate")
+        parser.add_argument('--no-baseline', action='store_true', help="skip replaying the current configuration")
+
+    def handle(self, *args, **options):
+        if options['action'] == 'show':
+            for name in CHAINS:
+                config = chain_config(name)
+                self.stdout.write(f"{name:<14} " + "  ".join(f"{key.lower()}={value}" for key, value in config.items()))
+            return
+
+        chain = options['chain']
+        if chain not in CHAINS + ('dec',):
+            raise CommandError(f"Unknown chain '{chain}'")
+        models = [model.strip() for model in options['candidates'].split(',') if model.strip()]
+        if not models and options['no_baseline']:
+            raise CommandError("Nothing to evaluate: give --candidates or drop --no-baseline")
+
+        cases = candidates.cases_for(chain, options['limit'])
+        if not cases:
+            self.stdout.write(f"no recorded {chain} turns to replay")
+            return
+        self.stdout.write(f"replaying {len(cases)} recorded {chain} turns")
+
+        runs = [] if options['no_baseline'] else [("current", {})]
+        for model in models:
+            overrides = {"MODEL": model}
+            for option, key in (('provider', 'PROVIDER'), ('temperature', 'TEMPERATURE'), ('max_tokens', 'MAX_TOKENS')):
+                if options[option] is not None:
+                    overrides[key] = options[option]
+            runs.append((model, overrides))
+
+        for label, overrides in runs:
+            try:
+                summary = candidates.evaluate(label, overrides, cases, options['workers'])
+            except Exception as e:
+                self.stderr.write(f"{label}: could not build the chain: {e}")
+                continue
+            self.report(chain, summary)
+
+    def report(self, chain, summary):
+        metrics = summary.metrics
+        config = summary.config
+        self.stdout.write(
+            f"\n== {summary.label}: {config['MODEL']} ({config['PROVIDER'] or 'auto'}, "
+            f"temperature={config['TEMPERATURE']}, max_tokens={config['MAX_TOKENS']})"
+        )
+        cases = metrics['cases']
+        valid = cases - metrics['call_errors'] - metrics['invalid']
+        self.stdout.write(
+            f"valid {valid}/{cases} ({metrics['call_errors']} call errors, {metrics['invalid']} invalid outputs)"
+        )
+        if metrics['agreement'] is not None:
+            measure = "mean similarity to production" if chain.startswith('dec') else "agreement"
+            self.stdout.write(f"{measure} {metrics['agreement']:.1%} of valid outputs")
+        for state, rate in metrics.get('per_state', {}).items():
+            self.stdout.write(f"  {state:<10} {rate:.1%}")
+        if metrics.get('mean_abs_diff') is not None:
+            self.stdout.write(
+                f"mean absolute score difference {metrics['mean_abs_diff']:.2f} per question, "
+                f"{metrics['total_abs_diff']:.2f} per assessment"
+            )
+        if metrics['latency_p50'] is not None:
+            self.stdout.write(f"latency p50 {metrics['latency_p50']:.2f}s  p95 {metrics['latency_p95']:.2f}s")
+        if metrics['quota_wait_p50'] is not None:
+            self.stdout.write(
+                f"quota wait p50 {metrics['quota_wait_p50']:.2f}s  max {metrics['quota_wait_max']:.2f}s "
+                f"(not in the latency)"
+            )
+        self.stdout.write(
+            f"tokens {metrics['prompt_tokens']:.0f} prompt + {metrics['completion_tokens']:.0f} completion per call, "
+            f"cost ${metrics['cost']:.4f} (${metrics['cost'] / cases * 1000:.2f} per 1000 calls)"
+        )
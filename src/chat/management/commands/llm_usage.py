@@ -0,0 +1,82 @@
+# chat/management/commands/llm_usage.py
+
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from chat.services import usage
+
+
+class Command(BaseCommand):
+    help = (
+        'Recomputes the daily LLM usage rollups from the usage ledger ("rollup", from --since or the '
+        'last rolled up day; chat turns keep them current) or prints token usage and cost per '
+        'stage, model, phase, session and patient over the last days ("report").'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=['rollup', 'report'])
+        parser.add_argument('--since', type=str, default=None,
+                            help="first day to recompute (YYYY-MM-DD); default the last rolled up day")
+        parser.add_argument('--days', type=int, default=7, help="days to report on, ending today")
+        parser.add_argument('--top', type=int, default=10, help="sessions and patients to list")
+
+    def handle(self, *args, **options):
+        since = None
+        if options['since']:
+            try:
+                since = date.fromisoformat(options['since'])
+            except ValueError:
+                raise CommandError(f"Invalid date: {options['since']}")
+
+        if options['action'] == 'rollup':
+            days = usage.rollup(since)
+            if days:
+                self.stdout.write(f"rolled up {days[0]} .. {days[-1]} ({len(days)} days)")
+            else:
+                self.stdout.write("no usage recorded")
+        else:
+            end = timezone.localdate()
+            self.report(usage.report(end - timedelta(days=options['days'] - 1), end, options['top']))
+
+    def report(self, data):
+        totals = data['totals']
+        if not totals['calls']:
+            self.stdout.write(f"no LLM calls between {data['start']} and {data['end']}")
+            return
+        self.stdout.write(self.style.MIGRATE_HEADING(f"\n{data['start']} .. {data['end']}"))
+        self.stdout.write(
+            f"{totals['calls']} calls ({totals['errors']} failed), {totals['prompt_tokens']} prompt tokens "
+            f"({totals['cached_tokens']} cached), {totals['completion_tokens']} completion tokens, "
+            f"${totals['cost']:.4f}"
+        )
+        if data['cost_per_session'] is not None:
+            self.stdout.write(f"{data['sessions']} sessions, ${data['cost_per_session']:.4f} per session")
+
+        for key in ('stage', 'chain', 'model', 'phase'):
+            self.stdout.write(self.style.MIGRATE_HEADING(f"\nby {key}"))
+            self.stdout.write(f"  {key:<20} {'calls':>7} {'prompt':>10} {'cached':>10} {'completion':>10} "
+                              f"{'avg ms':>8} {'cost':>10}")
+            for row in data[f'by_{key}']:
+                self.stdout.write(
+                    f"  {row[key] or '-':<20} {row['calls']:>7} {row['prompt_tokens']:>10} {row['cached_tokens']:>10} "
+                    f"{row['completion_tokens']:>10} {row['latency_ms'] // row['calls']:>8} {row['cost']:>10.4f}"
+                )
+
+        self.stdout.write(self.style.MIGRATE_HEADING("\ncost per completed assessment"))
+        for row in data['by_phase']:
+            if row['assessments']:
+                self.stdout.write(
+                    f"  {row['phase']:<20} {row['assessments']:>5} completed, "
+                    f"{row['tokens_per_assessment']} tokens, ${row['cost_per_assessment']:.4f} each"
+                )
+
+        self.stdout.write(self.style.MIGRATE_HEADING(f"\ntop {len(data['top_sessions'])} sessions"))
+        for row in data['top_sessions']:
+            self.stdout.write(f"  {row['session_id']}  patient {row['patient_id']}  {row['calls']:>4} calls  "
+                              f"{row['tokens']:>8} tokens  ${row['cost']:.4f}")
+        self.stdout.write(self.style.MIGRATE_HEADING(f"\ntop {len(data['top_patients'])} patients"))
+        for row in data['top_patients']:
+            self.stdout.write(f"  {row['patient_id']}  {row['sessions']:>3} sessions  {row['calls']:>4} calls  "
+                              f"{row['tokens']:>8} tokens  ${row['cost']:.4f}")
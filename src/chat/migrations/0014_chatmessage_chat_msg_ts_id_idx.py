@@ -0,0 +1,17 @@
+# Generated by Django 5.0.7 on 2026-10-19 07:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0013_rename_init_chatsession_init'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='chatmessage',
+            index=models.Index(fields=['timestamp', 'id'], name='chat_msg_ts_id_idx'),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Full-text search index over chat transcripts (PostgreSQL only).
+# The indexed expression must match `beaconmind.search.TRANSCRIPTS.vector()`.
+
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector
+from django.db import migrations
+
+
+def fts_index():
+    return GinIndex(
+        SearchVector('user_response', 'ai_response', config='english'),
+        name='chat_msg_fts_idx',
+    )
+
+
+def add_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    model = apps.get_model('chat', 'ChatMessage')
+    schema_editor.add_index(model, fts_index(), concurrently=True)
+
+
+def remove_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    model = apps.get_model('chat', 'ChatMessage')
+    schema_editor.remove_index(model, fts_index(), concurrently=True)
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('chat', '0014_chatmessage_chat_msg_ts_id_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_index, remove_index),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.7 on 2026-10-19 07:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0015_chatmessage_fts_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatmessage',
+            name='trace_id',
+            field=models.CharField(blank=True, db_index=True, max_length=32, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.7 on 2026-10-19 09:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0016_chatmessage_trace_id'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatsession',
+            name='clarifying',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,68 @@
+# Generated by Django 5.0.7 on 2026-10-19 07:49
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0017_chat_session_clarifying'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LLMUsageDaily',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('stage', models.CharField(max_length=20)),
+                ('chain', models.CharField(max_length=30)),
+                ('model', models.CharField(max_length=60)),
+                ('phase', models.CharField(blank=True, default='', max_length=30)),
+                ('calls', models.PositiveIntegerField(default=0)),
+                ('errors', models.PositiveIntegerField(default=0)),
+                ('sessions', models.PositiveIntegerField(default=0)),
+                ('prompt_tokens', models.PositiveBigIntegerField(default=0)),
+                ('completion_tokens', models.PositiveBigIntegerField(default=0)),
+                ('cached_tokens', models.PositiveBigIntegerField(default=0)),
+                ('latency_ms', models.PositiveBigIntegerField(default=0)),
+                ('cost', models.DecimalField(decimal_places=6, default=0, max_digits=14)),
+            ],
+            options={
+                'verbose_name': 'LLM Usage (daily)',
+                'verbose_name_plural': 'LLM Usage (daily)',
+                'ordering': ['date'],
+            },
+        ),
+        migrations.CreateModel(
+            name='LLMUsage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('timestamp', models.DateTimeField(default=django.utils.timezone.now)),
+                ('session_id', models.CharField(blank=True, max_length=40, null=True)),
+                ('message_id', models.CharField(blank=True, max_length=40, null=True)),
+                ('patient_id', models.CharField(blank=True, max_length=40, null=True)),
+                ('phase', models.CharField(blank=True, max_length=30, null=True)),
+                ('stage', models.CharField(max_length=20)),
+                ('chain', models.CharField(max_length=30)),
+                ('model', models.CharField(max_length=60)),
+                ('outcome', models.CharField(default='ok', max_length=10)),
+                ('prompt_tokens', models.PositiveIntegerField(default=0)),
+                ('completion_tokens', models.PositiveIntegerField(default=0)),
+                ('cached_tokens', models.PositiveIntegerField(default=0)),
+                ('latency_ms', models.PositiveIntegerField(default=0)),
+                ('cost', models.DecimalField(decimal_places=6, default=0, max_digits=12)),
+            ],
+            options={
+                'verbose_name': 'LLM Usage',
+                'verbose_name_plural': 'LLM Usage',
+                'ordering': ['timestamp'],
+                'indexes': [models.Index(fields=['timestamp'], name='llm_usage_ts_idx'), models.Index(fields=['session_id'], name='llm_usage_session_idx'), models.Index(fields=['patient_id', 'timestamp'], name='llm_usage_patient_ts_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='llmusagedaily',
+            constraint=models.UniqueConstraint(fields=('date', 'stage', 'chain', 'model', 'phase'), name='llm_usage_daily_uniq'),
+        ),
+    ]
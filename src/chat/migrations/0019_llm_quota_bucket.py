@@ -0,0 +1,26 @@
+# Generated by Django 5.0.7 on 2026-10-19 08:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0018_llm_usage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LLMQuotaBucket',
+            fields=[
+                ('model', models.CharField(max_length=60, primary_key=True, serialize=False)),
+                ('requests', models.FloatField()),
+                ('tokens', models.FloatField()),
+                ('updated', models.FloatField()),
+            ],
+            options={
+                'verbose_name': 'LLM Quota Bucket',
+                'verbose_name_plural': 'LLM Quota Buckets',
+            },
+        ),
+    ]
@@ -23,11 +23,15 @@ class ChatMessage(models.Model):
     ai_response_timestamp = models.DateTimeField(verbose_name="AI response timestamp", null=True)
     timestamp = models.DateTimeField(auto_now_add=True)
     meta_data = models.JSONField(null=True, default=dict)
+    trace_id = models.CharField(max_length=32, null=True, blank=True, db_index=True)
 
     class Meta:
         ordering = ['timestamp']
         verbose_name = 'Chat Message'
         verbose_name_plural = 'Chat Messages'
+        indexes = [
+            models.Index(fields=['timestamp', 'id'], name='chat_msg_ts_id_idx'),
+        ]
 
     def __str__(self):
         user_response_excerpt = self.user_response[:50] + ('...' if len(self.user_response) > 50 else '')
@@ -49,6 +53,8 @@ class ChatSession(models.Model):
     phase = models.CharField(max_length=30, null=True, default=None)
     node_id = models.CharField("Question Node ID", max_length=10, null=True, default=None)
     retries = models.IntegerField(default=0)
+    # the last reply asked for a clarification: the next one answers it, not the question
+    clarifying = models.BooleanField(default=False)
     last_msg = models.TextField("Last Message", null=True, default=None)
 
     class Meta:
@@ -58,3 +64,88 @@ class ChatSession(models.Model):
 
     def __str__(self):
         return f"{self.conversation.user.username} - session @ {timezone.localtime(self.timestamp).strftime('%b. %d, %Y, %I:%M %p').lower().capitalize()}"
+
+
+class LLMUsage(models.Model):
+    """
+    One LLM call of the chat pipeline, written when the turn ends
+    (including failed turns, whose calls are billed too). Ids are stored as
+    plain values so that the ledger outlives the rows it refers to.
+    """
+    timestamp = models.DateTimeField(default=timezone.now)
+    session_id = models.CharField(max_length=40, null=True, blank=True)
+    message_id = models.CharField(max_length=40, null=True, blank=True)
+    patient_id = models.CharField(max_length=40, null=True, blank=True)
+    phase = models.CharField(max_length=30, null=True, blank=True)
+    stage = models.CharField(max_length=20)
+    chain = models.CharField(max_length=30)
+    model = models.CharField(max_length=60)
+    outcome = models.CharField(max_length=10, default='ok')
+    prompt_tokens = models.PositiveIntegerField(default=0)
+    completion_tokens = models.PositiveIntegerField(default=0)
+    cached_tokens = models.PositiveIntegerField(default=0)
+    latency_ms = models.PositiveIntegerField(default=0)
+    cost = models.DecimalField(max_digits=12, decimal_places=6, default=0)
+
+    class Meta:
+        ordering = ['timestamp']
+        verbose_name = 'LLM Usage'
+        verbose_name_plural = 'LLM Usage'
+        indexes = [
+            models.Index(fields=['timestamp'], name='llm_usage_ts_idx'),
+            models.Index(fields=['session_id'], name='llm_usage_session_idx'),
+            models.Index(fields=['patient_id', 'timestamp'], name='llm_usage_patient_ts_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.chain} ({self.model}) @ {self.timestamp:%Y-%m-%d %H:%M:%S}"
+
+
+class LLMUsageDaily(models.Model):
+    """
+    Daily rollup of `LLMUsage` per stage, chain, model and phase, maintained
+    as the ledger is written (recomputed by `manage.py llm_usage rollup`).
+    """
+    date = models.DateField()
+    stage = models.CharField(max_length=20)
+    chain = models.CharField(max_length=30)
+    model = models.CharField(max_length=60)
+    phase = models.CharField(max_length=30, blank=True, default='')
+    calls = models.PositiveIntegerField(default=0)
+    errors = models.PositiveIntegerField(default=0)
+    sessions = models.PositiveIntegerField(default=0)
+    prompt_tokens = models.PositiveBigIntegerField(default=0)
+    completion_tokens = models.PositiveBigIntegerField(default=0)
+    cached_tokens = models.PositiveBigIntegerField(default=0)
+    latency_ms = models.PositiveBigIntegerField(default=0)
+    cost = models.DecimalField(max_digits=14, decimal_places=6, default=0)
+
+    class Meta:
+        ordering = ['date']
+        verbose_name = 'LLM Usage (daily)'
+        verbose_name_plural = 'LLM Usage (daily)'
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'stage', 'chain', 'model', 'phase'], name='llm_usage_daily_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.date} {self.chain} ({self.model})"
+
+
+class LLMQuotaBucket(models.Model):
+    """
+    Rate limit buckets of a model shared by all processes (see `chat.quota`):
+    the requests and tokens available as of `updated` (database clock,
+    epoch seconds).
+    """
+    model = models.CharField(max_length=60, primary_key=True)
+    requests = models.FloatField()
+    tokens = models.FloatField()
+    updated = models.FloatField()
+
+    class Meta:
+        verbose_name = 'LLM Quota Bucket'
+        verbose_name_plural = 'LLM Quota Buckets'
+
+    def __str__(self):
+        return f"{self.model}: {self.requests:.1f} requests, {self.tokens:.0f} tokens"
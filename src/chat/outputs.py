@@ -0,0 +1,227 @@
+"""
+Parsing and validation of the chains' JSON outputs.
+
+Models occasionally wrap their JSON in code fences, write a sentence around
+it, leave trailing commas, use Python literals or single quotes, put raw
+line breaks in strings or get cut off before the closing braces. `load()`
+repairs these locally; `parse_eval()`, `parse_dec()` and `parse_score()`
+validate the output of each stage and raise `OutputError` when it cannot
+be used, which the pipeline answers with a single retry of the call.
+
+The eval chain is additionally constrained at the provider: structured
+outputs with `EVAL_SCHEMA` (the state is an enum) and a few output tokens
+(`LLM_CHAINS['eval']`).
+"""
+
+import ast
+import json
+import re
+from typing import Any, Dict, List, Tuple
+
+from .services.fastpath import STATES
+
+
+EVAL_SCHEMA = {
+    "type": "object",
+    "properties": {"response": {"type": "string", "enum": list(STATES)}},
+    "required": ["response"],
+    "additionalProperties": False,
+}
+
+
+class OutputError(ValueError):
+    """
+    A chain output that cannot be repaired into a valid answer.
+    """
+
+    def __init__(self, message: str, content: str = ""):
+        super().__init__(message)
+        self.content = content
+
+
+_FENCE = re.compile(r"^\s*```[a-zA-Z]*\s*|\s*```\s*$")
+_TRAILING_COMMA = re.compile(r",(\s*[}\]])")
+_PY_LITERAL = re.compile(r"([:\[,]\s*)(True|False|None)\b")
+_PY_LITERALS = {"True": "true", "False": "false", "None": "null"}
+_STATE = re.compile(r"\b(normal_y|normal_n|drift|ambiguous|clarify)\b", re.IGNORECASE)
+_STATE_NAMES = {state.lower(): state for state in STATES}
+
+
+def _scan(text: str) -> Tuple[str, List[str], List[int], bool]:
+    """
+    Escapes raw control characters inside strings. Returns the text, the
+    brackets left open, the positions of the commas outside strings and
+    whether the text ends inside a string.
+    """
+    out, stack, commas = [], [], []
+    in_string = escaped = False
+    length = 0
+    for char in text:
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+            elif char == "\n":
+                char = "\\n"
+            elif char in "\r\t":
+                char = "\\r" if char == "\r" else "\\t"
+        elif char == '"':
+            in_string = True
+        elif char in "{[":
+            stack.append("}" if char == "{" else "]")
+        elif char in "}]" and stack and stack[-1] == char:
+            stack.pop()
+        elif char == ",":
+            commas.append(length)
+        out.append(char)
+        length += len(char)
+    return "".join(out), stack, commas, in_string
+
+
+def _close(text: str) -> str:
+    """
+    Closes an output cut off mid-way, dropping an incomplete last member.
+    """
+    text, stack, commas, in_string = _scan(text)
+    closed = text + ('"' if in_string else "") + "".join(reversed(stack))
+    try:
+        json.loads(closed)
+        return closed
+    except ValueError:
+        pass
+    if commas:
+        text, stack, _, in_string = _scan(text[:commas[-1]])
+        return text + ('"' if in_string else "") + "".join(reversed(stack))
+    return closed
+
+
+def _attempts(text: str):
+    text = _FENCE.sub("", text.strip())
+    start = text.find("{")
+    if start > 0:
+        text = text[start:]
+    end = text.rfind("}")
+    if end != -1:
+        yield text[:end + 1]
+    text = _TRAILING_COMMA.sub(r"\1", text[:end + 1] if end != -1 else text)
+    yield text
+    text = _PY_LITERAL.sub(lambda m: m.group(1) + _PY_LITERALS[m.group(2)], text)
+    yield text
+    yield _close(text)
+    yield _close(text.replace("“", '"').replace("”", '"'))
+
+
+def load(content: str) -> Tuple[Any, bool]:
+    """
+    JSON value of a chain output and whether it had to be repaired.
+    Raises `OutputError` when no repair yields valid JSON.
+    """
+    try:
+        return json.loads(content), False
+    except (TypeError, ValueError):
+        pass
+    if not isinstance(content, str) or not content.strip():
+        raise OutputError("Empty output", content or "")
+    for attempt in _attempts(content):
+        try:
+            return json.loads(attempt), True
+        except ValueError:
+            continue
+    # single quoted, Python-style dicts
+    try:
+        value = ast.literal_eval(_FENCE.sub("", content.strip()))
+        if isinstance(value, (dict, list)):
+            return value, True
+    except (ValueError, SyntaxError, MemoryError, RecursionError):
+        pass
+    raise OutputError("Output is not valid JSON", content)
+
+
+def _state(text: str):
+    matches = {_STATE_NAMES[match.lower()] for match in _STATE.findall(text)}
+    return matches.pop() if len(matches) == 1 else None
+
+
+def parse_eval(content: str) -> Tuple[str, bool]:
+    """
+    Eval state of an eval chain output and whether it was repaired. A
+    single state label anywhere in an unparsable output is accepted.
+    """
+    try:
+        data, repaired = load(content)
+    except OutputError:
+        data, repaired = None, True
+    value = data.get("response") if isinstance(data, dict) else data
+    if isinstance(value, str):
+        if value in STATES:
+            return value, repaired
+        state = _state(value)
+        if state is not None and value.strip().lower() == state.lower():
+            return state, True
+    state = _state(content or "")
+    if state is None:
+        raise OutputError("No eval state in output", content)
+    return state, True
+
+
+def parse_dec(content: str) -> Tuple[str, bool]:
+    """
+    Response of a dec chain output and whether it was repaired. A plain
+    text answer (no JSON at all) is taken as the response.
+    """
+    try:
+        data, repaired = load(content)
+    except OutputError:
+        if not content or not content.strip() or "{" in content:
+            raise
+        return content.strip(), True
+    value = data.get("response") if isinstance(data, dict) else data
+    if not isinstance(value, str) or not value.strip():
+        raise OutputError("No response in output", content)
+    return value, repaired
+
+
+def parse_score(content: str, questions: Dict[str, Dict[str, Any]]) -> Tuple[Dict[str, Dict[str, Any]], bool]:
+    """
+    Score records of a score chain output, one per question of
+    `questions` (`BaseAssessmentPhase.get_questions_dict()`), and whether
+    it was repaired. Scores must be integers within the question's range.
+    """
+    data, repaired = load(content)
+    if isinstance(data, dict) and isinstance(data.get("response"), dict):
+        data = data["response"]
+    elif isinstance(data, dict) and data and set(data) <= set(questions):
+        repaired = True
+    else:
+        raise OutputError("No score records in output", content)
+
+    records = {}
+    for qid, question in questions.items():
+        record = data.get(qid)
+        if not isinstance(record, dict):
+            raise OutputError(f"No score record for question {qid}", content)
+        low, high = question["score_range"]
+        try:
+            score = int(record.get("score"))
+        except (TypeError, ValueError):
+            raise OutputError(f"Invalid score for question {qid}: {record.get('score')!r}", content)
+        if not low <= score <= high:
+            raise OutputError(f"Score {score} of question {qid} is out of range", content)
+        keywords = record.get("keywords") or []
+        if isinstance(keywords, str):
+            keywords = [keyword.strip() for keyword in keywords.split(",")]
+            repaired = True
+        records[qid] = {
+            "score": score,
+            "remark": str(record.get("remark") or ""),
+            "snippet": str(record.get("snippet") or ""),
+            "keywords": [str(keyword) for keyword in keywords if keyword],
+        }
+        if score != record.get("score"):
+            repaired = True
+    if set(data) - set(questions):
+        repaired = True
+    return records, repaired
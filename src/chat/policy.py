@@ -0,0 +1,332 @@
+"""
+Call policy for the LLM chains: deadlines, hedged requests, retries and
+fallback models.
+
+`invoke(stage, chain, input)` runs a chain under the stage's policy
+(`LLM_CALL_POLICY['STAGES'][stage]`):
+
+- the whole call has a `DEADLINE` (seconds); past it `LLMDeadlineExceeded`
+  is raised and requests still running are abandoned. Within
+  `turn_budget()` (a chat turn), deadlines are cut to what is left of the
+  turn's `TURN_BUDGET`, so that retried calls of several stages stay under
+  the worker timeout (`gunicorn.conf.py`);
+- with `HEDGE`, a duplicate request is fired once the first one has taken
+  longer than the stage's observed p95 latency for the model (`HEDGE_AFTER`
+  until `MIN_SAMPLES` calls were seen, kept within `HEDGE_MIN`..`HEDGE_MAX`)
+  and the first answer wins;
+- rate limits (429), server errors (5xx), timeouts and connection errors
+  are retried with exponential backoff and full jitter (`Retry-After` is
+  honoured), up to `MAX_ATTEMPTS` per model;
+- `FALLBACKS` models (ex. "gpt-4o-mini", then a local "llama3") are raced
+  in once less than `FALLBACK_AT` of the deadline is left, and used in
+  turn when a model runs out of attempts.
+
+Every request is counted in `beacon_llm_requests_total` by kind (primary,
+hedge, retry, fallback) and result (won, lost, error, abandoned), and the
+winning response carries `response_metadata['policy']`. Requests run in a
+shared thread pool (`WORKERS`) and each waits for its model's rate limit
+quota (`chat.quota`); the OpenAI clients' own retries are turned off
+(`chains.Models.build`).
+"""
+
+import contextvars
+import logging
+import math
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
+
+import openai
+from django.conf import settings
+
+from telemetry.metrics import LLM_REQUESTS
+
+from . import quota
+from .chains import model_label, replace_model
+
+
+logger = logging.getLogger(__name__)
+
+_config = getattr(settings, 'LLM_CALL_POLICY', {})
+
+_DEFAULTS = {
+    "DEADLINE": 30.0,
+    "HEDGE": False,
+    "HEDGE_AFTER": 5.0,
+    "HEDGE_MIN": 0.5,
+    "HEDGE_MAX": 10.0,
+    "MAX_ATTEMPTS": 3,
+    "FALLBACK_AT": 0.3,
+    "FALLBACKS": [],
+}
+
+
+class LLMDeadlineExceeded(TimeoutError):
+    pass
+
+
+def stage_policy(stage: str) -> Dict[str, Any]:
+    return {**_DEFAULTS, **_config.get('STAGES', {}).get(stage, {})}
+
+
+_turn_deadline = contextvars.ContextVar("llm_turn_deadline", default=math.inf)
+
+
+@contextmanager
+def turn_budget(seconds: Optional[float] = None) -> Iterator[None]:
+    """
+    Bounds the LLM calls made in the block to `seconds` (default
+    `TURN_BUDGET`) from now, in total.
+    """
+    if seconds is None:
+        seconds = _config.get('TURN_BUDGET', math.inf)
+    token = _turn_deadline.set(min(_turn_deadline.get(), time.monotonic() + seconds))
+    try:
+        yield
+    finally:
+        _turn_deadline.reset(token)
+
+
+class LatencyWindow:
+    """
+    Recent successful request latencies per (stage, model), for the hedge
+    delay.
+    """
+
+    def __init__(self, size: int = 200):
+        self.size = size
+        self._samples: Dict[tuple, deque] = {}
+        self._lock = threading.Lock()
+
+    def add(self, key: tuple, seconds: float) -> None:
+        with self._lock:
+            self._samples.setdefault(key, deque(maxlen=self.size)).append(seconds)
+
+    def quantile(self, key: tuple, q: float, min_samples: int) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self._samples.get(key, ()))
+        if len(samples) < max(min_samples, 1):
+            return None
+        return samples[min(len(samples) - 1, math.ceil(q * len(samples)) - 1)]
+
+
+latencies = LatencyWindow()
+_executor = None
+_executor_lock = threading.Lock()
+_fallback_chains: Dict[tuple, Any] = {}
+
+
+def _pool() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=_config.get('WORKERS', 32), thread_name_prefix="llm")
+        return _executor
+
+
+def _fallback(chain, model_name: str):
+    key = (id(chain), model_name)
+    entry = _fallback_chains.get(key)
+    # chains are rebuilt when their configuration changes; ids of dropped ones can be reused
+    if entry is None or entry[0] is not chain:
+        entry = _fallback_chains[key] = (chain, replace_model(chain, model_name))
+    return entry[1]
+
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError)):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+
+def backoff(attempt: int, error: Optional[Exception] = None) -> float:
+    """
+    Delay before retry `attempt` (1-based): full jitter over an exponential
+    cap, or the server's Retry-After when longer.
+    """
+    base = _config.get('BACKOFF_BASE', 0.5)
+    delay = random.uniform(0, min(_config.get('BACKOFF_MAX', 8.0), base * 2 ** (attempt - 1)))
+    response = getattr(error, 'response', None)
+    try:
+        retry_after = float(response.headers.get('retry-after')) if response is not None else 0.0
+    except (TypeError, ValueError):
+        retry_after = 0.0
+    return max(delay, retry_after)
+
+
+class _Request:
+    def __init__(self, future, model: str, kind: str):
+        self.future = future
+        self.model = model
+        self.kind = kind
+        self.started = time.monotonic()
+
+
+class _Call:
+    """
+    One chain invocation under a policy: the requests fired for it and the
+    timers (hedge, fallback, retry, deadline) deciding the next one.
+    """
+
+    def __init__(self, stage: str, chain, input: dict, config: Optional[dict]):
+        self.stage = stage
+        self.policy = stage_policy(stage)
+        self.input = input
+        self.config = config
+        self.models = [(model_label(chain.last), chain)]
+        self.models += [(name, None) for name in self.policy["FALLBACKS"]]
+        self.level = 0
+        self.attempts = 0
+        self.pending: Dict[Any, _Request] = {}
+        self.fired = []
+        self.deadline = math.inf
+
+    def _chain(self, level: int):
+        name, chain = self.models[level]
+        if chain is None:
+            chain = _fallback(self.models[0][1], name)
+            self.models[level] = (name, chain)
+        return chain
+
+    def _fire(self, kind: str) -> None:
+        name = self.models[self.level][0]
+        chain = self._chain(self.level)
+        try:
+            # quota is taken here rather than in the pool, so that waiting requests hold no worker;
+            # hedges, and fallbacks raced against a running request, are only sent if there is room
+            grant = quota.reserve(self.stage, chain, self.input, self.deadline,
+                                  wait=kind != "hedge" and not self.pending)
+        except quota.QuotaTimeout:
+            LLM_REQUESTS.labels(self.stage, name, kind, "no_quota").inc()
+            if kind == "hedge" or self.pending:
+                return
+            if not self._next_level():
+                raise
+            return self._fire("fallback")
+        # requests of a call are numbered in their run metadata (ex. for the fake stand-in's draws)
+        config = dict(self.config or {})
+        config["metadata"] = {**config.get("metadata", {}), "llm_request": len(self.fired)}
+        context = contextvars.copy_context()
+        future = _pool().submit(context.run, quota.send, grant, chain, self.input, config)
+        self.pending[future] = _Request(future, name, kind)
+        self.fired.append(kind)
+        if kind != "hedge":
+            self.attempts += 1
+
+    def _hedge_delay(self) -> float:
+        observed = latencies.quantile(
+            (self.stage, self.models[self.level][0]), 0.95, _config.get('MIN_SAMPLES', 20))
+        delay = self.policy["HEDGE_AFTER"] if observed is None else observed
+        return min(max(delay, self.policy["HEDGE_MIN"]), self.policy["HEDGE_MAX"])
+
+    def _next_level(self) -> bool:
+        if self.level + 1 >= len(self.models):
+            return False
+        self.level += 1
+        self.attempts = 0
+        return True
+
+    def _abandon(self) -> None:
+        # requests still running finish in the background; count them as they do
+        for request in self.pending.values():
+            request.future.add_done_callback(
+                lambda future, request=request: self._finished_late(request, future))
+        self.pending = {}
+
+    def _finished_late(self, request: _Request, future) -> None:
+        if future.exception() is None:
+            latencies.add((self.stage, request.model), time.monotonic() - request.started)
+            LLM_REQUESTS.labels(self.stage, request.model, request.kind, "lost").inc()
+        else:
+            LLM_REQUESTS.labels(self.stage, request.model, request.kind, "abandoned").inc()
+
+    def run(self):
+        start = time.monotonic()
+        deadline = self.deadline = min(start + self.policy["DEADLINE"], _turn_deadline.get())
+        if deadline <= start:
+            LLM_REQUESTS.labels(self.stage, self.models[0][0], "call", "deadline").inc()
+            raise LLMDeadlineExceeded(f"{self.stage} call not started: the turn's LLM budget is spent")
+        fallback_at = deadline - self.policy["FALLBACK_AT"] * (deadline - start)
+        self._fire("primary")
+        hedge_at = start + self._hedge_delay() if self.policy["HEDGE"] else math.inf
+        retry_at = math.inf
+        last_error = None
+
+        while True:
+            now = time.monotonic()
+            if now >= deadline:
+                self._abandon()
+                LLM_REQUESTS.labels(self.stage, self.models[self.level][0], "call", "deadline").inc()
+                raise LLMDeadlineExceeded(
+                    f"{self.stage} call exceeded its {deadline - start:.1f}s deadline "
+                    f"({len(self.fired)} requests: {', '.join(self.fired)})"
+                ) from last_error
+            if now >= fallback_at:
+                fallback_at = math.inf
+                if self._next_level():
+                    self._fire("fallback")
+                    retry_at = math.inf
+                    hedge_at = math.inf
+            if now >= hedge_at:
+                hedge_at = math.inf
+                if self.pending and deadline - now > self.policy["HEDGE_MIN"]:
+                    self._fire("hedge")
+            if now >= retry_at:
+                retry_at = math.inf
+                self._fire("retry")
+
+            done, _ = wait(list(self.pending), timeout=max(0.0, min(deadline, fallback_at, hedge_at, retry_at) - now),
+                           return_when=FIRST_COMPLETED)
+            for future in done:
+                request = self.pending.pop(future)
+                error = future.exception()
+                if error is None:
+                    seconds = time.monotonic() - request.started
+                    latencies.add((self.stage, request.model), seconds)
+                    LLM_REQUESTS.labels(self.stage, request.model, request.kind, "won").inc()
+                    self._abandon()
+                    response = future.result()
+                    metadata = getattr(response, 'response_metadata', None)
+                    if isinstance(metadata, dict):
+                        metadata["policy"] = {
+                            "model": request.model,
+                            "kind": request.kind,
+                            "requests": self.fired,
+                            "seconds": round(time.monotonic() - start, 3),
+                        }
+                    return response
+
+                LLM_REQUESTS.labels(self.stage, request.model, request.kind, "error").inc()
+                last_error = error
+                if not is_retryable(error):
+                    self._abandon()
+                    raise error
+                if self.pending or retry_at < math.inf:
+                    # another request is still under way, or a retry already scheduled
+                    continue
+                if self.attempts >= self.policy["MAX_ATTEMPTS"]:
+                    if not self._next_level():
+                        raise error
+                    logger.warning("%s: %s failed %d times, falling back to %s", self.stage,
+                                   request.model, self.policy["MAX_ATTEMPTS"], self.models[self.level][0])
+                    self._fire("fallback")
+                else:
+                    retry_at = time.monotonic() + backoff(self.attempts, error)
+                    if retry_at >= deadline and self._next_level():
+                        # no time left to wait for a retry: go to the next model now
+                        retry_at = math.inf
+                        self._fire("fallback")
+
+
+def invoke(stage: str, chain, input: dict, config: Optional[dict] = None):
+    """
+    Invokes `chain` under the call policy of `stage`.
+    """
+    if not _config.get('ENABLED', False):
+        deadline = _turn_deadline.get()
+        return quota.invoke(stage, chain, input, config, deadline=deadline if deadline < math.inf else None)
+    return _Call(stage, chain, input, config).run()
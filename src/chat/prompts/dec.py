@@ -4,6 +4,11 @@
 
 from textwrap import dedent
 
+# Each prompt is laid out as a static prefix (instructions and output format, identical across
+# turns and patients) followed by the per-turn values, so that the provider's automatic prompt
+# prefix caching applies. Keep per-turn placeholders out of the instruction text
+# (`chains.ChainBuilder` checks the layout).
+
 
 base = dedent(
     """
@@ -11,17 +16,35 @@ base = dedent(
     """
 )
 
+turn_note = dedent(
+    """
+    The assessment phase you are performing, the question you are to ask/seek information on and the user's latest message are given at the end of the prompt.
+    """
+)
+
 output_instructions = dedent(
     """
     [IMPORTANT]: Your output must *always* be a valid JSON object and do not include the ```json or ``` at the beginning or end of the response. Only begin your response with the first curly brace `{{` and end with the last curly brace `}}`.
     """
 )
 
-init = base + dedent(
+# per-turn values, appended after the static instructions
+context = dedent(
+    """
+    Conversation:
+    {conversation}
+
+    Assessment phase: {phase}
+    {phase} question: {question}
+    User's latest message: "{message}"
+    """
+)
+
+init = base + turn_note + dedent(
     """
-    The conversation has just begun the user has initiated it with the message: "{message}".
-    You are to begin performing {phase} phase of the assessment.
-    Your task is to ask/seek information on the following {phase} question: {question}. 
+    The conversation has just begun and the user has initiated it with their latest message.
+    You are to begin performing the assessment phase.
+    Your task is to ask/seek information on the question.
     Be sure to first paraphrase the question to suit the context of the conversation.
     Do not ask the question verbatim.
     The question you ask must sound natural and conversational.
@@ -35,13 +58,18 @@ init = base + dedent(
     Output your response as a single JSON object with a single "response" key and the value as the response string. ex. {{"response": "<your response here>"}}. The `response` key holds a string data type.
     Example final output expected: {{"response": "Good morning!... <rest of the response>"}}
     """
-) + output_instructions
+) + output_instructions + dedent(
+    """
+    Assessment phase: {phase}
+    {phase} question: {question}
+    User's latest message: "{message}"
+    """
+)
 
-drift = base + dedent(
+drift = base + turn_note + dedent(
     """
-    The conversation has drifted off course with the user message of: "{message}".
-    You are performing {phase} phase of the assessment.
-    Your task is to ask/seek information on the following {phase} question: {question}.
+    The conversation has drifted off course with the user's latest message.
+    Your task is to ask/seek information on the question of the assessment phase.
     Be sure to first paraphrase the question to suit the context of the conversation.
 
     You must guide the conversation back to the question you are to ask.
@@ -53,19 +81,15 @@ drift = base + dedent(
     You may add line breaks to make your response more readable.
 
     Output your response as a single JSON object with the key "response" and the value as the response string. ex. {{"response": "<your response here>"}}. The `response` key holds a string data type.
-
-    Conversation:
-    {conversation}
     """
-) + output_instructions
+) + output_instructions + context
 
-ambiguous = base + dedent(
+ambiguous = base + turn_note + dedent(
     """
-    The user's response was ambiguous/unclear/confusing/unevaluable with the message: "{message}".
-    You are performing {phase} phase of the assessment.
-    You are asking/seeking information on the following {phase} question: {question}.
+    The user's latest message was ambiguous/unclear/confusing/unevaluable.
+    You are asking/seeking information on the question of the assessment phase.
 
-    As you couldn't understand the user's response, politely ask the user to elaborate on their response. ex. "Could you please elaborate on that?". 
+    As you couldn't understand the user's response, politely ask the user to elaborate on their response. ex. "Could you please elaborate on that?".
     If necessary, you may rephrase the question to make it easier for the user to understand.
     Do not ask the question verbatim.
     The question you ask must sound natural and conversational.
@@ -74,17 +98,13 @@ ambiguous = base + dedent(
     You may add line breaks to make your response more readable.
 
     Output your response as a single JSON object with the key "response" and the value as the response string. ex. {{"response": "<your response here>"}}. The `response` key holds a string data type.
-
-    Conversation:
-    {conversation}
     """
-) + output_instructions
+) + output_instructions + context
 
-clarify = base + dedent(
+clarify = base + turn_note + dedent(
     """
-    The user's response was a request for clarification/elaboration/explanation with the message: "{message}".
-    You are performing {phase} phase of the assessment.
-    Your task is to ask/seek information on the following {phase} question: {question}.
+    The user's latest message was a request for clarification/elaboration/explanation.
+    Your task is to ask/seek information on the question of the assessment phase.
 
     You must provide a clear and concise explanation to the user's request for clarification.
     Try to clear out any confusion the user might have regarding the question you had last asked.
@@ -98,15 +118,12 @@ clarify = base + dedent(
     You may add line breaks to make your response more readable.
 
     Output your response as a single JSON object with the key "response" and the value as the response string. ex. {{"response": "<your response here>"}}. The `response` key holds a string data type.
-
-    Conversation:
-    {conversation}
     """
-) + output_instructions
+) + output_instructions + context
 
-skipped = base + dedent(
+skipped = base + turn_note + dedent(
     """
-    The user's response was skipped and the message was: "{message}". As the user did not provide a satisfactory/evaluable response to the question you had last asked for a couple of times, you have decided to skip the response. Ignoring the user's response, you must now ask/seek information on the next {phase} question: {question}.
+    The user's latest message was skipped. As the user did not provide a satisfactory/evaluable response to the question you had last asked for a couple of times, you have decided to skip the response. Ignoring the user's response, you must now ask/seek information on the next question of the assessment phase, given at the end of the prompt.
 
     Be sure to first paraphrase the question to suit the context of the conversation.
     Do not ask the question verbatim.
@@ -116,19 +133,15 @@ skipped = base + dedent(
     You may add line breaks to make your response more readable.
 
     Output your response as a single JSON object with the key "response" and the value as the response string. ex. {{"response": "<your response here>"}}. The `response` key holds a string data type.
-
-    Conversation:
-    {conversation}
     """
-) + output_instructions
+) + output_instructions + context
 
-normal = base + dedent(
+normal = base + turn_note + dedent(
     """
-    The user's response was normal and clear with the message: "{message}".
+    The user's latest message was a normal and clear response.
     This means the user has provided a clear and understandable response to the question you had last asked.
 
-    You are performing {phase} phase of the assessment.
-    Now you must ask/seek information on the next {phase} question: {question}.
+    Now you must ask/seek information on the next question of the assessment phase, given at the end of the prompt.
     Optionally, you may provide a short one liner tip or suggestion (should be personalized and not generic) only if necessary based on conversation context.
     Be sure to first paraphrase the question to suit the context of the conversation.
     Do not ask the question verbatim.
@@ -138,11 +151,8 @@ normal = base + dedent(
     You may add line breaks to make your response more readable.
 
     Output your response as a single JSON object with the key "response" and the value as the response string. ex. {{"response": "<your response here>"}}. The `response` key holds a string data type.
-
-    Conversation:
-    {conversation}
     """
-) + output_instructions
+) + output_instructions + context
 
 conclude = base + dedent(
     """
@@ -154,8 +164,30 @@ conclude = base + dedent(
     Tips/information should be based on the conversation and key points discussed during the assessment and be personalized to the user's responses instead of generic information.
 
     Output your response as a single JSON object with the key "response" and the value as the response string. ex. {{"response": "<your response here>"}}. The `response` key holds a string data type.
-
+    """
+) + output_instructions + dedent(
+    """
     Conversation:
     {conversation}
     """
-) + output_instructions
+)
+
+personalize = base + turn_note + dedent(
+    """
+    A response prepared for a message very similar to the user's latest message is given at the end of the prompt.
+
+    Your task is to adapt the prepared response so that it directly addresses the user's exact message.
+    Keep its meaning, length and tone, and change as little as possible.
+
+    Output your response as a single JSON object with the key "response" and the value as the response string. ex. {{"response": "<your response here>"}}. The `response` key holds a string data type.
+    """
+) + output_instructions + dedent(
+    """
+    Assessment phase: {phase}
+    {phase} question: {question}
+    User's latest message: "{message}"
+
+    Prepared response:
+    {cached}
+    """
+)
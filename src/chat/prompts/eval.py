@@ -1,6 +1,7 @@
 # prompts/eval.py
 
 # This module contains the evaluation prompts for the chatbot.
+# The per-turn values come after the static instructions, for prompt prefix caching (see prompts/dec.py).
 
 from textwrap import dedent
 
@@ -19,9 +20,7 @@ output_instructions = dedent(
 
 eval = base + dedent(
     """
-    You are performing {phase} phase of the assessment.
-    You had asked the user the following {phase} question: "{question_original}" paraphrased into "{question}" on the previous turn.
-    The user has responded with: "{message}".
+    The assessment phase you are performing, the question you had asked the user on the previous turn (original and as paraphrased) and the user's response are given at the end of the prompt, after the conversation.
 
     Your task is to categorize the user's response into EXACTLY ONE category. 
     The categories are defined below.
@@ -59,8 +58,14 @@ eval = base + dedent(
     You must categorize the user's response into EXACTLY ONE of the these categories.
 
     Output your response as a single JSON object with the key "response" and the value as the category string. ex. {{"response": "<category>"}}
-
+    """
+) + output_instructions + dedent(
+    """
     Conversation:
     {conversation}
+
+    Assessment phase: {phase}
+    {phase} question asked: "{question_original}" paraphrased into "{question}" on the previous turn.
+    The user has responded with: "{message}"
     """
-) + output_instructions
+)
@@ -2,6 +2,8 @@
 
 """This module contains the scoring prompts for the chatbot."""
 
+# The per-turn values come after the static instructions, for prompt prefix caching (see prompts/dec.py).
+
 from textwrap import dedent
 
 
@@ -19,9 +21,9 @@ output_instructions = dedent(
 
 score = base + dedent(
     """
-    Given are some chat conversations between a patient and a mental health virtual assistant. The assistant is conducting an assessment for {phase} phase of the assessment. The patient has responded to the questions asked by the assistant.
-    
-    Based on the conversation evaluate and score the patient for all the {phase} questions.Output as a single JSON object of the form: {{ "response": "<response>" }}.
+    Given are some chat conversations between a patient and a mental health virtual assistant. The assistant is conducting an assessment phase, given at the end of the prompt. The patient has responded to the questions asked by the assistant.
+
+    Based on the conversation evaluate and score the patient for all the questions of the phase.Output as a single JSON object of the form: {{ "response": "<response>" }}.
 
     To each question's evaluation add a remark or a short justification (key `remark`) based on the patient's response. 
     Also add a key `snippet` that holds the snippet of message that was used for justifying the score. 
@@ -39,14 +41,21 @@ score = base + dedent(
                 ...
             }}
     }}
-    Key `score` holds integer values. `remark` and `snippet` are strings. `keywords` is List[str] type. `qid` must be chosen appropriately from the {phase} questions json described below. Make your remarks informative but concise. And keep snippets short and relevant.
+    Key `score` holds integer values. `remark` and `snippet` are strings. `keywords` is List[str] type. `qid` must be chosen appropriately from the questions json of the phase given at the end of the prompt. Make your remarks informative but concise. And keep snippets short and relevant.
 
-    The {phase} questions are given in JSON format below. `qid`, `text`, `labels`, `score_range` are the keys in the JSON object.
-    questions_json={questions_json}
+    The questions of the phase are given in JSON format (`questions_json`). `qid`, `text`, `labels`, `score_range` are the keys in the JSON object.
 
     Some questions in the chat may have been skipped if the patient's response was not evaluable. In such cases, you can assign the minimum valid score for that question as per the json (score_range[0]).
 
-    Refer the conversation below and provide the requested json output.
+    Refer the conversation at the end of the prompt and provide the requested json output.
+    """
+) + output_instructions + dedent(
+    """
+    Assessment phase: {phase}
+    {phase} questions:
+    questions_json={questions_json}
+
+    Conversation:
     {conversation_json}
     """
-) + output_instructions
+)
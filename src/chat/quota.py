@@ -0,0 +1,384 @@
+"""
+Cluster-wide scheduling of LLM requests under the provider's rate limits.
+
+Every request to a model with configured limits (`LLM_QUOTAS['MODELS']`,
+requests and tokens per minute) takes its share from two token buckets,
+requests and tokens, before it is sent:
+
+- the tokens of a request are estimated beforehand: its prompt (the
+  formatted prompt's length over the chars per token observed for the
+  model) plus its max_tokens, or the completion size observed for the
+  stage; the estimate is corrected with the actual usage afterwards;
+- the buckets are shared by all processes and replicas: one
+  `LLMQuotaBucket` row per model, refilled and debited atomically by a
+  single UPDATE ... RETURNING on a private autocommit connection (so that
+  it is never part of a request's transaction) using the database clock;
+  when the database cannot be reached (or is SQLite), each process falls
+  back to local buckets with `LOCAL_SHARE` of the limits;
+- they refill at `HEADROOM` of the limits and hold `BURST_SECONDS` worth
+  of them, so that requests are paced steadily just under the quota
+  instead of bursting into 429s and then backing off;
+- requests waiting for the same model are served by priority (`PRIORITIES`
+  per stage: eval before dec before score), then in arrival order; a
+  request that cannot be served before its deadline raises `QuotaTimeout`
+  and hedged requests do not wait at all;
+- a 429 from the provider drains the buckets for its Retry-After, so that
+  every replica backs off together.
+"""
+
+import heapq
+import itertools
+import logging
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+import openai
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+from telemetry.metrics import LLM_QUOTA_REQUESTS, LLM_QUOTA_WAIT_SECONDS
+
+from .chains import model_label
+
+
+logger = logging.getLogger(__name__)
+
+_config = getattr(settings, 'LLM_QUOTAS', {})
+
+
+class QuotaTimeout(TimeoutError):
+    pass
+
+
+class Limits:
+    """
+    Refill rates (per second) and capacities of a model's buckets.
+    """
+
+    def __init__(self, rpm: float, tpm: float, share: float = 1.0):
+        headroom = _config.get('HEADROOM', 0.9) * share
+        burst = _config.get('BURST_SECONDS', 5.0)
+        self.request_rate = rpm * headroom / 60
+        self.token_rate = tpm * headroom / 60
+        self.request_capacity = max(1.0, self.request_rate * burst)
+        self.token_capacity = max(1.0, self.token_rate * burst)
+
+    def wait(self, requests: float, tokens: float, cost: float) -> float:
+        """
+        Seconds until buckets at these levels hold one request and `cost` tokens.
+        """
+        return max(
+            0.0,
+            (1 - requests) / self.request_rate if self.request_rate else 0.0,
+            (cost - tokens) / self.token_rate if self.token_rate else 0.0,
+        )
+
+
+def limits(model: str, share: float = 1.0) -> Optional[Limits]:
+    quota = _config.get('MODELS', {}).get(model)
+    if not quota:
+        return None
+    return Limits(float(quota.get('RPM', 0)), float(quota.get('TPM', 0)), share)
+
+
+class LocalBackend:
+    """
+    Buckets of this process only.
+    """
+
+    def __init__(self):
+        self._buckets: Dict[str, list] = {}
+        self._lock = threading.Lock()
+
+    def _refill(self, model: str, limits: Limits) -> list:
+        now = time.monotonic()
+        bucket = self._buckets.setdefault(model, [limits.request_capacity, limits.token_capacity, now])
+        elapsed = now - bucket[2]
+        bucket[0] = min(limits.request_capacity, bucket[0] + elapsed * limits.request_rate)
+        bucket[1] = min(limits.token_capacity, bucket[1] + elapsed * limits.token_rate)
+        bucket[2] = now
+        return bucket
+
+    def take(self, model: str, limits: Limits, cost: float) -> float:
+        # a request larger than the bucket waits for a full one
+        cost = min(cost, limits.token_capacity)
+        with self._lock:
+            bucket = self._refill(model, limits)
+            wait = limits.wait(bucket[0], bucket[1], cost)
+            if wait == 0:
+                bucket[0] -= 1
+                bucket[1] -= cost
+            return wait
+
+    def adjust(self, model: str, limits: Limits, tokens: float) -> None:
+        with self._lock:
+            bucket = self._refill(model, limits)
+            bucket[1] = min(limits.token_capacity, bucket[1] - tokens)
+
+    def drain(self, model: str, limits: Limits, seconds: float) -> None:
+        with self._lock:
+            bucket = self._refill(model, limits)
+            bucket[0] = min(bucket[0], -limits.request_rate * seconds)
+            bucket[1] = min(bucket[1], -limits.token_rate * seconds)
+
+
+class DatabaseBackend:
+    """
+    Buckets shared through the `LLMQuotaBucket` table, on a connection of
+    their own in autocommit mode.
+    """
+
+    table = "chat_llmquotabucket"
+
+    def __init__(self, alias: str = DEFAULT_DB_ALIAS):
+        self.alias = alias
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def _cursor(self):
+        if self._connection is None:
+            self._connection = connections.create_connection(self.alias)
+            # used from the policy's worker threads, one at a time under the lock
+            self._connection.inc_thread_sharing()
+        return self._connection.cursor()
+
+    def _execute(self, sql: str, params: list):
+        with self._lock:
+            try:
+                with self._cursor() as cursor:
+                    cursor.execute(sql, params)
+                    return cursor.fetchone() if cursor.description else cursor.rowcount
+            except DatabaseError:
+                if self._connection is not None:
+                    self._connection.close()
+                    self._connection = None
+                raise
+
+    def _levels(self, limits: Limits) -> Tuple[str, str, str, str, list]:
+        """
+        SQL of the database clock, of LEAST and of the refilled request and token levels, with the
+        parameters of the latter.
+        """
+        if connections[self.alias].vendor == "postgresql":
+            now, least = "EXTRACT(EPOCH FROM now())", "LEAST"
+        else:
+            now, least = "((julianday('now') - 2440587.5) * 86400.0)", "MIN"
+        requests = f"{least}(%s, requests + ({now} - updated) * %s)"
+        tokens = f"{least}(%s, tokens + ({now} - updated) * %s)"
+        return now, least, requests, tokens, [limits.request_capacity, limits.request_rate,
+                                              limits.token_capacity, limits.token_rate]
+
+    def take(self, model: str, limits: Limits, cost: float) -> float:
+        cost = min(cost, limits.token_capacity)
+        now, _, requests, tokens, refill = self._levels(limits)
+        for _ in range(2):
+            row = self._execute(
+                f"UPDATE {self.table} SET requests = {requests} - 1, tokens = {tokens} - %s, updated = {now} "
+                f"WHERE model = %s AND {requests} >= 1 AND {tokens} >= %s RETURNING requests",
+                refill + [cost, model] + refill + [cost],
+            )
+            if row is not None:
+                return 0.0
+            row = self._execute(
+                f"SELECT {requests}, {tokens} FROM {self.table} WHERE model = %s", refill + [model])
+            if row is not None:
+                return max(limits.wait(row[0], row[1], cost), 0.001)
+            self._execute(
+                f"INSERT INTO {self.table} (model, requests, tokens, updated) VALUES (%s, %s, %s, {now}) "
+                f"ON CONFLICT (model) DO NOTHING",
+                [model, limits.request_capacity, limits.token_capacity],
+            )
+        return 0.001
+
+    def adjust(self, model: str, limits: Limits, tokens: float) -> None:
+        now, _, requests, level, refill = self._levels(limits)
+        self._execute(
+            f"UPDATE {self.table} SET requests = {requests}, tokens = {level} - %s, updated = {now} "
+            f"WHERE model = %s",
+            refill + [tokens, model],
+        )
+
+    def drain(self, model: str, limits: Limits, seconds: float) -> None:
+        now, least, requests, tokens, refill = self._levels(limits)
+        self._execute(
+            f"UPDATE {self.table} SET requests = {least}({requests}, %s), tokens = {least}({tokens}, %s), "
+            f"updated = {now} WHERE model = %s",
+            refill[:2] + [-limits.request_rate * seconds] + refill[2:] + [-limits.token_rate * seconds, model],
+        )
+
+
+class Scheduler:
+    """
+    Serves the requests waiting for each model in priority order: only the
+    request at the head of a model's queue draws from its buckets.
+    """
+
+    def __init__(self):
+        self.local = LocalBackend()
+        # SQLite has a single writer, which the request's own transaction may be holding
+        shared = _config.get('BACKEND', 'db') == 'db' and connections[DEFAULT_DB_ALIAS].vendor == 'postgresql'
+        self.shared = DatabaseBackend() if shared else None
+        self._shared_down_until = 0.0
+        self._queues: Dict[str, list] = {}
+        self._condition = threading.Condition()
+        self._sequence = itertools.count()
+        # observed prompt chars per token per model, completion tokens per (stage, model)
+        self._chars_per_token: Dict[str, float] = {}
+        self._completion: Dict[Tuple[str, str], float] = {}
+
+    def _backend(self, model: str):
+        """
+        The shared backend and the full limits, or the local one and this process' share when the
+        database is unavailable.
+        """
+        if self.shared is not None and time.monotonic() >= self._shared_down_until:
+            return self.shared, limits(model)
+        return self.local, limits(model, _config.get('LOCAL_SHARE', 0.25))
+
+    def _call(self, model: str, method: str, *args):
+        backend, model_limits = self._backend(model)
+        try:
+            return getattr(backend, method)(model, model_limits, *args), backend
+        except DatabaseError:
+            logger.warning("LLM quota buckets unavailable, using local buckets for %ss",
+                           _config.get('BACKEND_RETRY', 30), exc_info=True)
+            self._shared_down_until = time.monotonic() + _config.get('BACKEND_RETRY', 30)
+            backend, model_limits = self._backend(model)
+            return getattr(backend, method)(model, model_limits, *args), backend
+
+    def estimate(self, stage: str, model: str, chain, chars: int) -> Tuple[int, int]:
+        """
+        Estimated prompt and completion tokens of a request whose prompt has `chars` characters.
+        """
+        prompt = chars / self._chars_per_token.get(model, _config.get('CHARS_PER_TOKEN', 4.0))
+        step = getattr(chain, "last", chain)
+        model_step = getattr(step, "bound", step)
+        max_tokens = getattr(model_step, "max_tokens", None) or getattr(model_step, "num_predict", None)
+        completion = max_tokens or self._completion.get((stage, model), _config.get('COMPLETION_TOKENS', 256))
+        return int(prompt) + 1, int(completion)
+
+    def acquire(self, stage: str, model: str, cost: int, deadline: float, wait: bool = True) -> None:
+        """
+        Takes one request and `cost` tokens of `model`'s quota, waiting for them in priority order
+        until `deadline` (monotonic), or not at all without `wait`.
+        """
+        if limits(model) is None:
+            return
+        ticket = (_config.get('PRIORITIES', {}).get(stage, 9), next(self._sequence))
+        started = time.monotonic()
+        with self._condition:
+            queue = self._queues.setdefault(model, [])
+            heapq.heappush(queue, ticket)
+        try:
+            while True:
+                with self._condition:
+                    while queue[0] != ticket:
+                        remaining = deadline - time.monotonic()
+                        if not wait or remaining <= 0:
+                            raise QuotaTimeout(f"No {model} quota for a {stage} request before its deadline")
+                        self._condition.wait(remaining)
+                delay, backend = self._call(model, "take", cost)
+                if delay == 0:
+                    LLM_QUOTA_REQUESTS.labels(model, "db" if backend is self.shared else "local", "granted").inc()
+                    return
+                if not wait or time.monotonic() + delay > deadline:
+                    raise QuotaTimeout(f"No {model} quota for a {stage} request before its deadline")
+                with self._condition:
+                    # woken early when the queue changes: a request of higher priority goes first
+                    self._condition.wait(min(delay, _config.get('MAX_POLL', 1.0)))
+        except QuotaTimeout:
+            LLM_QUOTA_REQUESTS.labels(model, "db" if self.shared else "local", "timeout").inc()
+            raise
+        finally:
+            LLM_QUOTA_WAIT_SECONDS.labels(stage, model).observe(time.monotonic() - started)
+            with self._condition:
+                queue.remove(ticket)
+                heapq.heapify(queue)
+                self._condition.notify_all()
+
+    def settle(self, stage: str, model: str, estimate: Tuple[int, int], chars: int, response: Any) -> None:
+        """
+        Corrects the buckets and the estimates with the actual usage of a response.
+        """
+        if limits(model) is None:
+            return
+        usage = (getattr(response, 'response_metadata', None) or {}).get('token_usage') or {}
+        prompt, completion = usage.get('prompt_tokens'), usage.get('completion_tokens')
+        if not prompt:
+            return
+        if chars:
+            ratio = chars / prompt
+            self._chars_per_token[model] = 0.9 * self._chars_per_token.get(model, ratio) + 0.1 * ratio
+        if completion is not None:
+            key = (stage, model)
+            self._completion[key] = 0.9 * self._completion.get(key, completion) + 0.1 * completion
+        delta = prompt + (completion or 0) - sum(estimate)
+        if abs(delta) >= 1:
+            self._call(model, "adjust", delta)
+
+    def throttled(self, model: str, error: Exception) -> None:
+        if limits(model) is None:
+            return
+        response = getattr(error, 'response', None)
+        try:
+            seconds = float(response.headers.get('retry-after')) if response is not None else 0.0
+        except (TypeError, ValueError):
+            seconds = 0.0
+        self._call(model, "drain", seconds or _config.get('THROTTLE_SECONDS', 1.0))
+
+
+scheduler = Scheduler()
+
+
+class Grant:
+    """
+    Quota taken for one request, settled with its actual usage.
+    """
+
+    def __init__(self, stage: str, model: str, estimate: Tuple[int, int], chars: int):
+        self.stage = stage
+        self.model = model
+        self.estimate = estimate
+        self.chars = chars
+
+
+def reserve(stage: str, chain, input: dict, deadline: Optional[float] = None, wait: bool = True) -> Optional[Grant]:
+    """
+    Takes the quota of a request of `chain`, waiting for it until `deadline` (monotonic, default
+    `MAX_WAIT` from now) or not at all without `wait`. None when the chain's model has no limits.
+    """
+    model = model_label(getattr(chain, "last", chain))
+    if not _config.get('ENABLED', False) or limits(model) is None:
+        return None
+    if deadline is None:
+        deadline = time.monotonic() + _config.get('MAX_WAIT', 30.0)
+    try:
+        chars = len(chain.first.invoke(input).to_string())
+    except Exception:
+        chars = sum(len(str(value)) for value in input.values())
+    estimate = scheduler.estimate(stage, model, chain, chars)
+    scheduler.acquire(stage, model, sum(estimate), deadline, wait)
+    return Grant(stage, model, estimate, chars)
+
+
+def send(grant: Optional[Grant], chain, input: dict, config: Optional[dict] = None):
+    """
+    Invokes `chain` under a reserved grant, settling it with the response's usage.
+    """
+    if grant is None:
+        return chain.invoke(input, config)
+    try:
+        response = chain.invoke(input, config)
+    except openai.RateLimitError as e:
+        scheduler.throttled(grant.model, e)
+        raise
+    scheduler.settle(grant.stage, grant.model, grant.estimate, grant.chars, response)
+    return response
+
+
+def invoke(stage: str, chain, input: dict, config: Optional[dict] = None, deadline: Optional[float] = None):
+    """
+    Invokes `chain` once its model's quota allows it.
+    """
+    return send(reserve(stage, chain, input, deadline), chain, input, config)
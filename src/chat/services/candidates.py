@@ -0,0 +1,279 @@
+"""
+Offline evaluation of candidate models for the pipeline chains.
+
+Recorded turns are replayed through a chain built with a candidate
+configuration (see `chains.chain_config`) and the answers are compared with
+what production recorded:
+
+- eval: the state against the production label (`fastpath.label`), for
+  turns the eval chain classified itself;
+- score: the per-question scores against the assessment records;
+- dec: the output validity and the similarity of the response to the
+  production one (responses are free text: read a sample too).
+
+Inputs are rebuilt from the stored messages as the pipeline built them at
+the time of the turn. Latency, tokens and cost (`LLM_PRICES`) are measured
+per call; calls go straight to the model, without the call policy, but
+share the rate limit quotas with production at the lowest priority (the
+time spent waiting for them is reported apart from the latency).
+"""
+
+import json
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from django.db.models import Q
+
+from assessments.definitions import PhaseMap
+from assessments.models import Assessment
+
+from .. import quota
+from ..chains import build_chain, chain_config
+from ..models import ChatMessage
+from ..outputs import OutputError, parse_dec, parse_eval, parse_score
+from . import fastpath
+from .conversation import ConversationManager, HistoryManager
+from .semcache import embed, similarity
+from .usage import cost
+
+
+@dataclass
+class Case:
+    chain: str
+    inputs: Dict[str, Any]
+    expected: Any
+    ref: str  # message or assessment id
+    questions: Optional[Dict[str, Any]] = None
+
+
+@dataclass
+class Result:
+    case: Case
+    output: Any = None
+    error: Optional[str] = None  # "call: ..." or "output: ..."
+    seconds: float = 0.0  # the model call, after the quota was granted
+    quota_wait: float = 0.0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cost: float = 0.0
+
+
+@dataclass
+class Summary:
+    label: str
+    config: Dict[str, Any]
+    results: List[Result] = field(default_factory=list)
+    metrics: Dict[str, Any] = field(default_factory=dict)
+
+
+def _history(messages: List[ChatMessage]) -> List:
+    # the pipeline reads the history after storing the patient's message, before the AI reply
+    history = HistoryManager.qs_to_list(messages)
+    if history:
+        history[-1] = ("ai", None)
+    return history
+
+
+def eval_cases(limit: int) -> List[Case]:
+    messages = (
+        ChatMessage.objects.filter(user_marker__has_key='tr', chat_session__isnull=False)
+        .exclude(user_response__isnull=True)
+        .order_by('-timestamp')
+    )
+    cases = []
+    for msg in messages.iterator(chunk_size=500):
+        eval_meta = (msg.meta_data or {}).get('eval') or {}
+        if eval_meta.get('cache') or eval_meta.get('fallback') or eval_meta.get('degraded') \
+                or (eval_meta.get('fastpath') or {}).get('used'):
+            continue
+        label = fastpath.label(msg.user_marker, msg.ai_marker)
+        phase = PhaseMap.get(msg.user_marker.get('phase', ''))
+        if label is None or phase is None:
+            continue
+        session = list(
+            ChatMessage.objects.filter(chat_session_id=msg.chat_session_id, timestamp__lte=msg.timestamp)
+            .order_by('timestamp')
+        )
+        previous = session[-2].ai_response if len(session) > 1 else None
+        cases.append(Case('eval', {
+            "message": ConversationManager.format_msg(msg),
+            "phase": phase.verbose_name,
+            "question_original": msg.user_marker.get('question', ''),
+            "question": previous,
+            "conversation": _history(session),
+        }, label, msg.id))
+        if len(cases) >= limit:
+            break
+    return cases
+
+
+def dec_cases(chain: str, limit: int) -> List[Case]:
+    messages = (
+        ChatMessage.objects.filter(ai_marker__has_key='chat_status', ai_response__isnull=False)
+        .order_by('-timestamp')
+    )
+    if chain != 'dec':
+        messages = messages.filter(ai_marker__chat_status=chain.split('.', 1)[1].upper())
+    cases = []
+    for msg in messages.iterator(chunk_size=500):
+        dec_meta = (msg.meta_data or {}).get('dec') or {}
+        phase = PhaseMap.get(msg.ai_marker.get('phase', ''))
+        if dec_meta.get('cache') or dec_meta.get('degraded') or phase is None:
+            continue
+        history = list(
+            ChatMessage.objects.filter(conversation_id=msg.conversation_id, timestamp__lte=msg.timestamp)
+            .order_by('timestamp')
+        )
+        cases.append(Case(f"dec.{msg.ai_marker['chat_status'].lower()}", {
+            "message": ConversationManager.format_msg(msg),
+            "phase": phase.verbose_name,
+            "question": msg.ai_marker.get('question', ''),
+            "conversation": _history(history),
+        }, msg.ai_response, msg.id))
+        if len(cases) >= limit:
+            break
+    return cases
+
+
+def score_cases(limit: int) -> List[Case]:
+    assessments = (
+        Assessment.objects.filter(status='completed', session__isnull=False)
+        .prefetch_related('records')
+        .order_by('-completed_at')[:limit]
+    )
+    cases = []
+    for assessment in assessments:
+        phase = PhaseMap.get(assessment.type)
+        if phase is None or not phase.supports_scoring:
+            continue
+        messages = list(
+            ChatMessage.objects.filter(chat_session_id=assessment.session_id)
+            .filter(Q(ai_marker__phase=phase.name) | Q(user_marker__phase=phase.name))
+            .order_by('timestamp')
+        )
+        conversation = HistoryManager.qs_to_dict(messages)
+        if messages:
+            # scored before the last turn was answered
+            conversation[messages[-1].id].update(ai=None, ai_marker={})
+        questions = phase.get_questions_dict()
+        cases.append(Case('score', {
+            "phase": phase.verbose_name,
+            "questions_json": json.dumps(questions),
+            "conversation_json": json.dumps(conversation),
+        }, {record.question_id: record.score for record in assessment.records.all()}, assessment.id, questions))
+    return cases
+
+
+def cases_for(chain: str, limit: int) -> List[Case]:
+    if chain == 'eval':
+        return eval_cases(limit)
+    if chain == 'score':
+        return score_cases(limit)
+    if chain == 'dec' or chain.startswith('dec.'):
+        return dec_cases(chain, limit)
+    raise ValueError(f"Unknown chain '{chain}'")
+
+
+def _parse(case: Case, content: str):
+    if case.chain == 'eval':
+        return parse_eval(content)[0]
+    if case.chain == 'score':
+        return parse_score(content, case.questions)[0]
+    return parse_dec(content)[0]
+
+
+def _run_one(chains: Dict[str, Any], case: Case) -> Result:
+    result = Result(case)
+    chain = chains[case.chain]
+    started = time.perf_counter()
+    try:
+        grant = quota.reserve("offline", chain, case.inputs)
+    except quota.QuotaTimeout as e:
+        result.quota_wait = time.perf_counter() - started
+        result.error = f"call: {type(e).__name__}: {e}"
+        return result
+    result.quota_wait = time.perf_counter() - started
+    started = time.perf_counter()
+    try:
+        response = quota.send(grant, chain, case.inputs)
+    except Exception as e:
+        result.seconds = time.perf_counter() - started
+        result.error = f"call: {type(e).__name__}: {e}"
+        return result
+    result.seconds = time.perf_counter() - started
+    meta = response.response_metadata or {}
+    usage = meta.get('token_usage') or {}
+    result.prompt_tokens = usage.get('prompt_tokens') or 0
+    result.completion_tokens = usage.get('completion_tokens') or 0
+    cached = (usage.get('prompt_tokens_details') or {}).get('cached_tokens') or 0
+    result.cost = float(cost(meta.get('model_name') or '', result.prompt_tokens, result.completion_tokens, cached))
+    try:
+        result.output = _parse(case, response.content)
+    except OutputError as e:
+        result.error = f"output: {e}"
+    return result
+
+
+def evaluate(label: str, overrides: Dict[str, Any], cases: List[Case], workers: int = 4) -> Summary:
+    """
+    Replays `cases` through their chains built with the production
+    configuration updated with `overrides`.
+    """
+    names = sorted({case.chain for case in cases})
+    configs = {name: chain_config(name, overrides) for name in names}
+    chains = {name: build_chain(name, config) for name, config in configs.items()}
+    summary = Summary(label, configs[names[0]] if names else chain_config('eval', overrides))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        summary.results = list(executor.map(lambda case: _run_one(chains, case), cases))
+    summary.metrics = _metrics(summary.results)
+    return summary
+
+
+def _metrics(results: List[Result]) -> Dict[str, Any]:
+    answered = [result for result in results if result.error is None]
+    latencies = sorted(result.seconds for result in results if not (result.error or '').startswith('call'))
+    waits = sorted(result.quota_wait for result in results)
+    metrics = {
+        'cases': len(results),
+        'call_errors': sum(1 for result in results if (result.error or '').startswith('call')),
+        'invalid': sum(1 for result in results if (result.error or '').startswith('output')),
+        'latency_p50': latencies[len(latencies) // 2] if latencies else None,
+        'latency_p95': latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] if latencies else None,
+        'quota_wait_p50': waits[len(waits) // 2] if waits else None,
+        'quota_wait_max': waits[-1] if waits else None,
+        'prompt_tokens': statistics.mean([r.prompt_tokens for r in results]) if results else 0,
+        'completion_tokens': statistics.mean([r.completion_tokens for r in results]) if results else 0,
+        'cost': sum(result.cost for result in results),
+        'agreement': None,
+    }
+    if not answered:
+        return metrics
+
+    chain = answered[0].case.chain
+    if chain == 'eval':
+        metrics['agreement'] = sum(1 for r in answered if r.output == r.case.expected) / len(answered)
+        per_state = {}
+        for r in answered:
+            hits, total = per_state.get(r.case.expected, (0, 0))
+            per_state[r.case.expected] = (hits + (r.output == r.case.expected), total + 1)
+        metrics['per_state'] = {state: hits / total for state, (hits, total) in sorted(per_state.items())}
+    elif chain == 'score':
+        pairs = [
+            (record['score'], r.case.expected.get(qid))
+            for r in answered for qid, record in r.output.items() if r.case.expected.get(qid) is not None
+        ]
+        metrics['agreement'] = sum(1 for a, b in pairs if a == b) / len(pairs) if pairs else None
+        metrics['mean_abs_diff'] = statistics.mean([abs(a - b) for a, b in pairs]) if pairs else None
+        totals = [
+            (sum(record['score'] for record in r.output.values()), sum(r.case.expected.values()))
+            for r in answered
+        ]
+        metrics['total_abs_diff'] = statistics.mean([abs(a - b) for a, b in totals])
+    else:
+        metrics['agreement'] = statistics.mean([
+            similarity(embed(r.output), embed(r.case.expected or '')) for r in answered
+        ])
+    return metrics
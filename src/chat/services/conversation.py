@@ -42,8 +42,9 @@ class HistoryManager:
         """
         Retrieves full chat history of user in list format
         """
+        # oldest first: the history only grows at its end, which keeps the prompt prefix cacheable
         chat_obj = ChatMessage.objects.filter(
-            conversation_id=self.conversation_id).order_by('-timestamp')
+            conversation_id=self.conversation_id).order_by('timestamp')
         chat_history = []
         for msg in chat_obj:
             chat_history.append(
@@ -168,6 +169,8 @@ class ConversationManager:
 
     @staticmethod
     def get_or_create_conversation(user: AbstractBaseUser) -> tuple[Conversation, bool]:
+        if type(user).conversation.is_cached(user): # set by CachedTokenAuthentication
+            return user.conversation, False
         conversation, created = Conversation.objects.get_or_create(user=user)
         return conversation, created
 
@@ -191,7 +194,7 @@ class ConversationManager:
                 if time_inactive.total_seconds() / 60 > ChatSettings.SESSION_TIMEOUT:
                     chat_session.status = 'aborted'
                     chat_session.save(update_fields=['status'])
-                    assessments = chat_session.assessments.filter(status='pending')
+                    assessments = chat_session.assessments.filter(status='pending', needs_scoring=False)
                     for assessment in assessments:
                         assessment.status = 'aborted'
                         assessment.save(update_fields=['status'])
@@ -0,0 +1,113 @@
+"""
+Deterministic degraded mode of the chat pipeline, used while the LLM
+provider is unavailable (see `chat.breaker`).
+
+Questions are asked verbatim (`QuestionNode.text`, or their patient-facing
+version in `_TEXTS` when written for the LLM to fill in) with short answer
+options, and replies are mapped to the phase graph's transitions without
+any LLM call:
+
+- the options are the phase's labels (ex. "Not at all" .. "Nearly every
+  day"), or "No" / "Yes"; the first label is a "no" (n), the others a
+  "yes" (y);
+- questions whose yes and no lead to the same question (ex. "How?") take
+  any typed reply as an answer, other typed replies are classified by the
+  fast path's rules and model when confident;
+- unclear replies are asked again ("o") until the question's retries are
+  exhausted and it is skipped;
+- "Skip this question" skips it right away.
+
+Phases completed in degraded mode are scored later by the score chain
+(`Assessment.needs_scoring`, `manage.py rescore`).
+"""
+
+from typing import Dict, List, Tuple
+
+from assessments.definitions import BaseAssessmentPhase, QuestionNode
+
+from . import fastpath
+from .constants import ChatStates
+
+
+SKIP = "SKIP"
+SKIP_OPTION = "Skip this question"
+
+_NO_LABELS = ["No", "Yes"]
+
+# questions whose text is a template for the dec chain, by (phase, node)
+_TEXTS: Dict[Tuple[str, str], str] = {
+    ("monitoring", "1"): (
+        "Have you noticed any improvement or worsening in your symptoms (for example anxiety, low mood or "
+        "unusual thoughts) since your last visit?"
+    ),
+}
+
+_INTRO = (
+    "Our assistant is running in a simplified mode at the moment, so I'll ask you the questions directly. "
+    "Please pick the answer that fits best, or type it in."
+)
+_REPEAT = "Sorry, I couldn't match that to one of the answers. Please pick one of the options below."
+_CONCLUDE = (
+    "Thank you, that was the last question. Your answers have been recorded and will be reviewed "
+    "together with your care team."
+)
+
+
+def _labels(phase: BaseAssessmentPhase) -> List[str]:
+    return phase.labels if len(phase.labels) >= 2 else _NO_LABELS
+
+
+def is_open_ended(node: QuestionNode) -> bool:
+    """
+    Whether every answer leads to the same question.
+    """
+    return node.y() == node.n()
+
+
+def options(phase: BaseAssessmentPhase) -> List[str]:
+    """
+    Answer options shown for the questions of a phase (replies can be typed too).
+    """
+    return _labels(phase) + [SKIP_OPTION]
+
+
+def classify(phase: BaseAssessmentPhase, node: QuestionNode, reply: str) -> str:
+    """
+    Eval state of a reply (NORMAL_y, NORMAL_n or AMBIGUOUS), or `SKIP`.
+    """
+    text = fastpath.normalize(reply)
+    if text == fastpath.normalize(SKIP_OPTION):
+        return SKIP
+    labels = [fastpath.normalize(label) for label in _labels(phase)]
+    if text in labels:
+        return "NORMAL_n" if labels.index(text) == 0 else "NORMAL_y"
+    prediction = fastpath.rules(reply)
+    if prediction is not None and prediction.state not in ("NORMAL_y", "NORMAL_n"):
+        return "AMBIGUOUS"
+    if is_open_ended(node):
+        # the answer is kept for the score chain; any one leads on
+        return "NORMAL_y"
+    prediction = prediction or fastpath.predict(reply)
+    if fastpath.is_confident(prediction) and prediction.state in ("NORMAL_y", "NORMAL_n"):
+        return prediction.state
+    return "AMBIGUOUS"
+
+
+def text(phase: BaseAssessmentPhase, node: QuestionNode) -> str:
+    """
+    The question as shown to the patient.
+    """
+    return _TEXTS.get((phase.name, node.node_id), node.text)
+
+
+def respond(phase: BaseAssessmentPhase, node: QuestionNode, chat_state: str) -> str:
+    """
+    Response of the decision stage: the current question.
+    """
+    if chat_state == ChatStates.CONCLUDE:
+        return _CONCLUDE
+    if chat_state == ChatStates.INIT:
+        return f"{_INTRO}\n\n{text(phase, node)}"
+    if chat_state in (ChatStates.AMBIGUOUS, ChatStates.DRIFT, ChatStates.CLARIFY):
+        return f"{_REPEAT}\n\n{text(phase, node)}"
+    return text(phase, node)
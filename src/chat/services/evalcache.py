@@ -0,0 +1,123 @@
+"""
+Cache of eval chain classifications.
+
+Short answers repeat heavily: "no" to a given question node is classified
+the same way for every patient. Classifications are cached by phase, node,
+normalized reply (see `fastpath.normalize`) and the version of the eval
+prompt and model, optionally also by a hash of the last AI turn
+(`EVAL_CACHE['KEY_LAST_MSG']`), in a process-local TTL LRU, optionally
+backed by a shared Django cache (`EVAL_CACHE['SHARED_CACHE']`).
+
+Replies whose classification may depend on the conversation are never
+looked up or stored: long replies, replies referring back to earlier turns
+("same as before", "like I said"), replies on a retried node and replies
+to a clarification.
+
+Lookups are counted in `beacon_eval_cache_lookups_total` by outcome.
+"""
+
+import hashlib
+import re
+from typing import Optional
+
+from django.conf import settings
+from django.core.cache import caches
+
+from beaconmind.caching import TTLLRUCache
+from telemetry.metrics import EVAL_CACHE_LOOKUPS
+
+from .. import prompts
+from .fastpath import normalize
+
+
+# words referring to earlier turns, whose meaning depends on the conversation
+_CONTEXTUAL = re.compile(
+    r"\b(same|again|before|earlier|above|previous|already|told you|said|that one|as well|too|also)\b"
+)
+
+_config = getattr(settings, 'EVAL_CACHE', {})
+enabled = _config.get('ENABLED', False)
+_local = TTLLRUCache(maxsize=_config.get('MAXSIZE', 10_000), ttl=_config.get('TTL', 86400))
+_version = None
+
+
+def _shared_cache():
+    alias = _config.get('SHARED_CACHE')
+    return caches[alias] if alias else None
+
+
+def version() -> str:
+    """
+    Hash of the eval prompt and model; entries of other versions are never
+    read. Changes when the eval chain is rebuilt with another model.
+    """
+    global _version
+    from ..chains import ChainStore, model_label
+
+    chain = ChainStore.eval_chain
+    if _version is None or _version[0] is not chain:
+        _version = (chain, hashlib.sha1(f"{model_label(chain.last)}\n{prompts.eval}".encode()).hexdigest()[:10])
+    return _version[1]
+
+
+def bypass_reason(message: str, retries: int, clarifying: bool = False) -> Optional[str]:
+    """
+    Why a reply is not cacheable ("long", "context", "retry" or "clarify"), or None.
+    """
+    norm = normalize(message)
+    if len(norm) > _config.get('MAX_CHARS', 40) or len(norm.split()) > _config.get('MAX_WORDS', 6):
+        return 'long'
+    if retries:
+        return 'retry'
+    if clarifying:
+        # answers the clarification rather than the question the node is keyed on
+        return 'clarify'
+    if _CONTEXTUAL.search(norm):
+        return 'context'
+    return None
+
+
+def make_key(phase: str, node_id: str, message: str, last_msg: Optional[str] = None) -> str:
+    parts = [version(), phase, str(node_id), normalize(message)]
+    if _config.get('KEY_LAST_MSG'):
+        parts.append(hashlib.sha1((last_msg or '').encode()).hexdigest()[:10])
+    return "eval:" + hashlib.sha1("\x1f".join(parts).encode()).hexdigest()
+
+
+def lookup(key: str) -> tuple:
+    """
+    Cached state and the tier it came from ("local" or "shared"), or
+    (None, None).
+    """
+    state = _local.get(key)
+    if state is not None:
+        EVAL_CACHE_LOOKUPS.labels('hit_local').inc()
+        return state, 'local'
+    shared = _shared_cache()
+    if shared is not None:
+        state = shared.get(key)
+        if state is not None:
+            _local.set(key, state)
+            EVAL_CACHE_LOOKUPS.labels('hit_shared').inc()
+            return state, 'shared'
+    EVAL_CACHE_LOOKUPS.labels('miss').inc()
+    return None, None
+
+
+def store(key: str, state: str) -> None:
+    _local.set(key, state)
+    shared = _shared_cache()
+    if shared is not None:
+        shared.set(key, state, _config.get('SHARED_TTL', 86400))
+
+
+def bypass(reason: str) -> None:
+    EVAL_CACHE_LOOKUPS.labels(f'bypass_{reason}').inc()
+
+
+def clear() -> None:
+    """
+    Drops the local entries; shared entries expire with SHARED_TTL or on
+    the next prompt/model version.
+    """
+    _local.clear()
@@ -0,0 +1,337 @@
+"""
+Local fast path for the eval routine.
+
+Many patient replies ("yes", "not at all", "nearly every day", "what do you
+mean?") can be classified without a `gpt-4o` round trip. `predict()` tries
+exact rules first and then a small multinomial logistic regression over
+hashed character n-grams, trained on our own labelled history
+(`manage.py fastpath train`), and returns the state with a confidence.
+
+`CHAT_FASTPATH['MODE']`:
+- "off": the eval chain classifies every reply.
+- "shadow": predictions are made and compared with the eval chain's
+  answer (the `beacon_fastpath_predictions_total` metric and
+  `meta_data['eval']['fastpath']`), the chain's answer is used.
+- "enforce": predictions at or above `CHAT_FASTPATH['THRESHOLD']` for one of
+  `CHAT_FASTPATH['STATES']` are used and the eval chain is not called.
+
+Training labels come from the transition recorded in
+`user_marker['tr']` and, for "o" transitions, the state the dec routine
+handled (`ai_marker['chat_status']`), which tells DRIFT from AMBIGUOUS.
+"""
+
+import json
+import math
+import os
+import random
+import re
+import zlib
+from collections import Counter
+from dataclasses import asdict, dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from django.conf import settings
+
+from telemetry.metrics import FASTPATH_PREDICTIONS
+
+
+STATES = ("NORMAL_y", "NORMAL_n", "AMBIGUOUS", "DRIFT", "CLARIFY")
+
+N_BUCKETS = 1 << 18
+
+_PUNCT = re.compile(r"[^\w\s'?]+")
+_SPACES = re.compile(r"\s+")
+
+_YES = {
+    "yes", "yeah", "yea", "yep", "yup", "ya", "haan", "han", "sure", "definitely", "absolutely",
+    "of course", "yes i do", "yes i have", "yes i am", "i do", "i have", "always", "a lot",
+    "several days", "more than half the days", "most days", "nearly every day", "every day",
+    "everyday", "almost every day", "all the time",
+}
+_NO = {
+    "no", "nope", "nah", "not at all", "never", "not really", "no i don't", "no i haven't",
+    "no i am not", "no i'm not", "i don't", "i haven't", "not once", "none", "no never",
+}
+# "ok" and the like are left to the eval chain: they often acknowledge the question rather than answer it
+_AMBIGUOUS = {
+    "hmm", "hm", "hmmm", "umm", "um", "idk", "i don't know", "dont know", "don't know", "not sure",
+    "i'm not sure", "maybe",
+}
+_CLARIFY = re.compile(
+    r"^(what|sorry|pardon|huh)\??$"
+    r"|^what do you mean\b"
+    r"|^i don't understand\b"
+    r"|^(can|could) you (repeat|rephrase|explain)\b"
+    r"|^what does (that|it) mean\b"
+)
+
+_RULE_CONFIDENCE = {"NORMAL_y": 0.97, "NORMAL_n": 0.97, "CLARIFY": 0.95, "AMBIGUOUS": 0.9}
+
+
+def _config(name: str, default: Any = None) -> Any:
+    return getattr(settings, 'CHAT_FASTPATH', {}).get(name, default)
+
+
+def mode() -> str:
+    return _config('MODE', 'off')
+
+
+@dataclass
+class Prediction:
+    state: str
+    confidence: float
+    source: str  # "rules" or "model"
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {**asdict(self), 'confidence': round(self.confidence, 4)}
+
+
+def normalize(text: str) -> str:
+    text = _PUNCT.sub(" ", (text or "").lower().replace("’", "'"))
+    return _SPACES.sub(" ", text).strip()
+
+
+def rules(text: str) -> Optional[Prediction]:
+    """
+    Whole-reply matches only: "yes" is answered, "yes but ..." and "yes?"
+    are not.
+    """
+    norm = normalize(text)
+    bare = norm.rstrip("? ")
+    if _CLARIFY.search(norm):
+        state = "CLARIFY"
+    elif norm.endswith("?"):
+        return None
+    elif bare in _YES:
+        state = "NORMAL_y"
+    elif bare in _NO:
+        state = "NORMAL_n"
+    elif bare in _AMBIGUOUS or not bare:
+        state = "AMBIGUOUS"
+    else:
+        return None
+    return Prediction(state, _RULE_CONFIDENCE[state], "rules")
+
+
+def features(text: str) -> Dict[int, float]:
+    """
+    L2-normalized counts of hashed character 2-4 grams and word uni/bigrams.
+    """
+    norm = normalize(text)
+    padded = f" {norm} "
+    grams = Counter()
+    for n in (2, 3, 4):
+        for i in range(len(padded) - n + 1):
+            grams[f"c{padded[i:i + n]}"] += 1
+    words = norm.split()
+    for i, word in enumerate(words):
+        grams[f"w{word}"] += 1
+        if i:
+            grams[f"b{words[i - 1]} {word}"] += 1
+    grams[f"len{min(len(words), 10)}"] += 1
+
+    vector: Dict[int, float] = {}
+    for gram, count in grams.items():
+        index = zlib.crc32(gram.encode()) % N_BUCKETS
+        vector[index] = vector.get(index, 0.0) + count
+    norm2 = math.sqrt(sum(v * v for v in vector.values())) or 1.0
+    return {index: value / norm2 for index, value in vector.items()}
+
+
+def _softmax(scores: Dict[str, float]) -> Dict[str, float]:
+    top = max(scores.values())
+    exp = {label: math.exp(score - top) for label, score in scores.items()}
+    total = sum(exp.values())
+    return {label: value / total for label, value in exp.items()}
+
+
+class LinearModel:
+    """
+    Multinomial logistic regression over sparse hashed features, trained
+    with SGD. Stored as JSON with only the non-zero weights.
+    """
+
+    def __init__(self, classes: Iterable[str], weights: Dict[str, Dict[int, float]] = None,
+                 bias: Dict[str, float] = None, info: Dict[str, Any] = None):
+        self.classes = list(classes)
+        self.weights = weights or {label: {} for label in self.classes}
+        self.bias = bias or {label: 0.0 for label in self.classes}
+        self.info = info or {}
+
+    def probabilities(self, vector: Dict[int, float]) -> Dict[str, float]:
+        return _softmax({
+            label: self.bias[label] + sum(self.weights[label].get(i, 0.0) * v for i, v in vector.items())
+            for label in self.classes
+        })
+
+    def predict(self, text: str) -> Prediction:
+        probabilities = self.probabilities(features(text))
+        state = max(probabilities, key=probabilities.get)
+        return Prediction(state, probabilities[state], "model")
+
+    @classmethod
+    def train(cls, samples: List[Tuple[str, str]], epochs: int = 15, learning_rate: float = 0.5,
+              l2: float = 1e-5, seed: int = 0) -> "LinearModel":
+        classes = sorted({label for _, label in samples})
+        model = cls(classes)
+        data = [(features(text), label) for text, label in samples]
+        rng = random.Random(seed)
+        step = 0
+        for epoch in range(epochs):
+            rng.shuffle(data)
+            for vector, label in data:
+                step += 1
+                rate = learning_rate / (1 + step * 1e-4)
+                probabilities = model.probabilities(vector)
+                for cls_label in classes:
+                    gradient = probabilities[cls_label] - (1.0 if cls_label == label else 0.0)
+                    if abs(gradient) < 1e-6:
+                        continue
+                    weights = model.weights[cls_label]
+                    for index, value in vector.items():
+                        w = weights.get(index, 0.0)
+                        weights[index] = w - rate * (gradient * value + l2 * w)
+                    model.bias[cls_label] -= rate * gradient
+        for label in classes:
+            model.weights[label] = {i: w for i, w in model.weights[label].items() if abs(w) > 1e-4}
+        return model
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'classes': self.classes,
+            'buckets': N_BUCKETS,
+            'bias': self.bias,
+            'weights': {label: {str(i): round(w, 5) for i, w in weights.items()} for label, weights in self.weights.items()},
+            'info': self.info,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "LinearModel":
+        if data.get('buckets') != N_BUCKETS:
+            raise ValueError("Fast path model was trained with different features; retrain it")
+        weights = {label: {int(i): w for i, w in weights.items()} for label, weights in data['weights'].items()}
+        return cls(data['classes'], weights, data['bias'], data.get('info'))
+
+    def save(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.info.setdefault('trained_at', datetime.now(timezone.utc).isoformat())
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, separators=(',', ':'))
+
+
+class _ModelCache:
+    model: Optional[LinearModel] = None
+    path: Optional[str] = None
+    mtime: float = 0.0
+
+    @classmethod
+    def get(cls) -> Optional[LinearModel]:
+        path = _config('MODEL_PATH')
+        try:
+            mtime = os.stat(path).st_mtime
+        except (OSError, TypeError):
+            return None
+        if path != cls.path or mtime != cls.mtime:
+            with open(path) as f:
+                cls.model = LinearModel.from_dict(json.load(f))
+            cls.path, cls.mtime = path, mtime
+        return cls.model
+
+
+def predict(text: str) -> Optional[Prediction]:
+    """
+    Fast path prediction for a patient reply, or None when neither the rules
+    nor a trained model apply.
+    """
+    return predict_with(_ModelCache.get(), text)
+
+
+def predict_with(model: Optional[LinearModel], text: str) -> Optional[Prediction]:
+    prediction = rules(text)
+    if prediction is not None:
+        return prediction
+    return model.predict(text) if model is not None else None
+
+
+def is_confident(prediction: Optional[Prediction]) -> bool:
+    return (
+        prediction is not None
+        and prediction.state in _config('STATES', STATES)
+        and prediction.confidence >= _config('THRESHOLD', 0.9)
+    )
+
+
+def observe(prediction: Prediction, llm_state: Optional[str]) -> None:
+    """
+    Counts a prediction: against the eval chain's state in shadow mode, as
+    answered when it replaced the chain.
+    """
+    if llm_state is None:
+        outcome = 'answered'
+    else:
+        outcome = 'agree' if prediction.state == llm_state else 'disagree'
+    FASTPATH_PREDICTIONS.labels(
+        mode(), prediction.source, str(is_confident(prediction)).lower(), outcome,
+    ).inc()
+
+
+def label(user_marker: Dict[str, Any], ai_marker: Dict[str, Any]) -> Optional[str]:
+    """
+    Eval state of a stored reply, from its markers, or None when unknown.
+    """
+    tr = (user_marker or {}).get('tr')
+    status = (ai_marker or {}).get('chat_status')
+    if tr == 'y':
+        return 'NORMAL_y'
+    if tr == 'n':
+        return 'NORMAL_n'
+    if tr == 'c':
+        return 'CLARIFY'
+    if tr == 'o' and status in ('DRIFT', 'AMBIGUOUS'):
+        return status
+    return None
+
+
+def to_tr(state: str) -> str:
+    """
+    Transition (`user_marker['tr']`) an eval state leads to.
+    """
+    return {'NORMAL_y': 'y', 'NORMAL_n': 'n', 'CLARIFY': 'c'}.get(state, 'o')
+
+
+def evaluated_history(limit: Optional[int] = None) -> Iterator[Tuple[str, Dict[str, Any], Dict[str, Any], Dict[str, Any]]]:
+    """
+    (reply, user_marker, ai_marker, meta_data) of the evaluated replies,
+    newest first.
+    """
+    from ..models import ChatMessage
+
+    qs = (
+        ChatMessage.objects
+        .filter(user_marker__has_key='tr')
+        .exclude(user_response__isnull=True)
+        .order_by('-timestamp')
+        .values_list('user_response', 'user_marker', 'ai_marker', 'meta_data')
+    )
+    if limit:
+        qs = qs[:limit]
+    return qs.iterator(chunk_size=2000)
+
+
+def labelled_history(limit: Optional[int] = None) -> List[Tuple[str, str]]:
+    """
+    (reply, state) training pairs from the replies the eval chain
+    classified; replies answered by the fast path itself or in degraded
+    mode are left out.
+    """
+    samples = []
+    for text, user_marker, ai_marker, meta in evaluated_history(limit):
+        eval_meta = (meta or {}).get('eval') or {}
+        if eval_meta.get('fastpath', {}).get('used') or eval_meta.get('degraded'):
+            continue
+        state = label(user_marker, ai_marker)
+        if state is not None and text.strip():
+            samples.append((text, state))
+    return samples
@@ -0,0 +1,287 @@
+"""
+Semantic cache of dec responses for CLARIFY turns.
+
+For a given question node patients ask the same few clarifications ("what
+does little interest mean?", "what is fidgety?"), and the dec chains answer
+them alike. On a miss the patient is answered from the full conversation
+history, and the response cached is a second generation without it (from
+the question and the message only), so that it carries nothing of one
+patient to another. Responses are kept per (version, phase, node_id,
+state), the version hashing the dec chain's model and prompt (see
+`version`), with a local embedding of the patient message (the hashed
+character n-gram vector of `fastpath.features`). A later message whose
+nearest neighbour is at least `DEC_SEMANTIC_CACHE['THRESHOLD']`
+cosine-similar is answered from the cache, after a personalization pass
+instead of a full generation:
+
+- locally (default), by picking a stored variant of the response that
+  differs from the last AI message of the session, in microseconds;
+- with `PERSONALIZE_MODEL` set (ex. "gpt-4o-mini"), by a short rewrite
+  prompt (`dec.personalize`, no conversation history) of that variant
+  for the exact message.
+
+N-gram similarity cannot tell "not feeling safe" from "feeling safe", or
+"drinking" from "thinking", so a neighbour is only a hit when both
+messages are negated alike and each of their words has a close spelling
+(typos, plurals) in the other.
+
+Each node keeps at most `CAPACITY` entries (least recently used evicted),
+at most `MAX_NODES` nodes are kept (same), entries expire after `TTL`
+seconds and each entry keeps up to `MAX_VARIANTS` responses. The index is
+process-local; a brute force scan of one node is fast enough at these
+sizes.
+"""
+
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+from difflib import SequenceMatcher
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+from django.conf import settings
+
+from telemetry.metrics import SEMANTIC_CACHE_LOOKUPS
+
+from .. import prompts
+from ..outputs import OutputError, parse_dec
+from .fastpath import features, normalize
+
+
+_config = getattr(settings, 'DEC_SEMANTIC_CACHE', {})
+
+
+@dataclass
+class Entry:
+    message: str
+    vector: Dict[int, float]
+    words: Tuple[str, ...] = ()
+    responses: List[str] = field(default_factory=list)
+    expires_at: float = 0.0
+    hits: int = 0
+
+
+@dataclass
+class Hit:
+    response: str
+    similarity: float
+    message: str
+
+
+# phrasing shared by most clarification requests; left out so that the subject decides similarity
+_FILLER = frozenset(
+    "what whats does do did is are the a an of by you mean means meaning can could please explain "
+    "tell me i understand word term that this it sorry".split()
+)
+# "i don't understand ..." asks for a clarification, it does not negate the subject
+_NOT_UNDERSTOOD = re.compile(r"\b(do not|dont|don t) (understand|get|know)\b")
+_NEGATIONS = frozenset(
+    "not no never dont doesnt didnt cant cannot couldnt wont wouldnt isnt arent wasnt werent "
+    "havent hasnt hadnt nothing none nor neither nobody nowhere without".split()
+)
+# spelling similarity (difflib ratio) for two words to match
+_WORD_MATCH = 0.8
+
+
+def _words(message: str) -> Tuple[str, ...]:
+    """
+    Words of a message other than the filler, or all of them when nothing else is left.
+    """
+    norm = _NOT_UNDERSTOOD.sub("understand", normalize(message).replace("?", "").replace("'", ""))
+    words = norm.split()
+    return tuple([word for word in words if word not in _FILLER] or words)
+
+
+def _negated(words: Tuple[str, ...]) -> bool:
+    return any(word in _NEGATIONS for word in words)
+
+
+def _covered(words: Tuple[str, ...], others: Tuple[str, ...]) -> bool:
+    return all(
+        any(word == other or SequenceMatcher(None, word, other).ratio() >= _WORD_MATCH for other in others)
+        for word in words
+    )
+
+
+def matches(a: Tuple[str, ...], b: Tuple[str, ...]) -> bool:
+    """
+    Whether two messages' words can mean the same: negated alike, and every word of each has a
+    close spelling in the other.
+    """
+    return _negated(a) == _negated(b) and _covered(a, b) and _covered(b, a)
+
+
+def embed(message: str) -> Dict[int, float]:
+    """
+    Local embedding of a message: the n-gram vector of its words other
+    than the filler, or of all its words when nothing else is left.
+    """
+    return features(" ".join(_words(message)))
+
+
+def similarity(a: Dict[int, float], b: Dict[int, float]) -> float:
+    """
+    Cosine similarity of two L2-normalized sparse vectors.
+    """
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(value * b.get(index, 0.0) for index, value in a.items())
+
+
+class SemanticCache:
+    """
+    Thread-safe nearest-neighbour index of responses per (phase, node_id,
+    state).
+
+    Example usage:
+    ```
+    cache = SemanticCache(threshold=0.8)
+    cache.add(("phq9", "1", "CLARIFY"), "what does little interest mean", response)
+    hit = cache.nearest(("phq9", "1", "CLARIFY"), "what is little interest?")
+    ```
+    """
+
+    def __init__(self, threshold: float = 0.8, capacity: int = 50, max_nodes: int = 1000,
+                 ttl: float = 7 * 86400, max_variants: int = 3):
+        self.threshold = threshold
+        self.capacity = capacity
+        self.max_nodes = max_nodes
+        self.ttl = ttl
+        self.max_variants = max_variants
+        self._nodes: "OrderedDict[Tuple, OrderedDict[str, Entry]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _best(self, node: Tuple, vector: Dict[int, float],
+              words: Tuple[str, ...]) -> Tuple[Optional[Entry], float]:
+        entries = self._nodes.get(node)
+        if not entries:
+            return None, 0.0
+        now = time.monotonic()
+        best, best_score = None, 0.0
+        for key, entry in list(entries.items()):
+            if entry.expires_at < now:
+                del entries[key]
+                continue
+            score = similarity(vector, entry.vector)
+            if score > best_score and score >= self.threshold and matches(words, entry.words):
+                best, best_score = entry, score
+        return best, best_score
+
+    def nearest(self, node: Tuple, message: str, avoid: Optional[str] = None) -> Optional[Hit]:
+        """
+        Response cached for the nearest message at or above the threshold,
+        preferring a variant other than `avoid`, or None.
+        """
+        vector, words = embed(message), _words(message)
+        with self._lock:
+            entry, score = self._best(node, vector, words)
+            if entry is None:
+                return None
+            variants = [response for response in entry.responses if response != avoid]
+            if not variants:
+                return None
+            entry.hits += 1
+            self._nodes[node].move_to_end(entry.message)
+            self._nodes.move_to_end(node)
+            # rotate through the variants across hits
+            return Hit(variants[entry.hits % len(variants)], score, entry.message)
+
+    def add(self, node: Tuple, message: str, response: str) -> None:
+        """
+        Stores a generated response, as a variant of the nearest entry when
+        one is within the threshold.
+        """
+        norm = normalize(message)
+        vector, words = embed(message), _words(message)
+        with self._lock:
+            entry, _ = self._best(node, vector, words)
+            if entry is None:
+                entries = self._nodes.setdefault(node, OrderedDict())
+                entry = entries.get(norm) or Entry(norm, vector, words)
+                entries[norm] = entry
+                while len(entries) > self.capacity:
+                    entries.popitem(last=False)
+            if response not in entry.responses:
+                entry.responses.append(response)
+                del entry.responses[:-self.max_variants]
+            entry.expires_at = time.monotonic() + self.ttl
+            self._nodes.move_to_end(node)
+            while len(self._nodes) > self.max_nodes:
+                self._nodes.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._nodes.clear()
+
+    def __len__(self) -> int:
+        return sum(len(entries) for entries in self._nodes.values())
+
+
+cache = SemanticCache(
+    threshold=_config.get('THRESHOLD', 0.8),
+    capacity=_config.get('CAPACITY', 50),
+    max_nodes=_config.get('MAX_NODES', 1000),
+    ttl=_config.get('TTL', 7 * 86400),
+    max_variants=_config.get('MAX_VARIANTS', 3),
+)
+_personalize_chain = None
+_versions: Dict[str, Tuple[Any, str]] = {}
+
+
+def version(state: str) -> str:
+    """
+    Hash of the dec.{state} prompt and model; entries of other versions are
+    never read. Changes when the chain is rebuilt with another model.
+    """
+    from ..chains import ChainStore, model_label
+
+    chain = getattr(ChainStore, f"dec_{state.lower()}_chain")
+    cached = _versions.get(state)
+    if cached is None or cached[0] is not chain:
+        prompt = getattr(prompts.dec, state.lower())
+        cached = _versions[state] = (chain, hashlib.sha1(f"{model_label(chain.last)}\n{prompt}".encode()).hexdigest()[:10])
+    return cached[1]
+
+
+def applies(state: str, message: str) -> bool:
+    return (
+        _config.get('ENABLED', False)
+        and state in _config.get('STATES', ())
+        and len(normalize(message)) <= _config.get('MAX_CHARS', 120)
+    )
+
+
+def lookup(phase: str, node_id: str, state: str, message: str, last_msg: Optional[str]) -> Optional[Hit]:
+    hit = cache.nearest((version(state), phase, str(node_id), state), message, avoid=last_msg)
+    SEMANTIC_CACHE_LOOKUPS.labels(state, 'hit' if hit else 'miss').inc()
+    return hit
+
+
+def store(phase: str, node_id: str, state: str, message: str, response: str) -> None:
+    if response:
+        cache.add((version(state), phase, str(node_id), state), message, response)
+
+
+def personalize(hit: Hit, inputs: Dict[str, Any], invoke) -> Tuple[str, Dict[str, Any]]:
+    """
+    Adapts a cached response to the patient's message. `invoke(chain,
+    input)` runs a chain with the pipeline's telemetry. Returns the
+    response and the LLM response metadata (empty when done locally).
+    """
+    model = _config.get('PERSONALIZE_MODEL')
+    if not model:
+        return hit.response, {}
+
+    global _personalize_chain
+    if _personalize_chain is None:
+        from ..chains import ChainBuilder
+        _personalize_chain = ChainBuilder().with_model(model).with_prompt("dec.personalize").build()
+
+    llm_response = invoke(_personalize_chain, {**inputs, "cached": hit.response})
+    try:
+        response, _ = parse_dec(llm_response.content)
+    except OutputError:
+        response = hit.response
+    return response, llm_response.response_metadata
@@ -1,19 +1,33 @@
 import json
+import logging
+import time
 
+from django.conf import settings
 from django.db import transaction
 from django.db.models import Q
 from django.utils import timezone
 
 from assessments import definitions
 from assessments.definitions import PhaseMap, BaseAssessmentPhase
+from assessments.keywords import normalize_keywords, record_keyword_stats
 from assessments.models import Assessment, AssessmentRecord, AssessmentResult
+from telemetry.context import track_llm
+from telemetry.metrics import CHAT_DEGRADED_TURNS, CHAT_STAGE_SECONDS, LLM_OUTPUTS, observe_llm, stage as metrics_stage
+from telemetry.tracing import current_trace_id, langchain_config, span, traced
 
+from .. import policy
+from ..breaker import breaker, is_outage
 from ..chains import ChainStore
+from ..outputs import OutputError, parse_dec, parse_eval, parse_score
 from ..models import ChatMessage, ChatSession, Conversation
+from . import degraded, evalcache, fastpath, semcache
 from .constants import ChatStates
 from .conversation import ConversationManager, HistoryManager
+from .usage import UsageLedger
 
 
+logger = logging.getLogger(__name__)
+
 class SessionPipeline:
 
     def __init__(self, conversation: Conversation, chat_session: ChatSession = None):
@@ -27,9 +41,95 @@ class SessionPipeline:
         self.curr_phase = PhaseMap.get(self.session.phase)
         self.curr_node = self.curr_phase.get(self.session.node_id)
         self.chat_status = ChatStates.NORMAL
+        self.usage = UsageLedger(session_id=self.session.id, patient_id=self.patient.id)
+        # deterministic turns without LLM calls while the provider is unavailable (see degraded)
+        self.degraded = False
+        self.options = None
 
-    @transaction.atomic
+    def _invoke(self, stage: str, chain, input: dict, name: str = None, retry: int = 0):
+        """
+        Invokes a chain of the given pipeline stage (eval, dec or score), timing the LLM call
+        and adding it to the usage ledger under `name` (default the stage)
+        """
+        config = langchain_config()
+        if retry:
+            config["metadata"] = {"llm_retry": retry}
+        with track_llm(), metrics_stage(stage), span(f"llm.{stage}", stage=stage):
+            started = time.perf_counter()
+            try:
+                response = policy.invoke(stage, chain, input, config=config)
+            except Exception as e:
+                breaker.failure(e)
+                observe_llm(stage, error=True)
+                self.usage.add(stage, name or stage, self.curr_phase.name, seconds=time.perf_counter() - started,
+                               error=True, model=getattr(getattr(chain, "last", None), "model_name", None))
+                raise
+        seconds = time.perf_counter() - started
+        breaker.success()
+        observe_llm(stage, response, seconds=seconds)
+        self.usage.add(stage, name or stage, self.curr_phase.name, response, seconds=seconds)
+        return response
+
+    def _invoke_parsed(self, stage: str, chain, input: dict, parse, name: str = None):
+        """
+        Invokes a chain and validates its output with `parse` (see chat.outputs), calling it
+        again up to LLM_OUTPUT['RETRIES'] times when the output cannot be repaired.
+        Returns the LLM response and the parsed value
+        """
+        retries = settings.LLM_OUTPUT.get("RETRIES", 1)
+        for attempt in range(retries + 1):
+            response = self._invoke(stage, chain, input, name, retry=attempt)
+            try:
+                value, repaired = parse(response.content)
+            except OutputError:
+                LLM_OUTPUTS.labels(stage, "failed" if attempt == retries else "retried").inc()
+                if attempt == retries:
+                    raise
+                continue
+            LLM_OUTPUTS.labels(stage, "repaired" if repaired else "valid").inc()
+            return response, value
+
+    @traced("chat.trigger_pipeline")
     def trigger_pipeline(self, user_msg: str) -> str:
+        # the turn's LLM calls share one budget, so that retries cannot outlast the worker timeout
+        with metrics_stage("turn"), policy.turn_budget():
+            try:
+                self.degraded = not breaker.allow()
+                if self.degraded:
+                    CHAT_DEGRADED_TURNS.labels("open").inc()
+                try:
+                    response = self._run_atomic(user_msg)
+                except Exception as e:
+                    if self.degraded or not is_outage(e):
+                        raise
+                    # the provider failed mid-turn: the turn is rolled back and answered without it
+                    logger.warning("LLM unavailable in session %s, answering in degraded mode: %r", self.session.id, e)
+                    CHAT_DEGRADED_TURNS.labels("failure").inc()
+                    self._reload()
+                    self.degraded = True
+                    response = self._run_atomic(user_msg)
+            finally:
+                # outside the turn's transaction: calls of failed turns are billed too
+                self.usage.flush()
+        return response
+
+    def _run_atomic(self, user_msg: str) -> str:
+        with transaction.atomic():
+            response = self._run_turn(user_msg)
+            commit_start = time.perf_counter()
+        CHAT_STAGE_SECONDS.labels("commit").observe(time.perf_counter() - commit_start)
+        return response
+
+    def _reload(self) -> None:
+        """
+        Restores the session state of a rolled back turn
+        """
+        self.session.refresh_from_db()
+        self.curr_phase = PhaseMap.get(self.session.phase)
+        self.curr_node = self.curr_phase.get(self.session.node_id)
+        self.chat_status = ChatStates.NORMAL
+
+    def _run_turn(self, user_msg: str) -> str:
         user_msg_f = ConversationManager.format_msg(user_msg)
         user_msg_timestamp = timezone.now()
 
@@ -48,8 +148,10 @@ class SessionPipeline:
             chat_session=self.session,
             user_response_timestamp=user_msg_timestamp,
             user_marker=user_marker,
-            meta_data=meta
+            meta_data=meta,
+            trace_id=current_trace_id(),
         )
+        self.usage.message_id = msg.id
 
         if self.session.init:
 
@@ -68,6 +170,7 @@ class SessionPipeline:
         return response
 
 
+    @traced("chat.run_eval_routine")
     def run_eval_routine(self, msg: ChatMessage, user_msg: str) -> str:
         """
         Method to run the evaluation routine
@@ -75,33 +178,73 @@ class SessionPipeline:
 
         user_msg = user_msg.strip()
 
-        # invoke eval chain
-        eval_response = ChainStore.eval_chain.invoke(
-            input={
-                "message": user_msg,
-                "phase": self.curr_phase.verbose_name,
-                "question_original": self.curr_node.text,
-                "question": self.session.last_msg,
-                "conversation": self.history_manager.get_full_list_from_session(),
-            }
-        )
+        # local classifier; in enforce mode a confident prediction replaces the eval chain
+        prediction = fastpath.predict(msg.user_response) if fastpath.mode() != "off" and not self.degraded else None
+        use_fastpath = fastpath.mode() == "enforce" and fastpath.is_confident(prediction)
 
-        eval_meta = eval_response.response_metadata
-        meta = {
-            "eval": {
-                "meta": eval_meta,
+        # cached classification of the same short reply to the same question
+        cache_key = cached_state = None
+        if evalcache.enabled and not use_fastpath and not self.degraded:
+            reason = evalcache.bypass_reason(msg.user_response, self.session.retries, self.session.clarifying)
+            if reason:
+                evalcache.bypass(reason)
+            else:
+                cache_key = evalcache.make_key(
+                    self.curr_phase.name, self.curr_node.node_id, msg.user_response, self.session.last_msg)
+                cached_state, tier = evalcache.lookup(cache_key)
+
+        if self.degraded:
+            state = degraded.classify(self.curr_phase, self.curr_node, msg.user_response)
+            meta = {"eval": {"meta": {}, "degraded": True}}
+            if state == degraded.SKIP:
+                # skipped by the patient: exhaust the node's retries
+                self.session.retries = self.curr_node.r
+                state = "AMBIGUOUS"
+        elif use_fastpath:
+            state = prediction.state
+            meta = {"eval": {"meta": {}}}
+            fastpath.observe(prediction, None)
+        elif cached_state is not None:
+            state = cached_state
+            meta = {"eval": {"meta": {}, "cache": tier}}
+            if prediction is not None:
+                fastpath.observe(prediction, state)
+        else:
+            with metrics_stage("history"):
+                conversation = self.history_manager.get_full_list_from_session()
+
+            # invoke eval chain
+            try:
+                eval_response, state = self._invoke_parsed(
+                    "eval", ChainStore.eval_chain, {
+                        "message": user_msg,
+                        "phase": self.curr_phase.verbose_name,
+                        "question_original": self.curr_node.text,
+                        "question": self.session.last_msg,
+                        "conversation": conversation,
+                    }, parse_eval
+                )
+            except OutputError:
+                # no usable classification: go with the fast path, or ask the patient to elaborate
+                eval_response = None
+                state = prediction.state if prediction is not None else "AMBIGUOUS"
+
+            meta = {
+                "eval": {
+                    "meta": eval_response.response_metadata if eval_response is not None else {},
+                }
             }
-        }
 
-        state = json.loads(eval_response.content)["response"]
+            if eval_response is None:
+                meta["eval"]["fallback"] = state
+            else:
+                if prediction is not None:
+                    fastpath.observe(prediction, state)
+                if cache_key is not None:
+                    evalcache.store(cache_key, state)
 
-        assert state in [
-            "NORMAL_y", 
-            "NORMAL_n", 
-            "DRIFT", 
-            "AMBIGUOUS", 
-            "CLARIFY"
-        ], f"Invalid state: {state} returned by eval chain"
+        if prediction is not None:
+            meta["eval"]["fastpath"] = {**prediction.as_dict(), "used": use_fastpath}
 
         if state in ["NORMAL_y", "NORMAL_n"]: 
             
@@ -110,7 +253,8 @@ class SessionPipeline:
 
             # reset retries set by earlier states
             self.session.retries = 0
-            self.session.save(update_fields=["retries"])
+            self.session.clarifying = False
+            self.session.save(update_fields=["retries", "clarifying"])
 
         else: 
             if state in ["DRIFT", "AMBIGUOUS"]:
@@ -120,7 +264,8 @@ class SessionPipeline:
 
                 # increment retries
                 self.session.retries += 1
-                self.session.save(update_fields=["retries"])
+                self.session.clarifying = False
+                self.session.save(update_fields=["retries", "clarifying"])
 
             else:
                 self.chat_status = ChatStates.CLARIFY
@@ -129,7 +274,8 @@ class SessionPipeline:
 
                 # reset retries set by earlier states
                 self.session.retries = 0
-                self.session.save(update_fields=["retries"])
+                self.session.clarifying = True
+                self.session.save(update_fields=["retries", "clarifying"])
 
         user_marker = {
             "phase": self.curr_phase.name,
@@ -155,7 +301,11 @@ class SessionPipeline:
 
             # SCORING HAPPENS HERE ///////////////////////////////////////
             if self.curr_phase.supports_scoring:
-                self.run_score_routine(self.curr_phase)
+                with metrics_stage("scoring"):
+                    if self.degraded:
+                        self.defer_scoring(self.curr_phase)
+                    else:
+                        self.run_score_routine(self.curr_phase)
 
             # check for next phase
             next_phase = PhaseMap.next(self.session.phase)
@@ -194,35 +344,86 @@ class SessionPipeline:
         return msg
 
 
+    def fill_semcache(self, msg: ChatMessage, chat_state: str, chain, input: dict) -> None:
+        """
+        Caches a response for other patients, generated from the question and message only:
+        the patient's own response drew on their conversation history
+        """
+        try:
+            _, response = self._invoke_parsed(
+                "dec", chain, {**input, "conversation": []}, parse_dec, name=f"dec.{chat_state.lower()}.cache")
+        except Exception as e:
+            logger.warning("Semantic cache not filled in session %s: %r", self.session.id, e)
+            return
+        semcache.store(self.curr_phase.name, self.curr_node.node_id, chat_state, msg.user_response, response)
+
+    @traced("chat.run_dec_routine")
     def run_dec_routine(self, msg: ChatMessage, user_msg: str, chat_state: str) -> str:
         """
         Method to run the decision routine at a given chat_state
         """
 
-        # invoke dec.{state} chain
-        dec_response = getattr(ChainStore, f"dec_{chat_state.lower()}_chain").invoke(
-            input={
+        # repeated clarification messages on a node are answered from the semantic cache
+        hit = None
+        use_semcache = not self.degraded and semcache.applies(chat_state, msg.user_response or "")
+        if use_semcache:
+            hit = semcache.lookup(
+                self.curr_phase.name, self.curr_node.node_id, chat_state, msg.user_response, self.session.last_msg)
+
+        if self.degraded:
+            response = degraded.respond(self.curr_phase, self.curr_node, chat_state)
+            meta = {
+                "dec": {
+                    "type": chat_state.lower(),
+                    "meta": {},
+                    "degraded": True,
+                }
+            }
+        elif hit is not None:
+            response, dec_meta = semcache.personalize(hit, {
+                "message": msg.user_response,
+                "phase": self.curr_phase.verbose_name,
+                "question": self.curr_node.text,
+            }, invoke=lambda chain, input: self._invoke("dec", chain, input, name="dec.personalize"))
+            meta = {
+                "dec": {
+                    "type": chat_state.lower(),
+                    "meta": dec_meta,
+                    "cache": {"similarity": round(hit.similarity, 4), "message": hit.message},
+                }
+            }
+        else:
+            with metrics_stage("history"):
+                conversation = self.history_manager.get_full_list()
+
+            # invoke dec.{state} chain
+            dec_chain = getattr(ChainStore, f"dec_{chat_state.lower()}_chain")
+            dec_input = {
                 "message": user_msg.strip(),
                 "phase": self.curr_phase.verbose_name,
                 "question": self.curr_node.text,
-                "conversation": self.history_manager.get_full_list(),
             }
-        )
+            dec_response, response = self._invoke_parsed(
+                "dec", dec_chain, {**dec_input, "conversation": conversation}, parse_dec, name=f"dec.{chat_state.lower()}"
+            )
 
-        response = json.loads(dec_response.content).get("response", "")
-        dec_meta = dec_response.response_metadata
-        meta = {
-            "dec": {
-                "type": chat_state.lower(),
-                "meta": dec_meta,
+            dec_meta = dec_response.response_metadata
+            meta = {
+                "dec": {
+                    "type": chat_state.lower(),
+                    "meta": dec_meta,
+                }
             }
-        }
+            if use_semcache:
+                self.fill_semcache(msg, chat_state, dec_chain, dec_input)
         ai_marker = {
             "phase": self.curr_phase.name,
             "question": self.curr_node.text,
             "node_id": self.curr_node.node_id,
             "chat_status": chat_state,
         }
+        if self.degraded and chat_state != ChatStates.CONCLUDE:
+            self.options = ai_marker["options"] = degraded.options(self.curr_phase)
 
         # save message
         msg.ai_response = response
@@ -248,23 +449,39 @@ class SessionPipeline:
 
         return response
     
-    def run_score_routine(self, phase: BaseAssessmentPhase) -> None:
+    def defer_scoring(self, phase: BaseAssessmentPhase) -> Assessment:
         """
-        Method to run the scoring routine
+        Marks a phase completed in degraded mode for scoring once the LLM is available again
+        (`manage.py rescore`)
         """
-        
-        qs = self.history_manager.filter_by(
-            Q(chat_session_id=self.session.id),
-            Q(ai_marker__phase=phase.name) | Q(user_marker__phase=phase.name)
+        return Assessment.objects.create(
+            patient=self.patient,
+            session=self.session,
+            type=phase.name,
+            needs_scoring=True,
         )
 
+    @traced("chat.run_score_routine")
+    def run_score_routine(self, phase: BaseAssessmentPhase, assessment: Assessment = None) -> None:
+        """
+        Method to run the scoring routine, completing `assessment` when given (deferred scoring)
+        """
+        
+        with metrics_stage("history"):
+            qs = self.history_manager.filter_by(
+                Q(chat_session_id=self.session.id),
+                Q(ai_marker__phase=phase.name) | Q(user_marker__phase=phase.name)
+            )
+            conversation_json = json.dumps(self.history_manager.qs_to_dict(qs))
+
         # invoke the score chain
-        score_response = ChainStore.score_chain.invoke(
-            input={
+        q_data = phase.get_questions_dict()
+        score_response, data = self._invoke_parsed(
+            "score", ChainStore.score_chain, {
                 "phase": phase.verbose_name,
-                "questions_json": json.dumps(phase.get_questions_dict()),
-                "conversation_json": json.dumps(self.history_manager.qs_to_dict(qs)),
-            }
+                "questions_json": json.dumps(q_data),
+                "conversation_json": conversation_json,
+            }, lambda content: parse_score(content, q_data)
         )
         
         score_meta = score_response.response_metadata
@@ -273,25 +490,26 @@ class SessionPipeline:
                 "meta": score_meta,
             }
         }
-        data = json.loads(score_response.content)["response"]
 
         # save assessment records
-        assessment = Assessment.objects.create(
-            patient=self.patient,
-            session=self.session,
-            type=phase.name,
-        )
-        q_data = phase.get_questions_dict()
-        for qid, record in data.items():
-            AssessmentRecord.objects.create(
+        if assessment is None:
+            assessment = Assessment.objects.create(
+                patient=self.patient,
+                session=self.session,
+                type=phase.name,
+            )
+        records = AssessmentRecord.objects.bulk_create([
+            AssessmentRecord(
                 assessment=assessment,
                 question_id=qid,
                 question_text=q_data[qid]["text"],
                 score=record["score"],
                 remark=record["remark"],
                 snippet=record["snippet"],
-                keywords=record["keywords"],
+                keywords=normalize_keywords(record["keywords"]),
             )
+            for qid, record in data.items()
+        ])
 
         # save assessment result
         score = phase.total_score(data)
@@ -303,7 +521,11 @@ class SessionPipeline:
         )
         assessment.status = "completed"
         assessment.completed_at = timezone.now()
-        assessment.save(update_fields=["status", "completed_at"])
+        assessment.needs_scoring = False
+        assessment.save(update_fields=["status", "completed_at", "needs_scoring"])
+
+        # keep the keyword analytics counters up to date
+        record_keyword_stats(phase, records, timezone.localdate(assessment.completed_at))
         return
 
 
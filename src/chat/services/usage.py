@@ -0,0 +1,287 @@
+"""
+LLM usage ledger.
+
+`UsageLedger` collects one `LLMUsage` row per LLM call of a chat turn
+(stage, chain, model, prompt/completion/cached tokens, latency and cost
+from `LLM_PRICES`) and writes them when the turn ends, outside of the
+turn's transaction so that calls of failed turns are accounted for too.
+The same write adds the turn's calls to the `LLMUsageDaily` aggregates,
+in one upsert incrementing the counters in place.
+
+`rollup()` recomputes the aggregates of whole days from the ledger
+(backfills, repairs). `report()` answers the usual questions (cost per
+stage, model, phase, session or patient, and per completed assessment)
+from the ledger and the rollups.
+"""
+
+import logging
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from typing import Any, Dict, List, Optional
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, Max, Q, Sum
+from django.utils import timezone
+
+from telemetry.metrics import cached_tokens
+
+from ..models import LLMUsage, LLMUsageDaily
+
+
+logger = logging.getLogger(__name__)
+
+_MILLION = Decimal(1_000_000)
+
+
+def price(model: str) -> Optional[Dict[str, float]]:
+    """
+    Prices (USD per million tokens) of a model, matched by the longest
+    configured name prefix ("gpt-4o-2024-08-06" uses "gpt-4o").
+    """
+    prices = getattr(settings, 'LLM_PRICES', {})
+    matches = [name for name in prices if model.startswith(name)]
+    return prices[max(matches, key=len)] if matches else None
+
+
+def cost(model: str, prompt_tokens: int, completion_tokens: int, cached: int = 0) -> Decimal:
+    prices = price(model)
+    if prices is None:
+        return Decimal(0)
+    cached = min(cached, prompt_tokens)
+    total = (
+        Decimal(prompt_tokens - cached) * Decimal(str(prices['prompt']))
+        + Decimal(cached) * Decimal(str(prices.get('cached', prices['prompt'])))
+        + Decimal(completion_tokens) * Decimal(str(prices['completion']))
+    )
+    return (total / _MILLION).quantize(Decimal('0.000001'))
+
+
+class UsageLedger:
+    """
+    LLM calls of one chat turn, written together by `flush()`.
+    """
+
+    def __init__(self, session_id: Optional[str] = None, patient_id: Optional[str] = None):
+        self.session_id = session_id
+        self.patient_id = patient_id
+        self.message_id = None
+        self.entries: List[LLMUsage] = []
+
+    def add(self, stage: str, chain: str, phase: Optional[str], response: Any = None,
+            seconds: float = 0.0, error: bool = False, model: Optional[str] = None) -> None:
+        meta = getattr(response, 'response_metadata', None) or {}
+        usage = meta.get('token_usage') or {}
+        model = meta.get('model_name') or model or 'unknown'
+        prompt_tokens = usage.get('prompt_tokens') or 0
+        completion_tokens = usage.get('completion_tokens') or 0
+        cached = cached_tokens(meta)
+        self.entries.append(LLMUsage(
+            timestamp=timezone.now(),
+            session_id=self.session_id,
+            patient_id=self.patient_id,
+            phase=phase,
+            stage=stage,
+            chain=chain,
+            model=model,
+            outcome='error' if error else 'ok',
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            cached_tokens=cached,
+            latency_ms=int(seconds * 1000),
+            cost=cost(model, prompt_tokens, completion_tokens, cached),
+        ))
+
+    def flush(self) -> None:
+        if not self.entries:
+            return
+        for entry in self.entries:
+            entry.message_id = self.message_id
+        try:
+            with transaction.atomic():
+                # before the entries are written: a session counts once per day and group
+                _add_daily(self.session_id, self.entries)
+                LLMUsage.objects.bulk_create(self.entries)
+        except Exception:
+            # accounting must never fail a chat turn
+            logger.exception("Could not write %d LLM usage entries", len(self.entries))
+        self.entries = []
+
+
+_COUNTERS = ('calls', 'errors', 'sessions', 'prompt_tokens', 'completion_tokens', 'cached_tokens',
+             'latency_ms', 'cost')
+
+
+def _add_daily(session_id: Optional[str], entries: List[LLMUsage]) -> None:
+    """
+    Adds the calls of one session to their `LLMUsageDaily` rows.
+    """
+    groups: Dict[tuple, list] = {}
+    for entry in entries:
+        key = (timezone.localdate(entry.timestamp), entry.stage, entry.chain, entry.model, entry.phase or '')
+        totals = groups.setdefault(key, [0, 0, 0, 0, 0, 0, Decimal(0)])
+        totals[0] += 1
+        totals[1] += entry.outcome == 'error'
+        totals[2] += entry.prompt_tokens
+        totals[3] += entry.completion_tokens
+        totals[4] += entry.cached_tokens
+        totals[5] += entry.latency_ms
+        totals[6] += entry.cost
+
+    ops = connection.ops
+    daily = ops.quote_name(LLMUsageDaily._meta.db_table)
+    ledger = ops.quote_name(LLMUsage._meta.db_table)
+    # bulk_create(update_conflicts=True) can only overwrite the counters, not add to them
+    new_session = (
+        f"CASE WHEN %s IS NULL OR EXISTS (SELECT 1 FROM {ledger} WHERE session_id = %s "
+        f"AND timestamp >= %s AND timestamp < %s AND stage = %s AND chain = %s AND model = %s "
+        f"AND COALESCE(phase, '') = %s) THEN 0 ELSE 1 END"
+    )
+    rows, params = [], []
+    for (day, stage, chain, model, phase), (calls, errors, *tokens, cost_) in groups.items():
+        start, end = (ops.adapt_datetimefield_value(bound) for bound in _day_bounds(day))
+        rows.append(f"(%s, %s, %s, %s, %s, %s, %s, {new_session}, %s, %s, %s, %s, %s)")
+        params += [ops.adapt_datefield_value(day), stage, chain, model, phase, calls, errors,
+                   session_id, session_id, start, end, stage, chain, model, phase,
+                   *tokens, ops.adapt_decimalfield_value(cost_, 14, 6)]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {daily} (date, stage, chain, model, phase, {', '.join(_COUNTERS)}) "
+            f"VALUES {', '.join(rows)} ON CONFLICT (date, stage, chain, model, phase) DO UPDATE SET "
+            + ", ".join(f"{name} = {daily}.{name} + EXCLUDED.{name}" for name in _COUNTERS),
+            params,
+        )
+
+
+def _day_bounds(day: date):
+    start = timezone.make_aware(datetime.combine(day, time.min))
+    return start, start + timedelta(days=1)
+
+
+def rollup_day(day: date) -> int:
+    """
+    Recomputes the rollup rows of one (local) day. Returns the number of
+    rows written. Rows are overwritten in place, so that turns flushed
+    meanwhile never conflict with them.
+    """
+    start, end = _day_bounds(day)
+    groups = (
+        LLMUsage.objects.filter(timestamp__gte=start, timestamp__lt=end)
+        .values('stage', 'chain', 'model', 'phase')
+        .annotate(
+            n_calls=Count('id'),
+            n_errors=Count('id', filter=Q(outcome='error')),
+            n_sessions=Count('session_id', distinct=True),
+            n_prompt=Sum('prompt_tokens'),
+            n_completion=Sum('completion_tokens'),
+            n_cached=Sum('cached_tokens'),
+            n_latency=Sum('latency_ms'),
+            total_cost=Sum('cost'),
+        )
+        .order_by()
+    )
+    rows = [
+        LLMUsageDaily(
+            date=day, stage=group['stage'], chain=group['chain'], model=group['model'],
+            phase=group['phase'] or '', calls=group['n_calls'], errors=group['n_errors'],
+            sessions=group['n_sessions'], prompt_tokens=group['n_prompt'] or 0,
+            completion_tokens=group['n_completion'] or 0, cached_tokens=group['n_cached'] or 0,
+            latency_ms=group['n_latency'] or 0, cost=group['total_cost'] or 0,
+        )
+        for group in groups
+    ]
+    fields = ['date', 'stage', 'chain', 'model', 'phase']
+    groups = {(row.stage, row.chain, row.model, row.phase) for row in rows}
+    with transaction.atomic():
+        LLMUsageDaily.objects.bulk_create(
+            rows, update_conflicts=True, unique_fields=fields, update_fields=list(_COUNTERS),
+        )
+        stale = [
+            row.id for row in LLMUsageDaily.objects.filter(date=day).only(*fields)
+            if (row.stage, row.chain, row.model, row.phase) not in groups
+        ]
+        LLMUsageDaily.objects.filter(id__in=stale).delete()
+    return len(rows)
+
+
+def rollup(since: Optional[date] = None) -> List[date]:
+    """
+    Recomputes the rollups from `since` (default: the last rolled up day,
+    or the first ledger day) to today. Returns the days recomputed.
+    """
+    today = timezone.localdate()
+    if since is None:
+        since = LLMUsageDaily.objects.aggregate(last=Max('date'))['last']
+    if since is None:
+        first = LLMUsage.objects.order_by('timestamp').values_list('timestamp', flat=True).first()
+        if first is None:
+            return []
+        since = timezone.localdate(first)
+    days = [since + timedelta(days=i) for i in range((today - since).days + 1)]
+    for day in days:
+        rollup_day(day)
+    return days
+
+
+_TOTALS = dict(
+    calls=Sum('calls'), errors=Sum('errors'), prompt_tokens=Sum('prompt_tokens'),
+    completion_tokens=Sum('completion_tokens'), cached_tokens=Sum('cached_tokens'),
+    latency_ms=Sum('latency_ms'), cost=Sum('cost'),
+)
+
+
+def report(start: date, end: date, top: int = 10) -> Dict[str, Any]:
+    """
+    Usage between two local days (inclusive): totals per day, stage, chain,
+    model and phase from the rollups; cost per completed assessment by
+    phase; the most expensive sessions and patients from the ledger.
+    """
+    from assessments.models import Assessment
+
+    daily = LLMUsageDaily.objects.filter(date__gte=start, date__lte=end)
+    by = {
+        key: list(daily.values(key).annotate(**_TOTALS).order_by('-cost'))
+        for key in ('stage', 'chain', 'model', 'phase')
+    }
+    days = list(daily.values('date').annotate(**_TOTALS).order_by('date'))
+    totals = daily.aggregate(**_TOTALS)
+
+    start_ts, _ = _day_bounds(start)
+    _, end_ts = _day_bounds(end)
+    completed = dict(
+        Assessment.objects.filter(status='completed', completed_at__gte=start_ts, completed_at__lt=end_ts)
+        .values_list('type').annotate(n=Count('id')).order_by()
+    )
+    for row in by['phase']:
+        n = completed.get(row['phase'], 0)
+        row['assessments'] = n
+        row['tokens_per_assessment'] = (row['prompt_tokens'] + row['completion_tokens']) // n if n else None
+        row['cost_per_assessment'] = row['cost'] / n if n else None
+
+    ledger = LLMUsage.objects.filter(timestamp__gte=start_ts, timestamp__lt=end_ts)
+    sessions = list(
+        ledger.exclude(session_id=None).values('session_id', 'patient_id')
+        .annotate(calls=Count('id'), tokens=Sum('prompt_tokens') + Sum('completion_tokens'), cost=Sum('cost'))
+        .order_by('-cost')[:top]
+    )
+    patients = list(
+        ledger.exclude(patient_id=None).values('patient_id')
+        .annotate(calls=Count('id'), sessions=Count('session_id', distinct=True),
+                  tokens=Sum('prompt_tokens') + Sum('completion_tokens'), cost=Sum('cost'))
+        .order_by('-cost')[:top]
+    )
+    n_sessions = ledger.exclude(session_id=None).values('session_id').distinct().count()
+    return {
+        'start': start,
+        'end': end,
+        'totals': totals,
+        'sessions': n_sessions,
+        'cost_per_session': (totals['cost'] / n_sessions) if n_sessions and totals['cost'] is not None else None,
+        'days': days,
+        'by_stage': by['stage'],
+        'by_chain': by['chain'],
+        'by_model': by['model'],
+        'by_phase': by['phase'],
+        'top_sessions': sessions,
+        'top_patients': patients,
+    }
@@ -0,0 +1,319 @@
+"""
+Local stand-ins for the chat models, for tests, benchmarks and load runs.
+
+`FakeChatModel` answers the eval, dec and score prompts locally with
+schema-valid JSON, after a configurable (seeded, log-normal) latency and
+with OpenAI-shaped `response_metadata` (model name, token usage, finish
+reason), so the pipeline and its telemetry run unchanged without the
+provider. Timeouts, rate limits and server errors can be injected as the
+`openai` exceptions `ChatOpenAI` would raise, and malformed JSON outputs
+(`MALFORMED_RATE`) as models without structured outputs produce them. Cached prompt tokens are
+reported like the provider's automatic prefix caching would (prefixes of at
+least 1024 tokens seen in the last minutes, in 128 token steps).
+
+`ReplayChatModel` records the responses of a real model into fixture files
+(`record` mode) and plays them back (`replay` mode), keyed by a hash of the
+model and the prompt with timestamps and message ids blanked out.
+
+Both are selected with `LLM_STANDIN['MODEL']` ("fake" or "replay"), which
+makes `chains.Models.get()` hand out the stand-in for every chain.
+"""
+
+import hashlib
+import json
+import random
+import re
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+import httpx
+import openai
+from django.conf import settings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+from beaconmind.caching import TTLLRUCache
+
+
+# "19 oct 2026 3:04pm", as formatted by ConversationManager / HistoryManager
+_TIMESTAMP = re.compile(r"\d{1,2} [a-z]{3} \d{4} \d{1,2}:\d{2}[ap]m")
+# message ids keying the score prompt's conversation_json
+_MESSAGE_ID = re.compile(r'"\d+": \{"human"')
+
+_EVAL_STATES = {"NORMAL_y": 0.45, "NORMAL_n": 0.4, "AMBIGUOUS": 0.05, "DRIFT": 0.05, "CLARIFY": 0.05}
+
+_ERRORS = ("timeout", "rate_limit", "server")
+
+# ways a model's JSON output goes wrong, for `malformed_rate`
+_MALFORMATIONS = (
+    lambda content: f"```json\n{content}\n```",
+    lambda content: f"Here is the JSON output:\n{content}",
+    lambda content: content[:-1] + ",}",
+    lambda content: content[:int(len(content) * 0.8)],
+    lambda content: content.replace('"', "'"),
+    lambda content: "",
+)
+
+# provider prompt prefix caching: prompts of at least 1024 tokens, cached in 128 token steps
+_PREFIX_MIN_CHARS = 1024 * 4
+_PREFIX_STEP_CHARS = 128 * 4
+_prefixes = TTLLRUCache(maxsize=100_000, ttl=600)
+
+
+def _config(name: str, default: Any = None) -> Any:
+    return getattr(settings, 'LLM_STANDIN', {}).get(name, default)
+
+
+def _text(messages: List[BaseMessage]) -> str:
+    return "\n".join(f"{message.type}: {message.content}" for message in messages)
+
+
+def _n_tokens(text: str) -> int:
+    # ~4 characters per token for English text
+    return max(1, len(text) // 4)
+
+
+def prompt_stage(text: str) -> str:
+    """
+    Pipeline stage (eval, dec or score) a formatted prompt belongs to.
+    """
+    if "questions_json=" in text:
+        return "score"
+    if "NORMAL_y" in text and "CLARIFY" in text:
+        return "eval"
+    return "dec"
+
+
+def _questions(text: str) -> Dict[str, Any]:
+    start = text.index("questions_json=") + len("questions_json=")
+    questions, _ = json.JSONDecoder().raw_decode(text[start:].lstrip())
+    return questions
+
+
+def _cached_chars(model: str, text: str) -> int:
+    """
+    Length of the longest prefix of `text` seen in an earlier prompt to
+    `model`, in the provider's cache steps (0 below the minimum length).
+    Records the prefixes of `text`.
+    """
+    digest = hashlib.sha256(model.encode())
+    cached = 0
+    for end in range(_PREFIX_STEP_CHARS, len(text) + 1, _PREFIX_STEP_CHARS):
+        digest.update(text[end - _PREFIX_STEP_CHARS:end].encode())
+        if end < _PREFIX_MIN_CHARS:
+            continue
+        key = digest.copy().hexdigest()
+        if _prefixes.get(key):
+            cached = end
+        else:
+            _prefixes.set(key, True)
+    return cached
+
+
+def _openai_error(kind: str, model: str) -> Exception:
+    request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+    if kind == "timeout":
+        return openai.APITimeoutError(request=request)
+    status, error = (429, openai.RateLimitError) if kind == "rate_limit" else (500, openai.InternalServerError)
+    response = httpx.Response(status, request=request)
+    return error(f"Injected {kind} error ({model} stand-in)", response=response, body=None)
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Deterministic local chat model returning schema-valid answers to the
+    pipeline prompts. Answers, latencies and injected errors are drawn from
+    a generator seeded with `seed` and the prompt, so a given conversation
+    replays identically; latency, errors and malformed outputs also depend on
+    the request's number within its call (`llm_request` run metadata) and the
+    call's output retry (`llm_retry`), so that retried and hedged requests
+    come out differently.
+    """
+
+    model_name: str = "fake"
+    seed: int = 0
+    latency_median: float = 0.0  # seconds
+    latency_sigma: float = 0.5  # log-normal shape
+    latency_max: float = 30.0
+    error_rates: Dict[str, float] = {}  # "timeout", "rate_limit", "server" -> probability
+    eval_states: Dict[str, float] = _EVAL_STATES
+    completion_tokens: Optional[int] = None  # reported instead of the estimate
+    malformed_rate: float = 0.0  # probability of a malformed output, unless a response_format is given
+    prefix_cache: bool = True  # report cached prompt tokens like the provider's prefix caching
+    sleep: Callable[[float], None] = time.sleep
+
+    @classmethod
+    def from_settings(cls, target: Optional[str] = None, **kwargs) -> "FakeChatModel":
+        latency = _config("LATENCY", {})
+        return cls(
+            model_name=target or "fake",
+            seed=_config("SEED", 0),
+            latency_median=latency.get("MEDIAN", 0.0),
+            latency_sigma=latency.get("SIGMA", 0.5),
+            latency_max=latency.get("MAX", 30.0),
+            error_rates=_config("ERRORS", {}),
+            eval_states=_config("EVAL_STATES", _EVAL_STATES),
+            completion_tokens=_config("COMPLETION_TOKENS"),
+            malformed_rate=_config("MALFORMED_RATE", 0.0),
+        )
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-openai"
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return {"model_name": self.model_name, "seed": self.seed}
+
+    def _rng(self, text: str) -> random.Random:
+        digest = hashlib.sha256(f"{self.seed}:{text}".encode()).digest()
+        return random.Random(int.from_bytes(digest[:8], "big"))
+
+    def latency(self, rng: random.Random) -> float:
+        if self.latency_median <= 0:
+            return 0.0
+        return min(rng.lognormvariate(0, self.latency_sigma) * self.latency_median, self.latency_max)
+
+    def answer(self, stage: str, text: str, rng: random.Random) -> Any:
+        if stage == "eval":
+            states, weights = zip(*self.eval_states.items())
+            return rng.choices(states, weights)[0]
+        if stage == "score":
+            answer = {}
+            for qid, question in _questions(text).items():
+                low, high = question.get("score_range") or (0, 3)
+                answer[qid] = {
+                    "score": rng.randint(low, high),
+                    "remark": f"Stand-in remark for question {qid}.",
+                    "snippet": "stand-in snippet",
+                    "keywords": rng.sample(["sleep", "tired", "low mood", "appetite", "focus", "worry"], 2),
+                }
+            return answer
+        return f"Stand-in reply #{rng.randrange(10 ** 6)}. How have you been feeling lately?"
+
+    def _generate(self, messages: List[BaseMessage], stop=None, run_manager=None, **kwargs) -> ChatResult:
+        text = _text(messages)
+        rng = self._rng(text)
+        stage = prompt_stage(text)
+
+        metadata = run_manager.metadata if run_manager else {}
+        call_rng = self._rng(f"{metadata.get('llm_retry', 0)}:{metadata.get('llm_request', 0)}:{text}")
+
+        delay = self.latency(call_rng)
+        draw = call_rng.random()
+        for kind in _ERRORS:
+            rate = self.error_rates.get(kind, 0.0)
+            if draw < rate:
+                self.sleep(delay if kind != "timeout" else self.latency_max)
+                raise _openai_error(kind, self.model_name)
+            draw -= rate
+        self.sleep(delay)
+
+        content = json.dumps({"response": self.answer(stage, text, rng)})
+        # structured outputs always follow the schema
+        if "response_format" not in kwargs and call_rng.random() < self.malformed_rate:
+            content = call_rng.choice(_MALFORMATIONS)(content)
+        prompt_tokens = _n_tokens(text)
+        completion_tokens = self.completion_tokens or _n_tokens(content)
+        cached_tokens = min(_cached_chars(self.model_name, text) // 4, prompt_tokens) if self.prefix_cache else 0
+        metadata = {
+            "token_usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+                "prompt_tokens_details": {"cached_tokens": cached_tokens},
+            },
+            "model_name": self.model_name,
+            "system_fingerprint": "fake",
+            "finish_reason": "stop",
+            "logprobs": None,
+        }
+        message = AIMessage(content=content, response_metadata=metadata)
+        return ChatResult(generations=[ChatGeneration(message=message)], llm_output=metadata)
+
+
+class ReplayMiss(LookupError):
+    pass
+
+
+class ReplayChatModel(BaseChatModel):
+    """
+    Records the responses of a real model into `fixtures_dir` (`mode`
+    "record") or answers from them ("replay"). A replay without a matching
+    fixture raises `ReplayMiss`, or is answered by `fallback` when set.
+    """
+
+    model_name: str
+    fixtures_dir: Path
+    mode: str = "replay"
+    upstream: Optional[Callable[[], BaseChatModel]] = None  # real model factory, used in record mode
+    fallback: Optional[BaseChatModel] = None
+    replay_latency: bool = False
+    sleep: Callable[[float], None] = time.sleep
+
+    @classmethod
+    def from_settings(cls, target: str, upstream: Callable[[], BaseChatModel], **kwargs) -> "ReplayChatModel":
+        return cls(
+            model_name=target,
+            fixtures_dir=Path(_config("FIXTURES_DIR")),
+            mode=_config("REPLAY_MODE", "replay"),
+            upstream=upstream,
+            fallback=FakeChatModel.from_settings(target) if _config("ON_MISS") == "fake" else None,
+            replay_latency=_config("REPLAY_LATENCY", False),
+        )
+
+    @property
+    def _llm_type(self) -> str:
+        return "replay-openai"
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return {"model_name": self.model_name, "mode": self.mode}
+
+    def key(self, messages: List[BaseMessage]) -> str:
+        text = _MESSAGE_ID.sub('"_": {"human"', _TIMESTAMP.sub("<ts>", _text(messages)))
+        return hashlib.sha256(f"{self.model_name}\n{text}".encode()).hexdigest()[:32]
+
+    def _path(self, key: str) -> Path:
+        return self.fixtures_dir / f"{key}.json"
+
+    def _generate(self, messages: List[BaseMessage], stop=None, run_manager=None, **kwargs) -> ChatResult:
+        key = self.key(messages)
+        if self.mode == "record":
+            return self._record(key, messages, stop=stop, **kwargs)
+
+        path = self._path(key)
+        if not path.exists():
+            if self.fallback is not None:
+                return self.fallback._generate(messages, stop=stop, **kwargs)
+            raise ReplayMiss(f"No {self.model_name} fixture {key} in {self.fixtures_dir}")
+        with open(path) as f:
+            fixture = json.load(f)
+        if self.replay_latency:
+            self.sleep(fixture.get("latency", 0.0))
+        message = AIMessage(content=fixture["content"], response_metadata=fixture["response_metadata"])
+        return ChatResult(generations=[ChatGeneration(message=message)], llm_output=fixture["response_metadata"])
+
+    def _record(self, key: str, messages: List[BaseMessage], **kwargs) -> ChatResult:
+        started = time.perf_counter()
+        response = self.upstream().invoke(messages, **kwargs)
+        latency = time.perf_counter() - started
+
+        self.fixtures_dir.mkdir(parents=True, exist_ok=True)
+        fixture = {
+            "key": key,
+            "model": self.model_name,
+            "stage": prompt_stage(_text(messages)),
+            "recorded_at": datetime.now(timezone.utc).isoformat(),
+            "latency": round(latency, 3),
+            "messages": [{"type": m.type, "content": m.content} for m in messages],
+            "content": response.content,
+            "response_metadata": response.response_metadata,
+        }
+        with open(self._path(key), "w") as f:
+            json.dump(fixture, f, indent=2)
+        return ChatResult(generations=[ChatGeneration(message=response)],
+                          llm_output=response.response_metadata)
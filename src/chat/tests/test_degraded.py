@@ -0,0 +1,173 @@
+import time
+from io import StringIO
+from types import SimpleNamespace
+from unittest import mock
+
+import httpx
+import openai
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase
+
+from accounts.models import User
+from assessments.definitions import MonitoringPhase, PhaseMap
+from assessments.models import Assessment
+from chat import breaker as breaker_module
+from chat.breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+from chat.models import ChatSession, Conversation
+from chat.services import degraded
+from chat.services.constants import ChatStates
+from chat.services.session import SessionPipeline
+
+
+def connection_error():
+    return openai.APIConnectionError(request=httpx.Request("POST", "https://llm.test/v1/chat/completions"))
+
+
+class DegradedClassifyTests(SimpleTestCase):
+
+    def test_every_option_of_every_phase(self):
+        for phase in PhaseMap.all():
+            node = next(iter(phase.questions.values()))
+            *labels, skip = degraded.options(phase)
+            self.assertEqual(skip, degraded.SKIP_OPTION)
+            self.assertEqual(degraded.classify(phase, node, skip), degraded.SKIP)
+            for index, label in enumerate(labels):
+                with self.subTest(phase=phase.name, option=label):
+                    expected = "NORMAL_n" if index == 0 else "NORMAL_y"
+                    self.assertEqual(degraded.classify(phase, node, label), expected)
+                    self.assertEqual(degraded.classify(phase, node, f" {label.upper()}! "), expected)
+
+    def test_yes_and_no(self):
+        for phase in PhaseMap.all():
+            if "Yes" not in degraded.options(phase):
+                continue
+            node = next(iter(phase.questions.values()))
+            with self.subTest(phase=phase.name):
+                self.assertEqual(degraded.classify(phase, node, "Yes"), "NORMAL_y")
+                self.assertEqual(degraded.classify(phase, node, "No"), "NORMAL_n")
+
+    def test_typed_replies(self):
+        phase = MonitoringPhase()
+        closed, open_ended = phase.get("2a"), phase.get("2b")
+        self.assertEqual(degraded.classify(phase, closed, "yes, I have"), "NORMAL_y")
+        self.assertEqual(degraded.classify(phase, closed, "what do you mean?"), "AMBIGUOUS")
+        self.assertEqual(degraded.classify(phase, open_ended, "headaches mostly"), "NORMAL_y")
+        self.assertEqual(degraded.classify(phase, open_ended, "what do you mean?"), "AMBIGUOUS")
+
+
+class DegradedRespondTests(SimpleTestCase):
+
+    def test_questions_are_patient_facing(self):
+        for phase in PhaseMap.all():
+            for node in phase.questions.values():
+                with self.subTest(phase=phase.name, node=node.node_id):
+                    self.assertNotIn("[", degraded.respond(phase, node, ChatStates.NORMAL))
+
+    def test_responses(self):
+        phase = MonitoringPhase()
+        node = phase.get("2a")
+        self.assertEqual(degraded.respond(phase, node, ChatStates.NORMAL), node.text)
+        self.assertTrue(degraded.respond(phase, node, ChatStates.CLARIFY).endswith(node.text))
+        self.assertNotIn(node.text, degraded.respond(phase, node, ChatStates.CONCLUDE))
+
+
+class CircuitBreakerTests(SimpleTestCase):
+
+    def setUp(self):
+        patcher = mock.patch.dict(breaker_module._config, {
+            "ENABLED": True, "WINDOW": 60.0, "MIN_CALLS": 4, "FAILURE_RATE": 0.5,
+            "OPEN_SECONDS": 0.05, "MAX_OPEN_SECONDS": 0.15,
+        })
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.breaker = CircuitBreaker()
+
+    def probe(self, error=None):
+        model = mock.Mock(spec=["invoke"])
+        if error is not None:
+            model.invoke.side_effect = error
+        chains = SimpleNamespace(eval_chain=SimpleNamespace(last=model))
+        with mock.patch("chat.chains.ChainStore", chains), self.assertLogs("chat.breaker", "WARNING"):
+            self.breaker._probe()
+
+    def open(self):
+        for _ in range(4):
+            self.breaker.failure(connection_error())
+
+    def test_opens_on_outages_only(self):
+        for _ in range(4):
+            self.breaker.failure(ValueError("invalid output"))
+        self.assertEqual(self.breaker.state, CLOSED)
+        self.breaker.success()
+        self.breaker.success()
+        self.breaker.failure(connection_error())
+        self.assertEqual(self.breaker.state, CLOSED)
+        with self.assertLogs("chat.breaker", "WARNING"):
+            self.breaker.failure(TimeoutError())
+        self.assertEqual(self.breaker.state, OPEN)
+        self.assertFalse(self.breaker.allow())
+
+    def test_half_open_probe_closes(self):
+        with self.assertLogs("chat.breaker", "WARNING"):
+            self.open()
+        time.sleep(0.06)
+        with mock.patch.object(self.breaker, "_probe") as probe, self.assertLogs("chat.breaker", "WARNING"):
+            self.assertFalse(self.breaker.allow())
+            self.assertFalse(self.breaker.allow())
+        self.assertEqual(self.breaker.state, HALF_OPEN)
+        self.assertTrue(self.breaker._probing)
+        probe.assert_called_once()
+        self.probe()
+        self.assertEqual(self.breaker.state, CLOSED)
+        self.assertTrue(self.breaker.allow())
+
+    def test_failed_probe_backs_off(self):
+        with self.assertLogs("chat.breaker", "WARNING"):
+            self.open()
+        for open_seconds in (0.1, 0.15, 0.15):
+            self.probe(connection_error())
+            self.assertEqual(self.breaker.state, OPEN)
+            self.assertEqual(self.breaker.open_seconds, open_seconds)
+            self.assertFalse(self.breaker._probing)
+
+
+class RescoreTests(TestCase):
+
+    def setUp(self):
+        user = User.objects.create_user(username="rescore", password="-", role="patient")
+        conversation = Conversation.objects.create(user=user)
+        session = ChatSession.objects.create(conversation=conversation, phase="monitoring", node_id="1")
+        for name in ("assessment.phq9", "assessment.gad7", "monitoring"):
+            Assessment.objects.create(patient=user.patient, session=session, type=name, needs_scoring=True)
+
+    def rescore(self, score):
+        out, err = StringIO(), StringIO()
+        with mock.patch.object(SessionPipeline, "run_score_routine", autospec=True, side_effect=score) as routine:
+            call_command("rescore", stdout=out, stderr=err)
+        return routine, out.getvalue(), err.getvalue()
+
+    @staticmethod
+    def complete(pipeline, phase, assessment):
+        Assessment.objects.filter(id=assessment.id).update(needs_scoring=False, status="completed")
+
+    def test_scores_the_deferred_assessments(self):
+        routine, out, _ = self.rescore(self.complete)
+        self.assertEqual([call.args[1].name for call in routine.call_args_list],
+                         ["assessment.phq9", "assessment.gad7", "monitoring"])
+        self.assertIn("Scored 3 of 3", out)
+        self.assertFalse(Assessment.objects.filter(needs_scoring=True).exists())
+
+    def test_stops_at_an_outage(self):
+        calls = []
+
+        def score(pipeline, phase, assessment):
+            calls.append(phase.name)
+            if len(calls) == 2:
+                raise connection_error()
+            self.complete(pipeline, phase, assessment)
+
+        _, out, err = self.rescore(score)
+        self.assertEqual(calls, ["assessment.phq9", "assessment.gad7"])
+        self.assertIn("LLM unavailable", err)
+        self.assertIn("Scored 1 of 3", out)
+        self.assertEqual(Assessment.objects.filter(needs_scoring=True).count(), 2)
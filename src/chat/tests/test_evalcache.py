@@ -0,0 +1,130 @@
+from types import SimpleNamespace
+from unittest import mock
+
+from django.conf import settings
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from accounts.models import User
+from chat import quota
+from chat.chains import ChainStore
+from chat.models import ChatMessage
+from chat.services import evalcache
+from chat.services.conversation import ConversationManager
+from chat.services.session import SessionPipeline
+
+
+def eval_chain(model_name):
+    return SimpleNamespace(last=SimpleNamespace(model_name=model_name))
+
+
+class BypassReasonTests(SimpleTestCase):
+
+    def test_short_reply_is_cacheable(self):
+        self.assertIsNone(evalcache.bypass_reason("No, not really.", retries=0))
+
+    def test_bypassed_replies(self):
+        self.assertEqual(evalcache.bypass_reason("no " * 20, retries=0), "long")
+        self.assertEqual(evalcache.bypass_reason("no", retries=1), "retry")
+        self.assertEqual(evalcache.bypass_reason("same as before", retries=0), "context")
+
+    def test_reply_to_a_clarification(self):
+        self.assertEqual(evalcache.bypass_reason("yes", retries=0, clarifying=True), "clarify")
+
+
+class MakeKeyTests(SimpleTestCase):
+
+    def setUp(self):
+        self.chains = SimpleNamespace(eval_chain=eval_chain("gpt-4o"))
+        for patcher in (mock.patch("chat.chains.ChainStore", self.chains), mock.patch.object(evalcache, "_version", None)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_key(self):
+        key = evalcache.make_key("assessment.phq9", "1", "No.", "How often ...?")
+        self.assertEqual(evalcache.make_key("assessment.phq9", "1", "  no ", "Something else"), key)
+        self.assertNotEqual(evalcache.make_key("assessment.phq9", "2", "no"), key)
+        self.assertNotEqual(evalcache.make_key("assessment.gad7", "1", "no"), key)
+        self.assertNotEqual(evalcache.make_key("assessment.phq9", "1", "yes"), key)
+
+    def test_last_message(self):
+        with mock.patch.dict(evalcache._config, {"KEY_LAST_MSG": True}):
+            key = evalcache.make_key("assessment.phq9", "1", "no", "How often ...?")
+            self.assertNotEqual(evalcache.make_key("assessment.phq9", "1", "no", "Something else"), key)
+
+    def test_version_changes_with_the_eval_chain(self):
+        version = evalcache.version()
+        key = evalcache.make_key("assessment.phq9", "1", "no")
+        # the same chain: the version is not recomputed
+        self.assertEqual(evalcache.version(), version)
+        self.chains.eval_chain = eval_chain("gpt-4o")
+        self.assertEqual(evalcache.version(), version)
+        self.chains.eval_chain = eval_chain("gpt-4o-mini")
+        self.assertNotEqual(evalcache.version(), version)
+        self.assertNotEqual(evalcache.make_key("assessment.phq9", "1", "no"), key)
+        with mock.patch("chat.prompts.eval", "another prompt"):
+            self.chains.eval_chain = eval_chain("gpt-4o")
+            self.assertNotEqual(evalcache.version(), version)
+
+
+class TiersTests(TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.dict(evalcache._config, {"SHARED_CACHE": "shared"})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        evalcache.clear()
+        self.addCleanup(evalcache.clear)
+
+    def test_lookup_and_store(self):
+        self.assertEqual(evalcache.lookup("eval:key"), (None, None))
+        evalcache.store("eval:key", "NORMAL_n")
+        self.assertEqual(evalcache.lookup("eval:key"), ("NORMAL_n", "local"))
+        # another worker
+        evalcache.clear()
+        self.assertEqual(evalcache.lookup("eval:key"), ("NORMAL_n", "shared"))
+        self.assertEqual(evalcache.lookup("eval:key"), ("NORMAL_n", "local"))
+
+
+@override_settings(
+    LLM_STANDIN={**settings.LLM_STANDIN, "MODEL": "fake", "LATENCY": {"MEDIAN": 0, "SIGMA": 0, "MAX": 0},
+                 "ERRORS": {}, "MALFORMED_RATE": 0},
+    CHAT_FASTPATH={**settings.CHAT_FASTPATH, "MODE": "off"},
+)
+class EvalRoutineTests(TestCase):
+
+    def setUp(self):
+        for patcher in (mock.patch.dict(ChainStore._chains, clear=True), mock.patch.dict(quota._config, {"ENABLED": False}),
+                        mock.patch.object(evalcache, "enabled", True)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        evalcache.clear()
+        self.addCleanup(evalcache.clear)
+
+    def turn(self, username, message):
+        """
+        Answers `message` to the first question of a new patient's session; returns the turn's
+        eval metadata and the number of eval chain calls.
+        """
+        user = User.objects.create_user(username, f"{username}@example.com", "secret", role="patient")
+        conversation, _ = ConversationManager.get_or_create_conversation(user)
+        session, _ = ConversationManager.get_or_create_chat_session(conversation)
+        SessionPipeline(conversation, session).trigger_pipeline("hello")
+        with mock.patch.object(SessionPipeline, "_invoke_parsed", autospec=True,
+                               side_effect=SessionPipeline._invoke_parsed) as invoke:
+            SessionPipeline(conversation, session).trigger_pipeline(message)
+        eval_calls = sum(1 for call in invoke.call_args_list if call.args[1] == "eval")
+        msg = ChatMessage.objects.filter(chat_session=session).order_by("-timestamp", "-id").first()
+        return msg.meta_data["eval"], eval_calls
+
+    def test_hit(self):
+        first, calls = self.turn("alice", "No.")
+        self.assertNotIn("cache", first)
+        self.assertEqual(calls, 1)
+        second, calls = self.turn("bob", "no")
+        self.assertEqual((second["cache"], calls), ("local", 0))
+
+    def test_contextual_reply_is_not_cached(self):
+        self.turn("alice", "same as before")
+        meta, calls = self.turn("bob", "same as before")
+        self.assertNotIn("cache", meta)
+        self.assertEqual(calls, 1)
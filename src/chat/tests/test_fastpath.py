@@ -0,0 +1,80 @@
+import tempfile
+from pathlib import Path
+
+from django.test import SimpleTestCase, override_settings
+
+from chat.services import fastpath
+
+
+class RulesTests(SimpleTestCase):
+
+    def state(self, text):
+        prediction = fastpath.rules(text)
+        return prediction and prediction.state
+
+    def test_whole_reply_matches(self):
+        for text, state in [("Yes", "NORMAL_y"), ("yeah!", "NORMAL_y"), ("Nearly every day.", "NORMAL_y"),
+                            ("Not at all", "NORMAL_n"), ("no, I don’t", "NORMAL_n"), ("hmm", "AMBIGUOUS"),
+                            ("  ", "AMBIGUOUS"), ("What?", "CLARIFY"), ("what do you mean by that", "CLARIFY"),
+                            ("Could you explain", "CLARIFY")]:
+            with self.subTest(text=text):
+                self.assertEqual(self.state(text), state)
+
+    def test_partial_replies_are_left_to_the_model(self):
+        for text in ["yes but only at night", "yes?", "no idea what to say", "I sleep badly", "ok", "Okay."]:
+            with self.subTest(text=text):
+                self.assertIsNone(fastpath.rules(text))
+
+    def test_markers(self):
+        self.assertEqual(fastpath.label({"tr": "y"}, {}), "NORMAL_y")
+        self.assertEqual(fastpath.label({"tr": "o"}, {"chat_status": "DRIFT"}), "DRIFT")
+        self.assertIsNone(fastpath.label({"tr": "o"}, {"chat_status": "NORMAL"}))
+        self.assertIsNone(fastpath.label({}, None))
+        for state in fastpath.STATES:
+            if state in ("NORMAL_y", "NORMAL_n", "CLARIFY"):
+                self.assertEqual(fastpath.label({"tr": fastpath.to_tr(state)}, {}), state)
+            else:
+                self.assertEqual(fastpath.to_tr(state), "o")
+
+
+class ModelTests(SimpleTestCase):
+
+    SAMPLES = [
+        ("I have been sleeping badly for weeks", "NORMAL_y"),
+        ("I feel tired most of the time", "NORMAL_y"),
+        ("it happens quite often to be honest", "NORMAL_y"),
+        ("I have not had that problem lately", "NORMAL_n"),
+        ("that has not happened to me", "NORMAL_n"),
+        ("I really do not feel that way", "NORMAL_n"),
+        ("what is the weather like today", "DRIFT"),
+        ("did you watch the match yesterday", "DRIFT"),
+        ("tell me a joke about cats", "DRIFT"),
+    ] * 3
+
+    def test_train_and_predict(self):
+        model = fastpath.LinearModel.train(self.SAMPLES)
+        self.assertEqual(model.predict("I have been feeling tired for weeks").state, "NORMAL_y")
+        self.assertEqual(model.predict("did you watch the weather today").state, "DRIFT")
+        prediction = fastpath.predict_with(model, "Not at all")
+        self.assertEqual((prediction.state, prediction.source), ("NORMAL_n", "rules"))
+
+    def test_saved_model_is_reloaded_when_changed(self):
+        model = fastpath.LinearModel.train(self.SAMPLES)
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / "fastpath.json"
+            model.save(path)
+            with override_settings(CHAT_FASTPATH={"MODEL_PATH": str(path)}):
+                loaded = fastpath._ModelCache.get()
+                self.assertEqual(loaded.classes, model.classes)
+                self.assertEqual(fastpath.predict("tell me a joke").state, model.predict("tell me a joke").state)
+            with override_settings(CHAT_FASTPATH={"MODEL_PATH": str(path.with_name("missing.json"))}):
+                self.assertIsNone(fastpath.predict("I sleep badly"))
+
+    def test_confidence_threshold(self):
+        prediction = fastpath.Prediction("NORMAL_y", 0.85, "model")
+        with override_settings(CHAT_FASTPATH={"THRESHOLD": 0.9}):
+            self.assertFalse(fastpath.is_confident(prediction))
+            self.assertTrue(fastpath.is_confident(fastpath.rules("yes")))
+        with override_settings(CHAT_FASTPATH={"THRESHOLD": 0.8, "STATES": ["NORMAL_n"]}):
+            self.assertFalse(fastpath.is_confident(prediction))
+        self.assertFalse(fastpath.is_confident(None))
@@ -0,0 +1,80 @@
+from django.test import SimpleTestCase
+
+from chat.outputs import OutputError, load, parse_dec, parse_eval, parse_score
+
+
+QUESTIONS = {
+    "1": {"question": "Little interest or pleasure in doing things", "score_range": [0, 3]},
+    "2": {"question": "Feeling down, depressed, or hopeless", "score_range": [0, 3]},
+}
+
+
+class LoadTests(SimpleTestCase):
+
+    def test_valid_json_is_not_repaired(self):
+        self.assertEqual(load('{"response": "Hi"}'), ({"response": "Hi"}, False))
+
+    def test_repairs(self):
+        for content in [
+            '```json\n{"response": "Hi"}\n```',
+            'Sure! Here it is: {"response": "Hi"} Let me know.',
+            '{"response": "Hi",}',
+            "{'response': 'Hi'}",
+            '{"response": "Hi',
+            '{“response”: “Hi”}',
+        ]:
+            with self.subTest(content=content):
+                self.assertEqual(load(content), ({"response": "Hi"}, True))
+
+    def test_python_literals_and_line_breaks(self):
+        self.assertEqual(load('{"ok": True, "none": None}'), ({"ok": True, "none": None}, True))
+        self.assertEqual(load('{"response": "line one\nline two"}'), ({"response": "line one\nline two"}, True))
+
+    def test_truncated_member_is_dropped(self):
+        self.assertEqual(load('{"a": 1, "b": {"c": [1, 2'), ({"a": 1, "b": {"c": [1, 2]}}, True))
+        self.assertEqual(load('{"a": 1, "b": tr'), ({"a": 1}, True))
+
+    def test_unrepairable(self):
+        for content in ["", "   ", None, "no json here"]:
+            with self.subTest(content=content), self.assertRaises(OutputError):
+                load(content)
+
+
+class ParseTests(SimpleTestCase):
+
+    def test_eval(self):
+        self.assertEqual(parse_eval('{"response": "NORMAL_y"}'), ("NORMAL_y", False))
+        self.assertEqual(parse_eval('{"response": "normal_n"}'), ("NORMAL_n", True))
+        self.assertEqual(parse_eval("The state is CLARIFY."), ("CLARIFY", True))
+        with self.assertRaises(OutputError):
+            parse_eval("Either DRIFT or AMBIGUOUS")
+        with self.assertRaises(OutputError):
+            parse_eval('{"response": "MAYBE"}')
+
+    def test_dec(self):
+        self.assertEqual(parse_dec('{"response": "How are you?"}'), ("How are you?", False))
+        self.assertEqual(parse_dec("How are you?"), ("How are you?", True))
+        self.assertEqual(parse_dec('{"response": "How are'), ("How are", True))
+        for content in ['{"response": ""}', '{"answer": "How are you?"}', '{"response": {"text": "Hi"}', ""]:
+            with self.subTest(content=content), self.assertRaises(OutputError):
+                parse_dec(content)
+
+    def test_score(self):
+        content = ('{"response": {"1": {"score": 2, "remark": "often", "snippet": "most days", '
+                   '"keywords": ["fatigue"]}, "2": {"score": 0}}}')
+        records, repaired = parse_score(content, QUESTIONS)
+        self.assertFalse(repaired)
+        self.assertEqual(records["1"], {"score": 2, "remark": "often", "snippet": "most days", "keywords": ["fatigue"]})
+        self.assertEqual(records["2"], {"score": 0, "remark": "", "snippet": "", "keywords": []})
+
+    def test_score_repairs(self):
+        records, repaired = parse_score('{"1": {"score": "2", "keywords": "fatigue, sleep"}, "2": {"score": 1}}',
+                                        QUESTIONS)
+        self.assertTrue(repaired)
+        self.assertEqual((records["1"]["score"], records["1"]["keywords"]), (2, ["fatigue", "sleep"]))
+
+    def test_score_errors(self):
+        for content in ['{"response": {"1": {"score": 2}}}', '{"response": {"1": {"score": 4}, "2": {"score": 0}}}',
+                        '{"response": {"1": {"score": "often"}, "2": {"score": 0}}}', '{"response": "2"}']:
+            with self.subTest(content=content), self.assertRaises(OutputError):
+                parse_score(content, QUESTIONS)
@@ -0,0 +1,118 @@
+import threading
+import time
+from types import SimpleNamespace
+from unittest import mock
+
+import httpx
+import openai
+from django.test import SimpleTestCase
+from langchain_core.messages import AIMessage
+
+from chat import policy
+
+
+def connection_error():
+    return openai.APIConnectionError(request=httpx.Request("POST", "https://llm.test/v1/chat/completions"))
+
+
+class ScriptedChain:
+    """
+    Answers its requests in turn with the (delay, content or exception) steps of `script`.
+    """
+
+    def __init__(self, model_name, *script):
+        self.last = SimpleNamespace(model_name=model_name)
+        self.script = list(script)
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def invoke(self, input, config=None):
+        with self._lock:
+            delay, outcome = self.script[min(self.calls, len(self.script) - 1)]
+            self.calls += 1
+        time.sleep(delay)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return AIMessage(content=outcome)
+
+
+class CallPolicyTests(SimpleTestCase):
+
+    def configure(self, **stage):
+        stage = {"DEADLINE": 2.0, "HEDGE": False, "MAX_ATTEMPTS": 3, "FALLBACK_AT": 0.0, "FALLBACKS": [], **stage}
+        patcher = mock.patch.dict(policy._config, {
+            "ENABLED": True, "BACKOFF_BASE": 0.01, "BACKOFF_MAX": 0.05, "MIN_SAMPLES": 1000,
+            "STAGES": {"test": stage},
+        })
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def run_call(self, chain):
+        started = time.monotonic()
+        response = policy.invoke("test", chain, {})
+        return response, time.monotonic() - started
+
+    def test_retries_retryable_errors(self):
+        self.configure()
+        chain = ScriptedChain("primary-model", (0, connection_error()), (0, connection_error()), (0, "ok"))
+        response, _ = self.run_call(chain)
+        self.assertEqual(response.content, "ok")
+        self.assertEqual(response.response_metadata["policy"]["requests"], ["primary", "retry", "retry"])
+
+    def test_other_errors_are_raised_at_once(self):
+        self.configure()
+        chain = ScriptedChain("primary-model", (0, ValueError("bad request")), (0, "ok"))
+        with self.assertRaises(ValueError):
+            self.run_call(chain)
+        self.assertEqual(chain.calls, 1)
+
+    def test_hedges_slow_requests(self):
+        self.configure(HEDGE=True, HEDGE_AFTER=0.1, HEDGE_MIN=0.05, HEDGE_MAX=1.0)
+        chain = ScriptedChain("primary-model", (1.0, "slow"), (0, "fast"))
+        response, seconds = self.run_call(chain)
+        self.assertEqual(response.content, "fast")
+        self.assertEqual(response.response_metadata["policy"]["kind"], "hedge")
+        self.assertLess(seconds, 0.5)
+
+    def test_falls_back_after_max_attempts(self):
+        self.configure(MAX_ATTEMPTS=2, FALLBACKS=["backup-model"])
+        chain = ScriptedChain("primary-model", (0, connection_error()))
+        backup = ScriptedChain("backup-model", (0, "backup"))
+        with mock.patch.object(policy, "_fallback", return_value=backup), self.assertLogs("chat.policy", "WARNING"):
+            response, _ = self.run_call(chain)
+        self.assertEqual(chain.calls, 2)
+        self.assertEqual(response.content, "backup")
+        self.assertEqual(response.response_metadata["policy"]["model"], "backup-model")
+
+    def test_races_a_fallback_near_the_deadline(self):
+        self.configure(DEADLINE=1.0, FALLBACK_AT=0.7, FALLBACKS=["backup-model"])
+        chain = ScriptedChain("primary-model", (2.0, "slow"))
+        backup = ScriptedChain("backup-model", (0, "backup"))
+        with mock.patch.object(policy, "_fallback", return_value=backup):
+            response, seconds = self.run_call(chain)
+        self.assertEqual(response.response_metadata["policy"]["kind"], "fallback")
+        self.assertGreaterEqual(seconds, 0.3)
+        self.assertLess(seconds, 0.8)
+
+    def test_deadline(self):
+        self.configure(DEADLINE=0.3)
+        with self.assertRaises(policy.LLMDeadlineExceeded):
+            self.run_call(ScriptedChain("primary-model", (2.0, "slow")))
+
+    def test_turn_budget_cuts_stage_deadlines(self):
+        self.configure(DEADLINE=10.0)
+        started = time.monotonic()
+        with policy.turn_budget(0.3):
+            with self.assertRaises(policy.LLMDeadlineExceeded):
+                self.run_call(ScriptedChain("primary-model", (2.0, "slow")))
+        self.assertLess(time.monotonic() - started, 1.0)
+
+    def test_spent_turn_budget_sends_nothing(self):
+        self.configure()
+        chain = ScriptedChain("primary-model", (0, "ok"))
+        with policy.turn_budget(0):
+            with self.assertRaises(policy.LLMDeadlineExceeded):
+                self.run_call(chain)
+        self.assertEqual(chain.calls, 0)
+        # the budget ends with its block
+        self.assertEqual(self.run_call(chain)[0].content, "ok")
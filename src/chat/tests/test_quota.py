@@ -0,0 +1,139 @@
+import threading
+import time
+from unittest import mock, skipUnless
+
+from django.db import connection
+from django.test import SimpleTestCase, TransactionTestCase
+
+from chat import quota
+
+
+class QuotaTestMixin:
+
+    settings = {
+        "HEADROOM": 1.0, "BURST_SECONDS": 1.0, "BACKEND": "local", "MAX_POLL": 0.05,
+        "PRIORITIES": {"eval": 1, "dec": 2, "score": 3},
+        "MODELS": {"test-model": {"RPM": 600, "TPM": 60000}},
+    }
+
+    def setUp(self):
+        patcher = mock.patch.dict(quota._config, self.settings)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.limits = quota.limits("test-model")
+
+
+class LimitsTests(QuotaTestMixin, SimpleTestCase):
+
+    def test_rates_and_capacities(self):
+        self.assertEqual((self.limits.request_rate, self.limits.token_rate), (10, 1000))
+        self.assertEqual((self.limits.request_capacity, self.limits.token_capacity), (10, 1000))
+        self.assertIsNone(quota.limits("unlimited-model"))
+        self.assertEqual(quota.limits("test-model", 0.25).request_rate, 2.5)
+
+    def test_wait(self):
+        self.assertEqual(self.limits.wait(1, 500, 500), 0)
+        self.assertAlmostEqual(self.limits.wait(0.5, 500, 500), 0.05)
+        self.assertAlmostEqual(self.limits.wait(1, 0, 500), 0.5)
+
+
+class LocalBackendTests(QuotaTestMixin, SimpleTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.backend = quota.LocalBackend()
+
+    def test_takes_until_empty_then_refills(self):
+        for _ in range(10):
+            self.assertEqual(self.backend.take("test-model", self.limits, 10), 0)
+        wait = self.backend.take("test-model", self.limits, 10)
+        self.assertGreater(wait, 0)
+        self.assertLessEqual(wait, 0.1)
+        time.sleep(wait + 0.01)
+        self.assertEqual(self.backend.take("test-model", self.limits, 10), 0)
+
+    def test_tokens(self):
+        # larger than the bucket: served once it is full
+        self.assertEqual(self.backend.take("test-model", self.limits, 5000), 0)
+        self.assertAlmostEqual(self.backend.take("test-model", self.limits, 500), 0.5, places=2)
+        self.backend.adjust("test-model", self.limits, -500)
+        self.assertEqual(self.backend.take("test-model", self.limits, 500), 0)
+
+    def test_drain(self):
+        self.backend.drain("test-model", self.limits, 2.0)
+        self.assertAlmostEqual(self.backend.take("test-model", self.limits, 10), 2.1, places=2)
+
+
+class SchedulerTests(QuotaTestMixin, SimpleTestCase):
+
+    settings = {**QuotaTestMixin.settings, "BURST_SECONDS": 0.1}
+
+    def setUp(self):
+        super().setUp()
+        self.scheduler = quota.Scheduler()
+        self.assertIsNone(self.scheduler.shared)
+
+    def test_unlimited_models_do_not_wait(self):
+        for _ in range(100):
+            self.scheduler.acquire("dec", "unlimited-model", 10000, time.monotonic())
+
+    def test_serves_by_priority(self):
+        self.scheduler.acquire("dec", "test-model", 10, time.monotonic() + 1)
+        served = []
+
+        def request(stage):
+            self.scheduler.acquire(stage, "test-model", 10, time.monotonic() + 2)
+            served.append(stage)
+
+        threads = [threading.Thread(target=request, args=(stage,)) for stage in ("score", "dec", "eval")]
+        for thread in threads:
+            thread.start()
+            time.sleep(0.01)
+        for thread in threads:
+            thread.join()
+        self.assertEqual(served[0], "eval")
+        self.assertEqual(set(served), {"score", "dec", "eval"})
+
+    def test_deadline(self):
+        self.scheduler.acquire("dec", "test-model", 10, time.monotonic() + 1)
+        started = time.monotonic()
+        with self.assertRaises(quota.QuotaTimeout):
+            self.scheduler.acquire("dec", "test-model", 10, time.monotonic() + 1, wait=False)
+        with self.assertRaises(quota.QuotaTimeout):
+            self.scheduler.acquire("dec", "test-model", 10, time.monotonic() + 0.01)
+        self.assertLess(time.monotonic() - started, 0.05)
+
+    def test_settle_corrects_the_estimates(self):
+        response = mock.Mock(response_metadata={"token_usage": {"prompt_tokens": 100, "completion_tokens": 20}})
+        chain = mock.Mock(spec=[])
+        self.assertEqual(self.scheduler.estimate("dec", "test-model", chain, 800), (201, 256))
+        # the first usage seen replaces the defaults, later ones are averaged in
+        self.scheduler.settle("dec", "test-model", (201, 256), 800, response)
+        self.assertEqual(self.scheduler.estimate("dec", "test-model", chain, 800), (101, 20))
+        self.scheduler.settle("dec", "test-model", (101, 20), 400, response)
+        self.assertEqual(self.scheduler.estimate("dec", "test-model", chain, 1000), (132, 20))
+
+
+@skipUnless(connection.vendor == "postgresql", "the shared buckets need PostgreSQL")
+class DatabaseBackendTests(QuotaTestMixin, TransactionTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.backend = quota.DatabaseBackend()
+        self.addCleanup(lambda: self.backend._connection and self.backend._connection.close())
+
+    def test_takes_until_empty_then_refills(self):
+        for _ in range(10):
+            self.assertEqual(self.backend.take("test-model", self.limits, 10), 0)
+        wait = self.backend.take("test-model", self.limits, 10)
+        self.assertGreater(wait, 0)
+        self.assertLessEqual(wait, 0.1)
+        time.sleep(wait + 0.01)
+        self.assertEqual(self.backend.take("test-model", self.limits, 10), 0)
+
+    def test_drain_is_shared(self):
+        other = quota.DatabaseBackend()
+        self.addCleanup(lambda: other._connection and other._connection.close())
+        self.assertEqual(self.backend.take("test-model", self.limits, 10), 0)
+        other.drain("test-model", self.limits, 1.0)
+        self.assertGreater(self.backend.take("test-model", self.limits, 10), 0.9)
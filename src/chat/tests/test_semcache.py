@@ -0,0 +1,136 @@
+from types import SimpleNamespace
+from unittest import mock
+
+from django.conf import settings
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from accounts.models import User
+from chat import quota
+from chat.chains import ChainStore
+from chat.models import ChatMessage
+from chat.services import semcache
+from chat.services.constants import ChatStates
+from chat.services.conversation import ConversationManager
+from chat.services.semcache import SemanticCache
+from chat.services.session import SessionPipeline
+
+NODE = ("assessment.phq9", "1", "CLARIFY")
+
+
+class SemanticCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        self.cache = SemanticCache(threshold=0.8)
+
+    def test_paraphrases_hit(self):
+        self.cache.add(NODE, "what does little interest mean?", "It means ...")
+        for message in ["what is little interest", "What does 'little interest' mean",
+                        "I don't understand little interest"]:
+            hit = self.cache.nearest(NODE, message)
+            self.assertIsNotNone(hit, message)
+            self.assertEqual(hit.response, "It means ...")
+
+    def test_near_misses(self):
+        pairs = [
+            ("i am feeling safe at home", "i am not feeling safe at home"),
+            ("i am not feeling safe at home", "i am feeling safe at home"),
+            ("drinking a lot", "thinking a lot"),
+            ("what does sleeping too much mean", "what does not sleeping enough mean"),
+            ("what does feeling down mean", "what does feeling down and tired mean"),
+        ]
+        for cached, message in pairs:
+            cache = SemanticCache(threshold=0.8)
+            cache.add(NODE, cached, "response")
+            self.assertIsNone(cache.nearest(NODE, message), (cached, message))
+
+    def test_nodes_are_separate(self):
+        self.cache.add(NODE, "what is fidgety", "Restless.")
+        self.assertIsNone(self.cache.nearest(("assessment.phq9", "2", "CLARIFY"), "what is fidgety"))
+
+    def test_variants_avoid_the_last_message(self):
+        self.cache.add(NODE, "what is fidgety", "Restless.")
+        self.cache.add(NODE, "what does fidgety mean", "Unable to sit still.")
+        self.assertEqual(len(self.cache), 1)
+        self.assertEqual(self.cache.nearest(NODE, "fidgety?", avoid="Restless.").response, "Unable to sit still.")
+        self.cache.clear()
+        self.assertIsNone(self.cache.nearest(NODE, "fidgety?"))
+
+
+class AppliesTests(SimpleTestCase):
+
+    @mock.patch.dict(semcache._config, {"ENABLED": True})
+    def test_drift_is_never_cached(self):
+        self.assertFalse(semcache.applies("DRIFT", "i have been drinking a lot"))
+        self.assertTrue(semcache.applies("CLARIFY", "what is fidgety?"))
+        self.assertFalse(semcache.applies("CLARIFY", "what is fidgety? " * 20))
+
+
+class VersionTests(SimpleTestCase):
+
+    def setUp(self):
+        self.chains = SimpleNamespace(dec_clarify_chain=SimpleNamespace(last=SimpleNamespace(model_name="gpt-4o")))
+        for patcher in (mock.patch("chat.chains.ChainStore", self.chains), mock.patch.dict(semcache._versions, clear=True)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_version_changes_with_the_dec_chain(self):
+        version = semcache.version("CLARIFY")
+        self.chains.dec_clarify_chain = SimpleNamespace(last=SimpleNamespace(model_name="gpt-4o-mini"))
+        self.assertNotEqual(semcache.version("CLARIFY"), version)
+        with mock.patch("chat.prompts.dec.clarify", "another prompt"):
+            self.chains.dec_clarify_chain = SimpleNamespace(last=SimpleNamespace(model_name="gpt-4o"))
+            self.assertNotEqual(semcache.version("CLARIFY"), version)
+        self.chains.dec_clarify_chain = SimpleNamespace(last=SimpleNamespace(model_name="gpt-4o"))
+        self.assertEqual(semcache.version("CLARIFY"), version)
+
+
+@override_settings(
+    LLM_STANDIN={**settings.LLM_STANDIN, "MODEL": "fake", "LATENCY": {"MEDIAN": 0, "SIGMA": 0, "MAX": 0},
+                 "ERRORS": {}, "MALFORMED_RATE": 0},
+)
+class DecRoutineTests(TestCase):
+
+    def setUp(self):
+        for patcher in (mock.patch.dict(ChainStore._chains, clear=True), mock.patch.dict(quota._config, {"ENABLED": False}),
+                        mock.patch.dict(semcache._config, {"ENABLED": True, "PERSONALIZE_MODEL": ""})):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        semcache.cache.clear()
+        self.addCleanup(semcache.cache.clear)
+
+    def clarify(self, username, message="what does little interest mean?"):
+        """
+        Runs the dec routine on a CLARIFY reply to the first question of a new patient's session;
+        returns the message and the dec chain inputs.
+        """
+        user = User.objects.create_user(username, f"{username}@example.com", "secret", role="patient")
+        conversation, _ = ConversationManager.get_or_create_conversation(user)
+        session, _ = ConversationManager.get_or_create_chat_session(conversation)
+        SessionPipeline(conversation, session).trigger_pipeline("hello")
+        pipeline = SessionPipeline(conversation, session)
+        msg = ChatMessage.objects.create(conversation=conversation, chat_session=session, user_response=message)
+        with mock.patch.object(SessionPipeline, "_invoke_parsed", autospec=True,
+                               side_effect=SessionPipeline._invoke_parsed) as invoke:
+            pipeline.run_dec_routine(msg, message, ChatStates.CLARIFY)
+        return msg, [call.args[3] for call in invoke.call_args_list]
+
+    def test_miss_answers_with_the_history_and_caches_without(self):
+        msg, inputs = self.clarify("alice")
+        self.assertEqual(len(inputs), 2)
+        self.assertTrue(inputs[0]["conversation"])
+        self.assertEqual(inputs[1]["conversation"], [])
+        self.assertNotIn("cache", msg.meta_data["dec"])
+        self.assertEqual(len(semcache.cache), 1)
+
+    def test_hit(self):
+        self.clarify("alice")
+        msg, inputs = self.clarify("bob", "what is little interest")
+        self.assertEqual(inputs, [])
+        self.assertEqual(msg.meta_data["dec"]["cache"]["message"], "what does little interest mean?")
+        self.assertTrue(msg.ai_response)
+
+    def test_disabled(self):
+        with mock.patch.dict(semcache._config, {"ENABLED": False}):
+            _, inputs = self.clarify("alice")
+        self.assertEqual(len(inputs), 1)
+        self.assertEqual(len(semcache.cache), 0)
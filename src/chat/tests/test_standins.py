@@ -0,0 +1,27 @@
+from django.test import SimpleTestCase
+
+from chat.standins import FakeChatModel
+
+
+class FakeChatModelTests(SimpleTestCase):
+
+    def setUp(self):
+        self.model = FakeChatModel(model_name="fake-test", malformed_rate=0.5,
+                                   error_rates={"server": 0.3}, prefix_cache=False)
+
+    def outcome(self, prompt: str, **metadata) -> str:
+        try:
+            return self.model.invoke(prompt, config={"metadata": metadata}).content
+        except Exception as e:
+            return type(e).__name__
+
+    def test_repeated_calls_are_identical(self):
+        prompts = [f"dec prompt {i}" for i in range(20)]
+        first = [self.outcome(prompt) for prompt in prompts]
+        self.assertEqual([self.outcome(prompt) for prompt in prompts], first)
+
+    def test_requests_of_a_call_differ(self):
+        outcomes = {self.outcome("dec prompt", llm_request=n) for n in range(20)}
+        self.assertGreater(len(outcomes), 1)
+        self.assertEqual(self.outcome("dec prompt", llm_request=3), self.outcome("dec prompt", llm_request=3))
+        self.assertEqual(self.outcome("dec prompt", llm_retry=1), self.outcome("dec prompt", llm_retry=1))
@@ -0,0 +1,51 @@
+from types import SimpleNamespace
+
+from django.test import TestCase
+from django.utils import timezone
+
+from chat.models import LLMUsageDaily
+from chat.services import usage
+
+_FIELDS = ('stage', 'chain', 'model', 'phase', 'calls', 'errors', 'sessions', 'prompt_tokens',
+           'completion_tokens', 'cached_tokens', 'latency_ms', 'cost')
+
+
+def response(prompt, completion, model="gpt-4o"):
+    return SimpleNamespace(response_metadata={
+        "model_name": model,
+        "token_usage": {"prompt_tokens": prompt, "completion_tokens": completion},
+    })
+
+
+class UsageLedgerTests(TestCase):
+
+    def turn(self, session_id, error=False):
+        ledger = usage.UsageLedger(session_id=session_id, patient_id="p1")
+        ledger.add("eval", "eval", "assessment.phq9", response(1000, 5), seconds=0.4)
+        ledger.add("dec", "dec.normal", "assessment.phq9", response(2000, 50, "gpt-4o-mini"), seconds=1.2)
+        if error:
+            ledger.add("dec", "dec.normal", "assessment.phq9", seconds=10, error=True, model="gpt-4o-mini")
+        ledger.flush()
+
+    def rows(self):
+        return sorted(LLMUsageDaily.objects.values_list(*_FIELDS))
+
+    def test_flush_keeps_the_daily_rows_current(self):
+        self.turn("sess_a")
+        self.turn("sess_a", error=True)
+        self.turn("sess_b")
+
+        eval_row = LLMUsageDaily.objects.get(chain="eval")
+        self.assertEqual((eval_row.calls, eval_row.sessions, eval_row.prompt_tokens), (3, 2, 3000))
+        dec_row = LLMUsageDaily.objects.get(chain="dec.normal")
+        self.assertEqual((dec_row.calls, dec_row.errors, dec_row.sessions), (4, 1, 2))
+
+        flushed = self.rows()
+        usage.rollup_day(timezone.localdate())
+        self.assertEqual(self.rows(), flushed)
+
+    def test_rollup_is_repeatable(self):
+        self.turn("sess_a")
+        usage.rollup()
+        usage.rollup()
+        self.assertEqual(LLMUsageDaily.objects.get(chain="eval").calls, 1)
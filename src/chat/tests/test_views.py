@@ -0,0 +1,50 @@
+from unittest import mock
+
+from django.conf import settings
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from accounts import authentication
+from accounts.models import User
+from assessments.models import AssessmentResult
+from chat import quota, views
+from chat.chains import ChainStore
+from telemetry.querybudget import QueryBudget, QueryBudgetExceeded
+
+
+@override_settings(
+    QUERY_BUDGET={**settings.QUERY_BUDGET, "ENABLED": True, "RAISE": True},
+    LLM_STANDIN={**settings.LLM_STANDIN, "MODEL": "fake", "LATENCY": {"MEDIAN": 0, "SIGMA": 0, "MAX": 0},
+                 "ERRORS": {}, "MALFORMED_RATE": 0},
+)
+class ChatQueryBudgetTests(TestCase):
+    """
+    Chat turns against the fake stand-in, failing when a turn goes over the view's query budget.
+    """
+
+    def setUp(self):
+        # chains are built with the stand-in; the quotas pace requests on their own connection
+        for patcher in (mock.patch.dict(ChainStore._chains, clear=True), mock.patch.dict(quota._config, {"ENABLED": False})):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        authentication._local.clear()
+        self.addCleanup(authentication._local.clear)
+        user = User.objects.create_user("patient", "patient@example.com", "secret", role="patient")
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {Token.objects.create(user=user).key}")
+        self.url = reverse("chat:chat")
+
+    def test_turns(self):
+        for i in range(12):
+            response = self.client.post(self.url, {"query": "hello" if i == 0 else "Nearly every day"}, format="json")
+            self.assertEqual(response.status_code, 200, response.content)
+        # a scoring turn was among them
+        self.assertTrue(AssessmentResult.objects.exists())
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+
+    def test_over_budget(self):
+        with mock.patch.object(views.chat, "query_budget", QueryBudget(max_queries=5)):
+            with self.assertRaises(QueryBudgetExceeded):
+                self.client.post(self.url, {"query": "hello"}, format="json")
@@ -1,35 +1,49 @@
+import logging
+
 from django.shortcuts import render
 from accounts.decorators import allow_only
 from .serializers import ChatMessageSerializer, ChatSessionSerializer
 from rest_framework.decorators import authentication_classes, permission_classes, api_view
-from rest_framework.authentication import TokenAuthentication, SessionAuthentication
+from rest_framework.authentication import SessionAuthentication
+from accounts.authentication import CachedTokenAuthentication
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from .services.conversation import ConversationManager
 from .services.session import SessionPipeline
+from telemetry.context import annotate
+from telemetry.metrics import stage
+from telemetry.querybudget import query_budget
+
 
+logger = logging.getLogger(__name__)
 
 @allow_only(['patient'])
 def home(request):
     return render(request, 'chat/home.html')
 
 
+# a scoring turn runs about 25 queries, the others 18
+@query_budget(max_queries=30, max_duplicates=3)
 @api_view(['POST', 'GET'])
-@authentication_classes([SessionAuthentication, TokenAuthentication])
+@authentication_classes([SessionAuthentication, CachedTokenAuthentication])
 @permission_classes([IsAuthenticated])
 @allow_only(['patient'])
 def chat(request):
     user = request._user
-    conversation, _ = ConversationManager.get_or_create_conversation(user)
-    chat_session, _ = ConversationManager.get_or_create_chat_session(conversation)
+    with stage('hydrate'):
+        conversation, _ = ConversationManager.get_or_create_conversation(user)
+        chat_session, _ = ConversationManager.get_or_create_chat_session(conversation)
+        pipeline = SessionPipeline(conversation, chat_session)
+    annotate(session_id=chat_session.id)
     session_data = ChatSessionSerializer(chat_session)
-    pipeline = SessionPipeline(conversation, chat_session)
 
     if request.method == 'GET':
         # chat_obj = pipeline.history_manager.get_full_qs()
-        chat_obj = pipeline.history_manager.get_from_session()
+        chat_obj = list(pipeline.history_manager.get_from_session())
         chat = ChatMessageSerializer(chat_obj, many=True)
-        return Response({'data': chat.data, 'session': session_data.data}, status=200)
+        # answer options of the last question asked in degraded mode
+        options = (chat_obj[-1].ai_marker or {}).get('options') if chat_obj else None
+        return Response({'data': chat.data, 'session': session_data.data, 'options': options}, status=200)
 
     elif request.method == 'POST':
         user_response = request.data.get('query', '')
@@ -37,8 +51,13 @@ def chat(request):
             return Response({'error': 'Invalid request'}, status=400)
         try:
             response = pipeline.trigger_pipeline(user_response)
-        except Exception as e:
-            return Response({'error': e}, status=500)
-        return Response({'ai_response': response, 'session': session_data.data}, status=200)
+        except Exception:
+            logger.exception("Chat turn failed in session %s", chat_session.id)
+            return Response({'error': 'Something went wrong, please try again'}, status=500)
+        return Response({
+            'ai_response': response,
+            'session': session_data.data,
+            'options': pipeline.options,
+        }, status=200)
 
     return Response({'error': 'Invalid request'}, status=400)
@@ -1,3 +1,66 @@
-from django.test import TestCase
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from accounts.models import User
+from assessments.models import Assessment, AssessmentRecord, AssessmentResult, KeywordStat
+from chat.models import ChatSession, Conversation
+from telemetry.querybudget import QueryBudget, QueryBudgetExceeded
+
+from . import views
+
+
+@override_settings(QUERY_BUDGET={**settings.QUERY_BUDGET, "ENABLED": True, "RAISE": True})
+class DashboardQueryBudgetTests(TestCase):
+    """
+    Dashboard pages over several patients, failing when a page goes over its query budget
+    (N+1 queries included).
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.doctor = User.objects.create_user("doctor", "doctor@example.com", "secret", role="doctor")
+        for i in range(3):
+            patient = User.objects.create_user(f"patient{i}", f"patient{i}@example.com", "secret", role="patient")
+            session = ChatSession.objects.create(conversation=Conversation.objects.create(user=patient))
+            for type in ("assessment.phq9", "assessment.gad7"):
+                assessment = Assessment.objects.create(
+                    patient=patient.patient, session=session, type=type, status="completed", completed_at=timezone.now())
+                AssessmentResult.objects.create(assessment=assessment, score=6, severity="mild")
+                AssessmentRecord.objects.bulk_create(
+                    AssessmentRecord(assessment=assessment, question_id=str(q), score=q % 4, keywords=["fatigue"])
+                    for q in range(1, 8))
+        cls.assessment = assessment
+        month = timezone.localdate().replace(day=1)
+        KeywordStat.objects.bulk_create(
+            KeywordStat(keyword=keyword, type="assessment.phq9", month=month, records=4, score_sum=8, high_records=2)
+            for keyword in ("fatigue", "sleeping problem", "headache"))
+
+    def setUp(self):
+        self.client.force_login(self.doctor)
+
+    def test_home(self):
+        self.assertEqual(self.client.get(reverse("dashboard:home")).status_code, 200)
+
+    def test_assessment(self):
+        response = self.client.get(reverse("dashboard:assessment", args=[self.assessment.id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context["records"]), 7)
+
+    def test_keywords(self):
+        response = self.client.get(reverse("dashboard:keywords"), {"type": "assessment.phq9"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context["keywords"]), 3)
+
+    def test_usage(self):
+        staff = User.objects.create_user("staff", "staff@example.com", "secret", role="staff")
+        self.client.force_login(staff)
+        self.assertEqual(self.client.get(reverse("dashboard:usage"), {"days": 30}).status_code, 200)
+
+    def test_over_budget(self):
+        with mock.patch.object(views.home, "query_budget", QueryBudget(max_queries=2)):
+            with self.assertRaises(QueryBudgetExceeded):
+                self.client.get(reverse("dashboard:home"))
@@ -6,4 +6,7 @@ app_name = 'dashboard'
 urlpatterns = [
     path('', views.home, name='home'),
     path('assessments/<str:assessment_id>/', views.assessment, name='assessment'),
+    path('keywords/', views.keywords, name='keywords'),
+    path('usage/', views.usage, name='usage'),
+    path('api/search/', views.search, name='search'),
 ]
\ No newline at end of file
@@ -1,37 +1,42 @@
+from datetime import date, timedelta
+
+from django.contrib.admin.views.decorators import staff_member_required
+from django.db.models import F, FloatField, Sum
+from django.db.models.functions import Cast
+from django.http import JsonResponse
 from django.shortcuts import render, get_object_or_404
+from django.utils import timezone
 
-from assessments.models import Assessment
+from assessments.models import Assessment, AssessmentRecord, KeywordStat
 from assessments.definitions import PhaseMap
 from accounts.decorators import allow_only
+from beaconmind.search import ASSESSMENT_RECORDS, TRANSCRIPTS
+from chat.models import ChatMessage
+from chat.services import usage as llm_usage
+from telemetry.querybudget import query_budget
 
 
+@query_budget(max_queries=6, max_duplicates=1)
 @allow_only(['doctor'])
 def home(request):
-    assessments = Assessment.objects.all()
+    assessments = Assessment.objects.select_related('patient__user')
     return render(request, 'dashboard/home.html', {
         'assessments': assessments, 
         'phase_map': PhaseMap
     })
 
 
+@query_budget(max_queries=6, max_duplicates=1)
 @allow_only(['doctor'])
 def assessment(request, assessment_id):
-    assessment = get_object_or_404(Assessment, id=assessment_id)
-    records = assessment.records.all().order_by('question_id')
+    assessment = get_object_or_404(
+        Assessment.objects.select_related('patient__user', 'result'), id=assessment_id)
+    records = list(assessment.records.all().order_by('question_id'))
     result = getattr(assessment, 'result', None)
 
-    scores = []
     phase = PhaseMap.get(assessment.type)
-    idx = 0
-    curr_score = 0
-    n_records = records.count()
-    for record in records:
-        if idx < n_records and records[idx].question_id == record.question_id:
-            scores.append(records[idx].score)
-            curr_score += records[idx].score
-            idx += 1
-        else:
-            scores.append(0)
+    scores = [record.score for record in records]
+    curr_score = sum(scores)
 
     return render(request, 'dashboard/assessment.html', {
         'assessment': assessment,
@@ -41,3 +46,119 @@ def assessment(request, assessment_id):
         'result': result,
         'phase': phase,
     })
+
+
+@allow_only(['doctor'])
+def keywords(request):
+    """
+    Keywords that co-occur with high question scores, from the
+    pre-aggregated `KeywordStat` counters.
+    """
+    phase = PhaseMap.get(request.GET.get('type', '')) or PhaseMap.get_first()
+    try:
+        n_months = min(max(int(request.GET.get('months', 6)), 1), 36)
+    except ValueError:
+        n_months = 6
+
+    today = timezone.localdate()
+    months = []
+    year, month = today.year, today.month
+    for _ in range(n_months):
+        months.insert(0, date(year, month, 1))
+        year, month = (year, month - 1) if month > 1 else (year - 1, 12)
+
+    stats = KeywordStat.objects.filter(type=phase.name, month__gte=months[0])
+    top = list(
+        stats.values('keyword')
+        .annotate(
+            n_records=Sum('records'),
+            n_high=Sum('high_records'),
+            n_score=Sum('score_sum'),
+        )
+        .annotate(
+            high_rate=Cast(F('n_high'), FloatField()) / Cast(F('n_records'), FloatField()),
+            avg_score=Cast(F('n_score'), FloatField()) / Cast(F('n_records'), FloatField()),
+        )
+        .order_by('-n_high', '-n_records', 'keyword')[:30]
+    )
+
+    trend = {}
+    for row in stats.filter(keyword__in=[row['keyword'] for row in top]).values('keyword', 'month', 'high_records'):
+        trend[(row['keyword'], row['month'])] = row['high_records']
+    for row in top:
+        row['trend'] = [trend.get((row['keyword'], m), 0) for m in months]
+
+    return render(request, 'dashboard/keywords.html', {
+        'phase': phase,
+        'phase_map': PhaseMap,
+        'months': months,
+        'n_months': n_months,
+        'keywords': top,
+    })
+
+
+@staff_member_required
+def usage(request):
+    """
+    LLM token usage and cost per stage, model, phase, session and patient
+    over the last `days`, from the usage ledger and its daily rollups.
+    """
+    try:
+        n_days = min(max(int(request.GET.get('days', 7)), 1), 90)
+    except ValueError:
+        n_days = 7
+    end = timezone.localdate()
+    # the rollups are kept current by every chat turn (see UsageLedger.flush)
+    return render(request, 'dashboard/usage.html', {
+        'n_days': n_days,
+        'report': llm_usage.report(end - timedelta(days=n_days - 1), end),
+    })
+
+
+@allow_only(['doctor'])
+def search(request):
+    """
+    Full-text search over transcripts (`scope=transcripts`, default) or
+    assessment records (`scope=records`), ranked best first with
+    highlighted fragments. Optional `patient` narrows to one username.
+    """
+    term = request.GET.get('q', '').strip()
+    scope = request.GET.get('scope', 'transcripts')
+    patient = request.GET.get('patient', '').strip()
+    try:
+        page = max(int(request.GET.get('page', 1)), 1)
+    except ValueError:
+        page = 1
+    limit = 20
+
+    if scope == 'records':
+        qs = AssessmentRecord.objects.all()
+        if patient:
+            qs = qs.filter(assessment__patient__user__username=patient)
+        hits = ASSESSMENT_RECORDS.search(qs, term, limit=limit, offset=(page - 1) * limit)
+        results = [{
+            'id': hit['object'].id,
+            'assessment_id': hit['object'].assessment_id,
+            'question_id': hit['object'].question_id,
+            'question_text': hit['object'].question_text,
+            'score': hit['object'].score,
+            'timestamp': hit['object'].timestamp,
+            'rank': hit['rank'],
+            'highlights': hit['highlights'],
+        } for hit in hits]
+    elif scope == 'transcripts':
+        qs = ChatMessage.objects.all()
+        if patient:
+            qs = qs.filter(conversation__user__username=patient)
+        hits = TRANSCRIPTS.search(qs, term, limit=limit, offset=(page - 1) * limit)
+        results = [{
+            'id': hit['object'].id,
+            'chat_session_id': hit['object'].chat_session_id,
+            'timestamp': hit['object'].timestamp,
+            'rank': hit['rank'],
+            'highlights': hit['highlights'],
+        } for hit in hits]
+    else:
+        return JsonResponse({'error': 'Invalid scope'}, status=400)
+
+    return JsonResponse({'query': term, 'scope': scope, 'page': page, 'results': results})
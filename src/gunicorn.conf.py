@@ -0,0 +1,24 @@
+# gunicorn.conf.py
+# picked up automatically by gunicorn when started from this directory
+
+import os
+import shutil
+
+
+# workers silent for longer are killed: above the LLM budget of a chat turn (LLM_CALL_POLICY['TURN_BUDGET']),
+# leaving room for the turn's database work and its degraded answer when the LLM calls fail
+timeout = int(os.getenv('GUNICORN_TIMEOUT', float(os.getenv('LLM_TURN_BUDGET', 45)) + 15))
+
+
+def on_starting(server):
+    # start each deployment with empty prometheus multiprocess files
+    path = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+    if path:
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path, exist_ok=True)
+
+
+def child_exit(server, worker):
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
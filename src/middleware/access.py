@@ -1,14 +1,43 @@
 import logging
+from contextlib import ExitStack
+
+from django.db import connections
+from django.utils.functional import empty
+
+from telemetry import metrics
+from telemetry.context import db_timer, request_context
+
 
 class AccessLogMiddleware:
-    """Middleware to log every request with remote IP, method, path, and response status."""
+    """
+    Middleware to log every request with remote IP, method, path, and response status,
+    along with request duration, DB time and query count, LLM time, user role and chat session.
+
+    Records are handed to the (queue based) `access` logger; structured fields are passed as
+    `extra={"fields": {...}}` for the JSON formatter.
+    """
 
     def __init__(self, get_response):
         self.get_response = get_response
         self.logger = logging.getLogger("access")
 
     def __call__(self, request):
-        response = self.get_response(request)
+        with request_context() as stats, ExitStack() as stack, metrics.REQUESTS_IN_PROGRESS.track_inprogress():
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(db_timer))
+            response = self.get_response(request)
+
+        metrics.observe_request(request, response, stats)
+        metrics.observe_queues()
+
+        if not self.logger.isEnabledFor(logging.INFO):
+            return response
+
+        if stats.role is None:
+            stats.role = self.get_role(request)
+        duration_ms = round(stats.duration * 1000, 1)
+        db_ms = round(stats.db_time * 1000, 1)
+        llm_ms = round(stats.llm_time * 1000, 1)
 
         # Extract necessary information
         remote_addr = request.META.get("REMOTE_ADDR", "-")
@@ -18,7 +47,31 @@ class AccessLogMiddleware:
 
         # Log with extra parameters
         self.logger.info(
-            f"{remote_addr} {request_method} {path} {status_code}"
+            f"{remote_addr} {request_method} {path} {status_code} "
+            f"{duration_ms}ms db={stats.db_queries}/{db_ms}ms llm={stats.llm_calls}/{llm_ms}ms "
+            f"role={stats.role or '-'} session={stats.session_id or '-'}",
+            extra={"fields": {
+                "remote_addr": remote_addr,
+                "method": request_method,
+                "path": path,
+                "status": status_code,
+                "duration_ms": duration_ms,
+                "db_ms": db_ms,
+                "db_queries": stats.db_queries,
+                "llm_ms": llm_ms,
+                "llm_calls": stats.llm_calls,
+                "role": stats.role,
+                "session_id": stats.session_id,
+                "trace_id": stats.trace_id,
+            }},
         )
 
         return response
+
+    @staticmethod
+    def get_role(request):
+        # never trigger a session/user lookup just for the log line
+        user = getattr(request, "user", None)
+        if user is None or getattr(user, "_wrapped", None) is empty:
+            return None
+        return getattr(user, "role", None) if user.is_authenticated else "anonymous"
@@ -0,0 +1,39 @@
+from django.conf import settings
+
+from telemetry import profiling
+from telemetry.context import current
+from .access import AccessLogMiddleware
+
+
+class ProfilingMiddleware:
+    """
+    Middleware to sample the stacks of requests under the configured path prefixes and keep
+    the profiles of those slower than `PROFILING['SLOW_THRESHOLD']` (see `telemetry.profiling`).
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.enabled = settings.PROFILING.get('ENABLED', False)
+        self.paths = tuple(settings.PROFILING.get('PATHS', ()))
+
+    def __call__(self, request):
+        if not self.enabled or not request.path.startswith(self.paths):
+            return self.get_response(request)
+
+        profile = profiling.sampler.start()
+        response = None
+        try:
+            response = self.get_response(request)
+        finally:
+            match = getattr(request, "resolver_match", None)
+            stats = current()
+            profiling.finish(profile, {
+                "method": request.method,
+                "path": request.path,
+                "view": match.view_name if match else None,
+                "status": getattr(response, "status_code", None),
+                "role": (stats and stats.role) or AccessLogMiddleware.get_role(request),
+                "session_id": stats.session_id if stats else None,
+                "trace_id": stats.trace_id if stats else None,
+            })
+        return response
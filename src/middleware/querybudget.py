@@ -0,0 +1,43 @@
+import logging
+
+from django.conf import settings
+
+from telemetry.querybudget import QueryBudgetExceeded, QueryCounter, default_budget, get_budget
+
+
+class QueryBudgetMiddleware:
+    """
+    Middleware to count the queries of every request, and the repeats of each SQL shape, against
+    the budget the view declares with `@query_budget` (or the `QUERY_BUDGET` defaults). Requests over
+    budget are logged to the `querybudget` logger with the stacks of the offending queries, or raise
+    `QueryBudgetExceeded` when `QUERY_BUDGET['RAISE']` is set (see `telemetry.querybudget`).
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.logger = logging.getLogger("querybudget")
+        self.enabled = settings.QUERY_BUDGET.get('ENABLED', False)
+        self.raise_exception = settings.QUERY_BUDGET.get('RAISE', False)
+
+    def __call__(self, request):
+        if not self.enabled:
+            return self.get_response(request)
+
+        counter = request._query_counter = QueryCounter(default_budget())
+        with counter.watch():
+            response = self.get_response(request)
+
+        if counter.violations():
+            match = getattr(request, "resolver_match", None)
+            label = f"{request.method} {request.path} ({match.view_name if match else 'unresolved'})"
+            report = counter.report(label)
+            if self.raise_exception:
+                raise QueryBudgetExceeded(report)
+            self.logger.warning(report)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        counter = getattr(request, "_query_counter", None)
+        budget = get_budget(view_func)
+        if counter is not None and budget is not None:
+            counter.budget = budget
@@ -0,0 +1,46 @@
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+from telemetry.context import annotate
+from telemetry.tracing import db_tracer, trace_request, trusted_parent
+
+
+class TracingMiddleware:
+    """
+    Middleware to trace every request: a root span for the request, a span per database
+    query and whatever spans the view records (see `telemetry.tracing`). Continues the trace
+    of an incoming W3C `traceparent` header (its sampled flag is only honoured for callers in
+    TRACING['TRUSTED_PARENTS']) and returns the trace id in `X-Trace-Id`.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.enabled = settings.TRACING.get('ENABLED', False)
+
+    def __call__(self, request):
+        if not self.enabled:
+            return self.get_response(request)
+
+        with trace_request(
+            f"{request.method} {request.path}",
+            traceparent=request.headers.get("traceparent"),
+            trusted=trusted_parent(request.META.get("REMOTE_ADDR")),
+            **{"http.method": request.method, "http.target": request.path},
+        ) as root, ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(db_tracer))
+            annotate(trace_id=root.trace_id)
+            response = self.get_response(request)
+
+            match = getattr(request, "resolver_match", None)
+            if match is not None:
+                root.name = f"{request.method} {match.route or match.view_name}"
+                root.set(**{"http.route": match.route, "view": match.view_name})
+            root.set(**{"http.status_code": response.status_code})
+            if response.status_code >= 500:
+                root.error = f"HTTP {response.status_code}"
+
+        response["X-Trace-Id"] = root.trace_id
+        return response
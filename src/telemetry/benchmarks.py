@@ -0,0 +1,300 @@
+"""
+Micro-benchmarks for the CPU-side work of a chat turn.
+
+Benchmarks run the pure functions of the pipeline (message formatting,
+history conversion, phase graph navigation, scoring, prompt formatting and
+the DRF serializers) over seeded synthetic conversations of increasing
+size, without touching the database or the LLM. Results are stored as JSON
+and compared against a baseline result file, so that regressions in the
+per-turn overhead show up before a deploy:
+```
+python manage.py benchmark --save-baseline        # on main
+python manage.py benchmark --fail-on-regression   # on the branch
+```
+
+Timings are the best of several repeats (less sensitive to noise than the
+mean) and only comparable between runs on the same machine.
+"""
+
+import json
+import platform
+import random
+import subprocess
+import timeit
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from django.conf import settings
+
+
+WORDS = (
+    "i have been feeling tired most days and cannot sleep well at night sometimes "
+    "it is hard to focus on work my appetite is low and i worry about small things "
+    "thank you for sharing that can you tell me more about how often this happens"
+).split()
+
+
+@dataclass
+class Benchmark:
+    name: str
+    setup: Callable[[int], Callable[[], Any]]  # size -> function to time
+    sized: bool = True  # whether the benchmark depends on the conversation size
+
+
+_registry: Dict[str, Benchmark] = {}
+
+
+def benchmark(name: str, sized: bool = True):
+    """
+    Registers `setup(size)`, which prepares the inputs and returns the
+    function to time.
+    """
+    def decorator(setup):
+        _registry[name] = Benchmark(name, setup, sized)
+        return setup
+    return decorator
+
+
+def _sentence(rng: random.Random, low: int, high: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(low, high)))
+
+
+def synthetic_conversation(n_messages: int, seed: int = 0) -> List[Any]:
+    """
+    Unsaved `ChatMessage` instances of one session, one turn per message,
+    with realistic response lengths and markers.
+    """
+    from assessments.definitions import PhaseMap
+    from chat.models import ChatMessage
+
+    rng = random.Random(seed)
+    phases = PhaseMap.all()
+    started = datetime(2025, 1, 1, 9, tzinfo=timezone.utc)
+    messages = []
+    for i in range(n_messages):
+        phase = phases[(i // 12) % len(phases)]
+        node_id = str(i % phase.N + 1)
+        timestamp = started + timedelta(seconds=40 * i)
+        messages.append(ChatMessage(
+            id=f"msg_{i:08d}",
+            conversation_id="conv_benchmark",
+            chat_session_id="sess_benchmark",
+            user_response=_sentence(rng, 3, 30),
+            ai_response=_sentence(rng, 15, 80),
+            user_response_timestamp=timestamp,
+            ai_response_timestamp=timestamp + timedelta(seconds=3),
+            timestamp=timestamp,
+            user_marker={"phase": phase.name, "init": False, "node_id": node_id, "tr": rng.choice("ynoc")},
+            ai_marker={"phase": phase.name, "node_id": node_id, "chat_status": "NORMAL"},
+            meta_data={},
+        ))
+    return messages
+
+
+def _score_data(phase, rng: random.Random) -> Dict[str, Dict[str, Any]]:
+    return {
+        qid: {"score": rng.randint(phase.low, phase.high), "remark": "", "snippet": "", "keywords": []}
+        for qid in phase.get_questions_dict()
+    }
+
+
+# --- benchmarks ---------------------------------------------------------------------------------
+
+@benchmark("ConversationManager.format_msg")
+def _format_msg(size):
+    from chat.services.conversation import ConversationManager
+    messages = synthetic_conversation(size)
+    return lambda: [ConversationManager.format_msg(msg) for msg in messages]
+
+
+@benchmark("HistoryManager.qs_to_list")
+def _qs_to_list(size):
+    from chat.services.conversation import HistoryManager
+    messages = synthetic_conversation(size)
+    return lambda: HistoryManager.qs_to_list(messages)
+
+
+@benchmark("HistoryManager.qs_to_dict")
+def _qs_to_dict(size):
+    from chat.services.conversation import HistoryManager
+    messages = synthetic_conversation(size)
+    return lambda: json.dumps(HistoryManager.qs_to_dict(messages))
+
+
+@benchmark("BaseAssessmentPhase.get", sized=False)
+def _phase_get(size):
+    from assessments.definitions import PhaseMap
+    nodes = [(phase, node_id) for phase in PhaseMap.all() for node_id in phase.questions]
+    return lambda: [phase.get(node_id) for phase, node_id in nodes]
+
+
+@benchmark("BaseAssessmentPhase.next_q", sized=False)
+def _next_q(size):
+    from assessments.definitions import PhaseMap
+    steps = [(phase, node_id, tr) for phase in PhaseMap.all() for node_id in phase.questions for tr in "ynoc"]
+    return lambda: [phase.next_q(node_id, tr, r=1) for phase, node_id, tr in steps]
+
+
+@benchmark("BaseAssessmentPhase.get_questions_dict", sized=False)
+def _questions_dict(size):
+    from assessments.definitions import PhaseMap
+    phases = PhaseMap.all()
+    return lambda: [json.dumps(phase.get_questions_dict()) for phase in phases]
+
+
+@benchmark("BaseAssessmentPhase.severity+total_score", sized=False)
+def _scoring(size):
+    from assessments.definitions import PhaseMap
+    rng = random.Random(0)
+    scored = [(phase, _score_data(phase, rng)) for phase in PhaseMap.all() if phase.supports_scoring]
+    return lambda: [(phase.severity(data), phase.total_score(data)) for phase, data in scored]
+
+
+@benchmark("Prompts.get", sized=False)
+def _prompts_get(size):
+    from chat.chains import Prompts
+    names = ["eval", "score", "dec.init", "dec.normal", "dec.ambiguous", "dec.drift",
+             "dec.clarify", "dec.skipped", "dec.conclude"]
+    return lambda: [Prompts.get(name) for name in names]
+
+
+@benchmark("prompt.format eval")
+def _format_eval(size):
+    from chat.chains import Prompts
+    from chat.services.conversation import HistoryManager
+    from assessments.definitions import PhaseMap
+    phase = PhaseMap.get_first()
+    prompt = Prompts.get("eval")
+    inputs = {
+        "message": "I have been feeling low most days",
+        "phase": phase.verbose_name,
+        "question_original": phase.get(phase.base_node_id).text,
+        "question": phase.get(phase.base_node_id).text,
+        "conversation": HistoryManager.qs_to_list(synthetic_conversation(size)),
+    }
+    return lambda: prompt.invoke(inputs)
+
+
+@benchmark("prompt.format score")
+def _format_score(size):
+    from chat.chains import Prompts
+    from chat.services.conversation import HistoryManager
+    from assessments.definitions import PhaseMap
+    phase = PhaseMap.get_first()
+    prompt = Prompts.get("score")
+    inputs = {
+        "phase": phase.verbose_name,
+        "questions_json": json.dumps(phase.get_questions_dict()),
+        "conversation_json": json.dumps(HistoryManager.qs_to_dict(synthetic_conversation(size))),
+    }
+    return lambda: prompt.invoke(inputs)
+
+
+@benchmark("ChatMessageSerializer(many=True)")
+def _message_serializer(size):
+    from chat.serializers import ChatMessageSerializer
+    messages = synthetic_conversation(size)
+    return lambda: ChatMessageSerializer(messages, many=True).data
+
+
+@benchmark("ChatSessionSerializer", sized=False)
+def _session_serializer(size):
+    from assessments.definitions import PhaseMap
+    from chat.models import ChatSession
+    from chat.serializers import ChatSessionSerializer
+    session = ChatSession(
+        id="sess_benchmark", conversation_id="conv_benchmark", status="open", init=False,
+        phase=PhaseMap.first(), node_id="1", retries=0, last_msg="How have you been?",
+        timestamp=datetime(2025, 1, 1, tzinfo=timezone.utc),
+    )
+    return lambda: ChatSessionSerializer(session).data
+
+
+# --- running and comparing ----------------------------------------------------------------------
+
+def available() -> List[str]:
+    return list(_registry)
+
+
+def time_call(func: Callable[[], Any], repeat: int = 5, min_time: float = 0.2) -> float:
+    """
+    Best time of one call of `func` in seconds, over `repeat` rounds of at
+    least `min_time` seconds each.
+    """
+    timer = timeit.Timer(func)
+    number, elapsed = timer.autorange()
+    number = max(1, int(number * min_time / max(elapsed, 1e-9)))
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def run(sizes: List[int], names: Optional[List[str]] = None, repeat: int = 5,
+        progress: Callable[[str, float], None] = None) -> Dict[str, Any]:
+    """
+    Runs the benchmarks (all when `names` is empty) and returns the result
+    document: metadata and seconds per call by "name[size]".
+    """
+    results = {}
+    for name in names or available():
+        bench = _registry[name]
+        for size in sizes if bench.sized else [None]:
+            key = f"{name}[{size}]" if size is not None else name
+            seconds = time_call(bench.setup(size), repeat=repeat)
+            results[key] = seconds
+            if progress:
+                progress(key, seconds)
+    return {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "machine": f"{platform.system()} {platform.machine()} {platform.node()}",
+        "sizes": sizes,
+        "results": results,
+    }
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=settings.BASE_DIR,
+            capture_output=True, text=True, timeout=5,
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> List[Dict[str, Any]]:
+    """
+    Compares the benchmarks present in both result documents. A benchmark
+    regressed when it is more than `threshold` (ex. 0.2 = 20%) slower.
+    """
+    rows = []
+    for key, seconds in current["results"].items():
+        before = baseline["results"].get(key)
+        if before is None:
+            continue
+        ratio = seconds / before if before else float("inf")
+        rows.append({
+            "benchmark": key,
+            "baseline": before,
+            "current": seconds,
+            "ratio": ratio,
+            "regressed": ratio > 1 + threshold,
+        })
+    return rows
+
+
+def results_dir() -> Path:
+    return Path(settings.BENCHMARKS_DIR)
+
+
+def save(document: Dict[str, Any], path: Path) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(document, f, indent=2)
+
+
+def load(path: Path) -> Dict[str, Any]:
+    with open(path) as f:
+        return json.load(f)
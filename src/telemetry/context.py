@@ -0,0 +1,102 @@
+"""
+Per-request telemetry context.
+
+`RequestStats` accumulates timing of the request being handled (database
+and LLM time, query count) along with a few identifying fields. It lives in
+a context variable set by `AccessLogMiddleware`, so code anywhere in the
+request can add to it without passing it around.
+
+Example usage:
+```
+with track_llm():
+    response = chain.invoke(...)
+
+annotate(session_id=chat_session.id)
+```
+"""
+
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, Iterator, Optional
+
+
+@dataclass
+class RequestStats:
+    started: float = field(default_factory=time.perf_counter)
+    db_time: float = 0.0
+    db_queries: int = 0
+    llm_time: float = 0.0
+    llm_calls: int = 0
+    role: Optional[str] = None
+    session_id: Optional[str] = None
+    trace_id: Optional[str] = None
+
+    @property
+    def duration(self) -> float:
+        return time.perf_counter() - self.started
+
+    def as_dict(self) -> Dict[str, Any]:
+        data = asdict(self)
+        data.pop('started')
+        return data
+
+
+_current: ContextVar[Optional[RequestStats]] = ContextVar('request_stats', default=None)
+
+
+def current() -> Optional[RequestStats]:
+    """
+    Stats of the request being handled, or None outside of a request.
+    """
+    return _current.get()
+
+
+@contextmanager
+def request_context() -> Iterator[RequestStats]:
+    stats = RequestStats()
+    token = _current.set(stats)
+    try:
+        yield stats
+    finally:
+        _current.reset(token)
+
+
+def annotate(**fields) -> None:
+    """
+    Sets identifying fields (ex. `session_id`) on the current request stats.
+    """
+    stats = _current.get()
+    if stats is not None:
+        for name, value in fields.items():
+            setattr(stats, name, value)
+
+
+@contextmanager
+def track_llm() -> Iterator[None]:
+    """
+    Adds the time spent in the block to the LLM time of the current request.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats = _current.get()
+        if stats is not None:
+            stats.llm_time += time.perf_counter() - start
+            stats.llm_calls += 1
+
+
+def db_timer(execute, sql, params, many, context):
+    """
+    `connection.execute_wrapper()` hook adding query time to the current request.
+    """
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats = _current.get()
+        if stats is not None:
+            stats.db_time += time.perf_counter() - start
+            stats.db_queries += 1
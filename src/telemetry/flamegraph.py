@@ -0,0 +1,90 @@
+"""
+Flamegraph rendering of aggregated stack samples.
+"""
+
+from html import escape
+from typing import Dict, Iterable, List, Tuple
+from zlib import crc32
+
+
+class Node:
+    __slots__ = ('name', 'value', 'children')
+
+    def __init__(self, name: str):
+        self.name = name
+        self.value = 0.0
+        self.children: Dict[str, 'Node'] = {}
+
+
+def build_tree(stacks: Iterable[Tuple[List[str], float]]) -> Node:
+    root = Node('all')
+    for stack, weight in stacks:
+        node = root
+        node.value += weight
+        for frame in stack:
+            node = node.children.setdefault(frame, Node(frame))
+            node.value += weight
+    return root
+
+
+def collapsed(stacks: Iterable[Tuple[List[str], float]]) -> List[str]:
+    """
+    Merged stacks in the collapsed format of flamegraph.pl / speedscope
+    (`frame;frame;frame weight`).
+    """
+    merged: Dict[str, float] = {}
+    for stack, weight in stacks:
+        key = ';'.join(frame.replace(';', ',') for frame in stack)
+        merged[key] = merged.get(key, 0) + weight
+    return [f"{key} {round(value)}" for key, value in sorted(merged.items())]
+
+
+def _color(name: str) -> str:
+    h = crc32(name.encode())
+    # project code warm, library code cooler
+    if 'site-packages' in name or 'lib/python' in name:
+        return f"rgb({180 + h % 50},{150 + (h >> 8) % 60},{60 + (h >> 16) % 40})"
+    return f"rgb({220 + h % 35},{80 + (h >> 8) % 90},{40 + (h >> 16) % 30})"
+
+
+def render_svg(root: Node, title: str, width: int = 1600, row: int = 17, min_width: float = 0.5) -> str:
+    """
+    Renders the tree as a static SVG flamegraph (root at the bottom). Frame
+    widths are proportional to their sampled time; hover shows the details.
+    """
+    depth = _depth(root)
+    height = (depth + 1) * row + 40
+    scale = (width - 20) / root.value if root.value else 0
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+        f'font-family="Verdana, sans-serif" font-size="11">',
+        f'<rect width="100%" height="100%" fill="#f8f8f8"/>',
+        f'<text x="{width / 2}" y="20" text-anchor="middle" font-size="15">{escape(title)}</text>',
+    ]
+
+    def draw(node: Node, x: float, level: int):
+        w = node.value * scale
+        if w < min_width:
+            return
+        y = height - (level + 1) * row - 5
+        share = node.value / root.value * 100
+        parts.append(
+            f'<g><title>{escape(node.name)} ({node.value:.0f} ms, {share:.2f}%)</title>'
+            f'<rect x="{x + 10:.1f}" y="{y}" width="{w:.1f}" height="{row - 1}" fill="{_color(node.name)}" rx="2"/>'
+        )
+        chars = int(w / 7)
+        if chars >= 3:
+            label = node.name if len(node.name) <= chars else node.name[:chars - 2] + '..'
+            parts.append(f'<text x="{x + 13:.1f}" y="{y + row - 5}">{escape(label)}</text>')
+        parts.append('</g>')
+        for child in sorted(node.children.values(), key=lambda n: n.name):
+            draw(child, x, level + 1)
+            x += child.value * scale
+
+    draw(root, 0, 0)
+    parts.append('</svg>')
+    return '\n'.join(parts)
+
+
+def _depth(node: Node) -> int:
+    return 1 + max((_depth(child) for child in node.children.values()), default=0)
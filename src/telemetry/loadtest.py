@@ -0,0 +1,344 @@
+"""
+HTTP load-testing harness for the chat and dashboard endpoints.
+
+Virtual patients log in with the token API, load their chat history and
+then talk through a whole session (PHQ-9, GAD-7 and monitoring phases)
+with POST `/chat/api/chat/` until the session is closed, then start over.
+Virtual doctors browse the dashboard (assessment list, assessment
+details, keywords and search) with think times in between, on sessions
+created for them up front (the web login form has a captcha). Every
+request is timed per endpoint.
+
+While a run is in progress the database connections of the stack are
+sampled from `pg_stat_activity` (PostgreSQL only).
+
+Only the standard library is used on the client side, so the harness adds
+no dependencies. `manage.py loadtest` seeds the test users (with a random
+password per run, deleted afterwards) and runs the scenario against
+gunicorn configurations it starts itself, or against an already running
+stack (`--url`).
+"""
+
+import json
+import math
+import os
+import random
+import re
+import signal
+import subprocess
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from django.db import connections
+
+
+PATIENT_PREFIX = 'loadtest_patient_'
+DOCTOR_PREFIX = 'loadtest_doctor_'
+
+# answers a patient may give; the LLM stand-in decides how they are evaluated
+ANSWERS = [
+    "Yes, most days this week.",
+    "Not really, I've been okay.",
+    "Sometimes, maybe a couple of days.",
+    "I'm not sure what you mean.",
+    "Nearly every day, it's been hard.",
+    "No, not at all.",
+    "Can we talk about something else?",
+]
+
+_ASSESSMENT_LINK = re.compile(r"/dashboard/assessments/([\w-]+)/")
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    """
+    Nearest-rank percentile of an ascending list.
+    """
+    if not sorted_values:
+        return 0.0
+    rank = max(math.ceil(p / 100 * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+
+class Recorder:
+    """
+    Thread-safe collection of request timings, by endpoint label.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.timings: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.counters: Dict[str, int] = defaultdict(int)
+
+    def add(self, label: str, seconds: float, ok: bool) -> None:
+        with self._lock:
+            self.timings[label].append(seconds)
+            if not ok:
+                self.errors[label] += 1
+
+    def count(self, name: str, n: int = 1) -> None:
+        with self._lock:
+            self.counters[name] += n
+
+    def summary(self, duration: float) -> List[Dict[str, Any]]:
+        rows = []
+        with self._lock:
+            for label, values in sorted(self.timings.items()):
+                values = sorted(values)
+                rows.append({
+                    'endpoint': label,
+                    'requests': len(values),
+                    'errors': self.errors[label],
+                    'rps': round(len(values) / duration, 2) if duration else 0.0,
+                    'mean_ms': round(sum(values) / len(values) * 1000, 1),
+                    'p50_ms': round(percentile(values, 50) * 1000, 1),
+                    'p95_ms': round(percentile(values, 95) * 1000, 1),
+                    'p99_ms': round(percentile(values, 99) * 1000, 1),
+                })
+        return rows
+
+
+class HttpClient:
+    """
+    Minimal HTTP client recording the timing of every request.
+    """
+
+    def __init__(self, base_url: str, recorder: Recorder, timeout: float = 120.0):
+        self.base_url = base_url.rstrip('/')
+        self.recorder = recorder
+        self.timeout = timeout
+        self.headers: Dict[str, str] = {}
+
+    def request(self, method: str, path: str, label: str, json_body: Any = None) -> tuple:
+        headers = dict(self.headers)
+        data = None
+        if json_body is not None:
+            data = json.dumps(json_body).encode()
+            headers['Content-Type'] = 'application/json'
+        request = urllib.request.Request(self.base_url + path, data=data, method=method, headers=headers)
+
+        started = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                status, body = response.status, response.read()
+        except urllib.error.HTTPError as e:
+            status, body = e.code, e.read()
+        except (urllib.error.URLError, TimeoutError, ConnectionError):
+            status, body = 0, b''
+        self.recorder.add(label, time.perf_counter() - started, 200 <= status < 400)
+        return status, body
+
+
+@dataclass
+class Scenario:
+    base_url: str
+    duration: float
+    password: str  # of the seeded patients
+    recorder: Recorder = field(default_factory=Recorder)
+    think_time: float = 1.0  # mean seconds between a user's requests
+    max_turns: int = 200  # per chat session, in case a session never concludes
+    stop: threading.Event = field(default_factory=threading.Event)
+
+    def pause(self, rng: random.Random) -> None:
+        if self.think_time > 0:
+            self.stop.wait(rng.expovariate(1 / self.think_time))
+
+    def patient(self, username: str, seed: int) -> None:
+        rng = random.Random(seed)
+        client = HttpClient(self.base_url, self.recorder)
+        status, body = client.request('POST', '/accounts/api/get-auth/', 'POST /accounts/api/get-auth/',
+                                      json_body={'username': username, 'password': self.password})
+        if status != 200:
+            self.recorder.count('patient_login_failures')
+            return
+        client.headers['Authorization'] = f"Token {json.loads(body)['token']}"
+        client.request('GET', '/chat/api/chat/', 'GET /chat/api/chat/')
+
+        turns = 0
+        while not self.stop.is_set():
+            self.pause(rng)
+            status, body = client.request('POST', '/chat/api/chat/', 'POST /chat/api/chat/',
+                                          json_body={'query': rng.choice(ANSWERS)})
+            turns += 1
+            self.recorder.count('chat_turns')
+            if status != 200:
+                continue
+            session = json.loads(body).get('session') or {}
+            if session.get('status') == 'closed' or turns >= self.max_turns:
+                # the session was concluded; the next message opens a new one
+                self.recorder.count('chat_sessions_completed')
+                turns = 0
+                client.request('GET', '/chat/api/chat/', 'GET /chat/api/chat/')
+
+    def doctor(self, session_cookie: str, seed: int) -> None:
+        rng = random.Random(seed)
+        client = HttpClient(self.base_url, self.recorder)
+        client.headers['Cookie'] = session_cookie
+
+        while not self.stop.is_set():
+            status, body = client.request('GET', '/dashboard/', 'GET /dashboard/')
+            if status != 200:
+                self.recorder.count('doctor_failures')
+                self.pause(rng)
+                continue
+            ids = _ASSESSMENT_LINK.findall(body.decode(errors='replace'))
+            for assessment_id in rng.sample(ids, min(len(ids), 3)):
+                self.pause(rng)
+                client.request('GET', f'/dashboard/assessments/{assessment_id}/', 'GET /dashboard/assessments/<id>/')
+            self.pause(rng)
+            client.request('GET', '/dashboard/keywords/', 'GET /dashboard/keywords/')
+            self.pause(rng)
+            term = rng.choice(['sleep', 'tired', 'worry', 'appetite'])
+            client.request('GET', f'/dashboard/api/search/?q={term}', 'GET /dashboard/api/search/')
+            self.pause(rng)
+
+    def run(self, patients: List[str], doctors: List[str]) -> float:
+        """
+        Runs every virtual user in its own thread for `duration` seconds:
+        patients by username, doctors by session cookie. Returns the measured
+        duration.
+        """
+        threads = [
+            threading.Thread(target=self.patient, args=(name, i), daemon=True)
+            for i, name in enumerate(patients)
+        ] + [
+            threading.Thread(target=self.doctor, args=(cookie, 10_000 + i), daemon=True)
+            for i, cookie in enumerate(doctors)
+        ]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        self.stop.wait(self.duration)
+        self.stop.set()
+        for thread in threads:
+            thread.join(timeout=130)
+        return time.perf_counter() - started
+
+
+class ConnectionSampler:
+    """
+    Samples the client connections to the database from `pg_stat_activity`
+    (total and active) in a background thread.
+    """
+
+    QUERY = (
+        "SELECT count(*), count(*) FILTER (WHERE state = 'active') FROM pg_stat_activity "
+        "WHERE datname = current_database() AND backend_type = 'client backend' AND pid <> pg_backend_pid()"
+    )
+
+    def __init__(self, interval: float = 0.5, using: str = 'default'):
+        self.interval = interval
+        self.using = using
+        self.samples: List[tuple] = []
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def supported(self) -> bool:
+        return connections[self.using].vendor == 'postgresql'
+
+    def _run(self) -> None:
+        connection = connections[self.using]
+        try:
+            while not self._stop.is_set():
+                with connection.cursor() as cursor:
+                    cursor.execute(self.QUERY)
+                    self.samples.append(cursor.fetchone())
+                self._stop.wait(self.interval)
+        finally:
+            connection.close()
+
+    def __enter__(self) -> 'ConnectionSampler':
+        if self.supported:
+            self._thread = threading.Thread(target=self._run, name='db-connection-sampler', daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def summary(self) -> Optional[Dict[str, float]]:
+        if not self.samples:
+            return None
+        total = [sample[0] for sample in self.samples]
+        active = [sample[1] for sample in self.samples]
+        return {
+            'max': max(total),
+            'mean': round(sum(total) / len(total), 1),
+            'max_active': max(active),
+            'mean_active': round(sum(active) / len(active), 1),
+        }
+
+
+class Server:
+    """
+    Starts a server command (ex. gunicorn) in its own process group and
+    waits until it answers, stops it on exit.
+    """
+
+    def __init__(self, command: List[str], base_url: str, cwd: str, env: Dict[str, str], timeout: float = 60.0):
+        self.command = command
+        self.base_url = base_url
+        self.cwd = cwd
+        self.env = env
+        self.timeout = timeout
+        self.process = None
+
+    def __enter__(self) -> 'Server':
+        self.process = subprocess.Popen(
+            self.command, cwd=self.cwd, env={**os.environ, **self.env},
+            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, start_new_session=True,
+        )
+        deadline = time.monotonic() + self.timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"{self.command[0]} exited: {self.process.stderr.read().decode()[-2000:]}")
+            try:
+                with urllib.request.urlopen(self.base_url + '/accounts/login/', timeout=2):
+                    return self
+            except urllib.error.HTTPError:
+                return self  # answering, even if with an error
+            except (urllib.error.URLError, ConnectionError, TimeoutError):
+                time.sleep(0.5)
+        self.__exit__()
+        raise RuntimeError(f"{' '.join(self.command)} did not answer within {self.timeout:.0f}s")
+
+    def __exit__(self, *exc) -> None:
+        if self.process is None or self.process.poll() is not None:
+            return
+        os.killpg(self.process.pid, signal.SIGTERM)
+        try:
+            self.process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            os.killpg(self.process.pid, signal.SIGKILL)
+            self.process.wait()
+
+
+def run_load(base_url: str, patients: List[str], doctors: List[str], duration: float, password: str,
+             think_time: float = 1.0) -> Dict[str, Any]:
+    """
+    Runs the scenario against `base_url` and returns the report: run totals,
+    per-endpoint latencies and database connection usage.
+    """
+    scenario = Scenario(base_url=base_url, duration=duration, password=password, think_time=think_time)
+    with ConnectionSampler() as sampler:
+        elapsed = scenario.run(patients, doctors)
+    rows = scenario.recorder.summary(elapsed)
+    return {
+        'duration_s': round(elapsed, 1),
+        'patients': len(patients),
+        'doctors': len(doctors),
+        'requests': sum(row['requests'] for row in rows),
+        'errors': sum(row['errors'] for row in rows),
+        'rps': round(sum(row['requests'] for row in rows) / elapsed, 2),
+        'counters': dict(scenario.recorder.counters),
+        'endpoints': rows,
+        'db_connections': sampler.summary(),
+    }
@@ -0,0 +1,150 @@
+"""
+Non-blocking logging.
+
+`AsyncQueueHandler` only puts records on a queue; a `BatchQueueListener`
+thread drains the queue in batches, formats the records and hands them to
+the real handlers, which are flushed once per batch. File writes, JSON
+encoding and rotation therefore never run on the request thread.
+
+Configured through `LOGGING` (Python 3.12+ `dictConfig` queue handler
+support):
+```
+"access": {
+    "class": "telemetry.logging.AsyncQueueHandler",
+    "handlers": ["access_file"],
+    "listener": "telemetry.logging.BatchQueueListener",
+    "queue": {"()": "queue.Queue", "maxsize": 10000},
+},
+"access_file": {
+    "class": "telemetry.logging.BatchRotatingFileHandler",
+    ...
+}
+```
+"""
+
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+
+class AsyncQueueHandler(QueueHandler):
+    """
+    QueueHandler that starts its listener on first use in each process
+    (listener threads do not survive a fork, ex. gunicorn `--preload`) and
+    drops records instead of blocking when the queue is full.
+    """
+
+    listener: QueueListener = None
+
+    def __init__(self, queue):
+        super().__init__(queue)
+        self._pid = None
+        self._start_lock = threading.Lock()
+        self.dropped = 0
+
+    def _ensure_listener(self) -> None:
+        if self._pid == os.getpid() or self.listener is None:
+            return
+        with self._start_lock:
+            if self._pid != os.getpid():
+                self.listener._thread = None
+                self.listener.start()
+                self._pid = os.getpid()
+                atexit.register(self.listener.stop)
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # formatting is left to the listener thread; only the message is
+        # merged so later changes to mutable args do not leak into the log
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def emit(self, record: logging.LogRecord) -> None:
+        self._ensure_listener()
+        super().emit(record)
+
+
+class BatchQueueListener(QueueListener):
+    """
+    QueueListener that handles up to `batch_size` queued records at a time
+    and flushes its handlers once per batch.
+    """
+
+    batch_size = 500
+
+    def _monitor(self):
+        q = self.queue
+        has_task_done = hasattr(q, 'task_done')
+        stop = False
+        while not stop:
+            batch = [self.dequeue(True)]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(q.get_nowait())
+                except queue.Empty:
+                    break
+            for record in batch:
+                if record is self._sentinel:
+                    stop = True
+                else:
+                    self.handle(record)
+                if has_task_done:
+                    q.task_done()
+            for handler in self.handlers:
+                handler.flush()
+
+
+class BatchRotatingFileHandler(RotatingFileHandler):
+    """
+    RotatingFileHandler that leaves flushing to the caller (see
+    `BatchQueueListener`) and formats each record once; the stock handler
+    formats it a second time to decide on rollover. Creates the log's
+    directory when missing.
+    """
+
+    def _open(self):
+        os.makedirs(os.path.dirname(self.baseFilename), exist_ok=True)
+        return super()._open()
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            msg = self.format(record) + self.terminator
+            if self.stream is None:
+                self.stream = self._open()
+            if self.maxBytes > 0 and self.stream.tell() + len(msg) >= self.maxBytes:
+                self.doRollover()
+            self.stream.write(msg)
+        except RecursionError:
+            raise
+        except Exception:
+            self.handleError(record)
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats records as one JSON object per line. Structured fields passed as
+    `extra={"fields": {...}}` are merged into the object.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        data.update(getattr(record, 'fields', None) or {})
+        if record.exc_info:
+            data['exc'] = self.formatException(record.exc_info)
+        return json.dumps(data, default=str, separators=(',', ':'))
@@ -0,0 +1,83 @@
+# telemetry/management/commands/benchmark.py
+
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from telemetry import benchmarks
+
+
+class Command(BaseCommand):
+    help = (
+        'Runs the micro-benchmarks of the per-turn pipeline functions over synthetic conversations, '
+        'stores the results and compares them against the baseline (see telemetry.benchmarks).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('names', nargs='*', help="benchmarks to run (default all)")
+        parser.add_argument('--sizes', type=str, default='10,100,1000,10000',
+                            help="comma separated conversation sizes (messages)")
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--baseline', type=str, default=None,
+                            help="baseline result file (default BENCHMARKS_DIR/baseline.json)")
+        parser.add_argument('--save-baseline', action='store_true', help="store this run as the baseline")
+        parser.add_argument('--threshold', type=float, default=0.2,
+                            help="slowdown ratio counted as a regression (0.2 = 20%%)")
+        parser.add_argument('--fail-on-regression', action='store_true', help="exit with an error on regressions")
+        parser.add_argument('--list', action='store_true', help="list the benchmarks and exit")
+
+    def handle(self, *args, **options):
+        if options['list']:
+            for name in benchmarks.available():
+                self.stdout.write(name)
+            return
+
+        unknown = set(options['names']) - set(benchmarks.available())
+        if unknown:
+            raise CommandError(f"Unknown benchmarks: {', '.join(sorted(unknown))}")
+        sizes = [int(size) for size in options['sizes'].split(',') if size]
+
+        document = benchmarks.run(
+            sizes, options['names'], repeat=options['repeat'],
+            progress=lambda key, seconds: self.stdout.write(f"{key:<55}{self.format_time(seconds):>12}"),
+        )
+
+        directory = benchmarks.results_dir()
+        path = directory / 'results' / f"{document['created_at'][:19].replace(':', '')}.json"
+        benchmarks.save(document, path)
+        self.stdout.write(f"results written to {path}")
+
+        baseline_path = Path(options['baseline']) if options['baseline'] else directory / 'baseline.json'
+        if options['save_baseline']:
+            benchmarks.save(document, baseline_path)
+            self.stdout.write(self.style.SUCCESS(f"baseline written to {baseline_path}"))
+            return
+        if not baseline_path.exists():
+            self.stdout.write(f"no baseline at {baseline_path}; store one with --save-baseline")
+            return
+
+        baseline = benchmarks.load(baseline_path)
+        rows = benchmarks.compare(document, baseline, options['threshold'])
+        self.stdout.write(f"\ncompared with baseline {baseline.get('commit') or ''} ({baseline['created_at'][:19]})")
+        regressions = 0
+        for row in rows:
+            line = (
+                f"{row['benchmark']:<55}{self.format_time(row['baseline']):>12}"
+                f"{self.format_time(row['current']):>12}{row['ratio']:>8.2f}x"
+            )
+            if row['regressed']:
+                regressions += 1
+                line = self.style.ERROR(line + "  REGRESSION")
+            self.stdout.write(line)
+
+        if regressions and options['fail_on_regression']:
+            raise CommandError(f"{regressions} benchmarks regressed by more than {options['threshold']:.0%}")
+        self.stdout.write(self.style.SUCCESS(f"{len(rows)} compared, {regressions} regressions"))
+
+    @staticmethod
+    def format_time(seconds):
+        if seconds >= 1:
+            return f"{seconds:.2f} s"
+        if seconds >= 1e-3:
+            return f"{seconds * 1e3:.2f} ms"
+        return f"{seconds * 1e6:.1f} us"
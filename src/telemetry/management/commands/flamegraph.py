@@ -0,0 +1,56 @@
+# telemetry/management/commands/flamegraph.py
+
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from telemetry.flamegraph import build_tree, collapsed, render_svg
+from telemetry.profiling import load_stacks
+
+
+class Command(BaseCommand):
+    help = (
+        'Aggregates slow-request profiles written by the profiling middleware into a flamegraph '
+        '(SVG, or collapsed stacks for flamegraph.pl / speedscope).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dir', type=str, default=None, help="profiles directory (default PROFILING['DIR'])")
+        parser.add_argument('--view', type=str, default=None, help="only profiles of this view name, ex. chat:chat")
+        parser.add_argument('--hours', type=float, default=None, help="only profiles of the last N hours")
+        parser.add_argument('--min-ms', type=float, default=0, help="only requests slower than this")
+        parser.add_argument('--format', choices=['svg', 'collapsed'], default='svg')
+        parser.add_argument('-o', '--output', type=str, default='flamegraph.svg', help="output file")
+
+    def handle(self, *args, **options):
+        directory = Path(options['dir'] or settings.PROFILING['DIR'])
+        if not directory.exists():
+            raise CommandError(f"No profiles directory at {directory}")
+        since = datetime.now(timezone.utc) - timedelta(hours=options['hours']) if options['hours'] else None
+
+        stacks, used, total_ms = [], 0, 0.0
+        for path in sorted(directory.glob('*.speedscope.json')):
+            metadata, samples = load_stacks(path)
+            if options['view'] and metadata.get('view') != options['view']:
+                continue
+            if metadata.get('duration_ms', 0) < options['min_ms']:
+                continue
+            if since and datetime.fromisoformat(metadata['started_at']) < since:
+                continue
+            stacks.extend(samples)
+            used += 1
+            total_ms += metadata.get('duration_ms', 0)
+
+        if not used:
+            raise CommandError("No matching profiles")
+
+        title = f"{used} slow requests" + (f" to {options['view']}" if options['view'] else '') + \
+            f", {total_ms / used:.0f} ms average"
+        if options['format'] == 'svg':
+            output = render_svg(build_tree(stacks), title)
+        else:
+            output = '\n'.join(collapsed(stacks)) + '\n'
+        Path(options['output']).write_text(output)
+        self.stdout.write(self.style.SUCCESS(f"Aggregated {used} profiles into {options['output']}"))
@@ -0,0 +1,195 @@
+# telemetry/management/commands/loadtest.py
+
+import json
+import secrets
+import sys
+from importlib import import_module
+
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY, get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from accounts.models import Doctor, Patient
+from chat.models import ChatSession
+from telemetry.loadtest import DOCTOR_PREFIX, PATIENT_PREFIX, Server, run_load
+
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        'Load-tests the chat and dashboard endpoints with concurrent virtual patients (full assessment '
+        'conversations) and doctors (dashboard browsing). Starts gunicorn once per worker class with the '
+        'fake LLM stand-in, or targets a running stack with --url. Test users are created in the '
+        'configured database with a random password, and deleted with their data after the runs; '
+        'outside of DEBUG this needs --allow-seed.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', type=str, default=None,
+                            help="run against this already running stack instead of starting gunicorn")
+        parser.add_argument('--worker-classes', type=str, default='sync,gthread',
+                            help="comma separated gunicorn worker classes to compare, ex. sync,gthread,gevent")
+        parser.add_argument('--workers', type=int, default=3, help="gunicorn workers (one per beacon replica)")
+        parser.add_argument('--threads', type=int, default=8, help="threads per gthread worker")
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--patients', type=int, default=20, help="concurrent virtual patients")
+        parser.add_argument('--doctors', type=int, default=3, help="concurrent virtual doctors")
+        parser.add_argument('--duration', type=float, default=120, help="seconds per run")
+        parser.add_argument('--think-time', type=float, default=1.0, help="mean seconds between a user's requests")
+        parser.add_argument('--llm-latency', type=float, default=1.5, help="median LLM stand-in latency (s)")
+        parser.add_argument('--llm-latency-sigma', type=float, default=0.5)
+        parser.add_argument('--json', type=str, default=None, help="also write the reports to this file")
+        parser.add_argument('--allow-seed', action='store_true',
+                            help="create the test users (doctors can read every patient) even with DEBUG off")
+
+    def handle(self, *args, **options):
+        if not settings.DEBUG and not options['allow_seed']:
+            raise CommandError(
+                "Refusing to create load test users with DEBUG off: pass --allow-seed if this database "
+                "is meant for load tests"
+            )
+        password = secrets.token_urlsafe(24)
+        patients, doctors = self.seed(options['patients'], options['doctors'], password)
+        self.session_keys = []
+        try:
+            self.run(patients, doctors, password, options)
+        finally:
+            store = import_module(settings.SESSION_ENGINE).SessionStore
+            for session_key in self.session_keys:
+                store(session_key).delete()
+            self.cleanup()
+
+    def run(self, patients, doctors, password, options):
+        doctor_cookies = self.doctor_sessions(doctors)
+
+        if options['url']:
+            runs = {'external': None}
+        else:
+            runs = {name: name for name in options['worker_classes'].split(',') if name}
+
+        reports = {}
+        for name, worker_class in runs.items():
+            self.reset_sessions()
+            self.stdout.write(f"\n== {name}: {len(patients)} patients, {len(doctors)} doctors, {options['duration']:.0f}s")
+            try:
+                if worker_class is None:
+                    report = run_load(options['url'], patients, doctor_cookies, options['duration'],
+                                      password, options['think_time'])
+                else:
+                    base_url = f"http://localhost:{options['port']}"
+                    with Server(self.gunicorn(worker_class, options), base_url, str(settings.BASE_DIR), env={
+                        'LLM_STANDIN': 'fake',
+                        'LLM_STANDIN_LATENCY': str(options['llm_latency']),
+                        'LLM_STANDIN_LATENCY_SIGMA': str(options['llm_latency_sigma']),
+                    }):
+                        report = run_load(base_url, patients, doctor_cookies, options['duration'],
+                                          password, options['think_time'])
+            except RuntimeError as e:
+                self.stderr.write(self.style.ERROR(f"{name} failed: {e}"))
+                continue
+            reports[name] = report
+            self.print_report(report)
+
+        if len(reports) > 1:
+            self.stdout.write("\n== comparison")
+            for name, report in reports.items():
+                chat = next((row for row in report['endpoints'] if row['endpoint'] == 'POST /chat/api/chat/'), {})
+                db = report['db_connections'] or {}
+                self.stdout.write(
+                    f"{name:>10}: {report['rps']:7.2f} req/s, chat p95 {chat.get('p95_ms', 0):8.1f} ms, "
+                    f"errors {report['errors']}, db connections max {db.get('max', '-')}"
+                )
+
+        if options['json']:
+            with open(options['json'], 'w') as f:
+                json.dump(reports, f, indent=2)
+        if not reports:
+            raise CommandError("No run completed")
+
+    @staticmethod
+    def gunicorn(worker_class, options):
+        command = [
+            sys.executable, '-m', 'gunicorn', 'beaconmind.wsgi:application',
+            '--bind', f"127.0.0.1:{options['port']}",
+            '--workers', str(options['workers']),
+            '--worker-class', worker_class,
+        ]
+        if worker_class == 'gthread':
+            command += ['--threads', str(options['threads'])]
+        return command
+
+    @classmethod
+    def seed(cls, n_patients, n_doctors, password):
+        """
+        Creates the test users, all with `password`, replacing those left by an interrupted run.
+        """
+        patients = [f"{PATIENT_PREFIX}{i}" for i in range(n_patients)]
+        doctors = [f"{DOCTOR_PREFIX}{i}" for i in range(n_doctors)]
+        encoded = make_password(password)
+        cls.cleanup()
+        with transaction.atomic():
+            for usernames, role, profile in ((patients, 'patient', Patient), (doctors, 'doctor', Doctor)):
+                users = User.objects.bulk_create([
+                    User(username=username, email=f"{username}@example.com", password=encoded, role=role)
+                    for username in usernames
+                ])
+                profile.objects.bulk_create([profile(user=user) for user in users])
+        return patients, doctors
+
+    @staticmethod
+    def cleanup():
+        """
+        Deletes the test users with their conversations, assessments and sessions.
+        """
+        # web sessions of deleted users are rejected, whether or not they were deleted here
+        User.objects.filter(username__regex=rf"^({PATIENT_PREFIX}|{DOCTOR_PREFIX})\d+$").delete()
+
+    def doctor_sessions(self, doctors):
+        """
+        Logged in sessions for the test doctors, as `Cookie` header values
+        (the web login form has a captcha).
+        """
+        store = import_module(settings.SESSION_ENGINE).SessionStore
+        cookies = []
+        for user in User.objects.filter(username__in=doctors):
+            session = store()
+            session[SESSION_KEY] = user._meta.pk.value_to_string(user)
+            session[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+            session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+            session.save()
+            self.session_keys.append(session.session_key)
+            cookies.append(f"{settings.SESSION_COOKIE_NAME}={session.session_key}")
+        return cookies
+
+    @staticmethod
+    def reset_sessions():
+        # every virtual patient starts a fresh session at the first phase
+        ChatSession.objects.filter(
+            conversation__user__username__startswith=PATIENT_PREFIX, status='open',
+        ).update(status='aborted')
+
+    def print_report(self, report):
+        self.stdout.write(
+            f"{report['requests']} requests in {report['duration_s']}s ({report['rps']} req/s), "
+            f"{report['errors']} errors, {report['counters']}"
+        )
+        self.stdout.write(
+            f"{'endpoint':<36}{'requests':>9}{'errors':>8}{'req/s':>8}{'mean':>9}{'p50':>9}{'p95':>9}{'p99':>9}  (ms)"
+        )
+        for row in report['endpoints']:
+            self.stdout.write(
+                f"{row['endpoint']:<36}{row['requests']:>9}{row['errors']:>8}{row['rps']:>8.2f}"
+                f"{row['mean_ms']:>9.1f}{row['p50_ms']:>9.1f}{row['p95_ms']:>9.1f}{row['p99_ms']:>9.1f}"
+            )
+        db = report['db_connections']
+        if db:
+            self.stdout.write(
+                f"db connections: max {db['max']} (active {db['max_active']}), "
+                f"mean {db['mean']} (active {db['mean_active']})"
+            )
+        else:
+            self.stdout.write("db connections: not sampled (PostgreSQL only)")
@@ -0,0 +1,177 @@
+"""
+Prometheus metrics.
+
+Request latency per view, latency of each stage of a chat turn, LLM calls
+and token usage, fast path predictions, eval and dec cache lookups and queue depths, exposed in Prometheus text format at
+`/metrics` (`telemetry.views.metrics`).
+
+Under gunicorn, set `PROMETHEUS_MULTIPROC_DIR` to an empty directory
+writable by the workers: each worker then writes its samples to
+memory-mapped files there and `/metrics` aggregates all of them (see
+`gunicorn.conf.py` for the clean-up hooks). Without it, metrics are those
+of the serving process only.
+
+Example usage:
+```
+with stage('history'):
+    history = history_manager.get_full_list()
+```
+"""
+
+import logging
+import os
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess,
+)
+
+
+# seconds; chat turns are dominated by LLM calls of a few seconds
+STAGE_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 20, 40)
+REQUEST_BUCKETS = (.01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 20, 40)
+
+REQUEST_SECONDS = Histogram(
+    'beacon_http_request_seconds', 'Request latency by view',
+    ['view', 'method', 'status'], buckets=REQUEST_BUCKETS,
+)
+REQUEST_DB_SECONDS = Histogram(
+    'beacon_http_request_db_seconds', 'Database time per request by view',
+    ['view'], buckets=STAGE_BUCKETS,
+)
+REQUESTS_IN_PROGRESS = Gauge(
+    'beacon_http_requests_in_progress', 'Requests being handled',
+    multiprocess_mode='livesum',
+)
+CHAT_STAGE_SECONDS = Histogram(
+    'beacon_chat_stage_seconds', 'Latency of chat turn stages',
+    ['stage'], buckets=STAGE_BUCKETS,
+)
+LLM_CALLS = Counter(
+    'beacon_llm_calls_total', 'LLM chain invocations',
+    ['stage', 'model', 'outcome'],
+)
+LLM_CALL_SECONDS = Histogram(
+    'beacon_llm_call_seconds', 'LLM call latency by whether the provider served the prompt prefix from cache',
+    ['stage', 'model', 'prefix_cache'], buckets=STAGE_BUCKETS,
+)
+LLM_REQUESTS = Counter(
+    'beacon_llm_requests_total', 'LLM requests fired by the call policy, by kind and result',
+    ['stage', 'model', 'kind', 'result'],
+)
+LLM_TOKENS = Counter(
+    'beacon_llm_tokens_total', 'LLM tokens used',
+    ['stage', 'model', 'kind'],
+)
+LLM_QUOTA_REQUESTS = Counter(
+    'beacon_llm_quota_requests_total', 'LLM requests admitted by the rate limit scheduler, by bucket backend',
+    ['model', 'backend', 'result'],
+)
+LLM_QUOTA_WAIT_SECONDS = Histogram(
+    'beacon_llm_quota_wait_seconds', 'Time LLM requests waited for rate limit quota',
+    ['stage', 'model'], buckets=STAGE_BUCKETS,
+)
+LLM_CIRCUIT_STATE = Gauge(
+    'beacon_llm_circuit_state', 'LLM circuit breaker state (0 closed, 1 half open, 2 open)',
+    multiprocess_mode='livemax',
+)
+CHAT_DEGRADED_TURNS = Counter(
+    'beacon_chat_degraded_turns_total', 'Chat turns answered in degraded mode, by reason (open circuit, failed call)',
+    ['reason'],
+)
+FASTPATH_PREDICTIONS = Counter(
+    'beacon_fastpath_predictions_total', 'Fast path eval predictions, against the eval chain in shadow mode',
+    ['mode', 'source', 'confident', 'outcome'],
+)
+EVAL_CACHE_LOOKUPS = Counter(
+    'beacon_eval_cache_lookups_total', 'Eval classification cache lookups by outcome',
+    ['outcome'],
+)
+LLM_OUTPUTS = Counter(
+    'beacon_llm_outputs_total', 'LLM chain outputs by validation outcome (valid, repaired, retried, failed)',
+    ['stage', 'outcome'],
+)
+SEMANTIC_CACHE_LOOKUPS = Counter(
+    'beacon_semantic_cache_lookups_total', 'Dec response semantic cache lookups by chat state',
+    ['state', 'outcome'],
+)
+QUEUE_DEPTH = Gauge(
+    'beacon_queue_depth', 'Items waiting in in-process queues',
+    ['queue'], multiprocess_mode='livesum',
+)
+QUEUE_DROPPED = Gauge(
+    'beacon_queue_dropped', 'Items dropped by full in-process queues since start',
+    ['queue'], multiprocess_mode='livesum',
+)
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """
+    Observes the duration of a chat turn stage.
+    """
+    with CHAT_STAGE_SECONDS.labels(name).time():
+        yield
+
+
+def cached_tokens(meta: Dict[str, Any]) -> int:
+    """
+    Prompt tokens the provider served from its prompt prefix cache, from
+    the response metadata.
+    """
+    usage = (meta or {}).get('token_usage') or {}
+    return (usage.get('prompt_tokens_details') or {}).get('cached_tokens') or 0
+
+
+def observe_llm(stage: str, response: Any = None, error: bool = False, seconds: Optional[float] = None) -> None:
+    """
+    Counts an LLM call of a pipeline stage and the tokens reported in the
+    response metadata (prompt tokens, of which "cached" from the provider's
+    prefix cache, and completion tokens), and observes its latency.
+    """
+    meta: Dict[str, Any] = getattr(response, 'response_metadata', None) or {}
+    model = meta.get('model_name') or 'unknown'
+    LLM_CALLS.labels(stage, model, 'error' if error else 'ok').inc()
+    usage = meta.get('token_usage') or {}
+    for kind in ('prompt_tokens', 'completion_tokens'):
+        if usage.get(kind):
+            LLM_TOKENS.labels(stage, model, kind.split('_')[0]).inc(usage[kind])
+    cached = cached_tokens(meta)
+    if cached:
+        LLM_TOKENS.labels(stage, model, 'cached').inc(cached)
+    if seconds is not None and not error:
+        LLM_CALL_SECONDS.labels(stage, model, 'hit' if cached else 'miss').observe(seconds)
+
+
+def observe_request(request, response, stats) -> None:
+    """
+    Records request latency and DB time, labelled by the resolved view name.
+    """
+    match = getattr(request, 'resolver_match', None)
+    view = (match.view_name or match._func_path) if match else 'unresolved'
+    REQUEST_SECONDS.labels(view, request.method, str(response.status_code)).observe(stats.duration)
+    REQUEST_DB_SECONDS.labels(view).observe(stats.db_time)
+
+
+def observe_queues() -> None:
+    """
+    Samples the depth of the queued log handlers.
+    """
+    for name in ('access',):
+        for handler in logging.getLogger(name).handlers:
+            if hasattr(handler, 'queue'):
+                QUEUE_DEPTH.labels(f'log_{name}').set(handler.queue.qsize())
+                QUEUE_DROPPED.labels(f'log_{name}').set(getattr(handler, 'dropped', 0))
+
+
+def render() -> tuple:
+    """
+    Returns (body, content type) of the current metrics.
+    """
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
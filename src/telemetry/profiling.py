@@ -0,0 +1,206 @@
+"""
+Sampling profiler for slow requests.
+
+While requests are in flight, one background thread per process samples
+the Python stacks of the threads handling them every
+`PROFILING['INTERVAL']` seconds (`sys._current_frames()`; requests are not
+slowed down by tracing hooks). When a request finishes after more than
+`PROFILING['SLOW_THRESHOLD']` seconds, its samples are written to
+`PROFILING['DIR']` as a speedscope file (https://www.speedscope.app) with
+the request metadata under the `beaconmind` key. Faster requests discard
+their samples.
+
+Samples are wall-clock: time spent waiting (ex. on the LLM API or the
+database) shows up in the stacks doing the waiting.
+
+`manage.py flamegraph` aggregates the files into a flamegraph.
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from django.conf import settings
+
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='profile-writer')
+
+
+def _config(name: str, default: Any = None) -> Any:
+    return getattr(settings, 'PROFILING', {}).get(name, default)
+
+
+@lru_cache(maxsize=4096)
+def _short_path(path: str) -> str:
+    for prefix in sorted({str(settings.BASE_DIR), *sys.path}, key=len, reverse=True):
+        if prefix and path.startswith(prefix):
+            return path[len(prefix):].lstrip(os.sep)
+    return path
+
+
+class RequestProfile:
+    """
+    Stack samples of one request.
+    """
+
+    def __init__(self, thread_id: int):
+        self.thread_id = thread_id
+        self.started = time.perf_counter()
+        self.started_at = datetime.now(timezone.utc)
+        self.samples: Counter = Counter()
+
+    def add(self, frame) -> None:
+        stack = []
+        max_depth = _config('MAX_DEPTH', 200)
+        while frame is not None and len(stack) < max_depth:
+            code = frame.f_code
+            stack.append((code.co_qualname, code.co_filename, code.co_firstlineno))
+            frame = frame.f_back
+        self.samples[tuple(reversed(stack))] += 1
+
+
+class Sampler:
+    """
+    Process-wide sampling thread, running only while requests are profiled.
+    """
+
+    def __init__(self):
+        self.active: Dict[int, RequestProfile] = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._pid = None
+
+    def _ensure_thread(self) -> None:
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                # threads do not survive a fork; start one per process
+                self.active = {}
+                self._wake = threading.Event()
+                threading.Thread(target=self._run, name='request-sampler', daemon=True).start()
+                self._pid = os.getpid()
+
+    def _run(self) -> None:
+        interval = _config('INTERVAL', 0.01)
+        own = threading.get_ident()
+        while True:
+            self._wake.wait()
+            while self.active:
+                frames = sys._current_frames()
+                for thread_id, profile in list(self.active.items()):
+                    frame = frames.get(thread_id)
+                    if frame is not None and thread_id != own:
+                        profile.add(frame)
+                del frames
+                time.sleep(interval)
+            with self._lock:
+                if not self.active:
+                    self._wake.clear()
+
+    def start(self) -> RequestProfile:
+        self._ensure_thread()
+        profile = RequestProfile(threading.get_ident())
+        with self._lock:
+            self.active[profile.thread_id] = profile
+            self._wake.set()
+        return profile
+
+    def stop(self, profile: RequestProfile) -> float:
+        with self._lock:
+            self.active.pop(profile.thread_id, None)
+        return time.perf_counter() - profile.started
+
+
+sampler = Sampler()
+
+
+def to_speedscope(profile: RequestProfile, duration: float, metadata: Dict[str, Any]) -> Dict[str, Any]:
+    frames: Dict[Tuple[str, str, int], int] = {}
+    samples, weights = [], []
+    interval_ms = _config('INTERVAL', 0.01) * 1000
+    for stack, count in profile.samples.items():
+        samples.append([frames.setdefault(frame, len(frames)) for frame in stack])
+        weights.append(count * interval_ms)
+    name = f"{metadata.get('method')} {metadata.get('path')} ({duration * 1000:.0f} ms)"
+    return {
+        '$schema': 'https://www.speedscope.app/file-format-schema.json',
+        'name': name,
+        'exporter': 'beaconmind.telemetry.profiling',
+        'activeProfileIndex': 0,
+        'shared': {'frames': [
+            {'name': name_, 'file': _short_path(file), 'line': line}
+            for (name_, file, line) in frames
+        ]},
+        'profiles': [{
+            'type': 'sampled',
+            'name': name,
+            'unit': 'milliseconds',
+            'startValue': 0,
+            'endValue': sum(weights),
+            'samples': samples,
+            'weights': weights,
+        }],
+        'beaconmind': metadata,
+    }
+
+
+def _write(profile: RequestProfile, duration: float, metadata: Dict[str, Any]) -> None:
+    directory = Path(_config('DIR'))
+    directory.mkdir(parents=True, exist_ok=True)
+    view = (metadata.get('view') or 'unresolved').replace(':', '.').replace('/', '_')
+    path = directory / f"{profile.started_at:%Y%m%dT%H%M%S}-{os.getpid()}-{view}-{duration * 1000:.0f}ms.speedscope.json"
+    with open(path, 'w') as f:
+        json.dump(to_speedscope(profile, duration, metadata), f, separators=(',', ':'))
+    prune(directory)
+
+
+def prune(directory: Path) -> None:
+    """
+    Keeps only the newest `PROFILING['MAX_FILES']` profiles.
+    """
+    files = sorted(directory.glob('*.speedscope.json'), key=lambda p: p.name, reverse=True)
+    for path in files[_config('MAX_FILES', 500):]:
+        path.unlink(missing_ok=True)
+
+
+def finish(profile: RequestProfile, metadata: Dict[str, Any]) -> Optional[float]:
+    """
+    Stops sampling a request and, if it was slow, writes its profile in the
+    background. Returns the request duration.
+    """
+    duration = sampler.stop(profile)
+    if duration >= _config('SLOW_THRESHOLD', 5.0) and profile.samples:
+        metadata = {
+            **metadata,
+            'started_at': profile.started_at.isoformat(),
+            'duration_ms': round(duration * 1000, 1),
+            'samples': sum(profile.samples.values()),
+            'interval_ms': _config('INTERVAL', 0.01) * 1000,
+            'pid': os.getpid(),
+        }
+        _executor.submit(_write, profile, duration, metadata)
+    return duration
+
+
+def load_stacks(path: Path) -> Tuple[Dict[str, Any], List[Tuple[List[str], float]]]:
+    """
+    Reads a profile written by this module. Returns its metadata and
+    (stack of frame names, weight in ms) pairs.
+    """
+    with open(path) as f:
+        data = json.load(f)
+    frames = [f"{frame['name']} ({frame['file']}:{frame['line']})" for frame in data['shared']['frames']]
+    profile = data['profiles'][0]
+    return data.get('beaconmind', {}), [
+        ([frames[i] for i in sample], weight)
+        for sample, weight in zip(profile['samples'], profile['weights'])
+    ]
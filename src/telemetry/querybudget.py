@@ -0,0 +1,163 @@
+"""
+Per-view query budgets and N+1 detection.
+
+Views declare how many queries a request may run, and how many times a
+single SQL shape (the statement with its parameters left as placeholders)
+may repeat:
+```
+@query_budget(max_queries=8, max_duplicates=2)
+@allow_only(['doctor'])
+def home(request):
+    ...
+```
+`QueryBudgetMiddleware` counts the queries of every request and logs the
+view, the counts and the stack of the offending queries to the
+`querybudget` logger when a budget is exceeded. Views without a budget get
+`QUERY_BUDGET['DEFAULT_MAX_DUPLICATES']` as N+1 detector. With
+`QUERY_BUDGET['RAISE']` (tests) the middleware raises `QueryBudgetExceeded`
+instead, failing the test.
+
+In tests, code outside of a request can be checked with:
+```
+with assert_query_budget(max_queries=3):
+    SessionPipeline(conversation, chat_session)
+```
+"""
+
+import re
+import traceback
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Optional
+
+from django.conf import settings
+from django.db import connections
+
+
+_IN_LIST = re.compile(r'IN \((?:%s, )+%s\)')
+_VALUES_LIST = re.compile(r'VALUES (\((?:%s, )*%s\))(?:, \((?:%s, )*%s\))+')
+
+# stack frames from these paths are left out of reports
+_SKIP_FRAMES = ('django/db/', 'django/core/handlers/', 'django/utils/', 'django/views/decorators/',
+                'telemetry/', 'middleware/', 'whitenoise/', 'corsheaders/',
+                'threading.py', 'socketserver.py', 'wsgiref/', 'gunicorn/')
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+@dataclass(frozen=True)
+class QueryBudget:
+    max_queries: Optional[int] = None
+    max_duplicates: Optional[int] = None
+
+
+def query_budget(max_queries: Optional[int] = None, max_duplicates: Optional[int] = None):
+    """
+    Declares the query budget of a view. Must be the outermost decorator
+    (the middleware reads it from the resolved view function).
+    """
+    def decorator(view_func):
+        view_func.query_budget = QueryBudget(max_queries, max_duplicates)
+        return view_func
+    return decorator
+
+
+def get_budget(view_func) -> Optional[QueryBudget]:
+    while view_func is not None:
+        budget = getattr(view_func, 'query_budget', None)
+        if budget is not None:
+            return budget
+        view_func = getattr(view_func, '__wrapped__', None)
+    return None
+
+
+def sql_shape(sql: str) -> str:
+    """
+    Statement with variable-length placeholder lists collapsed, so the same
+    query over a different number of ids has one shape.
+    """
+    sql = _IN_LIST.sub('IN (%s, ...)', sql)
+    return _VALUES_LIST.sub(r'VALUES \1, ...', sql)
+
+
+def _stack() -> List[str]:
+    frames = [
+        frame for frame in traceback.extract_stack()
+        if not any(part in frame.filename for part in _SKIP_FRAMES)
+    ]
+    return traceback.format_list(frames[-12:])
+
+
+@dataclass
+class QueryCounter:
+    """
+    Counts queries by shape. Used as a `connection.execute_wrapper()` hook;
+    stacks are captured once per shape, when it first goes over the budget.
+    """
+
+    budget: QueryBudget = field(default_factory=QueryBudget)
+    total: int = 0
+    shapes: Counter = field(default_factory=Counter)
+    stacks: Dict[str, List[str]] = field(default_factory=dict)
+
+    def __call__(self, execute, sql, params, many, context):
+        self.total += 1
+        shape = sql_shape(sql)
+        self.shapes[shape] += 1
+        budget = self.budget
+        if budget.max_duplicates is not None and self.shapes[shape] == budget.max_duplicates + 1:
+            self.stacks[shape] = _stack()
+        elif budget.max_queries is not None and self.total == budget.max_queries + 1 and shape not in self.stacks:
+            self.stacks[shape] = _stack()
+        return execute(sql, params, many, context)
+
+    @contextmanager
+    def watch(self) -> Iterator['QueryCounter']:
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(self))
+            yield self
+
+    def duplicates(self) -> Dict[str, int]:
+        limit = self.budget.max_duplicates
+        if limit is None:
+            return {}
+        return {shape: n for shape, n in self.shapes.most_common() if n > limit}
+
+    def violations(self) -> List[str]:
+        problems = []
+        if self.budget.max_queries is not None and self.total > self.budget.max_queries:
+            problems.append(f"{self.total} queries, budget {self.budget.max_queries}")
+        for shape, n in self.duplicates().items():
+            problems.append(f"{n}x (budget {self.budget.max_duplicates}): {shape[:300]}")
+        return problems
+
+    def report(self, label: str) -> str:
+        lines = [f"Query budget exceeded in {label}:"]
+        lines += [f"  - {problem}" for problem in self.violations()]
+        for shape, stack in self.stacks.items():
+            lines.append(f"  stack of {shape[:120]}:")
+            lines += [f"    {line.rstrip()}" for line in ''.join(stack).splitlines()]
+        return '\n'.join(lines)
+
+
+@contextmanager
+def assert_query_budget(max_queries: Optional[int] = None, max_duplicates: Optional[int] = None,
+                        label: str = 'block') -> Iterator[QueryCounter]:
+    """
+    Test helper: fails with `QueryBudgetExceeded` when the block runs more
+    queries, or repeats a query shape more often, than allowed.
+    """
+    counter = QueryCounter(QueryBudget(max_queries, max_duplicates))
+    with counter.watch():
+        yield counter
+    if counter.violations():
+        raise QueryBudgetExceeded(counter.report(label))
+
+
+def default_budget() -> QueryBudget:
+    config = getattr(settings, 'QUERY_BUDGET', {})
+    return QueryBudget(config.get('DEFAULT_MAX_QUERIES'), config.get('DEFAULT_MAX_DUPLICATES'))
@@ -0,0 +1,87 @@
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from . import tracing
+from .querybudget import QueryBudgetExceeded, assert_query_budget, sql_shape
+
+
+class MetricsViewTests(SimpleTestCase):
+
+    @override_settings(METRICS_TOKEN="", DEBUG=False)
+    def test_refused_without_token_in_production(self):
+        self.assertEqual(self.client.get("/metrics").status_code, 403)
+
+    @override_settings(METRICS_TOKEN="", DEBUG=True)
+    def test_open_without_token_in_debug(self):
+        self.assertEqual(self.client.get("/metrics").status_code, 200)
+
+    @override_settings(METRICS_TOKEN="s3cret", DEBUG=False)
+    def test_token_required(self):
+        self.assertEqual(self.client.get("/metrics").status_code, 403)
+        self.assertEqual(self.client.get("/metrics", HTTP_AUTHORIZATION="Bearer wrong").status_code, 403)
+        self.assertEqual(self.client.get("/metrics", HTTP_AUTHORIZATION="Bearer s3cret").status_code, 200)
+
+
+class HeadSamplingTests(SimpleTestCase):
+
+    trace_id = "4bf92f3577b34da6a3ce929d0e0e4736"
+    sampled = f"00-{trace_id}-00f067aa0ba902b7-01"
+
+    def configure(self, **config):
+        patcher = mock.patch.dict(tracing.settings.TRACING, {"SAMPLE_RATE": 0.0, "TRUSTED_PARENTS": [], **config})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_untrusted_sampled_flag_is_ignored(self):
+        self.configure()
+        self.assertEqual(tracing.should_sample(self.sampled), (self.trace_id, "00f067aa0ba902b7", False))
+        self.assertEqual(tracing.should_sample(self.sampled, trusted=True), (self.trace_id, "00f067aa0ba902b7", True))
+        self.assertFalse(tracing.should_sample(self.sampled.replace("-01", "-00"), trusted=True)[2])
+        self.configure(SAMPLE_RATE=1.0)
+        self.assertTrue(tracing.should_sample(self.sampled.replace("-01", "-00"))[2])
+
+    def test_invalid_traceparent_starts_a_trace(self):
+        self.configure()
+        trace_id, parent_id, sampled = tracing.should_sample("00-not-a-trace-01", trusted=True)
+        self.assertEqual((len(trace_id), parent_id, sampled), (32, None, False))
+
+    def test_trusted_parent(self):
+        self.configure(TRUSTED_PARENTS=["10.0.0.0/8", "::1"])
+        self.assertTrue(tracing.trusted_parent("10.1.2.3"))
+        self.assertTrue(tracing.trusted_parent("::1"))
+        for address in ["192.168.1.10", "", None, "unknown"]:
+            self.assertFalse(tracing.trusted_parent(address))
+
+    def test_middleware(self):
+        self.configure(TRUSTED_PARENTS=["10.0.0.0/8"])
+        with mock.patch.object(tracing, "export") as export:
+            response = self.client.get("/metrics", HTTP_TRACEPARENT=self.sampled, REMOTE_ADDR="203.0.113.7")
+            self.assertEqual(response["X-Trace-Id"], self.trace_id)
+            export.assert_not_called()
+            self.client.get("/metrics", HTTP_TRACEPARENT=self.sampled, REMOTE_ADDR="10.0.0.7")
+            export.assert_called_once()
+
+
+class QueryBudgetTests(TestCase):
+
+    def test_sql_shape(self):
+        self.assertEqual(sql_shape("SELECT * FROM t WHERE id IN (%s, %s, %s)"), "SELECT * FROM t WHERE id IN (%s, ...)")
+        self.assertEqual(sql_shape("INSERT INTO t VALUES (%s, %s), (%s, %s)"), "INSERT INTO t VALUES (%s, %s), ...")
+
+    def test_assert_query_budget(self):
+        User = get_user_model()
+        for i in range(3):
+            User.objects.create_user(f"user{i}", role="staff")
+        with assert_query_budget(max_queries=1, max_duplicates=1) as counter:
+            list(User.objects.filter(pk__in=[1, 2, 3]))
+        self.assertEqual(counter.total, 1)
+        with self.assertRaisesRegex(QueryBudgetExceeded, "3x"):
+            with assert_query_budget(max_duplicates=1):
+                for user in User.objects.all():
+                    User.objects.filter(pk=user.pk).exists()
+        with self.assertRaisesRegex(QueryBudgetExceeded, "2 queries, budget 1"):
+            with assert_query_budget(max_queries=1):
+                User.objects.count()
+                User.objects.exists()
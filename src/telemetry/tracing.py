@@ -0,0 +1,368 @@
+"""
+Lightweight request tracing.
+
+Spans are opened with `span()` / `@traced()` and collected in memory for
+the request being handled (`TracingMiddleware` starts a trace per request).
+When the request ends the trace is kept if it was head-sampled
+(`TRACING['SAMPLE_RATE']`, or a sampled W3C `traceparent` header from a
+caller in `TRACING['TRUSTED_PARENTS']`), took
+longer than `TRACING['SLOW_THRESHOLD']` seconds (tail sampling) or failed,
+and is then logged to the `traces` logger as an OTLP/JSON `resourceSpans`
+payload. The queued handlers configured for that logger write it to a JSON
+lines file and/or post it to an OTLP/HTTP collector off the request thread.
+
+Example usage:
+```
+@traced('chat.run_eval_routine')
+def run_eval_routine(...):
+    with span('history.load', session_id=session.id):
+        ...
+```
+"""
+
+import ipaddress
+import json
+import logging
+import os
+import random
+import re
+import time
+import urllib.request
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from functools import lru_cache, wraps
+from typing import Any, Dict, Iterator, List, Optional
+from uuid import UUID
+
+from django.conf import settings
+from langchain_core.callbacks import BaseCallbackHandler
+
+
+logger = logging.getLogger('traces')
+
+_TRACEPARENT = re.compile(r'^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$')
+
+# OTLP enums
+SPAN_KIND_INTERNAL, SPAN_KIND_SERVER, SPAN_KIND_CLIENT = 1, 2, 3
+STATUS_OK, STATUS_ERROR = 1, 2
+
+
+def _config(name: str, default: Any = None) -> Any:
+    return getattr(settings, 'TRACING', {}).get(name, default)
+
+
+def _new_id(n_bytes: int) -> str:
+    return os.urandom(n_bytes).hex()
+
+
+@dataclass
+class Span:
+    name: str
+    trace_id: str
+    span_id: str
+    parent_id: Optional[str]
+    kind: int = SPAN_KIND_INTERNAL
+    start_ns: int = field(default_factory=time.time_ns)
+    end_ns: Optional[int] = None
+    attributes: Dict[str, Any] = field(default_factory=dict)
+    error: Optional[str] = None
+
+    def set(self, **attributes) -> None:
+        self.attributes.update(attributes)
+
+    def to_otlp(self) -> Dict[str, Any]:
+        data = {
+            'traceId': self.trace_id,
+            'spanId': self.span_id,
+            'name': self.name,
+            'kind': self.kind,
+            'startTimeUnixNano': str(self.start_ns),
+            'endTimeUnixNano': str(self.end_ns or time.time_ns()),
+            'attributes': [_attribute(key, value) for key, value in self.attributes.items() if value is not None],
+            'status': {'code': STATUS_ERROR, 'message': self.error} if self.error else {'code': STATUS_OK},
+        }
+        if self.parent_id:
+            data['parentSpanId'] = self.parent_id
+        return data
+
+
+@dataclass
+class Trace:
+    trace_id: str
+    sampled: bool
+    parent_id: Optional[str] = None
+    spans: List[Span] = field(default_factory=list)
+    dropped: int = 0
+
+
+_trace: ContextVar[Optional[Trace]] = ContextVar('trace', default=None)
+_span: ContextVar[Optional[Span]] = ContextVar('span', default=None)
+
+
+def _attribute(key: str, value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {'key': key, 'value': {'boolValue': value}}
+    if isinstance(value, int):
+        return {'key': key, 'value': {'intValue': str(value)}}
+    if isinstance(value, float):
+        return {'key': key, 'value': {'doubleValue': value}}
+    return {'key': key, 'value': {'stringValue': str(value)}}
+
+
+def current_trace_id() -> Optional[str]:
+    """
+    Id of the trace of the request being handled, or None.
+    """
+    trace = _trace.get()
+    return trace.trace_id if trace else None
+
+
+def current_span() -> Optional[Span]:
+    return _span.get()
+
+
+def _start_span(name: str, kind: int, attributes: Dict[str, Any], parent: Optional[Span] = None) -> Optional[Span]:
+    trace = _trace.get()
+    if trace is None:
+        return None
+    if len(trace.spans) >= _config('MAX_SPANS', 1000):
+        trace.dropped += 1
+        return None
+    parent = parent or _span.get()
+    span = Span(
+        name=name, trace_id=trace.trace_id, span_id=_new_id(8),
+        parent_id=parent.span_id if parent else trace.parent_id,
+        kind=kind, attributes=attributes,
+    )
+    trace.spans.append(span)
+    return span
+
+
+@contextmanager
+def span(name: str, kind: int = SPAN_KIND_INTERNAL, **attributes) -> Iterator[Optional[Span]]:
+    """
+    Records a span around the block. Does nothing (and yields None) outside
+    of a traced request.
+    """
+    new = _start_span(name, kind, attributes)
+    if new is None:
+        yield None
+        return
+    token = _span.set(new)
+    try:
+        yield new
+    except BaseException as e:
+        new.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        new.end_ns = time.time_ns()
+        _span.reset(token)
+
+
+def traced(name: str):
+    """
+    Decorator recording a span around every call of the function.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@lru_cache(maxsize=8)
+def _networks(trusted: tuple) -> tuple:
+    return tuple(ipaddress.ip_network(network, strict=False) for network in trusted)
+
+
+def trusted_parent(address: Optional[str]) -> bool:
+    """
+    Whether the sampled flag of a `traceparent` sent from `address` is honoured.
+    """
+    networks = _networks(tuple(_config('TRUSTED_PARENTS', ())))
+    try:
+        address = ipaddress.ip_address(address or '')
+    except ValueError:
+        return False
+    return any(address in network for network in networks)
+
+
+def should_sample(traceparent: Optional[str], trusted: bool = False) -> tuple:
+    """
+    Head sampling decision. Returns (trace id, parent span id, sampled).
+    The trace of an incoming `traceparent` is always continued, but its
+    sampled flag only decides when the caller is `trusted`: anyone else
+    could force every request to be traced.
+    """
+    sampled = random.random() < _config('SAMPLE_RATE', 0.0)
+    match = _TRACEPARENT.match(traceparent or '')
+    if match:
+        trace_id, parent_id, flags = match.groups()
+        return trace_id, parent_id, bool(int(flags, 16) & 1) if trusted else sampled
+    return _new_id(16), None, sampled
+
+
+@contextmanager
+def trace_request(name: str, traceparent: Optional[str] = None, trusted: bool = False,
+                  **attributes) -> Iterator[Span]:
+    """
+    Starts a trace with a root server span for the request, and exports it
+    at the end if it was sampled, slow or failed.
+    """
+    trace_id, parent_id, sampled = should_sample(traceparent, trusted)
+    trace = Trace(trace_id=trace_id, sampled=sampled, parent_id=parent_id)
+    trace_token = _trace.set(trace)
+    try:
+        with span(name, kind=SPAN_KIND_SERVER, **attributes) as root:
+            yield root
+    finally:
+        _trace.reset(trace_token)
+        duration = (root.end_ns - root.start_ns) / 1e9
+        if trace.sampled or root.error or duration >= _config('SLOW_THRESHOLD', 10.0):
+            root.set(**{'sampling.head': trace.sampled, 'spans.dropped': trace.dropped or None})
+            export(trace)
+
+
+def export(trace: Trace) -> None:
+    # encoding is left to the handlers, on the listener thread
+    logger.info(f"trace {trace.trace_id}", extra={'spans': trace.spans})
+
+
+def to_otlp(spans: List[Span]) -> Dict[str, Any]:
+    return {
+        'resourceSpans': [{
+            'resource': {'attributes': [_attribute('service.name', _config('SERVICE_NAME', 'beaconmind'))]},
+            'scopeSpans': [{
+                'scope': {'name': 'telemetry.tracing'},
+                'spans': [s.to_otlp() for s in spans],
+            }],
+        }]
+    }
+
+
+def db_tracer(execute, sql, params, many, context):
+    """
+    `connection.execute_wrapper()` hook recording a span per query. Only the
+    SQL is recorded, never the parameters.
+    """
+    if _trace.get() is None:
+        return execute(sql, params, many, context)
+    connection = context['connection']
+    with span('db.query', kind=SPAN_KIND_CLIENT, **{
+        'db.system': connection.vendor,
+        'db.statement': sql[:_config('MAX_STATEMENT', 500)],
+        'db.many': many or None,
+    }):
+        return execute(sql, params, many, context)
+
+
+class OTLPJsonFormatter(logging.Formatter):
+    """
+    Formats trace records as one OTLP/JSON payload per line.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        return json.dumps(to_otlp(record.spans), separators=(',', ':'))
+
+
+class OTLPHttpHandler(logging.Handler):
+    """
+    Posts trace records to an OTLP/HTTP collector (JSON encoding). Traces
+    are buffered by `emit()` and sent in one request per `flush()`, i.e. per
+    batch when used behind `telemetry.logging.BatchQueueListener`.
+    """
+
+    def __init__(self, endpoint: str, timeout: float = 5.0, level=logging.NOTSET):
+        super().__init__(level)
+        self.endpoint = endpoint
+        self.timeout = timeout
+        self._buffer: List[Dict[str, Any]] = []
+
+    def emit(self, record: logging.LogRecord) -> None:
+        self._buffer.extend(to_otlp(record.spans)['resourceSpans'])
+
+    def flush(self) -> None:
+        if not self._buffer or not self.endpoint:
+            self._buffer = []
+            return
+        body = json.dumps({'resourceSpans': self._buffer}, separators=(',', ':')).encode()
+        self._buffer = []
+        request = urllib.request.Request(
+            self.endpoint, data=body, method='POST', headers={'Content-Type': 'application/json'})
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                response.read()
+        except Exception as e:
+            logging.getLogger(__name__).warning(f"OTLP export to {self.endpoint} failed: {e}")
+
+
+class TracingCallbackHandler(BaseCallbackHandler):
+    """
+    LangChain callback handler recording a span for every chain and LLM
+    run inside a traced request (prompt formatting, model call, parsing).
+    Spans are nested by LangChain's parent run ids, as runs of a sequence
+    execute in copied contexts.
+    """
+
+    raise_error = False
+
+    def __init__(self):
+        self.runs: Dict[UUID, Span] = {}
+
+    def _start(self, run_id, parent_run_id, name, kind, **attributes):
+        new = _start_span(name, kind, attributes, parent=self.runs.get(parent_run_id))
+        if new is not None:
+            self.runs[run_id] = new
+
+    def _end(self, run_id, error=None, **attributes):
+        run_span = self.runs.pop(run_id, None)
+        if run_span is None:
+            return
+        run_span.end_ns = time.time_ns()
+        run_span.set(**attributes)
+        if error is not None:
+            run_span.error = f"{type(error).__name__}: {error}"
+
+    def on_chain_start(self, serialized, inputs, *, run_id, parent_run_id=None, **kwargs):
+        name = kwargs.get('name') or (serialized or {}).get('name') or 'chain'
+        self._start(run_id, parent_run_id, f"langchain.{name}", SPAN_KIND_INTERNAL)
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, parent_run_id=None, **kwargs):
+        params = kwargs.get('invocation_params') or {}
+        self._start(run_id, parent_run_id, 'llm.chat', SPAN_KIND_CLIENT, **{
+            'llm.model': params.get('model_name') or params.get('model'),
+            'llm.messages': sum(len(batch) for batch in messages),
+        })
+
+    def on_llm_start(self, serialized, prompts, *, run_id, parent_run_id=None, **kwargs):
+        self._start(run_id, parent_run_id, 'llm.completion', SPAN_KIND_CLIENT)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        usage = (response.llm_output or {}).get('token_usage') or {}
+        self._end(run_id, **{
+            'llm.prompt_tokens': usage.get('prompt_tokens'),
+            'llm.completion_tokens': usage.get('completion_tokens'),
+            'llm.cached_tokens': (usage.get('prompt_tokens_details') or {}).get('cached_tokens'),
+        })
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error)
+
+
+def langchain_config() -> Dict[str, Any]:
+    """
+    `config` for `Runnable.invoke()` adding the tracing callback handler
+    when the current request is traced.
+    """
+    if _trace.get() is None:
+        return {}
+    return {'callbacks': [TracingCallbackHandler()]}
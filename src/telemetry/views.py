@@ -0,0 +1,21 @@
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from django.utils.crypto import constant_time_compare
+
+from .metrics import observe_queues, render
+
+
+def metrics(request):
+    """
+    Prometheus scrape endpoint. Requires `Authorization: Bearer <METRICS_TOKEN>`;
+    without a `METRICS_TOKEN` it is only served with DEBUG on.
+    """
+    token = settings.METRICS_TOKEN
+    if not token:
+        if not settings.DEBUG:
+            return HttpResponseForbidden()
+    elif not constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return HttpResponseForbidden()
+    observe_queues()
+    body, content_type = render()
+    return HttpResponse(body, content_type=content_type)